@@ -0,0 +1,51 @@
+"""
+Time share_placement, which every immutable upload runs to pick the
+servers for its shares, for grids of different sizes.
+
+Run it with no arguments:
+
+python bench_happiness.py
+
+Each row is the time for one placement of N shares over that many servers,
+once with no existing shares and once with every share already on a server
+or two (as when re-uploading a file that is partly there).
+"""
+
+from __future__ import print_function
+
+import random
+
+from pyutil import benchutil
+
+from allmydata.immutable.happiness_upload import share_placement
+
+
+class B(object):
+    def __init__(self, num_servers, num_shares, existing):
+        self.peers = set("server%d" % i for i in range(num_servers))
+        self.shares = set(range(num_shares))
+        self.peers_to_shares = {}
+        if existing:
+            r = random.Random(num_servers * num_shares)
+            peers = sorted(self.peers)
+            for share in self.shares:
+                for peer in r.sample(peers, 2):
+                    self.peers_to_shares.setdefault(peer, set()).add(share)
+
+    def run(self, N):
+        for i in range(N):
+            share_placement(self.peers, set(), self.shares,
+                            self.peers_to_shares)
+
+
+benchutil.print_bench_footer(UNITS_PER_SECOND=1000)
+print("(milliseconds per placement)")
+
+for existing in [False, True]:
+    print("existing shares:", existing)
+    for num_servers in [10, 30, 100, 300]:
+        for num_shares in [10, 30, 100]:
+            b = B(num_servers, num_shares, existing)
+            print("%4d servers x %3d shares" % (num_servers, num_shares), end=' ')
+            benchutil.rep_bench(b.run, 1, runreps=3, runiters=3,
+                                UNITS_PER_SECOND=1000)
@@ -0,0 +1 @@
+Storage servers now answer mutable reads of several shares and ranges in a single HTTP request, and clients use it when the server advertises ``batched-mutable-readv``.
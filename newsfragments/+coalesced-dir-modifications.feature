@@ -0,0 +1 @@
+Concurrent changes to the same directory from one client are now combined into a single publish. The new ``[client]directory.write_window`` setting lets changes wait for others to join them.
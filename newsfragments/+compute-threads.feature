@@ -0,0 +1 @@
+The new [client]compute.threads option runs erasure coding, encryption and hashing on a per-client thread pool, so concurrent uploads and downloads can use more than one CPU core.
@@ -0,0 +1 @@
+Deep-check can now check several files and directories at once (``[client]deep_check.concurrency``), while limiting how many requests it has outstanding with each storage server (``[client]deep_check.requests_per_server``).
@@ -0,0 +1 @@
+Manifests, deep-stats and deep-checks now read several directories at once (``[client]traverse.concurrency``).
@@ -0,0 +1 @@
+Immutable downloads now fetch the following segments while earlier ones are being delivered. The new ``[client]download.readahead_segments`` and ``download.readahead_max_bytes`` options set how far ahead they read.
@@ -0,0 +1 @@
+Repeated reads of the same immutable file now reuse its validated hash trees and known share locations (``[client]download.state_cache_size``).
@@ -0,0 +1 @@
+Uploads now work out servers-of-happiness share placement with the Hopcroft-Karp matching algorithm, so uploads start faster on grids with many storage servers.
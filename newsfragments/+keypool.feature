@@ -0,0 +1 @@
+New mutable files and directories can be created faster with ``[client]mutable.keypool_size``, which keeps RSA keys generated ahead of time in the background.
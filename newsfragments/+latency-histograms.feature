@@ -0,0 +1 @@
+Storage servers now track operation latencies in fixed-size histograms, so their memory use no longer grows with the number of operations.
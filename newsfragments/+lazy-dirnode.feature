@@ -0,0 +1 @@
+Directories are now unpacked lazily, decrypting each child only when it is asked for.
@@ -0,0 +1 @@
+Storage servers can keep an SQLite index of their leases (``[storage]lease_index``), so expired leases are found without crawling every share.
@@ -0,0 +1 @@
+Storage servers can keep recently used share files open (``[storage]open_file_cache``) instead of opening and closing them for every read and write.
@@ -0,0 +1 @@
+Clients now remember which storage servers are connected between operations and pick the first servers in permuted order without sorting the whole grid, so choosing servers costs less CPU on large grids.
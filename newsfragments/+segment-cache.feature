@@ -0,0 +1 @@
+Immutable reads can keep recently decrypted segments in memory (``[client]download.segment_cache_size``), so overlapping range requests don't download them again.
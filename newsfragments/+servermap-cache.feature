@@ -0,0 +1 @@
+Mutable file and directory reads can reuse recent servermaps for ``[client]mutable.servermap_cache_ttl`` seconds instead of querying every server again.
@@ -0,0 +1 @@
+Very large directories can be stored as sharded directories (``URI:DIR2-HAMT:``), so changing one child only rewrites a few small shards.
@@ -0,0 +1 @@
+Storage servers can flush finished shares to disk before reporting success (``[storage]durability``), one share at a time or in batches.
@@ -0,0 +1 @@
+Storage servers now keep an in-memory index of the shares they hold, so share lookups no longer list directories on disk.
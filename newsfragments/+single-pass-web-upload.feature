@@ -0,0 +1 @@
+Large immutable uploads through the web gateway are now hashed for convergent encryption while they are received, so the gateway no longer reads them twice.
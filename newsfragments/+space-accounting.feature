@@ -0,0 +1 @@
+Storage servers now cache disk statistics and keep a running count of allocated space, instead of recomputing them for every upload.
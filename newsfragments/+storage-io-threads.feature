@@ -0,0 +1 @@
+Storage servers can now read and write share files on a thread pool, set with the new ``[storage]io_threads`` option, so that a slow disk does not hold up every other client.
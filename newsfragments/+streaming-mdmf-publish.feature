@@ -0,0 +1 @@
+MDMF publishes now send each segment's blocks to the servers as it is encoded, instead of holding every share of the file in memory.
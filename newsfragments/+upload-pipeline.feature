@@ -0,0 +1 @@
+Immutable uploads now encode the next segments while earlier blocks are still being sent. The new ``[client]upload.pipeline_depth`` option sets how many segments may be in flight at once.
@@ -0,0 +1 @@
+Immutable verification (``tahoe check --verify`` and ``deep-check --verify``) now fetches several blocks of each share at once, while keeping the block data in flight for a whole operation within one memory budget.
@@ -48,6 +48,7 @@ from allmydata.util import (
 )
 from allmydata.util.encodingutil import get_filesystem_encoding
 from allmydata.util.abbreviate import parse_abbreviated_size
+from allmydata.util.compute import ComputePool, defer_to_compute
 from allmydata.util.time_format import parse_duration, parse_date
 from allmydata.util.i2p_provider import create as create_i2p_provider
 from allmydata.util.tor_provider import create as create_tor_provider
@@ -62,6 +63,11 @@ from allmydata.interfaces import (
     IAnnounceableStorageServer,
 )
 from allmydata.nodemaker import NodeMaker
+from allmydata.dirnode import DirectoryWriteStats
+from allmydata.mutable.servermap import ServermapCache
+from allmydata.immutable.downloader.node import DownloadNodeCache, \
+     SegmentCache
+from allmydata.keypool import KeyPool
 from allmydata.blacklist import Blacklist
 from allmydata import node
 
@@ -87,18 +93,34 @@ def _is_valid_section(section_name):
 _client_config = configutil.ValidConfiguration(
     static_valid_sections={
         "client": (
+            "compute.threads",
+            "deep_check.concurrency",
+            "deep_check.requests_per_server",
+            "directory.write_window",
+            "download.readahead_max_bytes",
+            "download.readahead_segments",
+            "download.segment_cache_size",
+            "download.state_cache_size",
             "helper.furl",
             "introducer.furl",
             "key_generator.furl",
             "mutable.format",
+            "mutable.keypool_persist",
+            "mutable.keypool_size",
+            "mutable.servermap_cache_size",
+            "mutable.servermap_cache_ttl",
             "peers.preferred",
             "shares.happy",
             "shares.needed",
             "shares.total",
             "storage.plugins",
+            "traverse.concurrency",
+            "traverse.memory_budget",
+            "upload.pipeline_depth",
         ),
         "storage": (
             "debug_discard",
+            "durability",
             "enabled",
             "anonymous",
             "expire.cutoff_date",
@@ -108,8 +130,12 @@ _client_config = configutil.ValidConfiguration(
             "expire.mode",
             "expire.mutable",
             "expire.override_lease_duration",
+            "io_threads",
+            "lease_index",
+            "open_file_cache",
             "readonly",
             "reserved_space",
+            "share_index",
             "storage_dir",
             "plugins",
         ),
@@ -170,14 +196,19 @@ class KeyGenerator(object):
     """I create RSA keys for mutable files. Each call to generate() returns a
     single keypair."""
 
+    def __init__(self, compute=None):
+        # the ComputePool to generate keys on, or None
+        self._compute = compute
+
     def generate(self):
         """I return a Deferred that fires with a (verifyingkey, signingkey)
         pair. The returned key will be 2048 bit"""
         keysize = 2048
         # RSA key generation for a 2048 bit key takes between 0.8 and 3.2
-        # secs
-        signer, verifier = rsa.create_signing_keypair(keysize)
-        return defer.succeed( (verifier, signer) )
+        # secs, so do it in a compute thread if we have them. See KeyPool
+        # for doing it ahead of time.
+        d = defer_to_compute(self._compute, rsa.create_signing_keypair, keysize)
+        return d.addCallback(lambda keypair: (keypair[1], keypair[0]))
 
 class Terminator(service.Service):
     def __init__(self):
@@ -628,7 +659,8 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.init_stats_provider()
         self.init_secrets()
         self.init_node_key()
-        self._key_generator = KeyGenerator()
+        self.init_compute_pool()
+        self.init_key_generator()
         key_gen_furl = config.get_config("client", "key_generator.furl", None)
         if key_gen_furl:
             log.msg("[client]key_generator.furl= is now ignored, see #2783")
@@ -789,6 +821,15 @@ class _Client(node.Node, pollmixin.PollMixin):
             sharetypes.append("mutable")
         expiration_sharetypes = tuple(sharetypes)
 
+        io_threads = int(self.config.get_config("storage", "io_threads", 0))
+        lease_index = self.config.get_config("storage", "lease_index", False,
+                                             boolean=True)
+        share_index = self.config.get_config("storage", "share_index", False,
+                                             boolean=True)
+        open_file_cache = int(self.config.get_config("storage",
+                                                     "open_file_cache", 0))
+        durability = self.config.get_config("storage", "durability", "none")
+
         ss = StorageServer(storedir, self.nodeid,
                            reserved_space=reserved,
                            discard_storage=discard,
@@ -798,7 +839,12 @@ class _Client(node.Node, pollmixin.PollMixin):
                            expiration_mode=mode,
                            expiration_override_lease_duration=o_l_d,
                            expiration_cutoff_date=cutoff_date,
-                           expiration_sharetypes=expiration_sharetypes)
+                           expiration_sharetypes=expiration_sharetypes,
+                           io_threads=io_threads,
+                           lease_index=lease_index,
+                           share_index=share_index,
+                           open_file_cache=open_file_cache,
+                           durability=durability)
         ss.setServiceParent(self)
         return ss
 
@@ -892,10 +938,13 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.history = History(self.stats_provider)
         self.terminator = Terminator()
         self.terminator.setServiceParent(self)
+        pipeline_depth = int(self.config.get_config("client", "upload.pipeline_depth", 2))
         uploader = Uploader(
             helper_furl,
             self.stats_provider,
             self.history,
+            pipeline_depth=pipeline_depth,
+            compute=self._compute_pool,
         )
         uploader.setServiceParent(self)
         self.init_blacklist()
@@ -941,6 +990,28 @@ class _Client(node.Node, pollmixin.PollMixin):
         except EnvironmentError:
             pass
 
+    def init_compute_pool(self):
+        self._compute_pool = None
+        compute_threads = int(self.config.get_config("client", "compute.threads", 0))
+        if compute_threads > 0:
+            self._compute_pool = ComputePool(compute_threads)
+            self._compute_pool.setServiceParent(self)
+
+    def init_key_generator(self):
+        keypool_size = int(self.config.get_config("client", "mutable.keypool_size", 0))
+        if keypool_size > 0:
+            spare_keys_path = None
+            if self.config.get_config("client", "mutable.keypool_persist", False, boolean=True):
+                spare_keys_path = self.config.get_private_path("spare_rsa_keys")
+            self._key_generator = KeyPool(
+                keypool_size,
+                spare_keys_path,
+                self._secret_holder.get_renewal_secret(),
+            )
+            self._key_generator.setServiceParent(self)
+        else:
+            self._key_generator = KeyGenerator(self._compute_pool)
+
     def init_blacklist(self):
         fn = self.config.get_config_path("access.blacklist")
         self.blacklist = Blacklist(fn)
@@ -951,15 +1022,66 @@ class _Client(node.Node, pollmixin.PollMixin):
             self.mutable_file_default = MDMF_VERSION
         else:
             self.mutable_file_default = SDMF_VERSION
-        self.nodemaker = NodeMaker(self.storage_broker,
-                                   self._secret_holder,
-                                   self.get_history(),
-                                   self.getServiceNamed("uploader"),
-                                   self.terminator,
-                                   self.get_encoding_parameters(),
-                                   self.mutable_file_default,
-                                   self._key_generator,
-                                   self.blacklist)
+        servermap_cache = None
+        ttl = float(self.config.get_config("client", "mutable.servermap_cache_ttl", 0))
+        if ttl > 0:
+            size = int(self.config.get_config("client", "mutable.servermap_cache_size", 1000))
+            servermap_cache = ServermapCache(size, ttl)
+        download_cache = None
+        download_cache_size = int(self.config.get_config("client", "download.state_cache_size", 100))
+        if download_cache_size > 0:
+            download_cache = DownloadNodeCache(download_cache_size)
+        segment_cache = None
+        segment_cache_size = parse_abbreviated_size(
+            self.config.get_config("client", "download.segment_cache_size", "0"))
+        if segment_cache_size:
+            segment_cache = SegmentCache(segment_cache_size)
+            self.stats_provider.register_producer(segment_cache)
+        readahead_segments = int(self.config.get_config("client", "download.readahead_segments", 4))
+        if readahead_segments < 0:
+            raise ValueError("[client]download.readahead_segments must not be negative")
+        readahead_max_bytes = parse_abbreviated_size(
+            self.config.get_config("client", "download.readahead_max_bytes", "4MiB"))
+        traverse_concurrency = int(self.config.get_config("client", "traverse.concurrency", 10))
+        if traverse_concurrency < 1:
+            raise ValueError("[client]traverse.concurrency must be at least 1")
+        traverse_memory_budget = parse_abbreviated_size(
+            self.config.get_config("client", "traverse.memory_budget", "32MiB"))
+        deep_check_concurrency = int(self.config.get_config("client", "deep_check.concurrency", 10))
+        if deep_check_concurrency < 1:
+            raise ValueError("[client]deep_check.concurrency must be at least 1")
+        deep_check_requests_per_server = int(self.config.get_config("client", "deep_check.requests_per_server", 10))
+        if deep_check_requests_per_server < 1:
+            raise ValueError("[client]deep_check.requests_per_server must be at least 1")
+        directory_write_window = float(self.config.get_config("client", "directory.write_window", 0))
+        if directory_write_window < 0:
+            raise ValueError("[client]directory.write_window must not be negative")
+        directory_write_stats = DirectoryWriteStats()
+        self.stats_provider.register_producer(directory_write_stats)
+        self.nodemaker = NodeMaker(
+            self.storage_broker,
+            self._secret_holder,
+            self.get_history(),
+            self.getServiceNamed("uploader"),
+            self.terminator,
+            self.get_encoding_parameters(),
+            self.mutable_file_default,
+            self._key_generator,
+            blacklist=self.blacklist,
+            servermap_cache=servermap_cache,
+            traverse_concurrency=traverse_concurrency,
+            traverse_memory_budget=traverse_memory_budget,
+            tempdir=self._get_tempdir(),
+            download_cache=download_cache,
+            segment_cache=segment_cache,
+            deep_check_concurrency=deep_check_concurrency,
+            deep_check_requests_per_server=deep_check_requests_per_server,
+            download_readahead_segments=readahead_segments,
+            download_readahead_max_bytes=readahead_max_bytes,
+            compute=self._compute_pool,
+            directory_write_window=directory_write_window,
+            directory_write_stats=directory_write_stats,
+        )
 
     def get_history(self):
         return self.history
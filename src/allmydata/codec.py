@@ -13,8 +13,8 @@ if PY2:
     from builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, dict, list, object, range, str, max, min  # noqa: F401
 
 from zope.interface import implementer
-from twisted.internet import defer
 from allmydata.util import mathutil
+from allmydata.util.compute import defer_to_compute
 from allmydata.util.assertutil import precondition
 from allmydata.interfaces import ICodecEncoder, ICodecDecoder
 import zfec
@@ -23,6 +23,10 @@ import zfec
 class CRSEncoder(object):
     ENCODER_TYPE = b"crs"
 
+    def __init__(self, compute=None):
+        # the ComputePool to encode on, or None
+        self._compute = compute
+
     def set_params(self, data_size, required_shares, max_shares):
         assert required_shares <= max_shares
         self.data_size = data_size
@@ -53,9 +57,9 @@ class CRSEncoder(object):
 
         for inshare in inshares:
             assert len(inshare) == self.share_size, (len(inshare), self.share_size, self.data_size, self.required_shares)
-        shares = self.encoder.encode(inshares, desired_share_ids)
-
-        return defer.succeed((shares, desired_share_ids))
+        d = defer_to_compute(self._compute, self.encoder.encode, inshares, desired_share_ids)
+        d.addCallback(lambda shares: (shares, desired_share_ids))
+        return d
 
     def encode_proposal(self, data, desired_share_ids=None):
         raise NotImplementedError()
@@ -64,6 +68,10 @@ class CRSEncoder(object):
 @implementer(ICodecDecoder)
 class CRSDecoder(object):
 
+    def __init__(self, compute=None):
+        # the ComputePool to decode on, or None
+        self._compute = compute
+
     def set_params(self, data_size, required_shares, max_shares):
         self.data_size = data_size
         self.required_shares = required_shares
@@ -82,9 +90,8 @@ class CRSDecoder(object):
                      len(some_shares), len(their_shareids))
         precondition(len(some_shares) == self.required_shares,
                      len(some_shares), self.required_shares)
-        data = self.decoder.decode(some_shares,
-                                   [int(s) for s in their_shareids])
-        return defer.succeed(data)
+        return defer_to_compute(self._compute, self.decoder.decode, some_shares,
+                                [int(s) for s in their_shareids])
 
 def parse_params(serializedparams):
     pieces = serializedparams.split(b"-")
@@ -26,7 +26,7 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives.serialization import load_der_private_key, load_der_public_key, \
-    Encoding, PrivateFormat, PublicFormat, NoEncryption
+    Encoding, PrivateFormat, PublicFormat, NoEncryption, BestAvailableEncryption
 
 from allmydata.crypto.error import BadSignature
 
@@ -63,18 +63,20 @@ def create_signing_keypair(key_size):
     return priv_key, priv_key.public_key()
 
 
-def create_signing_keypair_from_string(private_key_der):
+def create_signing_keypair_from_string(private_key_der, password=None):
     """
     Create an RSA signing (private) key from previously serialized
     private key bytes.
 
     :param bytes private_key_der: blob as returned from `der_string_from_signing_keypair`
 
+    :param bytes password: the password the blob was encrypted with, if any
+
     :returns: 2-tuple of (private_key, public_key)
     """
     priv_key = load_der_private_key(
         private_key_der,
-        password=None,
+        password=password,
         backend=default_backend(),
     )
     if not isinstance(priv_key, rsa.RSAPrivateKey):
@@ -88,20 +90,26 @@ def create_signing_keypair_from_string(private_key_der):
     return priv_key, priv_key.public_key()
 
 
-def der_string_from_signing_key(private_key):
+def der_string_from_signing_key(private_key, password=None):
     """
     Serializes a given RSA private key to a DER string
 
     :param private_key: a private key object as returned from
         `create_signing_keypair` or `create_signing_keypair_from_string`
 
+    :param bytes password: if given, encrypt the key with this password
+
     :returns: bytes representing `private_key`
     """
     _validate_private_key(private_key)
+    if password is None:
+        encryption = NoEncryption()
+    else:
+        encryption = BestAvailableEncryption(password)
     return private_key.private_bytes(
         encoding=Encoding.DER,
         format=PrivateFormat.PKCS8,
-        encryption_algorithm=NoEncryption(),
+        encryption_algorithm=encryption,
     )
 
 
@@ -0,0 +1,323 @@
+"""
+Walk a directory tree, reading several directories at once.
+
+``DirectoryNode.deep_traverse`` used to read one directory at a time, so that
+the directories waiting to be read could not use up all the memory of the
+process (it once did, with 330k of them). That left deep-checks and
+manifests of big trees waiting on one servermap round trip after another.
+``DeepTraversal`` reads up to ``concurrency`` directories at once, and keeps
+the directories waiting to be read in a ``Frontier`` that moves them to a
+temporary file once they would use more than ``memory_budget`` bytes.
+
+Deep-check walkers also used to check one node at a time. They run up to
+``concurrency`` checks at once through ``ConcurrentChecks`` instead.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+import json
+import tempfile
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from foolscap.api import fireEventually
+
+from allmydata.interfaces import IDirectoryNode
+from allmydata.unknown import UnknownNode
+
+# About how much memory a directory waiting to be read takes up: mostly its
+# DirectoryNode.
+FRONTIER_ITEM_SIZE = 2000
+
+
+class Frontier(object):
+    """
+    I am a stack of (directory node, path) pairs waiting to be read.
+
+    When I hold more than ``memory_budget`` bytes worth of them, I write the
+    older half out to a temporary file as caps, and make nodes from them
+    again with ``nodemaker`` when everything newer has been popped.
+
+    :ivar int spilled: How many pairs have been written out so far.
+    """
+
+    def __init__(self, nodemaker, memory_budget: int,
+                 tempdir: Optional[str] = None):
+        self._nodemaker = nodemaker
+        self._limit = max(2, memory_budget // FRONTIER_ITEM_SIZE)
+        self._tempdir = tempdir
+        self._stack = []
+        self._file = None
+        self._chunks = [] # (offset, count) of each chunk in self._file
+        self._on_disk = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self._stack) + self._on_disk
+
+    def push(self, node, path: list[str]):
+        self._stack.append((node, path))
+        if len(self._stack) > self._limit:
+            self._spill()
+
+    def pop(self):
+        """
+        :return: The (node, path) pair pushed most recently.
+        """
+        if not self._stack:
+            self._unspill()
+        return self._stack.pop()
+
+    def _spill(self):
+        count = len(self._stack) // 2
+        spilling = self._stack[:count]
+        del self._stack[:count]
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self._tempdir)
+        self._file.seek(0, 2)
+        offset = self._file.tell()
+        lines = []
+        for (node, path) in spilling:
+            writecap = node.get_write_uri()
+            lines.append(json.dumps([
+                None if writecap is None else writecap.decode("ascii"),
+                node.get_readonly_uri().decode("ascii"),
+                path,
+            ]).encode("utf-8"))
+        self._file.write(b"\n".join(lines))
+        self._chunks.append((offset, count))
+        self._on_disk += count
+        self.spilled += count
+
+    def _unspill(self):
+        (offset, count) = self._chunks.pop()
+        self._file.seek(offset)
+        lines = self._file.read().split(b"\n")
+        self._file.seek(offset)
+        self._file.truncate()
+        self._on_disk -= count
+        for line in lines:
+            (writecap, readcap, path) = json.loads(line)
+            node = self._nodemaker.create_from_cap(
+                None if writecap is None else writecap.encode("ascii"),
+                readcap.encode("ascii"),
+            )
+            self._stack.append((node, path))
+
+    def close(self):
+        """
+        Forget everything, and delete the temporary file if there is one.
+        """
+        self._stack = []
+        self._chunks = []
+        self._on_disk = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DeepTraversal(object):
+    """
+    I walk the tree under a directory for ``DirectoryNode.deep_traverse``,
+    reading up to ``concurrency`` directories at once.
+
+    With a ``concurrency`` of 1, the walker sees nodes in the same order as
+    a depth-first walk that visits children in name order, files first.
+    """
+
+    def __init__(self, root, walker, monitor, concurrency: int = 10,
+                 memory_budget: int = 32 * 1024 * 1024,
+                 tempdir: Optional[str] = None):
+        assert concurrency > 0, concurrency
+        self._walker = walker
+        self._monitor = monitor
+        self._concurrency = concurrency
+        self._frontier = Frontier(root._nodemaker, memory_budget, tempdir)
+        self._frontier.push(root, [])
+        self._found = set([root.get_verify_cap()])
+        self._active = 0
+        self._failure = None
+        self._filling = False
+        self._refill = False
+        self._done = None
+
+    def run(self) -> defer.Deferred:
+        """
+        :return: A ``Deferred`` that fires with ``None`` once every directory
+            has been read and every node given to the walker, or with the
+            first failure once the directories already being read are done.
+        """
+        d = self._done = defer.Deferred()
+        self._fill()
+        return d
+
+    def _fill(self):
+        # Directories can be read synchronously (LIT directories, or in
+        # tests), so rather than recursing, keep going here until no more
+        # can be started.
+        if self._filling:
+            self._refill = True
+            return
+        self._filling = True
+        try:
+            self._refill = True
+            while self._refill:
+                self._refill = False
+                while (self._failure is None and self._frontier
+                       and self._active < self._concurrency):
+                    (node, path) = self._frontier.pop()
+                    self._active += 1
+                    d = defer.maybeDeferred(self._visit, node, path)
+                    d.addErrback(self._failed)
+                    d.addBoth(self._visited)
+        finally:
+            self._filling = False
+        if self._active == 0 and self._done is not None:
+            (done, self._done) = (self._done, None)
+            self._frontier.close()
+            if self._failure is None:
+                done.callback(None)
+            else:
+                done.errback(self._failure)
+
+    def _failed(self, f: Failure):
+        if self._failure is None:
+            self._failure = f
+
+    def _visited(self, ignored):
+        self._active -= 1
+        self._fill()
+
+    def _visit(self, node, path):
+        self._monitor.raise_if_cancelled()
+        d = defer.maybeDeferred(self._walker.add_node, node, path)
+        iterate_leaves = getattr(node, "iterate_leaves", None)
+        if iterate_leaves is None:
+            d.addCallback(lambda ignored: node.list())
+            d.addCallback(self._visit_children, node, path)
+        else:
+            # A sharded directory is read one leaf shard at a time, and the
+            # walker enters each leaf as a directory of its own.
+            d.addCallback(lambda ignored: iterate_leaves(
+                lambda leaf, children: self._visit_children(children, leaf,
+                                                            path)))
+        return d
+
+    def _visit_children(self, children, parent, path):
+        self._monitor.raise_if_cancelled()
+        if self._failure is not None:
+            return
+        walker = self._walker
+        d = defer.maybeDeferred(walker.enter_directory, parent, children)
+        # we process file-like children first, so we can drop their FileNode
+        # objects as quickly as possible. Tests suggest that a FileNode (held
+        # in the client's nodecache) consumes about 2440 bytes. dirnodes (not
+        # in the nodecache) seem to consume about 2000 bytes.
+        dirkids = []
+        filekids = []
+        for name, (child, metadata) in sorted(children.items()):
+            childpath = path + [name]
+            if isinstance(child, UnknownNode):
+                self._add_node(None, child, childpath)
+                continue
+            verifier = child.get_verify_cap()
+            # allow LIT files (for which verifier==None) to be processed
+            if (verifier is not None) and (verifier in self._found):
+                continue
+            self._found.add(verifier)
+            if IDirectoryNode.providedBy(child):
+                dirkids.append( (child, childpath) )
+            else:
+                filekids.append( (child, childpath) )
+        # Other readers may start on the subdirectories while we do the
+        # files, but we don't start them ourselves until we are done, so
+        # that the walker sees our files before anything that goes wrong in
+        # our subdirectories.
+        for (child, childpath) in reversed(dirkids):
+            self._frontier.push(child, childpath)
+        for i, (child, childpath) in enumerate(filekids):
+            d.addCallback(self._add_node, child, childpath)
+            # to work around the Deferred tail-recursion problem
+            # (specifically the defer.succeed flavor) requires us to avoid
+            # doing more than 158 LIT files in a row. We insert a turn break
+            # once every 100 files (LIT or CHK) to preserve some stack space
+            # for other code. This is a different expression of the same
+            # Twisted problem as in #237.
+            if i % 100 == 99:
+                d.addCallback(lambda ignored: fireEventually())
+        return d
+
+    def _add_node(self, ignored, node, path):
+        # Once something has failed the walker hears of nothing else, so
+        # that the failure is reported right after the node it came from.
+        if self._failure is None:
+            return self._walker.add_node(node, path)
+
+
+class ConcurrentChecks(object):
+    """
+    I run the node checks of a deep-check walker, up to ``concurrency`` of
+    them at once.
+
+    ``add()`` fires once the check has been started, so a walker that returns
+    it from ``add_node()`` holds the traversal back while every check is
+    busy, rather than queueing up checks without limit.
+    """
+
+    def __init__(self, concurrency: int):
+        assert concurrency > 0, concurrency
+        self._semaphore = defer.DeferredSemaphore(concurrency)
+        self._running = 0
+        self._failure = None
+        self._waiting = []
+
+    def add(self, f, *args) -> defer.Deferred:
+        """
+        Call ``f(*args)`` once fewer than ``concurrency`` of my calls are
+        running.
+
+        :return: A ``Deferred`` that fires with ``None`` once the call has
+            been made, or with the first failure of any call so far.
+        """
+        if self._failure is not None:
+            return defer.fail(self._failure)
+        self._running += 1
+        d = self._semaphore.acquire()
+        d.addCallback(self._start, f, args)
+        return d
+
+    def _start(self, ignored, f, args):
+        d = defer.maybeDeferred(f, *args)
+        d.addErrback(self._failed)
+        d.addBoth(self._finished)
+
+    def _failed(self, f: Failure):
+        if self._failure is None:
+            self._failure = f
+
+    def _finished(self, ignored):
+        self._running -= 1
+        self._semaphore.release()
+        if self._running == 0:
+            (waiting, self._waiting) = (self._waiting, [])
+            for d in waiting:
+                self._fire(d)
+
+    def when_done(self) -> defer.Deferred:
+        """
+        :return: A ``Deferred`` that fires with ``None`` once none of my
+            calls are running, or with the first failure of any of them.
+        """
+        d = defer.Deferred()
+        if self._running == 0:
+            self._fire(d)
+        else:
+            self._waiting.append(d)
+        return d
+
+    def _fire(self, d):
+        if self._failure is None:
+            d.callback(None)
+        else:
+            d.errback(self._failure)
@@ -16,17 +16,19 @@ from past.builtins import unicode
 import time
 
 from zope.interface import implementer
-from twisted.internet import defer
-from foolscap.api import fireEventually
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
 
 from allmydata.crypto import aes
 from allmydata.deep_stats import DeepStats
+from allmydata.deep_traversal import DeepTraversal, ConcurrentChecks
 from allmydata.mutable.common import NotWriteableError
 from allmydata.mutable.filenode import MutableFileNode
-from allmydata.unknown import UnknownNode, strip_prefix_for_ro
+from allmydata.unknown import strip_prefix_for_ro
 from allmydata.interfaces import IFilesystemNode, IDirectoryNode, IFileNode, \
      ExistingChildError, NoSuchChildError, ICheckable, IDeepCheckable, \
-     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError
+     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError, \
+     IStatsProducer
 from allmydata.check_results import DeepCheckResults, \
      DeepCheckAndRepairResults
 from allmydata.monitor import Monitor
@@ -36,7 +38,7 @@ from allmydata.util.assertutil import precondition
 from allmydata.util.netstring import netstring, split_netstring
 from allmydata.util.consumer import download_to_data
 from allmydata.uri import wrap_dirnode_cap
-from allmydata.util.dictutil import AuxValueDict
+from allmydata.util.dictutil import AuxValueDict, LazyAuxValueDict
 
 from eliot import (
     ActionType,
@@ -123,11 +125,21 @@ def update_metadata(metadata, new_metadata, now):
     return metadata
 
 
-# TODO: {Deleter,MetadataSetter,Adder}.modify all start by unpacking the
-# contents and end by repacking them. It might be better to apply them to
-# the unpacked contents.
+# Deleter, MetadataSetter and Adder each change the unpacked children of a
+# directory in modify_children(), which checks everything that might make it
+# fail before changing anything, so that WriteCoalescer can apply several of
+# them to the same children and leave out the ones that fail. modify() does
+# the same to packed contents, for MutableFileNode.modify.
 
-class Deleter(object):
+class _ChildrenModifier(object):
+    def modify(self, old_contents, servermap, first_time):
+        children = self.node._unpack_contents(old_contents)
+        if not self.modify_children(children, first_time):
+            return None
+        return self.node._pack_contents(children)
+
+
+class Deleter(_ChildrenModifier):
     def __init__(self, node, namex, must_exist=True, must_be_directory=False, must_be_file=False):
         self.node = node
         self.name = normalize(namex)
@@ -135,13 +147,12 @@ class Deleter(object):
         self.must_be_directory = must_be_directory
         self.must_be_file = must_be_file
 
-    def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+    def modify_children(self, children, first_time):
         if self.name not in children:
             if first_time and self.must_exist:
                 raise NoSuchChildError(self.name)
             self.old_child = None
-            return None
+            return False
         self.old_child, metadata = children[self.name]
 
         # Unknown children can be removed regardless of must_be_directory or must_be_file.
@@ -151,19 +162,17 @@ class Deleter(object):
             raise ChildOfWrongTypeError("delete required a file, not a directory")
 
         del children[self.name]
-        new_contents = self.node._pack_contents(children)
-        return new_contents
+        return True
 
 
-class MetadataSetter(object):
+class MetadataSetter(_ChildrenModifier):
     def __init__(self, node, namex, metadata, create_readonly_node=None):
         self.node = node
         self.name = normalize(namex)
         self.metadata = metadata
         self.create_readonly_node = create_readonly_node
 
-    def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+    def modify_children(self, children, first_time):
         name = self.name
         if name not in children:
             raise NoSuchChildError(name)
@@ -176,11 +185,10 @@ class MetadataSetter(object):
             child = self.create_readonly_node(child, name)
 
         children[name] = (child, metadata)
-        new_contents = self.node._pack_contents(children)
-        return new_contents
+        return True
 
 
-class Adder(object):
+class Adder(_ChildrenModifier):
     def __init__(self, node, entries=None, overwrite=True, create_readonly_node=None):
         """
         :param overwrite: Either True (allow overwriting anything existing),
@@ -201,9 +209,9 @@ class Adder(object):
         precondition(IFilesystemNode.providedBy(node), node)
         self.entries[namex] = (node, metadata)
 
-    def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+    def modify_children(self, children, first_time):
         now = time.time()
+        added = {}
         for (namex, (child, new_metadata)) in list(self.entries.items()):
             name = normalize(namex)
             precondition(IFilesystemNode.providedBy(child), child)
@@ -213,21 +221,136 @@ class Adder(object):
             child.raise_error()
 
             metadata = None
-            if name in children:
+            existing = added.get(name) or children.get(name)
+            if existing is not None:
                 if not self.overwrite:
                     raise ExistingChildError("child %s already exists" % quote_output(name, encoding='utf-8'))
 
-                if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(children[name][0]):
+                if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(existing[0]):
                     raise ExistingChildError("child %s already exists as a directory" % quote_output(name, encoding='utf-8'))
-                metadata = children[name][1].copy()
+                metadata = existing[1].copy()
 
             metadata = update_metadata(metadata, new_metadata, now)
             if self.create_readonly_node and metadata.get('no-write', False):
                 child = self.create_readonly_node(child, name)
 
-            children[name] = (child, metadata)
-        new_contents = self.node._pack_contents(children)
-        return new_contents
+            added[name] = (child, metadata)
+        for (name, value) in added.items():
+            children[name] = value
+        return True
+
+
+class _NothingWritten(Exception):
+    """
+    Every change in a batch that WriteCoalescer tried to write failed.
+    """
+
+
+@implementer(IStatsProducer)
+class DirectoryWriteStats(object):
+    """
+    I count the batches of directory changes that WriteCoalescers have
+    published. One of me is shared by all the directories of a client.
+
+    :ivar int batches: The number of batches published so far.
+    :ivar int changes: The number of changes in those batches.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.changes = 0
+
+    def get_stats(self):
+        return {
+            "dirnode.write.batches": self.batches,
+            "dirnode.write.changes": self.changes,
+        }
+
+
+class WriteCoalescer(object):
+    """
+    I apply the changes made to a directory around the same time in one
+    modify/publish cycle of its mutable file.
+
+    A change waits up to ``window`` seconds for others to join it (with the
+    default of 0, a change made while nothing is being published starts
+    right away). While a batch is being published, new changes queue up for
+    the next one. Each change in a batch succeeds or fails on its own, as it
+    would have done if it had been made alone after the ones before it.
+    Each batch is counted in ``stats``, a DirectoryWriteStats.
+    """
+
+    def __init__(self, dirnode, window=0.0, stats=None, reactor=reactor):
+        self._dirnode = dirnode
+        self.window = window
+        if stats is None:
+            stats = DirectoryWriteStats()
+        self.stats = stats
+        self._reactor = reactor
+        self._pending = [] # (modifier, Deferred)
+        self._timer = None
+        self._writing = False
+
+    def modify(self, modifier):
+        """
+        Apply ``modifier`` (a Deleter, MetadataSetter or Adder) as part of
+        the next batch.
+
+        :return: A Deferred that fires with None once the batch has been
+            published, or fails with whatever ``modifier`` raised.
+        """
+        d = defer.Deferred()
+        self._pending.append((modifier, d))
+        self._schedule()
+        return d
+
+    def _schedule(self):
+        if self._pending and not self._writing and self._timer is None:
+            if self.window > 0:
+                self._timer = self._reactor.callLater(self.window, self._write)
+            else:
+                self._write()
+
+    def _write(self):
+        self._timer = None
+        self._writing = True
+        batch, self._pending = self._pending, []
+        failures = {}
+        def modify(old_contents, servermap, first_time):
+            # This may be called again if the publish has to be retried.
+            failures.clear()
+            children = self._dirnode._unpack_contents(old_contents)
+            changed = False
+            for (i, (modifier, d)) in enumerate(batch):
+                try:
+                    if modifier.modify_children(children, first_time):
+                        changed = True
+                except Exception:
+                    failures[i] = Failure()
+            if not changed:
+                if failures:
+                    # Like a lone change that fails, don't write anything.
+                    raise _NothingWritten()
+                return None
+            return self._dirnode._pack_contents(children)
+        log.msg(format="writing %(changes)d changes to a directory at once",
+                changes=len(batch), level=log.NOISY)
+        d = self._dirnode._node.modify(modify)
+        def done(result):
+            self._writing = False
+            self.stats.batches += 1
+            self.stats.changes += len(batch)
+            for (i, (modifier, d)) in enumerate(batch):
+                if i in failures:
+                    d.errback(failures[i])
+                elif (isinstance(result, Failure) and
+                      not result.check(_NothingWritten)):
+                    d.errback(result)
+                else:
+                    d.callback(None)
+            self._schedule()
+        d.addBoth(done)
+
 
 def _encrypt_rw_uri(writekey, rw_uri):
     precondition(isinstance(rw_uri, bytes), rw_uri)
@@ -262,7 +385,8 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
     file. This is the same format as is returned by _unpack_contents. I also
     accept an AuxValueDict, in which case I'll use the auxilliary cached data
     as the pre-packed entry, which is faster than re-packing everything each
-    time.
+    time. Children of a LazyAuxValueDict that were never looked at are not
+    even unpacked.
 
     If writekey is provided then I will superencrypt the child's writecap with
     writekey.
@@ -273,9 +397,13 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
     precondition((writekey is None) or isinstance(writekey, bytes), writekey)
 
     has_aux = isinstance(children, AuxValueDict)
+    lazy = isinstance(children, LazyAuxValueDict) and not deep_immutable
     entries = []
-    for name in sorted(children.keys()):
+    for name in sorted(children.all_keys() if lazy else children.keys()):
         assert isinstance(name, str)
+        if lazy and not children.is_loaded(name):
+            entries.append(netstring(children.get_aux(name)))
+            continue
         entry = None
         (child, metadata) = children[name]
         child.raise_error()
@@ -323,6 +451,12 @@ class DirectoryNode(object):
         self._uri = wrap_dirnode_cap(filenode_cap)
         self._nodemaker = nodemaker
         self._uploader = uploader
+        if nodemaker is None:
+            self._writes = WriteCoalescer(self)
+        else:
+            self._writes = WriteCoalescer(self,
+                                          nodemaker.directory_write_window,
+                                          nodemaker.directory_write_stats)
 
     def __repr__(self):
         return "<%s %s-%s %s>" % (self.__class__.__name__,
@@ -382,9 +516,11 @@ class DirectoryNode(object):
         # an empty directory is serialized as an empty string
         if data == b"":
             return AuxValueDict()
-        writeable = not self.is_readonly()
         mutable = self.is_mutable()
-        children = AuxValueDict()
+        # Only the framing is parsed here: each child's rwcap is decrypted,
+        # its metadata parsed and its node made the first time it is looked
+        # up, by _unpack_child.
+        children = LazyAuxValueDict(self._unpack_child)
         position = 0
         while position < len(data):
             entries, position = split_netstring(data, 1, position)
@@ -398,39 +534,46 @@ class DirectoryNode(object):
             # at <http://unicode.org/policies/stability_policy.html>.
             # Therefore we normalize names going both in and out of directories.
             name = normalize(namex_utf8.decode("utf-8"))
-
-            rw_uri = b""
-            if writeable:
-                rw_uri = self._decrypt_rwcapdata(rwcapdata)
-
-            # Since the encryption uses CTR mode, it currently leaks the length of the
-            # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
-            # dirnode is writeable (ticket #925). By stripping trailing spaces in
-            # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
-            # ro_uri is treated in the same way for consistency.
-            # rw_uri and ro_uri will be either None or a non-empty string.
-
-            rw_uri = rw_uri.rstrip(b' ') or None
-            ro_uri = ro_uri.rstrip(b' ') or None
-
-            try:
-                child = self._create_and_validate_node(rw_uri, ro_uri, name)
-                if mutable or child.is_allowed_in_immutable_directory():
-                    metadata = json.loads(metadata_s)
-                    assert isinstance(metadata, dict)
-                    children[name] = (child, metadata)
-                    children.set_with_aux(name, (child, metadata), auxilliary=entry)
-                else:
-                    log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
-                            name=quote_output(name, encoding='utf-8'),
-                            facility="tahoe.webish", level=log.UNUSUAL)
-            except CapConstraintError as e:
-                log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
-                               "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
-                               facility="tahoe.webish", level=log.UNUSUAL)
+            children.set_lazily(name, (ro_uri, rwcapdata, metadata_s),
+                                auxilliary=entry)
 
         return children
 
+    def _unpack_child(self, name, fields):
+        """Return the (node, metadata) pair for a child packed as (ro_uri,
+        rwcapdata, metadata) by _pack_normalized_children, or None if it
+        can't be used here."""
+        (ro_uri, rwcapdata, metadata_s) = fields
+        rw_uri = b""
+        if not self.is_readonly():
+            rw_uri = self._decrypt_rwcapdata(rwcapdata)
+
+        # Since the encryption uses CTR mode, it currently leaks the length of the
+        # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
+        # dirnode is writeable (ticket #925). By stripping trailing spaces in
+        # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
+        # ro_uri is treated in the same way for consistency.
+        # rw_uri and ro_uri will be either None or a non-empty string.
+
+        rw_uri = rw_uri.rstrip(b' ') or None
+        ro_uri = ro_uri.rstrip(b' ') or None
+
+        try:
+            child = self._create_and_validate_node(rw_uri, ro_uri, name)
+            if self.is_mutable() or child.is_allowed_in_immutable_directory():
+                metadata = json.loads(metadata_s)
+                assert isinstance(metadata, dict)
+                return (child, metadata)
+            else:
+                log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
+                        name=quote_output(name, encoding='utf-8'),
+                        facility="tahoe.webish", level=log.UNUSUAL)
+        except CapConstraintError as e:
+            log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
+                           "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
+                           facility="tahoe.webish", level=log.UNUSUAL)
+        return None
+
     def _pack_contents(self, children):
         # expects children in the same format as _unpack_contents returns
         return _pack_normalized_children(children, self._node.get_writekey())
@@ -539,7 +682,7 @@ class DirectoryNode(object):
         assert isinstance(metadata, dict)
         s = MetadataSetter(self, name, metadata,
                            create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(s.modify)
+        d = self._writes.modify(s)
         d.addCallback(lambda res: self)
         return d
 
@@ -610,7 +753,7 @@ class DirectoryNode(object):
             # for this type of directory.
             child_node = self._create_and_validate_node(writecap, readcap, namex)
             a.set_node(namex, child_node, metadata)
-        d = self._node.modify(a.modify)
+        d = self._writes.modify(a)
         d.addCallback(lambda ign: self)
         return d
 
@@ -631,7 +774,7 @@ class DirectoryNode(object):
         a = Adder(self, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
         a.set_node(namex, child, metadata)
-        d = self._node.modify(a.modify)
+        d = self._writes.modify(a)
         d.addCallback(lambda res: child)
         return d
 
@@ -641,7 +784,7 @@ class DirectoryNode(object):
             return defer.fail(NotWriteableError())
         a = Adder(self, entries, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(a.modify)
+        d = self._writes.modify(a)
         d.addCallback(lambda res: self)
         return d
 
@@ -673,7 +816,7 @@ class DirectoryNode(object):
             return defer.fail(NotWriteableError())
         deleter = Deleter(self, namex, must_exist=must_exist,
                           must_be_directory=must_be_directory, must_be_file=must_be_file)
-        d = self._node.modify(deleter.modify)
+        d = self._writes.modify(deleter)
         d.addCallback(lambda res: deleter.old_child)
         return d
 
@@ -697,7 +840,7 @@ class DirectoryNode(object):
             entries = {name: (child, metadata)}
             a = Adder(self, entries, overwrite=overwrite,
                       create_readonly_node=self._create_readonly_node)
-            d = self._node.modify(a.modify)
+            d = self._writes.modify(a)
             d.addCallback(lambda res: child)
             return d
         d.addCallback(_created)
@@ -749,7 +892,8 @@ class DirectoryNode(object):
         the parent dirnode and the dict of childname->(childnode,metadata).
         This function should *not* traverse the children: I will do that.
         enter_directory() is most useful for the deep-stats number that
-        counts how large a directory is.
+        counts how large a directory is. A sharded directory is entered one
+        leaf shard at a time, with the leaf as the parent.
 
         I call walker.add_node(node, path) for each node (both files and
         directories) I can reach. Most work should be done here.
@@ -766,77 +910,29 @@ class DirectoryNode(object):
         """
 
         # this is just a tree-walker, except that following each edge
-        # requires a Deferred. We used to use a ConcurrencyLimiter to limit
-        # fanout to 10 simultaneous operations, but the memory load of the
-        # queued operations was excessive (in one case, with 330k dirnodes,
-        # it caused the process to run into the 3.0GB-ish per-process 32bit
-        # linux memory limit, and crashed). So we use a single big Deferred
-        # chain, and do a strict depth-first traversal, one node at a time.
-        # This can be slower, because we aren't pipelining directory reads,
-        # but it brought the memory footprint down by roughly 50%.
+        # requires a Deferred. We used to do a strict depth-first traversal,
+        # one node at a time, because queueing up the pending operations
+        # once ran a 330k-dirnode walk out of memory. DeepTraversal reads
+        # several directories at once instead, and keeps the queue within a
+        # memory budget by moving it to disk when it gets too long.
 
         monitor = Monitor()
         walker.set_monitor(monitor)
 
-        found = set([self.get_verify_cap()])
-        d = self._deep_traverse_dirnode(self, [], walker, monitor, found)
+        nodemaker = self._nodemaker
+        traversal = DeepTraversal(
+            self, walker, monitor,
+            concurrency=nodemaker.traverse_concurrency,
+            memory_budget=nodemaker.traverse_memory_budget,
+            tempdir=nodemaker.tempdir,
+        )
+        d = traversal.run()
         d.addCallback(lambda ignored: walker.finish())
         d.addBoth(monitor.finish)
         d.addErrback(lambda f: None)
 
         return monitor
 
-    def _deep_traverse_dirnode(self, node, path, walker, monitor, found):
-        # process this directory, then walk its children
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.add_node, node, path)
-        d.addCallback(lambda ignored: node.list())
-        d.addCallback(self._deep_traverse_dirnode_children, node, path,
-                      walker, monitor, found)
-        return d
-
-    def _deep_traverse_dirnode_children(self, children, parent, path,
-                                        walker, monitor, found):
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.enter_directory, parent, children)
-        # we process file-like children first, so we can drop their FileNode
-        # objects as quickly as possible. Tests suggest that a FileNode (held
-        # in the client's nodecache) consumes about 2440 bytes. dirnodes (not
-        # in the nodecache) seem to consume about 2000 bytes.
-        dirkids = []
-        filekids = []
-        for name, (child, metadata) in sorted(children.items()):
-            childpath = path + [name]
-            if isinstance(child, UnknownNode):
-                walker.add_node(child, childpath)
-                continue
-            verifier = child.get_verify_cap()
-            # allow LIT files (for which verifier==None) to be processed
-            if (verifier is not None) and (verifier in found):
-                continue
-            found.add(verifier)
-            if IDirectoryNode.providedBy(child):
-                dirkids.append( (child, childpath) )
-            else:
-                filekids.append( (child, childpath) )
-        for i, (child, childpath) in enumerate(filekids):
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          walker.add_node(child, childpath))
-            # to work around the Deferred tail-recursion problem
-            # (specifically the defer.succeed flavor) requires us to avoid
-            # doing more than 158 LIT files in a row. We insert a turn break
-            # once every 100 files (LIT or CHK) to preserve some stack space
-            # for other code. This is a different expression of the same
-            # Twisted problem as in #237.
-            if i % 100 == 99:
-                d.addCallback(lambda ignored: fireEventually())
-        for (child, childpath) in dirkids:
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          self._deep_traverse_dirnode(child, childpath,
-                                                      walker, monitor,
-                                                      found))
-        return d
-
 
     def build_manifest(self):
         """Return a Monitor, with a ['status'] that will be a list of (path,
@@ -851,10 +947,18 @@ class DirectoryNode(object):
         return self.deep_traverse(DeepStats(self))
 
     def start_deep_check(self, verify=False, add_lease=False):
-        return self.deep_traverse(DeepChecker(self, verify, repair=False, add_lease=add_lease))
+        return self.deep_traverse(self._make_deep_checker(verify, False, add_lease))
 
     def start_deep_check_and_repair(self, verify=False, add_lease=False):
-        return self.deep_traverse(DeepChecker(self, verify, repair=True, add_lease=add_lease))
+        return self.deep_traverse(self._make_deep_checker(verify, True, add_lease))
+
+    def _make_deep_checker(self, verify, repair, add_lease):
+        nodemaker = self._nodemaker
+        return DeepChecker(
+            self, verify, repair=repair, add_lease=add_lease,
+            concurrency=nodemaker.deep_check_concurrency,
+            requests_per_server=nodemaker.deep_check_requests_per_server,
+        )
 
 
 class ManifestWalker(DeepStats):
@@ -884,7 +988,13 @@ class ManifestWalker(DeepStats):
 
 
 class DeepChecker(object):
-    def __init__(self, root, verify, repair, add_lease):
+    """I check every node a deep_traverse() gives me, running up to
+    'concurrency' checks at once. If 'requests_per_server' is given, those
+    checks may have no more than that many queries outstanding with any one
+    server."""
+
+    def __init__(self, root, verify, repair, add_lease, concurrency=1,
+                 requests_per_server=None):
         root_si = root.get_storage_index()
         if root_si:
             root_si_base32 = base32.b2a(root_si)
@@ -901,12 +1011,19 @@ class DeepChecker(object):
         else:
             self._results = DeepCheckResults(root_si)
         self._stats = DeepStats(root)
+        self._checks = ConcurrentChecks(concurrency)
+        self._requests_per_server = requests_per_server
 
     def set_monitor(self, monitor):
         self.monitor = monitor
         monitor.set_status(self._results)
+        if self._requests_per_server:
+            monitor.limit_server_requests(self._requests_per_server)
 
     def add_node(self, node, childpath):
+        return self._checks.add(self._check_node, node, childpath)
+
+    def _check_node(self, node, childpath):
         if self._repair:
             d = node.check_and_repair(self.monitor, self._verify, self._add_lease)
             d.addCallback(self._results.add_check_and_repair, childpath)
@@ -920,9 +1037,13 @@ class DeepChecker(object):
         return self._stats.enter_directory(parent, children)
 
     def finish(self):
-        log.msg("deep-check done", parent=self._lp)
-        self._results.update_stats(self._stats.get_results())
-        return self._results
+        d = self._checks.when_done()
+        def _done(ignored):
+            log.msg("deep-check done", parent=self._lp)
+            self._results.update_stats(self._stats.get_results())
+            return self._results
+        d.addCallback(_done)
+        return d
 
 
 # use client.create_dirnode() to make one of these
@@ -12,6 +12,7 @@ if PY2:
 
 from zope.interface import implementer
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from foolscap.api import DeadReferenceError, RemoteException
 from allmydata import hashtree, codec, uri
 from allmydata.interfaces import IValidatedThingProxy, IVerifierURI
@@ -472,9 +473,20 @@ class Checker(log.PrefixingLogMixin):
     Before I send any new request to a server, I always ask the 'monitor'
     object that was passed into my constructor whether this task has been
     cancelled (by invoking its raise_if_cancelled() method).
+
+    When verifying, I ask for up to 'verify_window' blocks of each share at
+    once, and for at most 'verify_byte_budget' bytes of blocks from all the
+    servers together (but always at least one block). That budget is the
+    monitor's 'verify' byte budget, so it is shared with every other check
+    using the same monitor, such as the other files of a deep-check. I count
+    the blocks and bytes verified in the monitor's 'verify-blocks' and
+    'verify-bytes' progress counters.
     """
+    VERIFY_WINDOW = 8
+    VERIFY_BYTE_BUDGET = 16 * 1024 * 1024
+
     def __init__(self, verifycap, servers, verify, add_lease, secret_holder,
-                 monitor):
+                 monitor, verify_window=None, verify_byte_budget=None):
         assert precondition(isinstance(verifycap, CHKFileVerifierURI), verifycap, type(verifycap))
 
         prefix = str(base32.b2a(verifycap.get_storage_index()[:8])[:12], "utf-8")
@@ -486,6 +498,9 @@ class Checker(log.PrefixingLogMixin):
         self._servers = servers
         self._verify = verify # bool: verify what the servers claim, or not?
         self._add_lease = add_lease
+        self._verify_window = verify_window or self.VERIFY_WINDOW
+        self._budget = monitor.get_byte_budget(
+            "verify", verify_byte_budget or self.VERIFY_BYTE_BUDGET)
 
         frs = file_renewal_secret_hash(secret_holder.get_renewal_secret(),
                                        self._verifycap.get_storage_index())
@@ -520,7 +535,8 @@ class Checker(log.PrefixingLogMixin):
             )
             d2.addErrback(self._add_lease_failed, s.get_name(), storageindex)
 
-        d = storage_server.get_buckets(storageindex)
+        d = self._monitor.server_request(s, storage_server.get_buckets,
+                                         storageindex)
         def _wrap_results(res):
             return (res, True)
 
@@ -627,27 +643,7 @@ class Checker(log.PrefixingLogMixin):
             return d
         d.addCallback(_got_ueb)
 
-        def _discard_result(r):
-            assert isinstance(r, bytes), r
-            # to free up the RAM
-            return None
-
-        def _get_blocks(vrbp):
-            def _get_block(ign, blocknum):
-                db = vrbp.get_block(blocknum)
-                db.addCallback(_discard_result)
-                return db
-
-            dbs = defer.succeed(None)
-            for blocknum in range(veup.num_segments):
-                dbs.addCallback(_get_block, blocknum)
-
-            # The Deferred we return will fire after every block of this
-            # share has been downloaded and verified successfully, or else it
-            # will errback as soon as the first error is observed.
-            return dbs
-
-        d.addCallback(_get_blocks)
+        d.addCallback(self._verify_blocks)
 
         # if none of those errbacked, the blocks (and the hashes above them)
         # are good
@@ -678,6 +674,55 @@ class Checker(log.PrefixingLogMixin):
 
         return d
 
+    def _verify_blocks(self, vrbp):
+        """Fetch and verify every block of the share behind vrbp, with up to
+        my window of them outstanding at once. Return a Deferred that fires
+        after every block has been downloaded and verified successfully, or
+        else errbacks as soon as the first error is observed (once the
+        blocks already asked for have arrived)."""
+        done = defer.Deferred()
+        blocknums = iter(range(vrbp.num_blocks))
+        # Each outstanding block holds block_size bytes of the budget, even
+        # the last (usually shorter) one.
+        size = vrbp.block_size
+        state = {"outstanding": 0, "failure": None}
+
+        def _get_block(ign, blocknum):
+            self._monitor.raise_if_cancelled()
+            return vrbp.get_block(blocknum)
+
+        def _got_block(result):
+            self._budget.release(size)
+            state["outstanding"] -= 1
+            if isinstance(result, Failure):
+                if state["failure"] is None:
+                    state["failure"] = result
+            else:
+                assert isinstance(result, bytes), result
+                self._monitor.add_progress("verify-blocks", 1)
+                self._monitor.add_progress("verify-bytes", len(result))
+                # the block itself is dropped here, to free up the RAM
+            _fill_window()
+
+        def _fill_window():
+            while (state["failure"] is None and
+                   state["outstanding"] < self._verify_window):
+                blocknum = next(blocknums, None)
+                if blocknum is None:
+                    break
+                state["outstanding"] += 1
+                d = self._budget.acquire(size)
+                d.addCallback(_get_block, blocknum)
+                d.addBoth(_got_block)
+            if state["outstanding"] == 0 and not done.called:
+                if state["failure"] is None:
+                    done.callback(None)
+                else:
+                    done.errback(state["failure"])
+
+        _fill_window()
+        return done
+
     def _verify_server_shares(self, s):
         """ Return a deferred which eventually fires with a tuple of
         (set(sharenum), server, set(corruptsharenum),
@@ -12,14 +12,16 @@ if PY2:
 
 import time
 now = time.time
-from zope.interface import Interface
+from collections import OrderedDict
+from zope.interface import Interface, implementer
 from twisted.python.failure import Failure
 from twisted.internet import defer
 from foolscap.api import eventually
 from allmydata import uri
 from allmydata.codec import CRSDecoder
 from allmydata.util import base32, log, hashutil, mathutil, observer
-from allmydata.interfaces import DEFAULT_MAX_SEGMENT_SIZE
+from allmydata.interfaces import DEFAULT_MAX_SEGMENT_SIZE, \
+     NotEnoughSharesError, NoSharesError, IStatsProducer
 from allmydata.hashtree import IncompleteHashTree, BadHashError, \
      NotEnoughHashesError
 
@@ -49,11 +51,30 @@ class DownloadNode(object):
     """Internal class which manages downloads and holds state. External
     callers use CiphertextFileNode instead."""
 
+    # Each read() may ask for up to this many segments beyond the one its
+    # consumer is waiting for, so the next segments are already on their way
+    # while the consumer deals with the current one. READAHEAD_MAX_BYTES
+    # bounds how much (in whole segments) a single read() can have requested
+    # or be holding at once. Clients set their own with the
+    # 'readahead_segments' and 'readahead_max_bytes' arguments.
+    READAHEAD_SEGMENTS = 4
+    READAHEAD_MAX_BYTES = 4*1024*1024
+
     # Share._node points to me
     def __init__(self, verifycap, storage_broker, secret_holder,
-                 terminator, history, download_status):
+                 terminator, history, download_status, segment_cache=None,
+                 readahead_segments=None, readahead_max_bytes=None,
+                 compute=None):
         assert isinstance(verifycap, uri.CHKFileVerifierURI)
         self._verifycap = verifycap
+        # the ComputePool to decode segments on, or None
+        self._compute = compute
+        if readahead_segments is not None:
+            self.READAHEAD_SEGMENTS = readahead_segments
+        if readahead_max_bytes is not None:
+            self.READAHEAD_MAX_BYTES = readahead_max_bytes
+        # a SegmentCache shared with the other nodes of our client, or None
+        self._segment_cache = segment_cache
         self._storage_broker = storage_broker
         self._si_prefix = base32.b2a(verifycap.storage_index[:8])[:12]
         self.running = True
@@ -112,6 +133,8 @@ class DownloadNode(object):
         self._sharefinder = ShareFinder(storage_broker, verifycap, self,
                                         self._download_status, lp)
         self._shares = set()
+        # set by reused(): the shares we know about may have gone away
+        self._may_rediscover = False
 
     def _build_guessed_tables(self, max_segment_size):
         size = min(self._verifycap.size, max_segment_size)
@@ -129,15 +152,32 @@ class DownloadNode(object):
 
     def stop(self):
         # called by the Terminator at shutdown, mostly for tests
+        self.running = False
         if self._active_segment:
             self._active_segment.stop()
             self._active_segment = None
         self._sharefinder.stop()
 
+    def reused(self):
+        """I am being reused by a new download, from a DownloadNodeCache. If
+        the shares I found earlier can no longer provide a segment, I will
+        look for shares again before giving up."""
+        self._may_rediscover = True
+
+    def _rediscover_shares(self):
+        log.msg(format="%(node)s: looking for shares again",
+                node=repr(self), level=log.UNUSUAL, parent=self._lp,
+                umid="vC3nRw")
+        self._sharefinder.stop()
+        self._sharefinder = ShareFinder(self._storage_broker, self._verifycap,
+                                        self, self._download_status, self._lp)
+        self._shares = set()
+        self._no_more_shares = False
+
     # things called by outside callers, via CiphertextFileNode. get_segment()
     # may also be called by Segmentation.
 
-    def read(self, consumer, offset, size):
+    def read(self, consumer, offset, size, download_status=None):
         """I am the main entry point, from which FileNode.read() can get
         data. I feed the consumer with the desired range of ciphertext. I
         return a Deferred that fires (with the consumer) when the read is
@@ -145,7 +185,12 @@ class DownloadNode(object):
 
         Note that there is no notion of a 'file pointer': each call to read()
         uses an independent offset= value.
+
+        The read is recorded in download_status if given, otherwise in the
+        DownloadStatus I was created with.
         """
+        if download_status is None:
+            download_status = self._download_status
         # for concurrent operations: each gets its own Segmentation manager
         if size is None:
             size = self._verifycap.size
@@ -153,10 +198,10 @@ class DownloadNode(object):
         # so size is not negative (which indicates that offset >= EOF)
         size = max(0, min(size, self._verifycap.size-offset))
 
-        read_ev = self._download_status.add_read_event(offset, size, now())
+        read_ev = download_status.add_read_event(offset, size, now())
         if IDownloadStatusHandlingConsumer.providedBy(consumer):
             consumer.set_download_status_read_event(read_ev)
-            consumer.set_download_status(self._download_status)
+            consumer.set_download_status(download_status)
 
         lp = log.msg(format="imm Node(%(si)s).read(%(offset)d, %(size)d)",
                      si=base32.b2a(self._verifycap.storage_index)[:8],
@@ -214,6 +259,18 @@ class DownloadNode(object):
                      level=log.OPERATIONAL, parent=logparent, umid="UKFjDQ")
         seg_ev = self._download_status.add_segment_request(segnum, now())
         d = defer.Deferred()
+        if self._segment_cache is not None and self.segment_size:
+            # without the real segment size, segnum may be a guess, and
+            # Segmentation can only retry a wrong guess once it knows
+            segment = self._segment_cache.get(self._verifycap, segnum)
+            if segment is not None:
+                when = now()
+                offset = segnum * self.segment_size
+                seg_ev.activate(when)
+                seg_ev.deliver(when, offset, len(segment), 0)
+                c = Cancel(lambda c: None)
+                eventually(self._deliver, d, c, (offset, segment, 0))
+                return (d, c)
         c = Cancel(self._cancel_request)
         self._segment_requests.append( (segnum, d, c, seg_ev, lp) )
         self._start_new_segment()
@@ -322,7 +379,7 @@ class DownloadNode(object):
         # codec instance for all but the last segment. 3-of-10 takes 15us on
         # my laptop, 25-of-100 is 900us, 3-of-255 is 97us, 25-of-255 is
         # 2.5ms, worst-case 254-of-255 is 9.3ms
-        self._codec = CRSDecoder()
+        self._codec = CRSDecoder(self._compute)
         self._codec.set_params(self.segment_size, k, N)
 
 
@@ -408,6 +465,16 @@ class DownloadNode(object):
 
     def fetch_failed(self, sf, f):
         assert sf is self._active_segment
+        if self._may_rediscover and f.check(NotEnoughSharesError,
+                                            NoSharesError):
+            # The shares were found for an earlier download, and may have
+            # moved since. Nothing has been delivered for this segment yet,
+            # so we can start it again with fresh ones.
+            self._may_rediscover = False
+            self._rediscover_shares()
+            self._active_segment = None
+            self._start_new_segment()
+            return
         # deliver error upwards
         for (d,c,seg_ev) in self._extract_requests(sf.segnum):
             seg_ev.error(now())
@@ -432,6 +499,8 @@ class DownloadNode(object):
                     eventually(self._deliver, d, c, result)
             else:
                 (offset, segment, decodetime) = result
+                if self._segment_cache is not None:
+                    self._segment_cache.add(self._verifycap, segnum, segment)
                 for (d,c,seg_ev) in self._extract_requests(segnum):
                     # when we have two requests for the same segment, the
                     # second one will not be "activated" before the data is
@@ -458,7 +527,7 @@ class DownloadNode(object):
         decoded_size = self.segment_size
         if tail:
             # account for the padding in the last segment
-            codec = CRSDecoder()
+            codec = CRSDecoder(self._compute)
             k, N = self._verifycap.needed_shares, self._verifycap.total_shares
             codec.set_params(self.tail_segment_padded, k, N)
             block_size = self.tail_block_size
@@ -545,3 +614,102 @@ class DownloadNode(object):
         if self.num_segments is None:
             return (self.guessed_num_segments, False)
         return (self.num_segments, True)
+
+
+class DownloadNodeCache(object):
+    """
+    I remember the DownloadNodes of recently read immutable files, by verify
+    cap, so that a later read of the same file (another web request for it,
+    say) starts with the UEB and hash trees already validated and the shares
+    already located, and goes straight to fetching blocks. One of me is
+    shared by all the immutable file nodes of a client.
+
+    At most ``size`` nodes are kept, discarding the least recently used
+    first. A node handed out again looks for shares afresh if the ones it
+    knew about can no longer provide a segment.
+    """
+
+    def __init__(self, size):
+        assert size > 0, size
+        self._size = size
+        self._nodes = OrderedDict() # verify cap string -> DownloadNode
+
+    def get(self, verifycap):
+        """
+        Return the DownloadNode remembered for verifycap, or None.
+        """
+        key = verifycap.to_string()
+        node = self._nodes.get(key)
+        if node is None:
+            return None
+        if not node.running:
+            del self._nodes[key]
+            return None
+        self._nodes.move_to_end(key)
+        node.reused()
+        return node
+
+    def add(self, verifycap, node):
+        key = verifycap.to_string()
+        self._nodes[key] = node
+        self._nodes.move_to_end(key)
+        while len(self._nodes) > self._size:
+            self._nodes.popitem(last=False)
+
+
+@implementer(IStatsProducer)
+class SegmentCache(object):
+    """
+    I remember recently downloaded segments of immutable files, by verify
+    cap and segment number, so that reads of nearby ranges of the same file
+    (a video player making many small Range requests, say) don't fetch and
+    decode the same segment again. One of me is shared by all the immutable
+    file nodes of a client.
+
+    I hold ciphertext: decryption is cheap next to fetching and decoding,
+    and it means a segment is never held in memory unencrypted for longer
+    than one read needs it. At most ``max_bytes`` bytes of segments are
+    kept, discarding the least recently used first.
+    """
+
+    def __init__(self, max_bytes):
+        assert max_bytes > 0, max_bytes
+        self._max_bytes = max_bytes
+        self._segments = OrderedDict() # (verify cap string, segnum) -> data
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, verifycap, segnum):
+        """
+        Return the data of segment ``segnum`` of the file, or None.
+        """
+        key = (verifycap.to_string(), segnum)
+        segment = self._segments.get(key)
+        if segment is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._segments.move_to_end(key)
+        return segment
+
+    def add(self, verifycap, segnum, segment):
+        if len(segment) > self._max_bytes:
+            return
+        key = (verifycap.to_string(), segnum)
+        old = self._segments.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._segments[key] = segment
+        self._bytes += len(segment)
+        while self._bytes > self._max_bytes:
+            (ignored, evicted) = self._segments.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def get_stats(self):
+        return {
+            "downloader.segment_cache.hits": self.hits,
+            "downloader.segment_cache.misses": self.misses,
+            "downloader.segment_cache.bytes": self._bytes,
+            "downloader.segment_cache.max_bytes": self._max_bytes,
+        }
@@ -28,17 +28,32 @@ class Segmentation(object):
     segmentation: I figure out which segments are necessary, request them
     (from my CiphertextDownloader) in order, and trim the segments down to
     match the offset+size span. I use the Producer/Consumer interface to only
-    request one segment at a time.
+    deliver data while my consumer wants it.
+
+    Once the real segment size is known, I read ahead: I keep asking for the
+    following segments of my span while earlier ones are still being fetched
+    or are waiting for the consumer. The read-ahead window starts at one
+    segment, doubles each time a segment is delivered, and halves whenever
+    the consumer pauses me. It is capped by the node's READAHEAD_SEGMENTS
+    and READAHEAD_MAX_BYTES, and everything still outstanding is cancelled
+    if the consumer stops me early.
     """
     def __init__(self, node, offset, size, consumer, read_ev, logparent=None):
         self._node = node
         self._hungry = True
-        self._active_segnum = None
-        self._cancel_segment_request = None
+        # segments we have asked the node for, in file order, as
+        # [segnum, cancel, result] lists: result is None until the segment
+        # (or a Failure) arrives.
+        self._fetches = []
+        # the next segment to read ahead, or None if we don't know the real
+        # segment size yet.
+        self._next_segnum = None
+        self._window = 1
         # these are updated as we deliver data. At any given time, we still
         # want to download file[offset:offset+size]
         self._offset = offset
         self._size = size
+        self._end = offset + size
         assert offset+size <= node._verifycap.size
         self._consumer = consumer
         self._read_ev = read_ev
@@ -58,9 +73,13 @@ class Segmentation(object):
         return res
 
     def _maybe_fetch_next(self):
-        if not self._alive or not self._hungry:
+        if not self._alive:
             return
-        if self._active_segnum is not None:
+        if self._fetches:
+            self._maybe_deliver()
+            self._read_ahead()
+            return
+        if not self._hungry:
             return
         self._fetch_next()
 
@@ -86,24 +105,57 @@ class Segmentation(object):
         log.msg(format="_fetch_next(offset=%(offset)d) %(guess)swants segnum=%(segnum)d",
                 offset=self._offset, guess=guess_s, segnum=wanted_segnum,
                 level=log.NOISY, parent=self._lp, umid="5WfN0w")
-        self._active_segnum = wanted_segnum
-        d,c = n.get_segment(wanted_segnum, self._lp)
-        self._cancel_segment_request = c
-        d.addBoth(self._request_retired)
-        d.addCallback(self._got_segment, wanted_segnum)
-        if not have_actual_segment_size:
+        self._request_segment(wanted_segnum, guessed=not have_actual_segment_size)
+        if have_actual_segment_size:
+            self._next_segnum = wanted_segnum + 1
+            self._read_ahead()
+
+    def _read_ahead(self):
+        n = self._node
+        if self._next_segnum is None or n.segment_size is None:
+            return
+        last_segnum = (self._end - 1) // n.segment_size
+        limit = min(self._window, 1 + n.READAHEAD_SEGMENTS,
+                    max(1, n.READAHEAD_MAX_BYTES // n.segment_size))
+        while (self._alive and len(self._fetches) < limit
+               and self._next_segnum <= last_segnum):
+            log.msg(format="reading ahead segnum=%(segnum)d",
+                    segnum=self._next_segnum,
+                    level=log.NOISY, parent=self._lp, umid="dQbv7A")
+            self._request_segment(self._next_segnum, guessed=False)
+            self._next_segnum += 1
+
+    def _request_segment(self, segnum, guessed):
+        d,c = self._node.get_segment(segnum, self._lp)
+        fetch = [segnum, c, None]
+        self._fetches.append(fetch)
+        d.addBoth(self._segment_arrived, fetch, guessed)
+
+    def _segment_arrived(self, res, fetch, guessed):
+        if not any(f is fetch for f in self._fetches):
+            # we were stopped, and have already forgotten about it
+            return
+        fetch[2] = (res, guessed)
+        self._maybe_fetch_next()
+
+    def _maybe_deliver(self):
+        # hand the oldest segment to our consumer, if it has arrived and the
+        # consumer wants it. We deliver at most one segment per call: the
+        # consumer may pause or stop us while we're writing to it.
+        if not (self._alive and self._hungry):
+            return
+        if self._fetches[0][2] is None:
+            return
+        (segnum, c, (res, guessed)) = self._fetches.pop(0)
+        d = defer.succeed(res)
+        d.addCallback(self._got_segment, segnum)
+        if guessed:
             # we can retry once
             d.addErrback(self._retry_bad_segment)
         d.addErrback(self._error)
 
-    def _request_retired(self, res):
-        self._active_segnum = None
-        self._cancel_segment_request = None
-        return res
-
     def _got_segment(self, segment_args, wanted_segnum):
         (segment_start, segment, decodetime) = segment_args
-        self._cancel_segment_request = None
         # we got file[segment_start:segment_start+len(segment)]
         # we want file[self._offset:self._offset+self._size]
         log.msg(format="Segmentation got data:"
@@ -132,6 +184,7 @@ class Segmentation(object):
 
         self._offset += len(desired_data)
         self._size -= len(desired_data)
+        self._window = min(2 * self._window, 1 + self._node.READAHEAD_SEGMENTS)
         self._consumer.write(desired_data)
         # the consumer might call our .pauseProducing() inside that write()
         # call, setting self._hungry=False
@@ -154,23 +207,30 @@ class Segmentation(object):
                 level=log.WEIRD, parent=self._lp, umid="EYlXBg")
         self._alive = False
         self._hungry = False
+        self._cancel_fetches()
         self._deferred.errback(f)
 
+    def _cancel_fetches(self):
+        # cancel any outstanding segment requests, including the speculative
+        # ones, and drop any segments we were holding for the consumer
+        fetches, self._fetches = self._fetches, []
+        for (segnum, c, res) in fetches:
+            c.cancel()
+
     def stopProducing(self):
         log.msg("asked to stopProducing",
                 level=log.NOISY, parent=self._lp, umid="XIyL9w")
         self._hungry = False
         self._alive = False
-        # cancel any outstanding segment request
-        if self._cancel_segment_request:
-            self._cancel_segment_request.cancel()
-            self._cancel_segment_request = None
+        self._cancel_fetches()
         e = DownloadStopped("our Consumer called stopProducing()")
         self._deferred.errback(e)
 
     def pauseProducing(self):
         self._hungry = False
         self._start_pause = now()
+        # the consumer can't keep up, so reading far ahead buys us less
+        self._window = max(1, self._window // 2)
     def resumeProducing(self):
         self._hungry = True
         eventually(self._maybe_fetch_next)
@@ -21,6 +21,7 @@ from allmydata import uri
 from allmydata.storage.server import si_b2a
 from allmydata.hashtree import HashTree
 from allmydata.util import mathutil, hashutil, base32, log, happinessutil
+from allmydata.util.compute import defer_to_compute
 from allmydata.util.assertutil import _assert, precondition
 from allmydata.codec import CRSEncoder
 from allmydata.interfaces import IEncoder, IStorageBucketWriter, \
@@ -51,9 +52,11 @@ log(number of segments)).
 Each segment (A,B,C) is read into memory, encrypted, and encoded into
 blocks. The 'share' (say, share #1) that makes it out to a host is a
 collection of these blocks (block A1, B1, C1), plus some hash-tree
-information necessary to validate the data upon retrieval. Only one segment
-is handled at a time: all blocks for segment A are delivered before any
-work is begun on segment B.
+information necessary to validate the data upon retrieval. Segments are read
+and encoded strictly in order, but with a pipeline depth greater than one,
+segment B is read and encoded while the blocks for segment A are still being
+delivered, so that CPU work and network transfers overlap. At most
+'pipeline_depth' segments' worth of blocks are in flight at any time.
 
 As blocks are created, we retain the hash of each one. The list of block hashes
 for a single share (say, hash(A1), hash(B1), hash(C1)) is used to form the base
@@ -90,8 +93,22 @@ PiB=1024*TiB
 @implementer(IEncoder)
 class Encoder(object):
 
-    def __init__(self, log_parent=None, upload_status=None):
+    def __init__(self, log_parent=None, upload_status=None, pipeline_depth=1,
+                 compute=None):
+        """
+        :param int pipeline_depth: The number of segments whose blocks may be
+            in flight to the shareholders at once.  With 1, every block of a
+            segment is delivered before the next segment is read; larger
+            values let reading and encoding overlap with sending, at the cost
+            of holding up to that many encoded segments in memory.
+
+        :param Optional[ComputePool] compute: The pool to do erasure coding
+            and hashing on, or None to do it in the reactor thread.
+        """
         object.__init__(self)
+        precondition(pipeline_depth >= 1, pipeline_depth)
+        self._pipeline_depth = pipeline_depth
+        self._compute = compute
         self.uri_extension_data = {}
         self._codec = None
         self._status = None
@@ -147,7 +164,7 @@ class Encoder(object):
         self.num_segments = mathutil.div_ceil(self.file_size,
                                               self.segment_size)
 
-        self._codec = CRSEncoder()
+        self._codec = CRSEncoder(self._compute)
         self._codec.set_params(self.segment_size,
                                self.required_shares, self.num_shares)
 
@@ -175,7 +192,7 @@ class Encoder(object):
         # the tail codec is responsible for encoding tail_size bytes
         padded_tail_size = mathutil.next_multiple(tail_size,
                                                   self.required_shares)
-        self._tail_codec = CRSEncoder()
+        self._tail_codec = CRSEncoder(self._compute)
         self._tail_codec.set_params(padded_tail_size,
                                     self.required_shares, self.num_shares)
         data['tail_codec_params'] = self._tail_codec.get_serialized_params()
@@ -234,6 +251,9 @@ class Encoder(object):
         # to landlord[i]. This list contains a hash of each segment_share
         # that we sent to that landlord.
         self.share_root_hashes = [None] * self.num_shares
+        # shareid -> Deferred that fires once the shareholder has accepted
+        # the most recent block we sent it
+        self._block_accepted = {}
 
         self._times = {
             "cumulative_encoding": 0.0,
@@ -246,20 +266,7 @@ class Encoder(object):
         d = fireEventually()
 
         d.addCallback(lambda res: self.start_all_shareholders())
-
-        for i in range(self.num_segments-1):
-            # note to self: this form doesn't work, because lambda only
-            # captures the slot, not the value
-            #d.addCallback(lambda res: self.do_segment(i))
-            # use this form instead:
-            d.addCallback(lambda res, i=i: self._encode_segment(i, is_tail=False))
-            d.addCallback(self._send_segment, i)
-            d.addCallback(self._turn_barrier)
-        last_segnum = self.num_segments - 1
-        d.addCallback(lambda res: self._encode_segment(last_segnum, is_tail=True))
-        d.addCallback(self._send_segment, last_segnum)
-        d.addCallback(self._turn_barrier)
-
+        d.addCallback(lambda res: self._encode_and_send_segments())
         d.addCallback(lambda res: self.finish_hashing())
 
         d.addCallback(lambda res:
@@ -314,6 +321,34 @@ class Encoder(object):
             dl.append(d)
         return self._gather_responses(dl)
 
+    @defer.inlineCallbacks
+    def _encode_and_send_segments(self):
+        """
+        Encode every segment in order and send its blocks, keeping at most
+        ``pipeline_depth`` segments' worth of blocks in flight.
+
+        :return: A ``Deferred`` that fires once the blocks of every segment
+            have been delivered.
+        """
+        # Deferreds for segments whose blocks are still being sent, oldest
+        # first.
+        in_flight = []
+        try:
+            for segnum in range(self.num_segments):
+                is_tail = (segnum == self.num_segments - 1)
+                shares_and_hashes = yield self._encode_segment(segnum, is_tail)
+                in_flight.append(self._send_segment(shares_and_hashes, segnum))
+                while len(in_flight) >= self._pipeline_depth:
+                    yield in_flight.pop(0)
+                yield self._turn_barrier(None)
+            while in_flight:
+                yield in_flight.pop(0)
+        finally:
+            # If anything failed, the upload is over and err() will abort the
+            # shareholders; later segments failing as well is not news.
+            for d in in_flight:
+                d.addErrback(lambda f: None)
+
     def _encode_segment(self, segnum, is_tail):
         """
         Encode one segment of input into the configured number of shares.
@@ -325,11 +360,12 @@ class Encoder(object):
         :param bool is_tail: ``True`` if this is the last segment, ``False``
             otherwise.
 
-        :return: A ``Deferred`` which fires with a two-tuple.  The first
+        :return: A ``Deferred`` which fires with a three-tuple.  The first
             element is a list of string-y objects representing the encoded
             segment data for one of the shares.  The second element is a list
             of integers giving the share numbers of the shares in the first
-            element.
+            element.  The third element is a list of the block hashes of the
+            shares in the first element.
         """
         codec = self._tail_codec if is_tail else self._codec
         start = time.time()
@@ -373,6 +409,13 @@ class Encoder(object):
             # during this call, we hit 5*segsize memory
             return codec.encode(chunks)
         d.addCallback(_done_gathering)
+        def _hash_blocks(shares_and_shareids):
+            (shares, shareids) = shares_and_shareids
+            d2 = defer_to_compute(
+                self._compute, lambda: [hashutil.block_hash(block) for block in shares])
+            d2.addCallback(lambda block_hashes: (shares, shareids, block_hashes))
+            return d2
+        d.addCallback(_hash_blocks)
         def _done(res):
             elapsed = time.time() - start
             self._times["cumulative_encoding"] += elapsed
@@ -417,6 +460,10 @@ class Encoder(object):
             precondition(len(data) <= read_size, len(data), read_size)
             if not allow_short:
                 precondition(len(data) == read_size, len(data), read_size)
+            return defer_to_compute(self._compute, _hash_and_split, data)
+        def _hash_and_split(data):
+            # segments are gathered one at a time, so nothing else touches
+            # these hashers while this runs
             crypttext_segment_hasher.update(data)
             self._crypttext_hasher.update(data)
             if allow_short and len(data) < read_size:
@@ -428,13 +475,13 @@ class Encoder(object):
         d.addCallback(_got)
         return d
 
-    def _send_segment(self, shares_and_shareids, segnum):
+    def _send_segment(self, shares_and_hashes, segnum):
         # To generate the URI, we must generate the roothash, so we must
         # generate all shares, even if we aren't actually giving them to
         # anybody. This means that the set of shares we create will be equal
         # to or larger than the set of landlords. If we have any landlord who
         # *doesn't* have a share, that's an error.
-        (shares, shareids) = shares_and_shareids
+        (shares, shareids, block_hashes) = shares_and_hashes
         _assert(set(self.landlords.keys()).issubset(set(shareids)),
                 shareids=shareids, landlords=self.landlords)
         start = time.time()
@@ -449,7 +496,7 @@ class Encoder(object):
             d = self.send_block(shareid, segnum, block, lognum)
             dl.append(d)
 
-            block_hash = hashutil.block_hash(block)
+            block_hash = block_hashes[i]
             #from allmydata.util import base32
             #log.msg("creating block (shareid=%d, blocknum=%d) "
             #        "len=%d %r .. %r: %s" %
@@ -476,16 +523,36 @@ class Encoder(object):
     def send_block(self, shareid, segment_num, block, lognum):
         if shareid not in self.landlords:
             return defer.succeed(None)
-        sh = self.landlords[shareid]
-        lognum2 = self.log("put_block to %s" % self.landlords[shareid],
-                           parent=lognum, level=log.NOISY)
-        d = sh.put_block(segment_num, block)
-        def _done(res):
-            self.log("put_block done", parent=lognum2, level=log.NOISY)
-            return res
-        d.addCallback(_done)
+        # A shareholder only accepts a new put_block() once the Deferred from
+        # the previous one has fired (that's when its write pipeline has room
+        # again), so with a pipeline depth above one we may have to wait for
+        # the previous segment's block.
+        previous = self._block_accepted.get(shareid)
+        accepted = self._block_accepted[shareid] = defer.Deferred()
+        def _put(ign=None):
+            if shareid not in self.landlords:
+                # removed while we were waiting
+                return None
+            sh = self.landlords[shareid]
+            lognum2 = self.log("put_block to %s" % sh,
+                               parent=lognum, level=log.NOISY)
+            d = sh.put_block(segment_num, block)
+            def _done(res):
+                self.log("put_block done", parent=lognum2, level=log.NOISY)
+                return res
+            d.addCallback(_done)
+            return d
+        if previous is None:
+            d = defer.maybeDeferred(_put)
+        else:
+            d = previous
+            d.addCallback(_put)
         d.addErrback(self._remove_shareholder, shareid,
                      "segnum=%d" % segment_num)
+        def _accepted(res):
+            accepted.callback(None)
+            return res
+        d.addBoth(_accepted)
         return d
 
     def _remove_shareholder(self, why, shareid, where):
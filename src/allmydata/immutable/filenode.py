@@ -19,10 +19,11 @@ from zope.interface import implementer
 from twisted.internet import defer
 
 from allmydata import uri
-from twisted.internet.interfaces import IConsumer
+from twisted.internet.interfaces import IConsumer, IPushProducer
 from allmydata.crypto import aes
 from allmydata.interfaces import IImmutableFileNode, IUploadResults
 from allmydata.util import consumer
+from allmydata.util.compute import defer_to_compute, have_compute_pool
 from allmydata.check_results import CheckResults, CheckAndRepairResults
 from allmydata.util.dictutil import DictOfSets
 from allmydata.util.happinessutil import servers_of_happiness
@@ -36,13 +37,25 @@ from allmydata.immutable.downloader.status import DownloadStatus
 
 class CiphertextFileNode(object):
     def __init__(self, verifycap, storage_broker, secret_holder,
-                 terminator, history):
+                 terminator, history, download_cache=None,
+                 segment_cache=None, readahead_segments=None,
+                 readahead_max_bytes=None, compute=None):
         assert isinstance(verifycap, uri.CHKFileVerifierURI)
         self._verifycap = verifycap
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
         self._terminator = terminator
         self._history = history
+        # a DownloadNodeCache shared with the other nodes of our client, or
+        # None
+        self._download_cache = download_cache
+        # and a SegmentCache, or None
+        self._segment_cache = segment_cache
+        # how far DownloadNode reads ahead, or None for its defaults
+        self._readahead_segments = readahead_segments
+        self._readahead_max_bytes = readahead_max_bytes
+        # our client's ComputePool, or None
+        self._compute = compute
         self._download_status = None
         self._node = None # created lazily, on read()
 
@@ -53,11 +66,23 @@ class CiphertextFileNode(object):
             if self._history:
                 self._history.add_download(ds)
             self._download_status = ds
-        if self._node is None:
-            self._node = DownloadNode(self._verifycap, self._storage_broker,
-                                      self._secret_holder,
-                                      self._terminator,
-                                      self._history, self._download_status)
+        if self._node is None and self._download_cache is not None:
+            # our reads through a remembered node are recorded in our own
+            # DownloadStatus, though the work it does for them below the
+            # read level still goes to the one it was created with
+            self._node = self._download_cache.get(self._verifycap)
+        if self._node is not None:
+            return
+        self._node = DownloadNode(self._verifycap, self._storage_broker,
+                                  self._secret_holder,
+                                  self._terminator,
+                                  self._history, self._download_status,
+                                  segment_cache=self._segment_cache,
+                                  readahead_segments=self._readahead_segments,
+                                  readahead_max_bytes=self._readahead_max_bytes,
+                                  compute=self._compute)
+        if self._download_cache is not None:
+            self._download_cache.add(self._verifycap, self._node)
 
     def read(self, consumer, offset=0, size=None):
         """I am the main entry point, from which FileNode.read() can get
@@ -65,7 +90,7 @@ class CiphertextFileNode(object):
         return a Deferred that fires (with the consumer) when the read is
         finished."""
         self._maybe_create_download_node()
-        return self._node.read(consumer, offset, size)
+        return self._node.read(consumer, offset, size, self._download_status)
 
     def get_segment(self, segnum):
         """Begin downloading a segment. I return a tuple (d, c): 'd' is a
@@ -96,6 +121,8 @@ class CiphertextFileNode(object):
         return self._verifycap
     def get_size(self):
         return self._verifycap.size
+    def get_compute_pool(self):
+        return self._compute
 
     def raise_error(self):
         pass
@@ -194,15 +221,24 @@ class CiphertextFileNode(object):
                     monitor=monitor)
         return v.start()
 
-@implementer(IConsumer, IDownloadStatusHandlingConsumer)
+@implementer(IConsumer, IPushProducer, IDownloadStatusHandlingConsumer)
 class DecryptingConsumer(object):
     """I sit between a CiphertextDownloader (which acts as a Producer) and
     the real Consumer, decrypting everything that passes by. The real
     Consumer sees the real Producer, but the Producer sees us instead of the
-    real consumer."""
+    real consumer.
 
-    def __init__(self, consumer, readkey, offset):
+    When I decrypt in compute threads, I stand in for a streaming Producer
+    instead, so I can also pause it while too much ciphertext is waiting to
+    be decrypted."""
+
+    # pause the producer while more ciphertext than this is queued for the
+    # compute threads
+    MAX_PENDING_BYTES = 1000000
+
+    def __init__(self, consumer, readkey, offset, compute=None):
         self._consumer = consumer
+        self._compute = compute
         self._read_ev = None
         self._download_status = None
         # TODO: pycryptopp CTR-mode needs random-access operations: I want
@@ -216,6 +252,13 @@ class DecryptingConsumer(object):
         self._decryptor = aes.create_decryptor(readkey, iv)
         # this is just to advance the counter
         aes.decrypt_data(self._decryptor, b"\x00" * offset_small)
+        # when decrypting in compute threads, this fires once everything
+        # written to us so far has been passed on to the real consumer
+        self._pending = None
+        self._pending_bytes = 0
+        self._producer = None
+        self._consumer_paused = False
+        self._producer_paused = False
 
     def set_download_status_read_event(self, read_ev):
         self._read_ev = read_ev
@@ -223,33 +266,112 @@ class DecryptingConsumer(object):
         self._download_status = ds
 
     def registerProducer(self, producer, streaming):
-        # this passes through, so the real consumer can flow-control the real
-        # producer. Therefore we don't need to provide any IPushProducer
-        # methods. We implement all the IConsumer methods as pass-throughs,
-        # and only intercept write() to perform decryption.
-        self._consumer.registerProducer(producer, streaming)
+        # usually this passes through, so the real consumer can flow-control
+        # the real producer, and we only intercept write() to perform
+        # decryption.
+        if streaming and have_compute_pool(self._compute):
+            self._producer = producer
+            self._consumer.registerProducer(self, True)
+        else:
+            self._consumer.registerProducer(producer, streaming)
     def unregisterProducer(self):
-        self._consumer.unregisterProducer()
+        self._producer = None
+        if self._pending is None:
+            self._consumer.unregisterProducer()
+            return
+        def _unregister(res):
+            self._consumer.unregisterProducer()
+            return res
+        self._pending.addBoth(_unregister)
+
+    def pauseProducing(self):
+        self._consumer_paused = True
+        self._update_paused()
+    def resumeProducing(self):
+        self._consumer_paused = False
+        self._update_paused()
+    def stopProducing(self):
+        if self._producer:
+            self._producer.stopProducing()
+
+    def _update_paused(self):
+        paused = (self._consumer_paused or
+                  self._pending_bytes > self.MAX_PENDING_BYTES)
+        if paused == self._producer_paused or not self._producer:
+            return
+        self._producer_paused = paused
+        if paused:
+            self._producer.pauseProducing()
+        else:
+            self._producer.resumeProducing()
+
     def write(self, ciphertext):
+        if self._pending is None and not have_compute_pool(self._compute):
+            started = now()
+            plaintext = aes.decrypt_data(self._decryptor, ciphertext)
+            self._decrypted(started)
+            self._consumer.write(plaintext)
+            return
+        # decrypt in a compute thread, but hand the plaintext to the real
+        # consumer in the same order as the ciphertext arrived
+        if self._pending is None:
+            self._pending = defer.succeed(None)
+        self._pending_bytes += len(ciphertext)
+        self._pending.addCallback(self._decrypt_in_thread, ciphertext)
+        self._pending.addBoth(self._drained, len(ciphertext))
+        self._update_paused()
+
+    def _decrypt_in_thread(self, ignored, ciphertext):
         started = now()
-        plaintext = aes.decrypt_data(self._decryptor, ciphertext)
+        d = defer_to_compute(self._compute,
+                             aes.decrypt_data, self._decryptor, ciphertext)
+        def _write(plaintext):
+            self._decrypted(started)
+            self._consumer.write(plaintext)
+        d.addCallback(_write)
+        return d
+
+    def _drained(self, res, size):
+        self._pending_bytes -= size
+        self._update_paused()
+        return res
+
+    def _decrypted(self, started):
         if self._read_ev:
             elapsed = now() - started
             self._read_ev.update(0, elapsed, 0)
         if self._download_status:
             self._download_status.add_misc_event("AES", started, now())
-        self._consumer.write(plaintext)
+
+    def when_written(self):
+        """
+        :return: A ``Deferred`` that fires once everything written to me has
+            been decrypted and passed on to the real consumer, or fails if
+            that went wrong.
+        """
+        if self._pending is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._pending.addBoth(d.callback)
+        return d
 
 @implementer(IImmutableFileNode)
 class ImmutableFileNode(object):
 
     # I wrap a CiphertextFileNode with a decryption key
     def __init__(self, filecap, storage_broker, secret_holder, terminator,
-                 history):
+                 history, download_cache=None, segment_cache=None,
+                 readahead_segments=None, readahead_max_bytes=None,
+                 compute=None):
         assert isinstance(filecap, uri.CHKFileURI)
         verifycap = filecap.get_verify_cap()
-        self._cnode = CiphertextFileNode(verifycap, storage_broker,
-                                         secret_holder, terminator, history)
+        self._cnode = CiphertextFileNode(
+            verifycap, storage_broker, secret_holder, terminator, history,
+            download_cache=download_cache,
+            segment_cache=segment_cache,
+            readahead_segments=readahead_segments,
+            readahead_max_bytes=readahead_max_bytes,
+            compute=compute)
         assert isinstance(filecap, uri.CHKFileURI)
         self.u = filecap
         self._readkey = filecap.key
@@ -272,9 +394,11 @@ class ImmutableFileNode(object):
             return True
 
     def read(self, consumer, offset=0, size=None):
-        decryptor = DecryptingConsumer(consumer, self._readkey, offset)
+        decryptor = DecryptingConsumer(consumer, self._readkey, offset,
+                                       self._cnode.get_compute_pool())
         d = self._cnode.read(decryptor, offset, size)
-        d.addCallback(lambda dc: consumer)
+        d.addCallback(lambda dc: decryptor.when_written())
+        d.addCallback(lambda ign: consumer)
         return d
 
     def raise_error(self):
@@ -14,84 +14,10 @@ if PY2:
     # We omit dict, just in case newdict breaks things for external Python 2 code.
     from builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, list, object, range, str, max, min  # noqa: F401
 
+from collections import deque
 from queue import PriorityQueue
 
 
-def augmenting_path_for(graph):
-    """
-    I return an augmenting path, if there is one, from the source node
-    to the sink node in the flow network represented by my graph argument.
-    If there is no augmenting path, I return False. I assume that the
-    source node is at index 0 of graph, and the sink node is at the last
-    index. I also assume that graph is a flow network in adjacency list
-    form.
-    """
-    bfs_tree = bfs(graph, 0)
-    if bfs_tree[len(graph) - 1]:
-        n = len(graph) - 1
-        path = [] # [(u, v)], where u and v are vertices in the graph
-        while n != 0:
-            path.insert(0, (bfs_tree[n], n))
-            n = bfs_tree[n]
-        return path
-    return False
-
-def bfs(graph, s):
-    """
-    Perform a BFS on graph starting at s, where graph is a graph in
-    adjacency list form, and s is a node in graph. I return the
-    predecessor table that the BFS generates.
-    """
-    # This is an adaptation of the BFS described in "Introduction to
-    # Algorithms", Cormen et al, 2nd ed., p. 532.
-    # WHITE vertices are those that we haven't seen or explored yet.
-    WHITE = 0
-    # GRAY vertices are those we have seen, but haven't explored yet
-    GRAY  = 1
-    # BLACK vertices are those we have seen and explored
-    BLACK = 2
-    color        = [WHITE for i in range(len(graph))]
-    predecessor  = [None for i in range(len(graph))]
-    distance     = [-1 for i in range(len(graph))]
-    queue = [s] # vertices that we haven't explored yet.
-    color[s] = GRAY
-    distance[s] = 0
-    while queue:
-        n = queue.pop(0)
-        for v in graph[n]:
-            if color[v] == WHITE:
-                color[v] = GRAY
-                distance[v] = distance[n] + 1
-                predecessor[v] = n
-                queue.append(v)
-        color[n] = BLACK
-    return predecessor
-
-def residual_network(graph, f):
-    """
-    I return the residual network and residual capacity function of the
-    flow network represented by my graph and f arguments. graph is a
-    flow network in adjacency-list form, and f is a flow in graph.
-    """
-    new_graph = [[] for i in range(len(graph))]
-    cf = [[0 for s in range(len(graph))] for sh in range(len(graph))]
-    for i in range(len(graph)):
-        for v in graph[i]:
-            if f[i][v] == 1:
-                # We add an edge (v, i) with cf[v,i] = 1. This means
-                # that we can remove 1 unit of flow from the edge (i, v)
-                new_graph[v].append(i)
-                cf[v][i] = 1
-                cf[i][v] = -1
-            else:
-                # We add the edge (i, v), since we're not using it right
-                # now.
-                new_graph[i].append(v)
-                cf[i][v] = 1
-                cf[v][i] = -1
-    return (new_graph, cf)
-
-
 def calculate_happiness(mappings):
     """
     :param mappings: a dict mapping 'share' -> 'peer'
@@ -136,46 +62,103 @@ def _calculate_mappings(peers, shares, servermap=None):
 
 def _compute_maximum_graph(graph, shareIndices):
     """
-    This is an implementation of the Ford-Fulkerson method for finding
-    a maximum flow in a flow network applied to a bipartite graph.
-    Specifically, it is the Edmonds-Karp algorithm, since it uses a
-    BFS to find the shortest augmenting path at each iteration, if one
-    exists.
-
-    The implementation here is an adapation of an algorithm described in
-    "Introduction to Algorithms", Cormen et al, 2nd ed., pp 658-662.
+    I find a maximum matching of the peers and shares in the flow network
+    graph (see maximum_matching), and return a dict mapping each share
+    index in shareIndices to the index of the peer it is matched with, or
+    to None if it is not matched.
     """
 
     if graph == []:
         return {}
 
-    dim = len(graph)
-    flow_function = [[0 for sh in range(dim)] for s in range(dim)]
-    residual_graph, residual_function = residual_network(graph, flow_function)
-
-    while augmenting_path_for(residual_graph):
-        path = augmenting_path_for(residual_graph)
-        # Delta is the largest amount that we can increase flow across
-        # all of the edges in path. Because of the way that the residual
-        # function is constructed, f[u][v] for a particular edge (u, v)
-        # is the amount of unused capacity on that edge. Taking the
-        # minimum of a list of those values for each edge in the
-        # augmenting path gives us our delta.
-        delta = min(residual_function[u][v] for (u, v) in path)
-        for (u, v) in path:
-            flow_function[u][v] += delta
-            flow_function[v][u] -= delta
-            residual_graph, residual_function = residual_network(graph,flow_function)
-
-    new_mappings = {}
-    for shareIndex in shareIndices:
-        peer = residual_graph[shareIndex]
-        if peer == [dim - 1]:
-            new_mappings.setdefault(shareIndex, None)
-        else:
-            new_mappings.setdefault(shareIndex, peer[0])
+    peer_of_share = maximum_matching(graph)
+    return dict((shareIndex, peer_of_share.get(shareIndex))
+                for shareIndex in shareIndices)
+
 
-    return new_mappings
+def maximum_matching(graph):
+    """
+    I return a maximum matching of the bipartite graph in the flow network
+    represented by my graph argument, as a dict mapping each matched share
+    vertex to the peer vertex it is matched with. The peers are the
+    vertices that the source node (at index 0) has edges to, and the
+    shares are the vertices the peers have edges to.
+
+    This is the Hopcroft-Karp algorithm. Like Edmonds-Karp, it grows the
+    matching along shortest augmenting paths, but it finds a maximal set of
+    them with one BFS and DFS over the whole graph, and needs at most about
+    2 * sqrt(V) such phases. That takes O(E * sqrt(V)) time instead of the
+    O(V * E) of one BFS per augmenting path, which matters on large grids
+    where every peer can hold every share.
+    """
+    peers = graph[0]
+    peer_of_share = {}
+    share_of_peer = {}
+    while True:
+        # Build layers of peers, starting with the unmatched ones, where
+        # each peer is matched with a share the previous layer has an edge
+        # to. The first layer with an edge to an unmatched share is the
+        # last one: it ends the shortest augmenting paths.
+        layer = {}
+        queue = deque()
+        for peer in peers:
+            if peer not in share_of_peer:
+                layer[peer] = 0
+                queue.append(peer)
+        last_layer = None
+        while queue:
+            peer = queue.popleft()
+            if last_layer is not None and layer[peer] >= last_layer:
+                break
+            for share in graph[peer]:
+                matched_peer = peer_of_share.get(share)
+                if matched_peer is None:
+                    last_layer = layer[peer]
+                elif matched_peer not in layer:
+                    layer[matched_peer] = layer[peer] + 1
+                    queue.append(matched_peer)
+        if last_layer is None:
+            return peer_of_share
+        for peer in peers:
+            if peer not in share_of_peer:
+                _augment_from(graph, peer, layer, last_layer,
+                              peer_of_share, share_of_peer)
+
+
+def _augment_from(graph, start, layer, last_layer, peer_of_share,
+                  share_of_peer):
+    """
+    Search depth-first, one layer at a time, for an augmenting path from the
+    unmatched peer start to an unmatched share, and if there is one, flip
+    the matching along it. Peers that lead nowhere are dropped from layer
+    so that later searches in the same phase skip them.
+    """
+    # The peers on the path so far, each with its untried edges, and the
+    # share chosen to get from each of them to the next.
+    stack = [(start, iter(graph[start]))]
+    path = []
+    while stack:
+        (peer, shares) = stack[-1]
+        depth = layer[peer]
+        for share in shares:
+            matched_peer = peer_of_share.get(share)
+            if matched_peer is None:
+                if depth == last_layer:
+                    path.append(share)
+                    for ((p, _), s) in zip(stack, path):
+                        peer_of_share[s] = p
+                        share_of_peer[p] = s
+                    return True
+            elif depth < last_layer and layer.get(matched_peer) == depth + 1:
+                path.append(share)
+                stack.append((matched_peer, iter(graph[matched_peer])))
+                break
+        else:
+            del layer[peer]
+            stack.pop()
+            if path:
+                path.pop()
+    return False
 
 
 def _extract_ids(mappings):
@@ -259,9 +242,9 @@ def _servermap_flow_graph(peers, shares, servermap):
     Generates a flow network of peerIndices to shareIndices from a server map
     of 'peer' -> ['shares']. According to Wikipedia, "a flow network is a
     directed graph where each edge has a capacity and each edge receives a flow.
-    The amount of flow on an edge cannot exceed the capacity of the edge." This
-    is necessary because in order to find the maximum spanning, the Edmonds-Karp algorithm
-    converts the problem into a maximum flow problem.
+    The amount of flow on an edge cannot exceed the capacity of the edge."
+    maximum_matching takes the source's and the peers' edges in such a network
+    as the bipartite graph to match.
     """
     if servermap == {}:
         return []
@@ -44,6 +44,7 @@ from allmydata.util import base32, dictutil, idlib, log, mathutil
 from allmydata.util.happinessutil import servers_of_happiness, \
     merge_servers, failure_message
 from allmydata.util.assertutil import precondition, _assert
+from allmydata.util.compute import defer_to_compute
 from allmydata.util.rrefutil import add_version_to_remote_reference
 from allmydata.interfaces import IUploadable, IUploader, IUploadResults, \
      IEncryptedUploadable, RIEncryptedUploadable, IUploadStatus, \
@@ -547,8 +548,10 @@ class Tahoe2ServerSelector(log.PrefixingLogMixin):
         # 0. Start with an ordered list of servers. Maybe *2N* of them.
         #
 
-        all_servers = storage_broker.get_servers_for_psi(storage_index)
-        if not all_servers:
+        servers = list(itertools.islice(
+            storage_broker.iter_servers_for_psi(storage_index),
+            2 * total_shares))
+        if not servers:
             raise NoServersError("client gave us zero servers")
 
         def _create_server_tracker(server, renew, cancel):
@@ -558,7 +561,7 @@ class Tahoe2ServerSelector(log.PrefixingLogMixin):
             )
 
         readonly_trackers, write_trackers = self._create_trackers(
-            all_servers[:(2 * total_shares)],
+            servers,
             allocated_size,
             file_renewal_secret,
             file_cancel_secret,
@@ -945,10 +948,14 @@ class EncryptAnUploadable(object):
     IEncryptedUploadable."""
     CHUNKSIZE = 50*1024
 
-    def __init__(self, original, log_parent=None, chunk_size=None):
+    def __init__(self, original, log_parent=None, chunk_size=None,
+                 compute=None):
         """
         :param chunk_size: The number of bytes to read from the uploadable at a
             time, or None for some default.
+
+        :param Optional[ComputePool] compute: The pool to hash and encrypt
+            on, or None to do it in the reactor thread.
         """
         precondition(original.default_params_set,
                      "set_default_encoding_parameters not called on %r before wrapping with EncryptAnUploadable" % (original,))
@@ -958,10 +965,13 @@ class EncryptAnUploadable(object):
         self._plaintext_hasher = plaintext_hasher()
         self._plaintext_segment_hasher = None
         self._plaintext_segment_hashes = []
+        # how many bytes went into each of those hashes
+        self._plaintext_segment_sizes = []
         self._encoding_parameters = None
         self._file_size = None
         self._ciphertext_bytes_read = 0
         self._status = None
+        self._compute = compute
         if chunk_size is not None:
             self.CHUNKSIZE = chunk_size
 
@@ -1049,18 +1059,24 @@ class EncryptAnUploadable(object):
             if self._plaintext_segment_hashed_bytes == self._segment_size:
                 # we've filled this segment
                 self._plaintext_segment_hashes.append(p.digest())
+                self._plaintext_segment_sizes.append(
+                    self._plaintext_segment_hashed_bytes)
                 self._plaintext_segment_hasher = None
-                self.log("closed hash [%d]: %dB" %
-                         (len(self._plaintext_segment_hashes)-1,
-                          self._plaintext_segment_hashed_bytes),
-                         level=log.NOISY)
-                self.log(format="plaintext leaf hash [%(segnum)d] is %(hash)s",
-                         segnum=len(self._plaintext_segment_hashes)-1,
-                         hash=base32.b2a(p.digest()),
-                         level=log.NOISY)
 
             offset += this_segment
 
+    def _log_closed_segment_hashes(self, first):
+        # this may run in a compute thread, so it leaves the logging of the
+        # segment hashes it closes to us
+        for segnum in range(first, len(self._plaintext_segment_hashes)):
+            self.log("closed hash [%d]: %dB" %
+                     (segnum, self._plaintext_segment_sizes[segnum]),
+                     level=log.NOISY)
+            self.log(format="plaintext leaf hash [%(segnum)d] is %(hash)s",
+                     segnum=segnum,
+                     hash=base32.b2a(self._plaintext_segment_hashes[segnum]),
+                     level=log.NOISY)
+
 
     def read_encrypted(self, length, hash_only):
         # make sure our parameters have been set up first
@@ -1107,26 +1123,55 @@ class EncryptAnUploadable(object):
         def _good(plaintext):
             # and encrypt it..
             # o/' over the fields we go, hashing all the way, sHA! sHA! sHA! o/'
-            ct = self._hash_and_encrypt_plaintext(plaintext, hash_only)
+            return self._hash_and_encrypt_plaintext(plaintext, hash_only)
+        d.addCallback(_good)
+        def _encrypted(ct):
             # Intentionally tell the accumulator about the expected size, not
             # the actual size.  If we run out of data we still want remaining
             # to drop otherwise it will never reach 0 and the loop will never
             # end.
             ciphertext_accum.extend(size, ct)
-        d.addCallback(_good)
+        d.addCallback(_encrypted)
         return d
 
     def _hash_and_encrypt_plaintext(self, data, hash_only):
+        """
+        Hash and encrypt some plaintext chunks, in a compute thread if
+        possible.
+
+        :return: A ``Deferred`` that fires with the list of ciphertext chunks
+            (which is empty if ``hash_only`` is true).
+        """
         assert isinstance(data, (tuple, list)), type(data)
         data = list(data)
+        for chunk in data:
+            self.log(" read_encrypted handling %dB-sized chunk" % len(chunk),
+                     level=log.NOISY)
+        if hash_only:
+            self.log("  skipping encryption", level=log.NOISY)
+        first_segment_hash = len(self._plaintext_segment_hashes)
+        d = defer_to_compute(self._compute, self._hash_and_encrypt_chunks,
+                             data, hash_only)
+        def _done(cryptdata_and_bytes):
+            (cryptdata, bytes_processed) = cryptdata_and_bytes
+            self._log_closed_segment_hashes(first_segment_hash)
+            self._ciphertext_bytes_read += bytes_processed
+            if self._status:
+                progress = float(self._ciphertext_bytes_read) / self._file_size
+                self._status.set_progress(1, progress)
+            return cryptdata
+        d.addCallback(_done)
+        return d
+
+    def _hash_and_encrypt_chunks(self, data, hash_only):
+        # This may run in a compute thread. Reads happen one at a time, so
+        # nothing else uses the hashers or the encryptor meanwhile.
         cryptdata = []
         # we use data.pop(0) instead of 'for chunk in data' to save
         # memory: each chunk is destroyed as soon as we're done with it.
         bytes_processed = 0
         while data:
             chunk = data.pop(0)
-            self.log(" read_encrypted handling %dB-sized chunk" % len(chunk),
-                     level=log.NOISY)
             bytes_processed += len(chunk)
             self._plaintext_hasher.update(chunk)
             self._update_segment_hash(chunk)
@@ -1136,17 +1181,11 @@ class EncryptAnUploadable(object):
             # this ability, change this to simply update the counter
             # before each call to (hash_only==False) encrypt_data
             ciphertext = aes.encrypt_data(self._encryptor, chunk)
-            if hash_only:
-                self.log("  skipping encryption", level=log.NOISY)
-            else:
+            if not hash_only:
                 cryptdata.append(ciphertext)
             del ciphertext
             del chunk
-        self._ciphertext_bytes_read += bytes_processed
-        if self._status:
-            progress = float(self._ciphertext_bytes_read) / self._file_size
-            self._status.set_progress(1, progress)
-        return cryptdata
+        return (cryptdata, bytes_processed)
 
 
     def get_plaintext_hashtree_leaves(self, first, last, num_segments):
@@ -1156,6 +1195,8 @@ class EncryptAnUploadable(object):
             assert len(self._plaintext_segment_hashes) == num_segments-1
             p, segment_left = self._get_segment_hasher()
             self._plaintext_segment_hashes.append(p.digest())
+            self._plaintext_segment_sizes.append(
+                self._plaintext_segment_hashed_bytes)
             del self._plaintext_segment_hasher
             self.log("closing plaintext leaf hasher, hashed %d bytes" %
                      self._plaintext_segment_hashed_bytes,
@@ -1226,10 +1267,13 @@ class UploadStatus(object):
 
 class CHKUploader(object):
 
-    def __init__(self, storage_broker, secret_holder, reactor=None):
+    def __init__(self, storage_broker, secret_holder, reactor=None,
+                 pipeline_depth=1, compute=None):
         # server_selector needs storage_broker and secret_holder
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
+        self._pipeline_depth = pipeline_depth
+        self._compute = compute
         self._log_number = self.log("CHKUploader starting", parent=None)
         self._encoder = None
         self._storage_index = None
@@ -1290,6 +1334,8 @@ class CHKUploader(object):
         self._encoder = encode.Encoder(
             self._log_number,
             self._upload_status,
+            pipeline_depth=self._pipeline_depth,
+            compute=self._compute,
         )
         # this just returns itself
         yield self._encoder.set_encrypted_uploadable(eu)
@@ -1746,6 +1792,60 @@ class BaseUploadable(object):
         d.addCallback(_got_size)
         return d
 
+class ConvergentSpool(object):
+    """
+    I wrap the file that an upload of a known size is spooled into, and feed
+    everything written to me to the convergence hasher as it arrives. A
+    FileHandle that reads from me can then get its encryption key without
+    reading the whole file a second time.
+
+    Writes are only hashed until anything else is done to the file (seeking
+    to the start, for example). If the bytes written up to then are not
+    exactly ``size`` of them, I don't know the key and the FileHandle hashes
+    the file itself.
+    """
+
+    def __init__(self, f, size, encoding_parameters, convergence):
+        k = encoding_parameters["k"]
+        n = encoding_parameters["n"]
+        # This is the segment size BaseUploadable will pick for this size.
+        segsize = min(encoding_parameters["max_segment_size"], size)
+        segsize = mathutil.next_multiple(segsize, k)
+        self._f = f
+        self._size = size
+        self._params = (k, n, segsize, convergence)
+        self._hasher = convergence_hasher(k, n, segsize, convergence)
+        self._written = 0
+        self._writing = True
+
+    def _stop_writing(self):
+        if self._writing:
+            self._writing = False
+            if self._written != self._size:
+                self._hasher = None
+
+    def write(self, data):
+        if not self._writing:
+            self._hasher = None
+        elif self._hasher is not None:
+            self._hasher.update(data)
+            self._written += len(data)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        self._stop_writing()
+        return getattr(self._f, name)
+
+    def get_convergent_key(self, k, n, segsize, convergence):
+        """
+        :return: The encryption key for what was written to me, if it was
+            hashed with these parameters, or None if it wasn't.
+        """
+        self._stop_writing()
+        if self._hasher is None or self._params != (k, n, segsize, convergence):
+            return None
+        return self._hasher.digest()
+
 @implementer(IUploadable)
 class FileHandle(BaseUploadable):
 
@@ -1772,6 +1872,15 @@ class FileHandle(BaseUploadable):
         def _got(params):
             k, happy, n, segsize = params
             f = self._filehandle
+            get_convergent_key = getattr(f, "get_convergent_key", None)
+            if get_convergent_key is not None:
+                # The data was hashed while it was being spooled.
+                self._key = get_convergent_key(k, n, segsize, self.convergence)
+                if self._key is not None:
+                    f.seek(0)
+                    if self._status:
+                        self._status.set_progress(0, 1.0)
+                    return self._key
             enckey_hasher = convergence_hasher(k, n, segsize, self.convergence)
             f.seek(0)
             BLOCKSIZE = 64*1024
@@ -1857,8 +1966,12 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
     name = "uploader"
     URI_LIT_SIZE_THRESHOLD = 55
 
-    def __init__(self, helper_furl=None, stats_provider=None, history=None):
+    def __init__(self, helper_furl=None, stats_provider=None, history=None,
+                 pipeline_depth=1, compute=None):
         self._helper_furl = helper_furl
+        self._pipeline_depth = pipeline_depth
+        # our client's ComputePool, or None
+        self._compute = compute
         self.stats_provider = stats_provider
         self._history = history
         self._helper = None
@@ -1919,7 +2032,8 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
                 uploader = LiteralUploader()
                 return uploader.start(uploadable)
             else:
-                eu = EncryptAnUploadable(uploadable, self._parentmsgid)
+                eu = EncryptAnUploadable(uploadable, self._parentmsgid,
+                                         compute=self._compute)
                 d2 = defer.succeed(None)
                 storage_broker = self.parent.get_storage_broker()
                 if self._helper:
@@ -1929,7 +2043,10 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
                 else:
                     storage_broker = self.parent.get_storage_broker()
                     secret_holder = self.parent._secret_holder
-                    uploader = CHKUploader(storage_broker, secret_holder, reactor=reactor)
+                    uploader = CHKUploader(storage_broker, secret_holder,
+                                           reactor=reactor,
+                                           pipeline_depth=self._pipeline_depth,
+                                           compute=self._compute)
                     d2.addCallback(lambda x: uploader.start(eu))
 
                 self._all_uploads[uploader] = None
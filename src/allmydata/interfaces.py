@@ -475,6 +475,11 @@ class IStorageBroker(Interface):
         """
         @return: list of IServer instances
         """
+    def iter_servers_for_psi(peer_selection_index):
+        """
+        @return: iterator of the IServer instances get_servers_for_psi()
+            would return, in the same order
+        """
     def get_connected_servers():
         """
         @return: frozenset of connected IServer instances
@@ -2643,6 +2648,13 @@ class INodeMaker(Interface):
         (childnode, metadata_dict) tuples), the directory will be populated
         with those children, otherwise it will be empty."""
 
+    def create_new_sharded_directory(initial_children={}):
+        """I create a new mutable directory whose children are spread over a
+        tree of mutable files, so that changing one child does not mean
+        publishing all of them again. I return a Deferred that fires with
+        the IDirectoryNode instance. initial_children= is as for
+        create_new_mutable_directory."""
+
 
 class IClientStatus(Interface):
     def list_all_uploads():
@@ -12,8 +12,12 @@ from future.utils import PY2
 if PY2:
     from builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, dict, list, object, range, str, max, min  # noqa: F401
 
+import time
+
 from zope.interface import Interface, implementer
+from twisted.internet import defer
 from allmydata.util import observer
+from allmydata.util.deferredutil import ByteBudget, KeyedLimiter
 
 
 class IMonitor(Interface):
@@ -61,6 +65,24 @@ class IMonitor(Interface):
         """Return the status object. If the operation failed, this will be a
         Failure instance."""
 
+    def add_progress(name, amount):
+        """Add 'amount' to the progress counter called 'name'. Unlike the
+        status object, these counters can be shared by every operation the
+        Monitor is passed to (the blocks verified by each file check of a
+        deep-check, for example)."""
+
+    def server_request(server, f, *args, **kwargs):
+        """Call f(*args, **kwargs) to send a request to 'server' (an IServer)
+        and return a Deferred that fires with its result. If the initiator
+        has called limit_server_requests(), the call may wait until enough
+        of the requests already sent to that server have been answered."""
+
+    def get_byte_budget(name, max_bytes):
+        """Return the ByteBudget called 'name', creating it with room for
+        'max_bytes' the first time it is asked for. Like the progress
+        counters, a budget is shared by every operation the Monitor is passed
+        to, so concurrent subtasks stay within one limit between them."""
+
     def finish(status):
         """Call this when the operation is done, successful or not. The
         Monitor's lifetime is influenced by the completion of the operation
@@ -87,6 +109,20 @@ class IMonitor(Interface):
         """Cancel the operation as soon as possible. is_cancelled() will
         start returning True after this is called."""
 
+    def limit_server_requests(limit):
+        """Allow at most 'limit' requests made through server_request() to
+        be outstanding with each server at once, across every operation the
+        Monitor is passed to."""
+
+    def get_progress():
+        """Return a dict mapping the name of each progress counter to its
+        value."""
+
+    def get_rate(name):
+        """Return how much the progress counter called 'name' has grown per
+        second, on average, since progress was first reported to the
+        Monitor, or None if it has not been."""
+
     #   get_status() is useful too, but it is operation-specific
 
 
@@ -101,6 +137,10 @@ class Monitor(object):
         self.cancelled = False
         self.finished = False
         self.status = None
+        self.progress = {}
+        self.progress_started = None
+        self.server_limiter = None
+        self.byte_budgets = {}
         self.observer = observer.OneShotObserverList()
 
     def is_cancelled(self):
@@ -129,3 +169,30 @@ class Monitor(object):
         return self.status
     def set_status(self, status):
         self.status = status
+
+    def add_progress(self, name, amount):
+        if self.progress_started is None:
+            self.progress_started = time.time()
+        self.progress[name] = self.progress.get(name, 0) + amount
+    def get_progress(self):
+        return self.progress.copy()
+    def get_rate(self, name):
+        if self.progress_started is None:
+            return None
+        elapsed = time.time() - self.progress_started
+        if elapsed <= 0:
+            return None
+        return self.progress.get(name, 0) / elapsed
+
+    def limit_server_requests(self, limit):
+        self.server_limiter = KeyedLimiter(limit)
+    def server_request(self, server, f, *args, **kwargs):
+        if self.server_limiter is None:
+            return defer.maybeDeferred(f, *args, **kwargs)
+        return self.server_limiter.run(server.get_serverid(), f,
+                                       *args, **kwargs)
+
+    def get_byte_budget(self, name, max_bytes):
+        if name not in self.byte_budgets:
+            self.byte_budgets[name] = ByteBudget(max_bytes)
+        return self.byte_budgets[name]
@@ -64,11 +64,16 @@ class BackoffAgent(object):
 class MutableFileNode(object):
 
     def __init__(self, storage_broker, secret_holder,
-                 default_encoding_parameters, history):
+                 default_encoding_parameters, history, servermap_cache=None,
+                 compute=None):
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
         self._default_encoding_parameters = default_encoding_parameters
         self._history = history
+        # a ServermapCache shared with the other nodes of our client, or None
+        self._servermap_cache = servermap_cache
+        # our client's ComputePool, or None
+        self._compute = compute
         self._pubkey = None # filled in upon first read
         self._privkey = None # filled in if we're mutable
         # we keep track of the last encoding parameters that we use. These
@@ -224,6 +229,8 @@ class MutableFileNode(object):
         return self._encprivkey
     def get_pubkey(self):
         return self._pubkey
+    def get_compute_pool(self):
+        return self._compute
 
     def get_required_shares(self):
         return self._required_shares
@@ -271,7 +278,8 @@ class MutableFileNode(object):
         if self.is_readonly():
             return self
         ro = MutableFileNode(self._storage_broker, self._secret_holder,
-                             self._default_encoding_parameters, self._history)
+                             self._default_encoding_parameters, self._history,
+                             compute=self._compute)
         ro.init_from_cap(self._uri.get_readonly())
         return ro
 
@@ -430,6 +438,34 @@ class MutableFileNode(object):
         """
         I am the serialized sibling of download_best_version.
         """
+        cached = None
+        if self._servermap_cache:
+            cached = self._servermap_cache.get(self._storage_index)
+        if cached is None:
+            return self._download_best_version_from_grid()
+        (servermap, pubkey) = cached
+        if not self._pubkey:
+            self._populate_pubkey(pubkey)
+
+        # We have a recent servermap, so optimistically read the best
+        # version it knows about. If that doesn't work -- most likely
+        # because someone has published a newer version since -- forget it
+        # and start over with a fresh servermap update.
+        d = self.get_readable_version(servermap=servermap)
+        d.addCallback(self._record_size)
+        d.addCallback(lambda version: version.download_to_data())
+        def _stale(failure):
+            failure.trap(NotEnoughSharesError, UncoordinatedWriteError)
+            self._servermap_cache.invalidate(self._storage_index)
+            return self._download_best_version_from_grid()
+        d.addErrback(_stale)
+        return d
+
+
+    def _download_best_version_from_grid(self):
+        """
+        I download the best version after a fresh servermap update.
+        """
         d = self.get_best_readable_version()
         d.addCallback(self._record_size)
         d.addCallback(lambda version: version.download_to_data())
@@ -622,6 +658,9 @@ class MutableFileNode(object):
         """
         servermap = ServerMap()
         d = self._update_servermap(servermap, mode)
+        if self._servermap_cache and mode == MODE_READ:
+            d.addCallback(self._cache_servermap,
+                          self._servermap_cache.get_generation())
         # The servermap will tell us about the most recent size of the
         # file, so we may as well set that so that callers might get
         # more data about us.
@@ -643,6 +682,28 @@ class MutableFileNode(object):
         return servermap
 
 
+    def _cache_servermap(self, servermap, generation):
+        """
+        I remember servermap in our ServermapCache if it found a
+        recoverable version. I return the servermap that I was given.
+        """
+        if servermap.recoverable_versions():
+            self._servermap_cache.add(self._storage_index, servermap,
+                                      self._pubkey, generation)
+        return servermap
+
+
+    def _invalidate_cached_servermap(self, res=None):
+        """
+        I forget any cached servermap for this file, because we are
+        publishing a new version of it. I return res, so that I can be used
+        as a callback.
+        """
+        if self._servermap_cache:
+            self._servermap_cache.invalidate(self._storage_index)
+        return res
+
+
     def _update_servermap(self, servermap, mode):
         u = ServermapUpdater(self, self._storage_broker, Monitor(), servermap,
                              mode)
@@ -698,7 +759,9 @@ class MutableFileNode(object):
         if self._history:
             self._history.notify_publish(p.get_status(),
                                          new_contents.get_size())
+        self._invalidate_cached_servermap()
         d = p.publish(new_contents)
+        d.addBoth(self._invalidate_cached_servermap)
         d.addCallback(self._did_upload, new_contents.get_size())
         return d
 
@@ -1022,7 +1085,9 @@ class MutableFileVersion(object):
         if self._history:
             self._history.notify_publish(p.get_status(),
                                          new_contents.get_size())
+        self._node._invalidate_cached_servermap()
         d = p.publish(new_contents)
+        d.addBoth(self._node._invalidate_cached_servermap)
         d.addCallback(self._did_upload, new_contents.get_size())
         return d
 
@@ -1187,7 +1252,10 @@ class MutableFileVersion(object):
                                    segments_and_bht[0],
                                    segments_and_bht[1])
         p = Publish(self._node, self._storage_broker, self._servermap)
-        return p.update(u, offset, segments_and_bht[2], self._version)
+        self._node._invalidate_cached_servermap()
+        d = p.update(u, offset, segments_and_bht[2], self._version)
+        d.addBoth(self._node._invalidate_cached_servermap)
+        return d
 
 
     def _update_servermap(self, mode=MODE_WRITE, update_range=None):
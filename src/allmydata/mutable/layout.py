@@ -765,6 +765,8 @@ class MDMFSlotWriteProxy(object):
         # This is a list of write vectors that will be sent to our
         # remote server once we are directed to write things there.
         self._writevs = []
+        # The number of bytes of block data in self._writevs.
+        self._queued_size = 0
         self._secrets = secrets
         # The segment size needs to be a multiple of the k parameter --
         # any padding should have been carried out by the publisher
@@ -791,6 +793,12 @@ class MDMFSlotWriteProxy(object):
         # write about that.
         self._written = False
 
+        # Whether flush() has sent blocks to a share that did not exist
+        # before. Until the final write puts the signed header down, the
+        # start of such a share is still zeros, and later writes test for
+        # that instead of for a checkstring.
+        self._flushed = False
+
         # When writing data to the storage servers, we get a read vector
         # for free. We'll read the checkstring, which will help us
         # figure out what's gone wrong if a write fails.
@@ -936,6 +944,69 @@ class MDMFSlotWriteProxy(object):
         data = salt + data
 
         self._writevs.append(tuple([offset, data]))
+        self._queued_size += len(data)
+
+
+    def get_queued_size(self):
+        """
+        I return the number of bytes of blocks that have been put but not
+        yet sent to the remote server.
+        """
+        return self._queued_size
+
+
+    def can_flush(self):
+        """
+        I return True if flush() may be used: that is, if I am writing a
+        share that did not exist before. An existing share still holds the
+        previous version, which must stay readable until the final write
+        replaces it, so its writes are all held until finish_publishing.
+        """
+        return self._flushed or not self._testvs
+
+
+    def flush(self):
+        """
+        I send the write vectors queued so far (just blocks) to the remote
+        server now, instead of holding on to them until finish_publishing.
+        This lets the publisher stream a large file without keeping all of
+        its shares in memory.
+
+        I may only be used on a new share (see can_flush). The first flush
+        requires that the share does not exist yet, and later ones that
+        nobody has written its header since, so an uncoordinated write is
+        still noticed. The checkstring, signed header and offsets are all
+        written together by finish_publishing, so readers never see a share
+        that claims to be the new version until it is complete.
+
+        I return a Deferred that fires with the server's answer. Callers
+        must wait for it before calling flush or finish_publishing again.
+        """
+        assert self.can_flush()
+        writevs = self._writevs
+        self._writevs = []
+        self._queued_size = 0
+        if self._flushed:
+            testvs = self._testvs
+        else:
+            testvs = [(0, 1, b"")]
+        tw_vectors = {self.shnum: (testvs, writevs, None)}
+        d = self._storage_server.slot_testv_and_readv_and_writev(
+            self._storage_index,
+            self._secrets,
+            tw_vectors,
+            self._readv,
+        )
+        def _result(results):
+            if not self._flushed and results[0]:
+                # The header is still unwritten, so it reads as zeros.
+                self._flushed = True
+                checkstring_size = struct.calcsize(MDMFCHECKSTRING)
+                self._testvs = [(0, checkstring_size,
+                                 b"\x00" * checkstring_size)]
+            return results
+        d.addCallback(_result)
+        return d
 
 
     def put_encprivkey(self, encprivkey):
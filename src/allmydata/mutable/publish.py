@@ -21,8 +21,9 @@ from allmydata.crypto import aes
 from allmydata.crypto import rsa
 from allmydata.interfaces import IPublishStatus, SDMF_VERSION, MDMF_VERSION, \
                                  IMutableUploadable
-from allmydata.util import base32, hashutil, mathutil, log
+from allmydata.util import base32, hashutil, mathutil, log, observer
 from allmydata.util.dictutil import DictOfSets
+from allmydata.util.compute import defer_to_compute
 from allmydata import hashtree, codec
 from allmydata.storage.server import si_b2a
 from foolscap.api import eventually, fireEventually
@@ -121,6 +122,10 @@ class Publish(object):
     To make the initial publish, set servermap to None.
     """
 
+    # MDMF blocks for a share that did not exist before are sent to its
+    # server once this many bytes of them are waiting to go to it.
+    STREAMING_BUFFER_SIZE = 512 * KiB
+
     def __init__(self, filenode, storage_broker, servermap):
         self._node = filenode
         self._storage_broker = storage_broker
@@ -254,6 +259,11 @@ class Publish(object):
         # When self.placed == self.goal, we're done.
         self.placed = set() # (server, shnum) tuples
 
+        # MDMF writers that are sending blocks to their server before the
+        # end of the upload, mapped to a OneShotObserverList that fires when
+        # that write is done.
+        self._flushes = {}
+
         self.bad_share_checkstrings = {}
 
         # This is set at the last step of the publishing process.
@@ -447,6 +457,11 @@ class Publish(object):
         # When self.placed == self.goal, we're done.
         self.placed = set() # (server, shnum) tuples
 
+        # MDMF writers that are sending blocks to their server before the
+        # end of the upload, mapped to a OneShotObserverList that fires when
+        # that write is done.
+        self._flushes = {}
+
         self.bad_share_checkstrings = {}
 
         # This is set at the last step of the publishing process.
@@ -599,7 +614,7 @@ class Publish(object):
             self.tail_segment_size = segment_size
 
         # Make FEC encoders
-        fec = codec.CRSEncoder()
+        fec = codec.CRSEncoder(self._node.get_compute_pool())
         fec.set_params(self.segment_size,
                        self.required_shares, self.total_shares)
         self.piece_size = fec.get_block_size()
@@ -608,7 +623,7 @@ class Publish(object):
         if self.tail_segment_size == self.segment_size:
             self.tail_fec = self.fec
         else:
-            tail_fec = codec.CRSEncoder()
+            tail_fec = codec.CRSEncoder(self._node.get_compute_pool())
             tail_fec.set_params(self.tail_segment_size,
                                 self.required_shares,
                                 self.total_shares)
@@ -663,12 +678,20 @@ class Publish(object):
             self._add_dummy_salts()
 
         if segnum > self.end_segment:
-            # We don't have any more segments to push.
+            # We don't have any more segments to push. Blocks that are still
+            # on their way to a server must get there before we send the
+            # final write, since each writer can only have one write
+            # outstanding.
             self._state = PUSHING_EVERYTHING_ELSE_STATE
-            return self._push()
+            d = self._wait_for_flushes()
+            d.addCallback(self._push)
+            d.addErrback(self._failure)
+            return d
 
         d = self._encode_segment(segnum)
         d.addCallback(self._push_segment, segnum)
+        if self._version == MDMF_VERSION:
+            d.addCallback(self._flush_blocks)
         def _increment_segnum(ign):
             self._current_segment += 1
         # XXX: I don't think we need to do addBoth here -- any errBacks
@@ -726,34 +749,38 @@ class Publish(object):
         key = hashutil.ssk_readkey_data_hash(salt, self.readkey)
         self._status.set_status("Encrypting")
         encryptor = aes.create_encryptor(key)
-        crypttext = aes.encrypt_data(encryptor, data)
-        assert len(crypttext) == len(data)
+        d = defer_to_compute(self._node.get_compute_pool(),
+                             aes.encrypt_data, encryptor, data)
 
-        now = time.time()
-        self._status.accumulate_encrypt_time(now - started)
-        started = now
+        def _encrypted(crypttext):
+            assert len(crypttext) == len(data)
 
-        # now apply FEC
-        if segnum + 1 == self.num_segments:
-            fec = self.tail_fec
-        else:
-            fec = self.fec
-
-        self._status.set_status("Encoding")
-        crypttext_pieces = [None] * self.required_shares
-        piece_size = fec.get_block_size()
-        for i in range(len(crypttext_pieces)):
-            offset = i * piece_size
-            piece = crypttext[offset:offset+piece_size]
-            piece = piece + b"\x00"*(piece_size - len(piece)) # padding
-            crypttext_pieces[i] = piece
-            assert len(piece) == piece_size
-        d = fec.encode(crypttext_pieces)
-        def _done_encoding(res):
-            elapsed = time.time() - started
-            self._status.accumulate_encode_time(elapsed)
-            return (res, salt)
-        d.addCallback(_done_encoding)
+            now = time.time()
+            self._status.accumulate_encrypt_time(now - started)
+
+            # now apply FEC
+            if segnum + 1 == self.num_segments:
+                fec = self.tail_fec
+            else:
+                fec = self.fec
+
+            self._status.set_status("Encoding")
+            crypttext_pieces = [None] * self.required_shares
+            piece_size = fec.get_block_size()
+            for i in range(len(crypttext_pieces)):
+                offset = i * piece_size
+                piece = crypttext[offset:offset+piece_size]
+                piece = piece + b"\x00"*(piece_size - len(piece)) # padding
+                crypttext_pieces[i] = piece
+                assert len(piece) == piece_size
+            d2 = fec.encode(crypttext_pieces)
+            def _done_encoding(res):
+                elapsed = time.time() - now
+                self._status.accumulate_encode_time(elapsed)
+                return (res, salt)
+            d2.addCallback(_done_encoding)
+            return d2
+        d.addCallback(_encrypted)
         return d
 
 
@@ -779,6 +806,68 @@ class Publish(object):
                 writer.put_block(sharedata, segnum, salt)
 
 
+    def _flush_blocks(self, ignored=None):
+        """
+        I send the blocks that an MDMF writer has queued up to its server
+        once there are at least STREAMING_BUFFER_SIZE bytes of them, so
+        that we hold on to at most about two buffers' worth of each share
+        rather than the whole share. Only shares that did not exist before
+        are written early: an existing share keeps the old version readable
+        until its single final write, so its blocks stay queued.
+
+        A writer that is still busy with its previous flush has to finish
+        it first. I return a Deferred that fires once every writer that
+        needed to wait has been able to start its new write.
+        """
+        ds = []
+        for writers in list(self.writers.values()):
+            for writer in writers:
+                if not writer.can_flush():
+                    continue
+                if writer.get_queued_size() < self.STREAMING_BUFFER_SIZE:
+                    continue
+                if writer in self._flushes:
+                    d = self._flushes[writer].when_fired()
+                    d.addCallback(lambda ign, writer=writer:
+                                  self._start_flush(writer))
+                    ds.append(d)
+                else:
+                    self._start_flush(writer)
+        return defer.DeferredList(ds)
+
+
+    def _start_flush(self, writer):
+        if writer not in self.writers.get(writer.shnum, ()):
+            # This writer was discarded while we were waiting for it.
+            return
+        started = time.time()
+        observers = self._flushes[writer] = observer.OneShotObserverList()
+        self.num_outstanding += 1
+        def _no_longer_outstanding(res):
+            self.num_outstanding -= 1
+            return res
+        d = writer.flush()
+        d.addBoth(_no_longer_outstanding)
+        d.addErrback(self._connection_problem, writer)
+        d.addCallback(self._got_write_answer, writer, started)
+        def _done(res):
+            del self._flushes[writer]
+            observers.fire(None)
+            if isinstance(res, failure.Failure):
+                self.log("error while flushing blocks to %r" % (writer,),
+                         failure=res, level=log.WEIRD, umid="Mq7cTz")
+        d.addBoth(_done)
+
+
+    def _wait_for_flushes(self):
+        """
+        I return a Deferred that fires when none of our writers are waiting
+        for a server to accept their blocks.
+        """
+        return defer.DeferredList([o.when_fired()
+                                   for o in list(self._flushes.values())])
+
+
     def push_everything_else(self):
         """
         I put everything else associated with a share.
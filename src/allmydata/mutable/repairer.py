@@ -13,6 +13,7 @@ if PY2:
 from zope.interface import implementer
 from twisted.internet import defer
 from allmydata.interfaces import IRepairResults, ICheckResults
+from allmydata.monitor import Monitor
 from allmydata.mutable.publish import MutableData
 from allmydata.mutable.common import MODE_REPAIR
 from allmydata.mutable.servermap import ServerMap, ServermapUpdater
@@ -42,6 +43,9 @@ class Repairer(object):
         assert check_results.get_storage_index() == node.get_storage_index()
         self._storage_broker = storage_broker
         self._history = history
+        if monitor is None:
+            # IRepairable.repair() callers need not pass one
+            monitor = Monitor()
         self._monitor = monitor
 
     def start(self, force=False):
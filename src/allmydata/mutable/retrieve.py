@@ -28,6 +28,7 @@ from allmydata.interfaces import IRetrieveStatus, NotEnoughSharesError, \
 from allmydata.util.assertutil import _assert, precondition
 from allmydata.util import hashutil, log, mathutil, deferredutil
 from allmydata.util.dictutil import DictOfSets
+from allmydata.util.compute import defer_to_compute
 from allmydata import hashtree, codec
 from allmydata.storage.server import si_b2a
 
@@ -398,7 +399,7 @@ class Retrieve(object):
             self._num_segments = 0
             self._tail_data_size = 0
 
-        self._segment_decoder = codec.CRSDecoder()
+        self._segment_decoder = codec.CRSDecoder(self._node.get_compute_pool())
         self._segment_decoder.set_params(segsize, k, n)
 
         if  not self._tail_data_size:
@@ -409,7 +410,7 @@ class Retrieve(object):
         if self._tail_segment_size == self._segment_size:
             self._tail_decoder = self._segment_decoder
         else:
-            self._tail_decoder = codec.CRSDecoder()
+            self._tail_decoder = codec.CRSDecoder(self._node.get_compute_pool())
             self._tail_decoder.set_params(self._tail_segment_size,
                                           self._required_shares,
                                           self._total_shares)
@@ -913,9 +914,13 @@ class Retrieve(object):
         started = time.time()
         key = hashutil.ssk_readkey_data_hash(salt, self._node.get_readkey())
         decryptor = aes.create_decryptor(key)
-        plaintext = aes.decrypt_data(decryptor, segment)
-        self._status.accumulate_decrypt_time(time.time() - started)
-        return plaintext
+        d = defer_to_compute(self._node.get_compute_pool(),
+                             aes.decrypt_data, decryptor, segment)
+        def _decrypted(plaintext):
+            self._status.accumulate_decrypt_time(time.time() - started)
+            return plaintext
+        d.addCallback(_decrypted)
+        return d
 
 
     def notify_server_corruption(self, server, shnum, reason):
@@ -16,8 +16,8 @@ from six import ensure_str
 import sys, time, copy
 from zope.interface import implementer
 from itertools import count
-from collections import defaultdict
-from twisted.internet import defer
+from collections import defaultdict, OrderedDict
+from twisted.internet import defer, reactor
 from twisted.python import failure
 from foolscap.api import DeadReferenceError, RemoteException, eventually, \
                          fireEventually
@@ -393,6 +393,81 @@ class ServerMap(object):
         self.update_data.setdefault(shnum , []).append((verinfo, data))
 
 
+class ServermapCache(object):
+    """
+    I remember recent MODE_READ servermaps, by storage index, so that
+    repeated reads of the same mutable file (hot directories in particular)
+    can skip the servermap update. One of me is shared by all the mutable
+    file nodes of a client.
+
+    Entries older than ``ttl`` seconds are never handed out, and at most
+    ``size`` entries are kept, discarding the least recently used first.
+    Readers must be prepared for a cached servermap to be out of date, and
+    fall back to a fresh update if retrieving from it fails.
+    """
+
+    def __init__(self, size, ttl, clock=reactor):
+        assert size > 0, size
+        assert ttl > 0, ttl
+        self._size = size
+        self._ttl = ttl
+        self._clock = clock
+        # storage index -> (when, servermap, pubkey)
+        self._entries = OrderedDict()
+        # bumped by every invalidate()
+        self._generation = 0
+        # storage index -> the generation at which it was last invalidated,
+        # so that updates which started before a publish don't put their
+        # results in the cache after it. Only the most recent invalidations
+        # are kept; anything older counts as invalidated at _oldest.
+        self._invalidated = OrderedDict()
+        self._oldest = 0
+
+    def get_generation(self):
+        return self._generation
+
+    def get(self, storage_index):
+        """
+        Return (servermap, pubkey) for storage_index, with a copy of the
+        cached servermap, or None if there isn't a fresh one.
+        """
+        entry = self._entries.get(storage_index)
+        if entry is None:
+            return None
+        (when, servermap, pubkey) = entry
+        if self._clock.seconds() - when > self._ttl:
+            del self._entries[storage_index]
+            return None
+        self._entries.move_to_end(storage_index)
+        return (servermap.copy(), pubkey)
+
+    def add(self, storage_index, servermap, pubkey, generation):
+        """
+        Remember servermap, which was updated in MODE_READ, along with the
+        verified public key of the file, unless storage_index has been
+        invalidated since get_generation() returned generation.
+        """
+        if self._invalidated.get(storage_index, self._oldest) > generation:
+            return
+        self._entries[storage_index] = (self._clock.seconds(),
+                                        servermap.copy(), pubkey)
+        self._entries.move_to_end(storage_index)
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, storage_index):
+        """
+        Forget anything known about storage_index, e.g. because we are about
+        to publish a new version of it.
+        """
+        self._generation += 1
+        self._entries.pop(storage_index, None)
+        self._invalidated[storage_index] = self._generation
+        self._invalidated.move_to_end(storage_index)
+        while len(self._invalidated) > self._size:
+            (_, self._oldest) = self._invalidated.popitem(last=False)
+
+
 class ServermapUpdater(object):
     def __init__(self, filenode, storage_broker, monitor, servermap,
                  mode=MODE_READ, add_lease=False, update_range=None):
@@ -626,7 +701,8 @@ class ServermapUpdater(object):
             d2.addErrback(self._add_lease_failed, server, storage_index)
         else:
             d2 = defer.succeed(None)
-        d = ss.slot_readv(storage_index, shnums, readv)
+        d = self._monitor.server_request(server, ss.slot_readv,
+                                         storage_index, shnums, readv)
 
         def passthrough(result):
             # Wait for d2, but fire with result of slot_readv() regardless of
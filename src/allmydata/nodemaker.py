@@ -13,13 +13,15 @@ if PY2:
 import weakref
 from zope.interface import implementer
 from allmydata.util.assertutil import precondition
-from allmydata.interfaces import INodeMaker
+from allmydata.interfaces import INodeMaker, MDMF_VERSION
 from allmydata.immutable.literal import LiteralFileNode
 from allmydata.immutable.filenode import ImmutableFileNode, CiphertextFileNode
 from allmydata.immutable.upload import Data
 from allmydata.mutable.filenode import MutableFileNode
 from allmydata.mutable.publish import MutableData
-from allmydata.dirnode import DirectoryNode, pack_children
+from allmydata.dirnode import DirectoryNode, DirectoryWriteStats, \
+     pack_children
+from allmydata.sharded_dirnode import ShardedDirectoryNode
 from allmydata.unknown import UnknownNode
 from allmydata.blacklist import ProhibitedNode
 from allmydata import uri
@@ -31,7 +33,15 @@ class NodeMaker(object):
     def __init__(self, storage_broker, secret_holder, history,
                  uploader, terminator,
                  default_encoding_parameters, mutable_file_default,
-                 key_generator, blacklist=None):
+                 key_generator, blacklist=None, servermap_cache=None,
+                 traverse_concurrency=10,
+                 traverse_memory_budget=32*1024*1024, tempdir=None,
+                 download_cache=None, segment_cache=None,
+                 deep_check_concurrency=10,
+                 deep_check_requests_per_server=10,
+                 download_readahead_segments=None,
+                 download_readahead_max_bytes=None, compute=None,
+                 directory_write_window=0.0, directory_write_stats=None):
         self.storage_broker = storage_broker
         self.secret_holder = secret_holder
         self.history = history
@@ -41,6 +51,29 @@ class NodeMaker(object):
         self.mutable_file_default = mutable_file_default
         self.key_generator = key_generator
         self.blacklist = blacklist
+        self.servermap_cache = servermap_cache
+        self.download_cache = download_cache
+        self.segment_cache = segment_cache
+        # how many segments, and at most how many bytes, immutable reads may
+        # ask for ahead of their consumer, or None for DownloadNode's defaults
+        self.download_readahead_segments = download_readahead_segments
+        self.download_readahead_max_bytes = download_readahead_max_bytes
+        # the ComputePool for CPU-heavy work on our files, or None
+        self.compute = compute
+        # how deep_traverse() walks directory trees:
+        self.traverse_concurrency = traverse_concurrency
+        self.traverse_memory_budget = traverse_memory_budget
+        self.tempdir = tempdir
+        # how many nodes a deep-check checks at once, and how many queries
+        # those checks may have outstanding with each server
+        self.deep_check_concurrency = deep_check_concurrency
+        self.deep_check_requests_per_server = deep_check_requests_per_server
+        # how long a directory change waits for others to publish with it,
+        # and the DirectoryWriteStats counting those publishes
+        self.directory_write_window = directory_write_window
+        if directory_write_stats is None:
+            directory_write_stats = DirectoryWriteStats()
+        self.directory_write_stats = directory_write_stats
 
         self._node_cache = weakref.WeakValueDictionary() # uri -> node
 
@@ -48,17 +81,28 @@ class NodeMaker(object):
         return LiteralFileNode(cap)
     def _create_immutable(self, cap):
         return ImmutableFileNode(cap, self.storage_broker, self.secret_holder,
-                                 self.terminator, self.history)
+                                 self.terminator, self.history,
+                                 **self._download_options())
     def _create_immutable_verifier(self, cap):
         return CiphertextFileNode(cap, self.storage_broker, self.secret_holder,
-                                  self.terminator, self.history)
+                                  self.terminator, self.history,
+                                  **self._download_options())
+    def _download_options(self):
+        return dict(download_cache=self.download_cache,
+                    segment_cache=self.segment_cache,
+                    readahead_segments=self.download_readahead_segments,
+                    readahead_max_bytes=self.download_readahead_max_bytes,
+                    compute=self.compute)
     def _create_mutable(self, cap):
         n = MutableFileNode(self.storage_broker, self.secret_holder,
                             self.default_encoding_parameters,
-                            self.history)
+                            self.history, self.servermap_cache,
+                            self.compute)
         return n.init_from_cap(cap)
     def _create_dirnode(self, filenode):
         return DirectoryNode(filenode, self, self.uploader)
+    def _create_sharded_dirnode(self, filenode):
+        return ShardedDirectoryNode(filenode, self, self.uploader)
 
     def create_from_cap(self, writecap, readcap=None, deep_immutable=False, name=u"<unknown name>"):
         # this returns synchronously. It starts with a "cap string".
@@ -124,13 +168,18 @@ class NodeMaker(object):
                             uri.ReadonlyMDMFDirectoryURI)):
             filenode = self._create_from_single_cap(cap.get_filenode_cap())
             return self._create_dirnode(filenode)
+        if isinstance(cap, (uri.ShardedDirectoryURI,
+                            uri.ReadonlyShardedDirectoryURI)):
+            filenode = self._create_from_single_cap(cap.get_filenode_cap())
+            return self._create_sharded_dirnode(filenode)
         return None
 
     def create_mutable_file(self, contents=None, version=None):
         if version is None:
             version = self.mutable_file_default
         n = MutableFileNode(self.storage_broker, self.secret_holder,
-                            self.default_encoding_parameters, self.history)
+                            self.default_encoding_parameters, self.history,
+                            self.servermap_cache, self.compute)
         d = self.key_generator.generate()
         d.addCallback(n.create_with_keys, contents, version=version)
         d.addCallback(lambda res: n)
@@ -149,6 +198,18 @@ class NodeMaker(object):
         d.addCallback(self._create_dirnode)
         return d
 
+    def create_new_sharded_directory(self, initial_children={}):
+        """
+        Create a ShardedDirectoryNode, for directories that will have too
+        many children to republish all of them for every change.
+        """
+        d = self.create_mutable_file(MutableData(pack_children({}, None)),
+                                     version=MDMF_VERSION)
+        d.addCallback(self._create_sharded_dirnode)
+        if initial_children:
+            d.addCallback(lambda node: node.set_nodes(initial_children))
+        return d
+
     def create_immutable_directory(self, children, convergence=None):
         if convergence is None:
             convergence = self.secret_holder.get_convergence_secret()
@@ -626,6 +626,19 @@ def dump_uri_instance(u, nodeid, secret, out, show_header=True):
             print("Directory Verifier URI:", file=out)
         dump_uri_instance(u._filenode_uri, nodeid, secret, out, False)
 
+    elif isinstance(u, uri.ShardedDirectoryURI): # sharded MDMF directory
+        if show_header:
+            print("Sharded Directory Writeable URI:", file=out)
+        dump_uri_instance(u._filenode_uri, nodeid, secret, out, False)
+    elif isinstance(u, uri.ReadonlyShardedDirectoryURI):
+        if show_header:
+            print("Sharded Directory Read-only URI:", file=out)
+        dump_uri_instance(u._filenode_uri, nodeid, secret, out, False)
+    elif isinstance(u, uri.ShardedDirectoryURIVerifier):
+        if show_header:
+            print("Sharded Directory Verifier URI:", file=out)
+        dump_uri_instance(u._filenode_uri, nodeid, secret, out, False)
+
     else:
         print("unknown cap type", file=out)
 
@@ -0,0 +1,412 @@
+"""
+Directories whose children are spread over a tree of mutable files.
+
+An ordinary directory is one mutable file, so every change to it
+re-encrypts, re-encodes and publishes every child, which takes minutes once
+there are hundreds of thousands of them. A ``ShardedDirectoryNode`` (cap
+prefix ``URI:DIR2-HAMT:``) puts each child in a leaf shard chosen by a hash
+of its name, like a hash array mapped trie: the root and interior shards map
+each hex digit of that hash to a shard one level down, and a leaf that grows
+past ``max_leaf_entries`` children is split sixteen ways. Every shard is an
+MDMF directory of its own, so looking up or changing a child reads and
+writes only the few small shards on the way to it.
+
+Shards are never merged again when children are deleted, and a change that
+touches children in several leaves (``set_children`` or ``set_nodes``) is
+made one leaf at a time, so it can fail half-way through. A split first
+retires the leaf by adding a marker child to it; changes made through a
+sharded directory fail on a retired leaf and are retried from the root,
+finishing the split first if it is still unfinished. So the leaf's children
+stay as they were while they are copied, and a change that reached the old
+leaf just before the split is copied with them. Changes made to a shard
+directly, rather than through its sharded directory, are not covered.
+"""
+
+from __future__ import annotations
+
+from binascii import hexlify
+
+from twisted.internet import defer
+
+from allmydata.dirnode import DirectoryNode, Adder, Deleter, MetadataSetter
+from allmydata.interfaces import NoSuchChildError, MDMF_VERSION
+from allmydata.mutable.common import UncoordinatedWriteError
+from allmydata.util import hashutil
+from allmydata.util.dictutil import LazyAuxValueDict
+from allmydata.util.encodingutil import normalize
+from allmydata.uri import wrap_sharded_dirnode_cap
+
+# The metadata key that tells the children of an interior shard apart:
+SHARD_KIND = "hamt-shard"
+LEAF = "leaf"
+INTERIOR = "interior"
+# A leaf shard that has been split has a child with this name and kind:
+RETIRED_NAME = ""
+RETIRED = "retired"
+
+_NAME_HASH_TAG = b"allmydata_sharded_directory_name_v1"
+
+
+def _is_retired(children):
+    marker = children.get(RETIRED_NAME)
+    return marker is not None and marker[1].get(SHARD_KIND) == RETIRED
+
+
+def _without_marker(children):
+    if _is_retired(children):
+        children = dict(children)
+        del children[RETIRED_NAME]
+    return children
+
+
+def shard_path(name: str) -> str:
+    """
+    :return: The hex digits that lead to the leaf shard for the child
+        called ``name`` (normalized), one per level.
+    """
+    return hexlify(hashutil.tagged_hash(_NAME_HASH_TAG,
+                                        name.encode("utf-8"))).decode("ascii")
+
+
+class ShardedDirectoryNode(DirectoryNode):
+    """
+    I am a mutable directory whose children are kept in a tree of shards.
+
+    I offer the same interface as ``DirectoryNode``. ``list`` has to read
+    every shard; ``iterate_leaves`` and ``iterate_children`` (and so deep
+    traversals) read them one at a time instead.
+    """
+
+    max_leaf_entries = 1000
+
+    def __init__(self, filenode, nodemaker, uploader):
+        DirectoryNode.__init__(self, filenode, nodemaker, uploader)
+        self._uri = wrap_sharded_dirnode_cap(filenode.get_cap())
+        # The root shard, which is an interior shard:
+        self._table = DirectoryNode(filenode, nodemaker, uploader)
+        self._writes = _ShardedWriter(self)
+
+    @defer.inlineCallbacks
+    def _find_leaf(self, name):
+        """
+        :return: A Deferred that fires with (interior, depth, leaf): the leaf
+            shard that would hold ``name`` (or None if there isn't one yet),
+            the interior shard that links to it, and how deep that link is.
+        """
+        path = shard_path(name)
+        interior = self._table
+        for (depth, digit) in enumerate(path):
+            try:
+                (shard, metadata) = yield interior.get_child_and_metadata(digit)
+            except NoSuchChildError:
+                return (interior, depth, None)
+            if metadata.get(SHARD_KIND) != INTERIOR:
+                return (interior, depth, shard)
+            interior = shard
+        raise AssertionError("sharded directory is deeper than its hash")
+
+    @defer.inlineCallbacks
+    def _walk(self, visit_leaf, interior=None):
+        # Depth-first, in digit order, one shard at a time.
+        if interior is None:
+            interior = self._table
+        shards = yield interior.list()
+        for digit in sorted(shards):
+            (shard, metadata) = shards[digit]
+            if metadata.get(SHARD_KIND) == INTERIOR:
+                yield visit_leaf(None, shard)
+                yield self._walk(visit_leaf, shard)
+            else:
+                yield visit_leaf(shard, None)
+
+    def iterate_leaves(self, visit):
+        """
+        Call ``visit(leaf, children)`` for every leaf shard, with the dict of
+        its children, reading one leaf shard at a time.
+
+        :return: A Deferred that fires with None once every leaf has been
+            visited.
+        """
+        @defer.inlineCallbacks
+        def visit_leaf(leaf, interior):
+            if leaf is None:
+                return
+            children = yield leaf.list()
+            yield visit(leaf, _without_marker(children))
+        return self._walk(visit_leaf)
+
+    def iterate_children(self, visit):
+        """
+        Call ``visit(name, child, metadata)`` for every child, reading one
+        leaf shard at a time, so that only that shard's children are held
+        in memory.
+
+        :return: A Deferred that fires with None once every child has been
+            visited.
+        """
+        @defer.inlineCallbacks
+        def visit_leaf(leaf, children):
+            for name in sorted(children):
+                (child, metadata) = children[name]
+                yield visit(name, child, metadata)
+        return self.iterate_leaves(visit_leaf)
+
+    def _list_shards(self):
+        shards = []
+        def visit_shard(leaf, interior):
+            shards.append(leaf or interior)
+        d = self._walk(visit_shard)
+        d.addCallback(lambda ignored: shards)
+        return d
+
+    def _read(self):
+        children = {}
+        def visit(name, child, metadata):
+            children[name] = (child, metadata)
+        d = self.iterate_children(visit)
+        d.addCallback(lambda ignored: children)
+        return d
+
+    def has_child(self, namex):
+        d = self.get_child_and_metadata(namex)
+        def _missing(f):
+            f.trap(NoSuchChildError)
+            return False
+        d.addCallbacks(lambda ignored: True, _missing)
+        return d
+
+    def get(self, namex):
+        d = self.get_child_and_metadata(namex)
+        d.addCallback(lambda child_and_metadata: child_and_metadata[0])
+        return d
+
+    def get_child_and_metadata(self, namex):
+        name = normalize(namex)
+        d = self._find_leaf(name)
+        def _found(found):
+            (interior, depth, leaf) = found
+            if leaf is None:
+                raise NoSuchChildError(name)
+            return leaf.get_child_and_metadata(name)
+        d.addCallback(_found)
+        def _not_marker(child_and_metadata):
+            if (name == RETIRED_NAME and
+                    child_and_metadata[1].get(SHARD_KIND) == RETIRED):
+                raise NoSuchChildError(name)
+            return child_and_metadata
+        d.addCallback(_not_marker)
+        return d
+
+    def get_metadata_for(self, namex):
+        d = self.get_child_and_metadata(namex)
+        d.addCallback(lambda child_and_metadata: child_and_metadata[1])
+        return d
+
+    def check(self, monitor, verify=False, add_lease=False):
+        """
+        Check the root shard and every other shard.
+
+        :return: A Deferred that fires with the results for the root shard,
+            unless another shard is unhealthy, in which case it fires with
+            the results for the first such shard.
+        """
+        return self._check_shards(
+            monitor,
+            lambda node: node.check(monitor, verify, add_lease),
+            lambda results: results.is_healthy())
+
+    def check_and_repair(self, monitor, verify=False, add_lease=False):
+        return self._check_shards(
+            monitor,
+            lambda node: node.check_and_repair(monitor, verify, add_lease),
+            lambda results: results.get_post_repair_results().is_healthy())
+
+    @defer.inlineCallbacks
+    def _check_shards(self, monitor, check, is_healthy):
+        results = yield check(self._node)
+        shards = yield self._list_shards()
+        for shard in shards:
+            monitor.raise_if_cancelled()
+            shard_results = yield check(shard)
+            if is_healthy(results) and not is_healthy(shard_results):
+                results = shard_results
+        return results
+
+
+class _ShardedWriter(object):
+    """
+    I make the changes that ``DirectoryNode`` would hand to its
+    ``WriteCoalescer`` to the right leaf shards of a
+    ``ShardedDirectoryNode``, creating and splitting shards as needed.
+
+    Changes are made one after another, so that a leaf can't change while
+    it is being split by us. Other writers can still try to change it, so a
+    split retires the leaf before copying it, and a change that finds its
+    leaf retired is retried.
+    """
+
+    def __init__(self, dirnode):
+        self._dirnode = dirnode
+        self._lock = defer.DeferredLock()
+
+    def modify(self, modifier):
+        return self._lock.run(self._modify, modifier)
+
+    @defer.inlineCallbacks
+    def _modify(self, modifier):
+        if isinstance(modifier, Adder):
+            yield self._add(modifier)
+            return
+        assert isinstance(modifier, (Deleter, MetadataSetter)), modifier
+        while True:
+            (interior, depth, leaf) = yield self._dirnode._find_leaf(
+                modifier.name)
+            if leaf is None:
+                # Fail (or not) as the change would in an empty directory.
+                modifier.modify_children({}, True)
+                return
+            try:
+                yield leaf._writes.modify(_LeafModifier(modifier))
+                return
+            except _RetiredShard:
+                yield self._retired(modifier.name, leaf)
+
+    @defer.inlineCallbacks
+    def _add(self, adder):
+        entries = dict((normalize(namex), entry)
+                       for (namex, entry) in adder.entries.items())
+        paths = dict((name, shard_path(name)) for name in entries)
+        while entries:
+            name = min(entries)
+            (interior, depth, leaf) = yield self._dirnode._find_leaf(name)
+            digit = paths[name][depth]
+            if leaf is None:
+                leaf = yield self._create_shard({})
+                yield interior.set_node(digit, leaf, {SHARD_KIND: LEAF},
+                                        overwrite=False)
+            prefix = paths[name][:depth + 1]
+            here = dict((n, entries.pop(n)) for n in list(entries)
+                        if paths[n].startswith(prefix))
+            change = _LeafModifier(Adder(
+                adder.node, here, overwrite=adder.overwrite,
+                create_readonly_node=adder.create_readonly_node))
+            try:
+                yield leaf._writes.modify(change)
+            except _RetiredShard:
+                entries.update(here)
+                yield self._retired(name, leaf)
+                continue
+            if change.count > self._dirnode.max_leaf_entries:
+                yield self._split(interior, digit, depth, leaf)
+
+    def _create_shard(self, children):
+        return self._dirnode._nodemaker.create_new_mutable_directory(
+            children, version=MDMF_VERSION)
+
+    @defer.inlineCallbacks
+    def _retired(self, name, leaf):
+        """
+        A change to the child ``name`` found ``leaf`` retired. If ``leaf``
+        is still where ``name`` belongs, the writer splitting it stopped or
+        hasn't got that far yet: finish the split, so that the change can
+        be retried in the shard that replaces it.
+        """
+        (interior, depth, current) = yield self._dirnode._find_leaf(name)
+        if current is not None and current.get_uri() == leaf.get_uri():
+            yield self._split(interior, shard_path(name)[depth], depth, leaf)
+
+    @defer.inlineCallbacks
+    def _split(self, interior, digit, depth, leaf):
+        """
+        Replace ``leaf`` with an interior shard whose leaves hold its
+        children.
+
+        ``leaf`` is retired first, so that no more changes are made to it
+        through a sharded directory, and the children it has then are the
+        ones copied. If another writer has already replaced it in
+        ``interior``, that is left alone.
+        """
+        marker = self._dirnode._nodemaker.create_from_cap(b"URI:LIT:")
+        retirer = _Retirer(marker)
+        yield leaf._writes.modify(retirer)
+        groups = {}
+        for (name, (child, metadata)) in retirer.children.items():
+            group = groups.setdefault(shard_path(name)[depth + 1], {})
+            group[name] = (child, metadata)
+        shards = {}
+        for subdigit in sorted(groups):
+            shard = yield self._create_shard(groups[subdigit])
+            shards[subdigit] = (shard, {SHARD_KIND: LEAF})
+        replacement = yield self._create_shard(shards)
+        relinker = _Relinker(interior, digit, leaf, replacement)
+        yield interior._writes.modify(relinker)
+
+
+class _RetiredShard(Exception):
+    """
+    A change was made to a leaf shard that has been split.
+    """
+
+
+class _Retirer(object):
+    """
+    I add the marker that retires a leaf shard, and remember the children
+    it had apart from that.
+    """
+
+    def __init__(self, marker):
+        self._marker = marker
+        self.children = None
+
+    def modify_children(self, children, first_time):
+        self.children = dict(_without_marker(children))
+        if _is_retired(children):
+            # Whoever retired it stopped before finishing the split.
+            return False
+        children[RETIRED_NAME] = (self._marker, {SHARD_KIND: RETIRED})
+        return True
+
+
+class _Relinker(Adder):
+    """
+    I replace the link to a leaf shard with one to the interior shard that
+    takes its place, unless the link no longer points at that leaf.
+    """
+
+    def __init__(self, interior, digit, leaf, replacement):
+        Adder.__init__(self, interior,
+                       {digit: (replacement, {SHARD_KIND: INTERIOR})})
+        self._digit = digit
+        self._leaf_uri = leaf.get_uri()
+
+    def modify_children(self, children, first_time):
+        if self._digit not in children:
+            raise UncoordinatedWriteError("leaf shard %s went away while it"
+                                          " was being split" % (self._digit,))
+        (current, metadata) = children[self._digit]
+        if current.get_uri() != self._leaf_uri:
+            # Someone else split it first.
+            return False
+        return Adder.modify_children(self, children, first_time)
+
+
+class _LeafModifier(object):
+    """
+    I make the change ``modifier`` makes to a leaf shard, unless the leaf
+    has been retired, and remember how many children it has afterwards.
+    """
+
+    def __init__(self, modifier):
+        self._modifier = modifier
+        self.count = 0
+
+    def modify_children(self, children, first_time):
+        if _is_retired(children):
+            raise _RetiredShard()
+        changed = self._modifier.modify_children(children, first_time)
+        if isinstance(children, LazyAuxValueDict):
+            # Without unpacking the ones that haven't been looked at.
+            self.count = len(children.all_keys())
+        else:
+            self.count = len(children)
+        return changed
@@ -86,3 +86,16 @@ class StatsProvider(service.MultiService):
         ret = { 'counters': self.counters, 'stats': stats }
         log.msg(format='get_stats() -> %(stats)s', stats=ret, level=log.NOISY)
         return ret
+
+    def get_histograms(self):
+        """
+        :return: A dict mapping names to ``allmydata.util.histogram.Histogram``
+            instances, from every producer that has a ``get_histograms``
+            method.
+        """
+        histograms = {}
+        for sp in self.stats_producers:
+            get_histograms = getattr(sp, "get_histograms", None)
+            if get_histograms is not None:
+                histograms.update(get_histograms())
+        return histograms
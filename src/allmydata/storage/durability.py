@@ -0,0 +1,248 @@
+"""
+Make share writes durable.
+
+The storage server writes share files without ever flushing them to disk, so
+after a power failure a share that a client was told had been stored may
+turn out to be truncated or missing. Flushing with ``fsync`` fixes that, but
+doing it on every close and every mutable write makes writes much slower,
+because each ``fsync`` waits for the disk.
+
+The ``[storage]durability`` setting chooses between:
+
+``none``
+    Don't flush anything (the traditional behavior).
+
+``close``
+    Flush each finished immutable share, and each mutable share after it is
+    written, before telling the client that the operation succeeded.
+
+``group``
+    Like ``close``, but ``GroupCommitter`` flushes the shares finished by
+    all clients in a short window together, on a background thread. A
+    directory that several of them share only needs flushing once, and the
+    disk sees one burst of flushes instead of a steady trickle.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, Optional
+import errno
+import os
+import sys
+import time
+
+from twisted.application import service
+from twisted.internet import defer, reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from allmydata.storage.iopool import ShareIOPool, run_io, after_io
+
+
+DURABILITY_MODES = ("none", "close", "group")
+
+
+def fsync_path(path: str):
+    """
+    Flush a file or directory to disk. Paths that no longer exist are
+    ignored, as are directories on Windows, which can't flush them.
+    """
+    if sys.platform == "win32" and os.path.isdir(path):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def bucket_directories(bucketdir: str) -> list[str]:
+    """
+    :return: The directories whose entries make the shares in ``bucketdir``
+        reachable: the bucket directory itself, its prefix directory, and
+        the shares directory.
+    """
+    prefixdir = os.path.dirname(bucketdir)
+    return [bucketdir, prefixdir, os.path.dirname(prefixdir)]
+
+
+def sync_and_then(files: Iterable[str], then: Optional[Callable[[], Any]],
+                  directories: Iterable[str]) -> Any:
+    """
+    Flush ``files``, call ``then`` (which usually renames or creates
+    directory entries), and flush ``directories``.
+
+    :return: The result of ``then``.
+    """
+    for path in files:
+        fsync_path(path)
+    result = None if then is None else then()
+    for path in directories:
+        fsync_path(path)
+    return result
+
+
+def _do_nothing():
+    pass
+
+
+def run_durably(io_pool: Optional[ShareIOPool],
+                committer: Optional[GroupCommitter],
+                key, files: Iterable[str], then: Optional[Callable[[], Any]],
+                directories: Iterable[str]) -> Any:
+    """
+    Like ``sync_and_then``, but after any share-file I/O already submitted to
+    ``io_pool`` with ``key``, and as part of a group commit if there is a
+    ``committer``.
+
+    :return: The result of ``then``, or a ``Deferred`` that fires with it.
+    """
+    if committer is None:
+        return run_io(io_pool, key, sync_and_then, files, then, directories)
+    return after_io(
+        run_io(io_pool, key, _do_nothing),
+        lambda ignored: committer.sync(files, then, directories),
+    )
+
+
+class GroupCommitter(service.Service):
+    """
+    I flush shares to disk in batches, on a thread of my own.
+
+    A request waits up to ``window`` seconds for others to join it. While a
+    batch is being flushed, new requests queue up for the next one.
+
+    :ivar int batches: The number of batches flushed so far.
+    :ivar int commits: The number of requests in those batches.
+    """
+    name = "share-commit"
+
+    def __init__(self, window: float = 0.002,
+                 on_commit: Optional[Callable[[float], None]] = None,
+                 reactor=reactor):
+        """
+        :param on_commit: If given, called in the reactor thread with the
+            number of seconds each batch took to flush.
+        """
+        self._window = window
+        self._on_commit = on_commit
+        self._reactor = reactor
+        self._pool = ThreadPool(minthreads=0, maxthreads=1,
+                                name="tahoe-storage-commit")
+        # (files, then, directories, Deferred) for the next batch:
+        self._pending = []
+        self._timer = None
+        self._committing = False
+        self.batches = 0
+        self.commits = 0
+
+    def startService(self):
+        service.Service.startService(self)
+        self._pool.start()
+
+    def stopService(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Shares that are waiting for a batch were finished before we were
+        # told to stop, so flush them before the pool goes away.
+        pending, self._pending = self._pending, []
+        for (files, then, directories, d) in pending:
+            defer.maybeDeferred(
+                sync_and_then, files, then, directories).chainDeferred(d)
+        self._pool.stop()
+        return service.Service.stopService(self)
+
+    def sync(self, files: Iterable[str], then: Optional[Callable[[], Any]],
+             directories: Iterable[str]) -> defer.Deferred:
+        """
+        Do ``sync_and_then(files, then, directories)`` as part of the next
+        batch. Must be called in the reactor thread.
+
+        :return: A ``Deferred`` that fires with the result of ``then`` once
+            the whole batch has been flushed.
+        """
+        if not self.running:
+            return defer.maybeDeferred(sync_and_then, files, then, directories)
+        d = defer.Deferred()
+        self._pending.append((list(files), then, list(directories), d))
+        self._schedule()
+        return d
+
+    def _schedule(self):
+        if self._pending and not self._committing and self._timer is None:
+            self._timer = self._reactor.callLater(self._window, self._commit)
+
+    def _commit(self):
+        self._timer = None
+        self._committing = True
+        batch, self._pending = self._pending, []
+        started = time.time()
+
+        def done(results):
+            self._committing = False
+            self.batches += 1
+            self.commits += len(batch)
+            if self._on_commit is not None:
+                self._on_commit(time.time() - started)
+            for ((files, then, directories, d), result) in zip(batch, results):
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+            self._schedule()
+
+        def failed(f):
+            # Flushing failed, so none of the batch can be said to be on disk.
+            self._committing = False
+            self.batches += 1
+            self.commits += len(batch)
+            for (files, then, directories, d) in batch:
+                d.errback(f)
+            self._schedule()
+
+        d = deferToThreadPool(self._reactor, self._pool, self._flush, batch)
+        d.addCallbacks(done, failed)
+
+    def _flush(self, batch):
+        """
+        Flush a batch, in the commit thread.
+
+        :return: The result of each request's ``then``, or the ``Failure`` it
+            raised.
+        """
+        synced = set()
+        for (files, then, directories, d) in batch:
+            for path in files:
+                if path not in synced:
+                    fsync_path(path)
+                    synced.add(path)
+        results = []
+        for (files, then, directories, d) in batch:
+            try:
+                results.append(None if then is None else then())
+            except:
+                results.append(Failure())
+        for ((files, then, directories, d), result) in zip(batch, results):
+            if isinstance(result, Failure):
+                continue
+            for path in directories:
+                if path not in synced:
+                    fsync_path(path)
+                    synced.add(path)
+        return results
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        :return: Batch statistics suitable for ``IStatsProducer.get_stats``.
+        """
+        return {
+            "storage_server.commit.batches": self.batches,
+            "storage_server.commit.commits": self.commits,
+        }
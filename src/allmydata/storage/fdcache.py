@@ -0,0 +1,158 @@
+"""
+A cache of open share files.
+
+Share file methods open the file, do one read or write, and close it again.
+For an upload that means an ``open``/``close`` pair for every block of every
+share, and for a download one for every read. ``FileHandleCache`` keeps the
+most recently used share files open instead, up to a limit.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class _FullIO(object):
+    """
+    I wrap an unbuffered file so that, like a buffered one, ``read(n)`` only
+    returns fewer than ``n`` bytes at the end of the file, and ``write``
+    only returns once all of its data has been written.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._raw.readall()
+        chunks = []
+        while size > 0:
+            chunk = self._raw.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self._raw.write(view):]
+        return len(data)
+
+
+class FileHandleCache(object):
+    """
+    I keep up to ``size`` share files open, closing the least recently used
+    one when I need room for another.
+
+    Handles are unbuffered, so nothing written through one can be hidden
+    from another (though reads and writes still complete, see ``_FullIO``),
+    and each is used by one caller (in one thread) at a time.
+    Anything that renames or deletes a share file, or replaces it with a new
+    one, must call ``invalidate`` first.
+    """
+
+    def __init__(self, size: int):
+        assert size > 0, size
+        self._size = size
+        self._handles = OrderedDict() # path -> (mode, file)
+        # Paths with handles in use, mapped to [number of users, epoch]. The
+        # epoch is bumped by invalidate(), so that a handle that was in use
+        # while its file was renamed or deleted is not put back.
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def open(self, path: str, mode: str):
+        """
+        Use an open handle for ``path``, positioned at the start of the file
+        like ``open(path, mode)`` would give but with no buffering.
+
+        :param mode: ``"rb"`` or ``"rb+"``.
+        """
+        assert mode in ("rb", "rb+"), mode
+        with self._lock:
+            (cached_mode, f) = self._handles.pop(path, (None, None))
+            users = self._in_use.setdefault(path, [0, 0])
+            users[0] += 1
+            epoch = users[1]
+            if f is not None and (cached_mode == mode or mode == "rb"):
+                self.hits += 1
+                mode = cached_mode
+            else:
+                self.misses += 1
+                if f is not None:
+                    f.close()
+                f = None
+        ok = False
+        try:
+            if f is None:
+                f = _FullIO(open(path, mode, buffering=0))
+            else:
+                f.seek(0)
+            yield f
+            ok = True
+        finally:
+            self._put(path, mode, f, epoch, ok)
+
+    def _put(self, path, mode, f, epoch, ok):
+        evicted = []
+        with self._lock:
+            users = self._in_use[path]
+            users[0] -= 1
+            if users[0] == 0:
+                del self._in_use[path]
+            if f is None:
+                pass
+            elif not ok or users[1] != epoch or path in self._handles:
+                # Something went wrong, the file has moved on since we opened
+                # this handle, or someone else got a handle for it while we
+                # were using ours.
+                evicted.append(f)
+            else:
+                self._handles[path] = (mode, f)
+                while len(self._handles) > self._size:
+                    (ignored, (ignored, old)) = self._handles.popitem(last=False)
+                    evicted.append(old)
+        for old in evicted:
+            old.close()
+
+    def invalidate(self, path: str):
+        """
+        Close any cached handle for ``path``, which is about to be renamed or
+        deleted.
+        """
+        with self._lock:
+            if path in self._in_use:
+                self._in_use[path][1] += 1
+            (ignored, f) = self._handles.pop(path, (None, None))
+        if f is not None:
+            f.close()
+
+    def clear(self):
+        """
+        Close every cached handle.
+        """
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for (ignored, f) in handles:
+            f.close()
+
+    def get_stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "storage_server.fd_cache.hits": self.hits,
+            "storage_server.fd_cache.misses": self.misses,
+            "storage_server.fd_cache.hit_rate":
+                self.hits / lookups if lookups else 0.0,
+            "storage_server.fd_cache.open_files": len(self._handles),
+        }
@@ -73,6 +73,7 @@ _SCHEMAS = {
                  'delete-mutable-shares-with-zero-length-writev' => bool
                  'fills-holes-with-zero-bytes' => bool
                  'prevents-read-past-end-of-share-data' => bool
+                 ? 'batched-mutable-readv' => bool
                  }
                  'application-version' => bstr
               }
@@ -112,6 +113,12 @@ _SCHEMAS = {
         response = #6.258([* uint])
         """
     ),
+    "mutable_read": Schema(
+        """
+        response = {* share_number: [* bstr]}
+        share_number = uint
+        """
+    ),
 }
 
 
@@ -774,6 +781,41 @@ class StorageClientMutables:
             self._client, "mutable", storage_index, share_number, offset, length
         )
 
+    @async_to_deferred
+    async def read_share_chunks(
+        self,
+        storage_index: bytes,
+        share_numbers: set[int],
+        read_vector: list[ReadVector],
+    ) -> dict[int, list[bytes]]:
+        """
+        Download the same chunks from several shares in a single request.
+
+        Only servers whose version information includes
+        ``batched-mutable-readv`` support this.
+
+        :param share_numbers: The shares to read from; an empty set means all
+            of the shares the server has.
+
+        :return: A mapping from share number to the data read for each entry
+            in ``read_vector``, in order.  Shares the server does not have are
+            left out.
+        """
+        url = self._client.relative_url(
+            "/v1/mutable/{}/read".format(_encode_si(storage_index))
+        )
+        message = {
+            "share-numbers": set(share_numbers),
+            "read-vector": [asdict(r) for r in read_vector],
+        }
+        response = await self._client.request(
+            "POST", url, message_to_serialize=message
+        )
+        if response.code == http.OK:
+            return await _decode_cbor(response, _SCHEMAS["mutable_read"])
+        else:
+            raise ClientException(response.code, (await response.content()))
+
     @async_to_deferred
     async def list_shares(self, storage_index: bytes) -> set[int]:
         """
@@ -16,9 +16,9 @@ from twisted.web import http
 from twisted.internet.interfaces import (
     IListeningPort,
     IStreamServerEndpoint,
-    IPullProducer,
+    IPushProducer,
 )
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, inlineCallbacks, maybeDeferred
 from twisted.internet.ssl import CertificateOptions, Certificate, PrivateCertificate
 from twisted.web.server import Site, Request
 from twisted.protocols.tls import TLSMemoryBIOFactory
@@ -50,6 +50,7 @@ from .http_common import (
 
 from .common import si_a2b
 from .immutable import BucketWriter, ConflictingWriteError
+from .iopool import after_io
 from ..util.hashutil import timing_safe_compare
 from ..util.base32 import rfc3548_alphabet
 from allmydata.interfaces import BadWriteEnablerError
@@ -282,23 +283,109 @@ _SCHEMAS = {
         share_number = uint
         """
     ),
+    "mutable_read": Schema(
+        """
+        request = {
+            "share-numbers": #6.258([*256 uint])
+            "read-vector": [*30 {"offset": uint, "size": uint}]
+        }
+        """
+    ),
 }
 
 
-# Callable that takes offset and length, returns the data at that range.
-ReadData = Callable[[int, int], bytes]
+# Callable that takes offset and length, returns the data at that range,
+# possibly via a Deferred (e.g. when share I/O happens in a thread pool).
+ReadData = Callable[[int, int], Union[bytes, Deferred]]
 
 
-@implementer(IPullProducer)
+@implementer(IPushProducer)
 @define
-class _ReadAllProducer:
+class _ReadProducer:
     """
-    Producer that calls a read function repeatedly to read all the data, and
-    writes to a request.
+    Base class for producers that call a read function repeatedly and write
+    the results to a request.
+
+    At most one read is outstanding at a time, and no new read is started
+    while the consumer is paused.
     """
 
     request: Request
     read_data: ReadData
+    result: Deferred
+    start: int
+    _paused: bool = field(default=False, init=False)
+    _reading: bool = field(default=False, init=False)
+    _looping: bool = field(default=False, init=False)
+    _done: bool = field(default=False, init=False)
+
+    def _next_length(self) -> int:
+        """How many bytes to ask ``read_data`` for next."""
+        raise NotImplementedError()
+
+    def _write(self, data: bytes) -> bool:
+        """
+        Write the result of a read to the request, returning whether we're
+        finished.
+        """
+        raise NotImplementedError()
+
+    def _register(self):
+        """Register with the request and start producing."""
+        self.request.registerProducer(self, True)
+        self._read_more()
+
+    def _read_more(self):
+        # Reads that finish synchronously are handled by this loop, rather
+        # than by recursion, so that large shares don't exhaust the stack.
+        self._looping = True
+        try:
+            while not (self._paused or self._reading or self._done):
+                self._reading = True
+                d = maybeDeferred(self.read_data, self.start, self._next_length())
+                d.addCallbacks(self._got_data, self._read_failed)
+        finally:
+            self._looping = False
+
+    def _got_data(self, data: bytes):
+        self._reading = False
+        if self._done:
+            return
+        if self._write(data):
+            self._finish()
+            self.result.callback(b"")
+        elif not self._looping:
+            self._read_more()
+
+    def _read_failed(self, failure):
+        self._reading = False
+        if self._done:
+            return
+        self._finish()
+        self.result.errback(failure)
+
+    def _finish(self):
+        self._done = True
+        self.request.unregisterProducer()
+
+    def resumeProducing(self):
+        self._paused = False
+        self._read_more()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def stopProducing(self):
+        self._done = True
+
+
+@define
+class _ReadAllProducer(_ReadProducer):
+    """
+    Producer that calls a read function repeatedly to read all the data, and
+    writes to a request.
+    """
+
     result: Deferred = Factory(Deferred)
     start: int = field(default=0)
 
@@ -309,46 +396,35 @@ class _ReadAllProducer:
         returned from a HTTP server endpoint.
         """
         producer = cls(request, read_data)
-        request.registerProducer(producer, False)
+        producer._register()
         return producer.result
 
-    def resumeProducing(self):
-        data = self.read_data(self.start, 65536)
+    def _next_length(self) -> int:
+        return 65536
+
+    def _write(self, data: bytes) -> bool:
         if not data:
-            self.request.unregisterProducer()
-            d = self.result
-            del self.result
-            d.callback(b"")
-            return
+            return True
         self.request.write(data)
         self.start += len(data)
+        return False
 
-    def pauseProducing(self):
-        pass
 
-    def stopProducing(self):
-        pass
-
-
-@implementer(IPullProducer)
 @define
-class _ReadRangeProducer:
+class _ReadRangeProducer(_ReadProducer):
     """
     Producer that calls a read function to read a range of data, and writes to
     a request.
     """
 
-    request: Request
-    read_data: ReadData
-    result: Deferred
-    start: int
-    remaining: int
-    first_read: bool = field(default=True)
+    remaining: int = field(kw_only=True)
+    first_read: bool = field(default=True, kw_only=True)
 
-    def resumeProducing(self):
-        to_read = min(self.remaining, 65536)
-        data = self.read_data(self.start, to_read)
-        assert len(data) <= to_read
+    def _next_length(self) -> int:
+        return min(self.remaining, 65536)
+
+    def _write(self, data: bytes) -> bool:
+        assert len(data) <= self._next_length()
 
         if self.first_read and self.remaining > 0:
             # For empty bodies the content-range header makes no sense since
@@ -380,18 +456,7 @@ class _ReadRangeProducer:
         self.request.write(data)
 
         # TODO remove the second clause in https://tahoe-lafs.org/trac/tahoe-lafs/ticket/3907
-        if self.remaining == 0 or not data:
-            self.request.unregisterProducer()
-            d = self.result
-            del self.result
-            d.callback(b"")
-            return
-
-    def pauseProducing(self):
-        pass
-
-    def stopProducing(self):
-        pass
+        return self.remaining == 0 or not data
 
 
 def read_range(request: Request, read_data: ReadData) -> Union[Deferred, bytes]:
@@ -410,14 +475,15 @@ def read_range(request: Request, read_data: ReadData) -> Union[Deferred, bytes]:
     The resulting data is written to the request.
     """
 
-    def read_data_with_error_handling(offset: int, length: int) -> bytes:
-        try:
-            return read_data(offset, length)
-        except _HTTPError as e:
-            request.setResponseCode(e.code)
+    def read_data_with_error_handling(offset: int, length: int) -> Deferred:
+        def error(failure):
+            failure.trap(_HTTPError)
+            request.setResponseCode(failure.value.code)
             # Empty read means we're done.
             return b""
 
+        return maybeDeferred(read_data, offset, length).addErrback(error)
+
     if request.getHeader("range") is None:
         return _ReadAllProducer.produce_to(request, read_data_with_error_handling)
 
@@ -435,12 +501,9 @@ def read_range(request: Request, read_data: ReadData) -> Union[Deferred, bytes]:
     offset, end = range_header.ranges[0]
     request.setResponseCode(http.PARTIAL_CONTENT)
     d = Deferred()
-    request.registerProducer(
-        _ReadRangeProducer(
-            request, read_data_with_error_handling, d, offset, end - offset
-        ),
-        False,
-    )
+    _ReadRangeProducer(
+        request, read_data_with_error_handling, d, offset, remaining=end - offset
+    )._register()
     return d
 
 
@@ -580,6 +643,7 @@ class HTTPServer(object):
         "/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>/abort",
         methods=["PUT"],
     )
+    @inlineCallbacks
     def abort_share_upload(self, request, authorization, storage_index, share_number):
         """Abort an in-progress immutable share upload."""
         try:
@@ -590,8 +654,9 @@ class HTTPServer(object):
             if e.code == http.NOT_FOUND:
                 # It may be we've already uploaded this, in which case error
                 # should be method not allowed (405).
+                buckets = yield self._storage_server.get_buckets(storage_index)
                 try:
-                    self._storage_server.get_buckets(storage_index)[share_number]
+                    buckets[share_number]
                 except KeyError:
                     pass
                 else:
@@ -601,7 +666,7 @@ class HTTPServer(object):
 
         # Abort the upload; this should close it which will eventually result
         # in self._uploads.remove_write_bucket() being called.
-        bucket.abort()
+        yield bucket.abort()
 
         return b""
 
@@ -611,6 +676,7 @@ class HTTPServer(object):
         "/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["PATCH"],
     )
+    @inlineCallbacks
     def write_share_data(self, request, authorization, storage_index, share_number):
         """Write data to an in-progress immutable upload."""
         content_range = parse_content_range_header(request.getHeader("content-range"))
@@ -630,7 +696,7 @@ class HTTPServer(object):
             assert data, "uploaded data length doesn't match range"
 
             try:
-                finished = bucket.write(offset, data)
+                finished = yield bucket.write(offset, data)
             except ConflictingWriteError:
                 request.setResponseCode(http.CONFLICT)
                 return b""
@@ -638,7 +704,7 @@ class HTTPServer(object):
             offset += len(data)
 
         if finished:
-            bucket.close()
+            yield bucket.close()
             request.setResponseCode(http.CREATED)
         else:
             request.setResponseCode(http.OK)
@@ -646,7 +712,8 @@ class HTTPServer(object):
         required = []
         for start, end, _ in bucket.required_ranges().ranges():
             required.append({"begin": start, "end": end})
-        return self._send_encoded(request, {"required": required})
+        result = yield self._send_encoded(request, {"required": required})
+        return result
 
     @_authorized_route(
         _app,
@@ -654,12 +721,14 @@ class HTTPServer(object):
         "/v1/immutable/<storage_index:storage_index>/shares",
         methods=["GET"],
     )
+    @inlineCallbacks
     def list_shares(self, request, authorization, storage_index):
         """
         List shares for the given storage index.
         """
-        share_numbers = set(self._storage_server.get_buckets(storage_index).keys())
-        return self._send_encoded(request, share_numbers)
+        buckets = yield self._storage_server.get_buckets(storage_index)
+        result = yield self._send_encoded(request, set(buckets.keys()))
+        return result
 
     @_authorized_route(
         _app,
@@ -667,15 +736,18 @@ class HTTPServer(object):
         "/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["GET"],
     )
+    @inlineCallbacks
     def read_share_chunk(self, request, authorization, storage_index, share_number):
         """Read a chunk for an already uploaded immutable."""
+        buckets = yield self._storage_server.get_buckets(storage_index)
         try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
+            bucket = buckets[share_number]
         except KeyError:
             request.setResponseCode(http.NOT_FOUND)
             return b""
 
-        return read_range(request, bucket.read)
+        result = yield read_range(request, bucket.read)
+        return result
 
     @_authorized_route(
         _app,
@@ -683,13 +755,14 @@ class HTTPServer(object):
         "/v1/lease/<storage_index:storage_index>",
         methods=["PUT"],
     )
+    @inlineCallbacks
     def add_or_renew_lease(self, request, authorization, storage_index):
         """Update the lease for an immutable or mutable share."""
         if not list(self._storage_server.get_shares(storage_index)):
             raise _HTTPError(http.NOT_FOUND)
 
         # Checking of the renewal secret is done by the backend.
-        self._storage_server.add_lease(
+        yield self._storage_server.add_lease(
             storage_index,
             authorization[Secrets.LEASE_RENEW],
             authorization[Secrets.LEASE_CANCEL],
@@ -704,12 +777,14 @@ class HTTPServer(object):
         "/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>/corrupt",
         methods=["POST"],
     )
+    @inlineCallbacks
     def advise_corrupt_share_immutable(
         self, request, authorization, storage_index, share_number
     ):
         """Indicate that given share is corrupt, with a text reason."""
+        buckets = yield self._storage_server.get_buckets(storage_index)
         try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
+            bucket = buckets[share_number]
         except KeyError:
             raise _HTTPError(http.NOT_FOUND)
 
@@ -725,6 +800,7 @@ class HTTPServer(object):
         "/v1/mutable/<storage_index:storage_index>/read-test-write",
         methods=["POST"],
     )
+    @inlineCallbacks
     def mutable_read_test_write(self, request, authorization, storage_index):
         """Read/test/write combined operation for mutables."""
         rtw_request = self._read_encoded(request, _SCHEMAS["mutable_read_test_write"])
@@ -734,7 +810,7 @@ class HTTPServer(object):
             authorization[Secrets.LEASE_CANCEL],
         )
         try:
-            success, read_data = self._storage_server.slot_testv_and_readv_and_writev(
+            success, read_data = yield self._storage_server.slot_testv_and_readv_and_writev(
                 storage_index,
                 secrets,
                 {
@@ -752,7 +828,10 @@ class HTTPServer(object):
             )
         except BadWriteEnablerError:
             raise _HTTPError(http.UNAUTHORIZED)
-        return self._send_encoded(request, {"success": success, "data": read_data})
+        result = yield self._send_encoded(
+            request, {"success": success, "data": read_data}
+        )
+        return result
 
     @_authorized_route(
         _app,
@@ -763,23 +842,53 @@ class HTTPServer(object):
     def read_mutable_chunk(self, request, authorization, storage_index, share_number):
         """Read a chunk from a mutable."""
 
-        def read_data(offset, length):
+        def got_data(datavs):
             try:
-                return self._storage_server.slot_readv(
-                    storage_index, [share_number], [(offset, length)]
-                )[share_number][0]
+                return datavs[share_number][0]
             except KeyError:
                 raise _HTTPError(http.NOT_FOUND)
 
+        def read_data(offset, length):
+            return after_io(
+                self._storage_server.slot_readv(
+                    storage_index, [share_number], [(offset, length)]
+                ),
+                got_data,
+            )
+
         return read_range(request, read_data)
 
+    @_authorized_route(
+        _app,
+        set(),
+        "/v1/mutable/<storage_index:storage_index>/read",
+        methods=["POST"],
+    )
+    def read_mutable_chunks(self, request, authorization, storage_index):
+        """
+        Read the same ranges from several shares of a mutable at once.
+
+        An empty set of share numbers means all shares.
+        """
+        read_request = self._read_encoded(request, _SCHEMAS["mutable_read"])
+        return after_io(
+            self._storage_server.slot_readv(
+                storage_index,
+                sorted(read_request["share-numbers"]),
+                [(d["offset"], d["size"]) for d in read_request["read-vector"]],
+            ),
+            lambda datavs: self._send_encoded(request, datavs),
+        )
+
     @_authorized_route(
         _app, set(), "/v1/mutable/<storage_index:storage_index>/shares", methods=["GET"]
     )
+    @inlineCallbacks
     def enumerate_mutable_shares(self, request, authorization, storage_index):
         """List mutable shares for a storage index."""
-        shares = self._storage_server.enumerate_mutable_shares(storage_index)
-        return self._send_encoded(request, shares)
+        shares = yield self._storage_server.enumerate_mutable_shares(storage_index)
+        result = yield self._send_encoded(request, shares)
+        return result
 
     @_authorized_route(
         _app,
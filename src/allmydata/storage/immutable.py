@@ -16,6 +16,7 @@ import os, stat, struct, time
 from collections_extended import RangeMap
 
 from foolscap.api import Referenceable
+from twisted.internet.defer import Deferred
 
 from zope.interface import implementer
 from allmydata.interfaces import (
@@ -26,6 +27,8 @@ from allmydata.interfaces import (
 from allmydata.util import base32, fileutil, log
 from allmydata.util.assertutil import precondition
 from allmydata.storage.common import UnknownImmutableContainerVersionError
+from allmydata.storage.durability import bucket_directories
+from allmydata.storage.iopool import run_io, after_io
 
 from .immutable_schema import (
     NEWEST_SCHEMA_VERSION,
@@ -149,6 +152,7 @@ class ShareFile(object):
             create=False,
             lease_count_format="L",
             schema=NEWEST_SCHEMA_VERSION,
+            fd_cache=None,
     ):
         """
         Initialize a ``ShareFile``.
@@ -170,6 +174,10 @@ class ShareFile(object):
             exercise values near the maximum encodeable value without having
             to create billions of leases.
 
+        :param Optional[FileHandleCache] fd_cache: If given, get file
+            handles from here instead of opening the file for every
+            operation.
+
         :raise ValueError: If the encoding of ``lease_count_format`` is too
             large or if it is not a single format character.
         """
@@ -180,19 +188,22 @@ class ShareFile(object):
         self._lease_count_size = struct.calcsize(self._lease_count_format)
         self.home = filename
         self._max_size = max_size
+        self._fd_cache = fd_cache
         if create:
             # touch the file, so later callers will see that we're working on
             # it. Also construct the metadata.
             assert not os.path.exists(self.home)
             fileutil.make_dirs(os.path.dirname(self.home))
             self._schema = schema
+            if fd_cache is not None:
+                fd_cache.invalidate(self.home)
             with open(self.home, 'wb') as f:
                 f.write(self._schema.header(max_size))
             self._lease_offset = max_size + 0x0c
             self._num_leases = 0
         else:
-            with open(self.home, 'rb') as f:
-                filesize = os.path.getsize(self.home)
+            with self._open('rb') as f:
+                filesize = os.fstat(f.fileno()).st_size
                 (version, unused, num_leases) = struct.unpack(">LLL", f.read(0xc))
             self._schema = schema_from_version(version)
             if self._schema is None:
@@ -201,7 +212,14 @@ class ShareFile(object):
             self._lease_offset = filesize - (num_leases * self.LEASE_SIZE)
         self._data_offset = 0xc
 
+    def _open(self, mode):
+        if self._fd_cache is None:
+            return open(self.home, mode)
+        return self._fd_cache.open(self.home, mode)
+
     def unlink(self):
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.home)
         os.unlink(self.home)
 
     def read_share_data(self, offset, length):
@@ -212,7 +230,7 @@ class ShareFile(object):
         actuallength = max(0, min(length, self._lease_offset-seekpos))
         if actuallength == 0:
             return b""
-        with open(self.home, 'rb') as f:
+        with self._open('rb') as f:
             f.seek(seekpos)
             return f.read(actuallength)
 
@@ -221,7 +239,7 @@ class ShareFile(object):
         precondition(offset >= 0, offset)
         if self._max_size is not None and offset+length > self._max_size:
             raise DataTooLargeError(self._max_size, offset, length)
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             real_offset = self._data_offset+offset
             f.seek(real_offset)
             assert f.tell() == real_offset
@@ -256,7 +274,7 @@ class ShareFile(object):
 
     def get_leases(self):
         """Yields a LeaseInfo instance for all leases."""
-        with open(self.home, 'rb') as f:
+        with self._open('rb') as f:
             (version, unused, num_leases) = struct.unpack(">LLL", f.read(0xc))
             f.seek(self._lease_offset)
             for i in range(num_leases):
@@ -265,7 +283,7 @@ class ShareFile(object):
                     yield self._schema.lease_serializer.unserialize(data)
 
     def add_lease(self, lease_info):
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             num_leases = self._read_num_leases(f)
             # Before we write the new lease record, make sure we can encode
             # the new lease count.
@@ -291,7 +309,7 @@ class ShareFile(object):
                 if allow_backdate or new_expire_time > lease.get_expiration_time():
                     # yes
                     lease = lease.renew(new_expire_time)
-                    with open(self.home, 'rb+') as f:
+                    with self._open('rb+') as f:
                         self._write_lease_record(f, i, lease)
                 return
         raise IndexError("unable to renew non-existent lease")
@@ -340,7 +358,7 @@ class ShareFile(object):
             # the same order as they were added, so that if we crash while
             # doing this, we won't lose any non-cancelled leases.
             leases = [l for l in leases if l] # remove the cancelled leases
-            with open(self.home, 'rb+') as f:
+            with self._open('rb+') as f:
                 for i, lease in enumerate(leases):
                     self._write_lease_record(f, i, lease)
                 self._write_num_leases(f, len(leases))
@@ -357,14 +375,35 @@ class BucketWriter(object):
     Keep track of the process of writing to a ShareFile.
     """
 
-    def __init__(self, ss, incominghome, finalhome, max_size, lease_info, clock):
+    def __init__(self, ss, incominghome, finalhome, max_size, lease_info, clock,
+                 io_pool=None, fd_cache=None, sync=None):
+        """
+        :param Optional[ShareIOPool] io_pool: If given, do share-file I/O for
+            ``write``, ``close`` and ``abort`` on this pool, in which case
+            they return ``Deferred``s.
+
+        :param Optional[FileHandleCache] fd_cache: If given, keep the share
+            file open in here between writes.
+
+        :param sync: If given, ``close`` makes the finished share durable by
+            calling this like ``run_durably`` with everything but the first
+            two arguments, and may return a ``Deferred``.
+        """
         self.ss = ss
         self.incominghome = incominghome
         self.finalhome = finalhome
         self._max_size = max_size # don't allow the client to write more than this
         self.closed = False
+        # True while a close is running on the I/O pool:
+        self._closing = False
+        # True once the finished share has been moved to finalhome:
+        self.placed = False
         self.throw_out_all_data = False
-        self._sharefile = ShareFile(incominghome, create=True, max_size=max_size)
+        self._io_pool = io_pool
+        self._fd_cache = fd_cache
+        self._sync = sync
+        self._sharefile = ShareFile(incominghome, create=True, max_size=max_size,
+                                    fd_cache=fd_cache)
         # also, add our lease to the file now, so that other ones can be
         # added by simultaneous uploaders
         self._sharefile.add_lease(lease_info)
@@ -396,6 +435,20 @@ class BucketWriter(object):
         if self.throw_out_all_data:
             return False
 
+        def written(complete):
+            self.ss.add_latency("write", self._clock.seconds() - start)
+            self.ss.count("write")
+            return complete
+
+        return after_io(
+            run_io(self._io_pool, self.incominghome, self._write, offset, data),
+            written,
+        )
+
+    def _write(self, offset, data):  # type: (int, bytes) -> bool
+        """
+        Do the share-file work of ``write``.
+        """
         # Make sure we're not conflicting with existing data:
         end = offset + len(data)
         for (chunk_start, chunk_stop, _) in self._already_written.ranges(offset, end):
@@ -409,8 +462,6 @@ class BucketWriter(object):
         self._sharefile.write_share_data(offset, data)
 
         self._already_written.set(True, offset, end)
-        self.ss.add_latency("write", self._clock.seconds() - start)
-        self.ss.count("write")
 
         # Return whether the whole thing has been written. See
         # https://github.com/mlenzen/collections-extended/issues/169 and
@@ -423,8 +474,65 @@ class BucketWriter(object):
         self._timeout.cancel()
         start = self._clock.seconds()
 
+        def closed(filelen):
+            self._sharefile = None
+            self.closed = True
+            self._closing = False
+            self.ss.bucket_writer_closed(self, filelen)
+            self.ss.add_latency("close", self._clock.seconds() - start)
+            self.ss.count("close")
+
+        if self._io_pool is not None or self._sync is not None:
+            self._closing = True
+        if self._sync is None:
+            result = run_io(self._io_pool, self.incominghome, self._finish)
+        else:
+            # The data has to be on disk before the rename makes the share
+            # visible, and the rename has to be on disk before we say we're
+            # done.
+            result = self._sync(self.incominghome, [self.incominghome],
+                                self._finish,
+                                bucket_directories(
+                                    os.path.dirname(self.finalhome)))
+        result = after_io(result, closed)
+        if isinstance(result, Deferred):
+            result.addErrback(self._close_failed)
+        return result
+
+    def _close_failed(self, f):
+        """
+        Give up on a share whose ``close`` failed on the I/O pool, so that
+        its space is released, and pass the failure on.
+        """
+        log.msg("storage: close of sharefile %s failed" % self.incominghome,
+                failure=f, facility="tahoe.storage", level=log.UNUSUAL)
+        if self.closed:
+            return f
+        self._closing = False
+        return after_io(self.abort(), lambda ignored: f)
+
+    def _finish(self):
+        """
+        Do the share-file work of ``close``: put the share in place, and
+        let the server read the leases it needs from it.
+
+        :return int: The size of the share file.
+        """
+        filelen = self._move_into_place()
+        self.ss.index_share_leases(self.finalhome)
+        return filelen
+
+    def _move_into_place(self):
+        """
+        Move the finished share from incoming/ to its final home.
+
+        :return int: The size of the share file.
+        """
         fileutil.make_dirs(os.path.dirname(self.finalhome))
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.incominghome)
         fileutil.rename(self.incominghome, self.finalhome)
+        self.placed = True
         try:
             # self.incominghome is like storage/shares/incoming/ab/abcde/4 .
             # We try to delete the parent (.../ab/abcde) to avoid leaving
@@ -449,13 +557,7 @@ class BucketWriter(object):
             # exceptions, those are normal consequences of the
             # above-mentioned conditions.
             pass
-        self._sharefile = None
-        self.closed = True
-
-        filelen = os.stat(self.finalhome)[stat.ST_SIZE]
-        self.ss.bucket_writer_closed(self, filelen)
-        self.ss.add_latency("close", self._clock.seconds() - start)
-        self.ss.count("close")
+        return os.stat(self.finalhome)[stat.ST_SIZE]
 
     def disconnected(self):
         if not self.closed:
@@ -473,27 +575,47 @@ class BucketWriter(object):
         log.msg("storage: aborting sharefile %s" % self.incominghome,
                 facility="tahoe.storage", level=log.UNUSUAL)
         self.ss.count("abort")
-        if self.closed:
+        if self.closed or self._closing:
+            # A close that is already in progress on the I/O pool wins.
             return
 
-        os.remove(self.incominghome)
-        # if we were the last share to be moved, remove the incoming/
-        # directory that was our parent
-        parentdir = os.path.split(self.incominghome)[0]
-        if not os.listdir(parentdir):
-            os.rmdir(parentdir)
-        self._sharefile = None
-
-        # We are now considered closed for further writing. We must tell
-        # the storage server about this so that it stops expecting us to
-        # use the space it allocated for us earlier.
+        # We are now considered closed for further writing.
         self.closed = True
-        self.ss.bucket_writer_closed(self, 0)
 
         # Cancel timeout if it wasn't already cancelled.
         if self._timeout.active():
             self._timeout.cancel()
 
+        def removed(ignored):
+            self._sharefile = None
+            # We must tell the storage server about this so that it stops
+            # expecting us to use the space it allocated for us earlier.
+            self.ss.bucket_writer_closed(self, 0)
+
+        # Writes that are still queued on the I/O pool for this share go
+        # first, so that they don't recreate the file we remove.
+        return after_io(
+            run_io(self._io_pool, self.incominghome, self._remove_incoming),
+            removed,
+        )
+
+    def _remove_incoming(self):
+        """
+        Do the share-file work of ``abort``.
+        """
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.incominghome)
+        try:
+            os.remove(self.incominghome)
+        except FileNotFoundError:
+            # A failed close may have got as far as moving it away.
+            pass
+        # if we were the last share to be moved, remove the incoming/
+        # directory that was our parent
+        parentdir = os.path.split(self.incominghome)[0]
+        if os.path.isdir(parentdir) and not os.listdir(parentdir):
+            os.rmdir(parentdir)
+
 
 @implementer(RIBucketWriter)
 class FoolscapBucketWriter(Referenceable):  # type: ignore # warner/foolscap#78
@@ -504,7 +626,11 @@ class FoolscapBucketWriter(Referenceable):  # type: ignore # warner/foolscap#78
         self._bucket_writer = bucket_writer
 
     def remote_write(self, offset, data):
-        self._bucket_writer.write(offset, data)
+        # Wait for the write to finish, but don't send back its result.
+        return after_io(
+            self._bucket_writer.write(offset, data),
+            lambda complete: None,
+        )
 
     def remote_close(self):
         return self._bucket_writer.close()
@@ -518,11 +644,20 @@ class BucketReader(object):
     Manage the process for reading from a ``ShareFile``.
     """
 
-    def __init__(self, ss, sharefname, storage_index=None, shnum=None):
+    def __init__(self, ss, sharefname, storage_index=None, shnum=None,
+                 io_pool=None, fd_cache=None):
+        """
+        :param Optional[ShareIOPool] io_pool: If given, ``read`` happens on
+            this pool and returns a ``Deferred``.
+
+        :param Optional[FileHandleCache] fd_cache: If given, keep the share
+            file open in here between reads.
+        """
         self.ss = ss
-        self._share_file = ShareFile(sharefname)
+        self._share_file = ShareFile(sharefname, fd_cache=fd_cache)
         self.storage_index = storage_index
         self.shnum = shnum
+        self._io_pool = io_pool
 
     def __repr__(self):
         return "<%s %s %s>" % (self.__class__.__name__,
@@ -533,10 +668,19 @@ class BucketReader(object):
 
     def read(self, offset, length):
         start = time.time()
-        data = self._share_file.read_share_data(offset, length)
-        self.ss.add_latency("read", time.time() - start)
-        self.ss.count("read")
-        return data
+
+        def read(data):
+            self.ss.add_latency("read", time.time() - start)
+            self.ss.count("read")
+            return data
+
+        # Immutable shares don't change once they're in place, so reads don't
+        # need to be ordered with respect to anything else.
+        return after_io(
+            run_io(self._io_pool, None, self._share_file.read_share_data,
+                   offset, length),
+            read,
+        )
 
     def advise_corrupt_share(self, reason):
         return self.ss.advise_corrupt_share(b"immutable",
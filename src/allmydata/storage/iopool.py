@@ -0,0 +1,169 @@
+"""
+Run blocking share-file I/O off the reactor thread.
+
+By default the storage server reads and writes share files directly in the
+reactor thread.  That is fine for fast disks, but a single slow seek on a
+spinning disk then stalls every other client.  ``ShareIOPool`` runs that I/O
+on a dedicated, bounded thread pool instead, keeping operations on the same
+key (usually a storage index) in submission order so that e.g. mutable
+test-and-set semantics are preserved.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Hashable, Optional
+import time
+
+from twisted.application import service
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+def run_io(pool: Optional[ShareIOPool], key: Hashable, f: Callable, *args, **kwargs) -> Any:
+    """
+    Call ``f(*args, **kwargs)`` on ``pool``, or right away if there is no pool.
+
+    :return: The result of ``f`` if ``pool`` is ``None``, otherwise a
+        ``Deferred`` that fires with it.
+    """
+    if pool is None:
+        return f(*args, **kwargs)
+    return pool.run(key, f, *args, **kwargs)
+
+
+def after_io(result: Any, f: Callable, *args, **kwargs) -> Any:
+    """
+    Call ``f(value, *args, **kwargs)`` with the value of ``result``, a result
+    from ``run_io``.
+
+    :return: The result of ``f``, or a ``Deferred`` that fires with it if
+        ``result`` is a ``Deferred``.
+    """
+    if isinstance(result, Deferred):
+        return result.addCallback(f, *args, **kwargs)
+    return f(result, *args, **kwargs)
+
+
+class ShareIOPool(service.Service):
+    """
+    A bounded thread pool for share-file I/O.
+
+    Calls submitted with the same (non-``None``) key run one at a time, in
+    the order they were submitted.  Calls with different keys, or with a key
+    of ``None``, may run concurrently.
+
+    :ivar int queue_depth: Calls that were submitted but have not finished,
+        whether they are running or still waiting for a thread.
+    :ivar int max_queue_depth: The largest value ``queue_depth`` has had.
+
+    Stopping the service waits for the calls already submitted to finish.
+    Calls submitted after that run right away in the calling thread, as
+    ``run_io`` would run them without a pool.
+    """
+    name = "share-io"
+
+    def __init__(self, threads: int, on_wait: Optional[Callable[[float], None]] = None,
+                 reactor=reactor):
+        """
+        :param threads: The maximum number of threads to run I/O on.
+
+        :param on_wait: If given, called in the reactor thread with the
+            number of seconds each call waited in the queue before it started.
+        """
+        assert threads > 0, threads
+        self._reactor = reactor
+        self._pool = ThreadPool(minthreads=0, maxthreads=threads,
+                                name="tahoe-storage-io")
+        self._on_wait = on_wait
+        # key -> Deferred that fires when the most recently submitted call for
+        # that key has finished.
+        self._tails: Dict[Hashable, Deferred] = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        # Deferreds to fire when queue_depth next drops to 0.
+        self._idle_waiters: list[Deferred] = []
+        self._stopped = False
+
+    def startService(self):
+        service.Service.startService(self)
+        self._pool.start()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        d = self._wait_until_idle()
+        def stop(ignored):
+            self._stopped = True
+            # ThreadPool.stop joins the threads, which would block the reactor.
+            return deferToThreadPool(self._reactor,
+                                     self._reactor.getThreadPool(),
+                                     self._pool.stop)
+        d.addCallback(stop)
+        return d
+
+    def _wait_until_idle(self) -> Deferred:
+        if self.queue_depth == 0:
+            return succeed(None)
+        d = Deferred()
+        self._idle_waiters.append(d)
+        return d
+
+    def run(self, key: Hashable, f: Callable, *args, **kwargs) -> Deferred:
+        """
+        Call ``f(*args, **kwargs)`` in the pool, after any earlier calls
+        submitted with the same key have finished.
+
+        :return: A ``Deferred`` that fires with the result of ``f``.
+        """
+        if self._stopped:
+            return maybeDeferred(f, *args, **kwargs)
+        submitted = time.time()
+        started = []  # type: list[float]
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        result = Deferred()
+        finished = Deferred()
+        previous = None
+        if key is not None:
+            previous = self._tails.get(key)
+            self._tails[key] = finished
+
+        def call_in_thread():
+            # Runs in a pool thread; this only hands the start time back to
+            # the reactor thread, which does all the bookkeeping.
+            started.append(time.time())
+            return f(*args, **kwargs)
+
+        def done(value):
+            self.queue_depth -= 1
+            if self._on_wait is not None and started:
+                self._on_wait(started[0] - submitted)
+            if key is not None and self._tails.get(key) is finished:
+                del self._tails[key]
+            finished.callback(None)
+            if self.queue_depth == 0:
+                waiters, self._idle_waiters = self._idle_waiters, []
+                for waiter in waiters:
+                    waiter.callback(None)
+            return value
+
+        def start(ignored=None):
+            d = deferToThreadPool(self._reactor, self._pool, call_in_thread)
+            d.addBoth(done)
+            d.chainDeferred(result)
+
+        if previous is None:
+            start()
+        else:
+            previous.addCallback(start)
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: Queue statistics suitable for ``IStatsProducer.get_stats``.
+        """
+        return {
+            "storage_server.io.queue_depth": self.queue_depth,
+            "storage_server.io.max_queue_depth": self.max_queue_depth,
+        }
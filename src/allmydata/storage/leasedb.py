@@ -0,0 +1,179 @@
+"""
+An index of the leases held in share files.
+
+Share files are the authority on which leases a share has: the lease
+records in them are what clients renew and what the lease checker cancels.
+Finding the expired ones that way means opening every share on the server,
+though, so a server can also keep a SQLite database that records the
+expiration time of every lease. ``LeaseDB`` is that database. The storage
+server updates it whenever it adds or renews a lease, and the lease checker
+makes it agree with the share files it examines (which also rebuilds it, one
+cycle after it is first enabled or if it gets lost). Expiring leases then
+starts with a range query on expiration time.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Iterable, Optional, Union
+
+from allmydata.storage.lease import LeaseInfo, HashedLeaseInfo
+from allmydata.storage.lease_schema import HashedLeaseSerializer
+from allmydata.util.dbutil import get_db
+
+SCHEMA_v1 = """
+CREATE TABLE version
+(
+ version INTEGER  -- contains one row, set to 1
+);
+
+CREATE TABLE leases
+(
+ storage_index VARCHAR(26) NOT NULL,   -- base32
+ shnum INTEGER NOT NULL,
+ sharetype VARCHAR(9) NOT NULL,        -- 'mutable' or 'immutable'
+ renew_secret_hash BLOB NOT NULL,
+ expiration_time INTEGER NOT NULL,
+ PRIMARY KEY (storage_index, shnum, renew_secret_hash)
+);
+
+CREATE INDEX leases_by_expiration_time ON leases (expiration_time);
+"""
+
+
+def _lease_key(lease_info: Union[LeaseInfo, HashedLeaseInfo]) -> bytes:
+    """
+    Identify a lease by the hash of its renew secret, which is what v2 share
+    files store, so that leases read from any share file and leases given to
+    the storage server by clients get the same key.
+    """
+    if isinstance(lease_info, HashedLeaseInfo):
+        return lease_info._lease_info.renew_secret
+    return HashedLeaseSerializer._hash_secret(lease_info.renew_secret)
+
+
+def _share_id(sharefile: str) -> tuple[str, int]:
+    """
+    :param sharefile: The path of a share, like
+        ``storage/shares/$START/$STORAGEINDEX/$SHARENUM``.
+
+    :return: The base32 storage index and share number of that share.
+    """
+    (bucketdir, shnum) = os.path.split(sharefile)
+    return (os.path.basename(bucketdir), int(shnum))
+
+
+class LeaseDB(object):
+    """
+    I am the lease index of one storage server.
+
+    Shares are named by the path of their share file. I can be used from
+    the storage server's I/O threads as well as from the reactor thread.
+    """
+
+    def __init__(self, dbfile: str):
+        (self._sqlite, self._db) = get_db(
+            dbfile, create_version=(SCHEMA_v1, 1), dbname="leasedb",
+            check_same_thread=False,
+        )
+        # Everything in here can be rebuilt from the share files, so trade
+        # durability of the last few updates for cheap commits.
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add_or_renew_lease(self, sharefile: str, sharetype: str,
+                           lease_info: LeaseInfo):
+        """
+        Record that the share has ``lease_info``. If it already had a lease
+        with the same renew secret, I keep whichever expiration time is
+        later, like ``renew_lease`` on the share file does.
+        """
+        (si_s, shnum) = _share_id(sharefile)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO leases VALUES (?,?,?,?,?)"
+                " ON CONFLICT (storage_index, shnum, renew_secret_hash)"
+                " DO UPDATE SET expiration_time ="
+                "  MAX(expiration_time, excluded.expiration_time)",
+                (si_s, shnum, sharetype, _lease_key(lease_info),
+                 int(lease_info.get_expiration_time())))
+            self._db.commit()
+
+    def set_leases(self, sharefile: str, sharetype: str,
+                   leases: Iterable[Union[LeaseInfo, HashedLeaseInfo]]):
+        """
+        Replace everything I know about the share's leases with ``leases``,
+        normally what was just read from the share file.
+        """
+        (si_s, shnum) = _share_id(sharefile)
+        rows = [(si_s, shnum, sharetype, _lease_key(li),
+                 int(li.get_expiration_time()))
+                for li in leases]
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM leases WHERE storage_index=? AND shnum=?",
+                (si_s, shnum))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO leases VALUES (?,?,?,?,?)", rows)
+            self._db.commit()
+
+    def remove_share(self, sharefile: str):
+        """
+        Forget the leases of a share that has been deleted.
+        """
+        self.set_leases(sharefile, "", [])
+
+    def get_leases(self, sharefile: str) -> list[int]:
+        """
+        :return: The expiration times of the share's leases, earliest first.
+        """
+        (si_s, shnum) = _share_id(sharefile)
+        with self._lock:
+            c = self._db.execute(
+                "SELECT expiration_time FROM leases"
+                " WHERE storage_index=? AND shnum=?"
+                " ORDER BY expiration_time",
+                (si_s, shnum))
+            return [row[0] for row in c.fetchall()]
+
+    def get_expiration_candidates(self, cutoff: float,
+                                  sharetypes: Iterable[str],
+                                  after: Optional[tuple[str, int]] = None,
+                                  limit: Optional[int] = None,
+                                  ) -> list[tuple[str, int]]:
+        """
+        :param cutoff: Find leases set to expire before this time.
+
+        :param sharetypes: Only look at shares of these types.
+
+        :param after: If given, only find shares that sort after this
+            (storage index, share number).
+
+        :param limit: If given, find at most this many shares.
+
+        :return: The base32 storage index and share number of each share
+            that has such a lease, in order.
+        """
+        sharetypes = list(sharetypes)
+        if not sharetypes:
+            return []
+        query = ("SELECT DISTINCT storage_index, shnum FROM leases"
+                 " WHERE expiration_time < ? AND sharetype IN (%s)"
+                 % ",".join("?" * len(sharetypes)))
+        args = [cutoff] + sharetypes
+        if after is not None:
+            query += " AND (storage_index > ? OR (storage_index = ? AND shnum > ?))"
+            args += [after[0], after[0], after[1]]
+        query += " ORDER BY storage_index, shnum"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            c = self._db.execute(query, args)
+            return [(si_s, shnum) for (si_s, shnum) in c.fetchall()]
@@ -84,11 +84,17 @@ class MutableShareFile(object):
         """
         return schema_from_header(header) is not None
 
-    def __init__(self, filename, parent=None, schema=NEWEST_SCHEMA_VERSION):
+    def __init__(self, filename, parent=None, schema=NEWEST_SCHEMA_VERSION,
+                 fd_cache=None):
+        """
+        :param Optional[FileHandleCache] fd_cache: If given, get file handles
+            from here instead of opening the file for every operation.
+        """
         self.home = filename
+        self._fd_cache = fd_cache
         if os.path.exists(self.home):
             # we don't cache anything, just check the magic
-            with open(self.home, 'rb') as f:
+            with self._open('rb') as f:
                 header = f.read(self.HEADER_SIZE)
             self._schema = schema_from_header(header)
             if self._schema is None:
@@ -102,10 +108,19 @@ class MutableShareFile(object):
 
     def create(self, my_nodeid, write_enabler):
         assert not os.path.exists(self.home)
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.home)
         with open(self.home, 'wb') as f:
             f.write(self._schema.header(my_nodeid, write_enabler))
 
+    def _open(self, mode):
+        if self._fd_cache is None:
+            return open(self.home, mode)
+        return self._fd_cache.open(self.home, mode)
+
     def unlink(self):
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(self.home)
         os.unlink(self.home)
 
     def _read_data_length(self, f):
@@ -275,7 +290,7 @@ class MutableShareFile(object):
 
     def get_leases(self):
         """Yields a LeaseInfo instance for all leases."""
-        with open(self.home, 'rb') as f:
+        with self._open('rb') as f:
             for i, lease in self._enumerate_leases(f):
                 yield lease
 
@@ -302,7 +317,7 @@ class MutableShareFile(object):
         :return: ``None``
         """
         precondition(lease_info.owner_num != 0) # 0 means "no lease here"
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             num_lease_slots = self._get_num_lease_slots(f)
             empty_slot = self._get_first_empty_lease_slot(f)
             if empty_slot is not None:
@@ -325,7 +340,7 @@ class MutableShareFile(object):
             secret.
         """
         accepting_nodeids = set()
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             for (leasenum,lease) in self._enumerate_leases(f):
                 if lease.is_renew_secret(renew_secret):
                     # yup. See if we need to update the owner time.
@@ -368,7 +383,7 @@ class MutableShareFile(object):
                                 cancel_secret=b"\x00"*32,
                                 expiration_time=0,
                                 nodeid=b"\x00"*20)
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             for (leasenum,lease) in self._enumerate_leases(f):
                 accepting_nodeids.add(lease.nodeid)
                 if lease.is_cancel_secret(cancel_secret):
@@ -407,7 +422,7 @@ class MutableShareFile(object):
 
     def readv(self, readv):
         datav = []
-        with open(self.home, 'rb') as f:
+        with self._open('rb') as f:
             for (offset, length) in readv:
                 datav.append(self._read_share_data(f, offset, length))
         return datav
@@ -419,7 +434,7 @@ class MutableShareFile(object):
 #        return data_length
 
     def check_write_enabler(self, write_enabler, si_s):
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             (real_write_enabler, write_enabler_nodeid) = \
                                  self._read_write_enabler_and_nodeid(f)
         # avoid a timing attack
@@ -438,7 +453,7 @@ class MutableShareFile(object):
 
     def check_testv(self, testv):
         test_good = True
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             for (offset, length, operator, specimen) in testv:
                 data = self._read_share_data(f, offset, length)
                 if not testv_compare(data, operator, specimen):
@@ -447,7 +462,7 @@ class MutableShareFile(object):
         return test_good
 
     def writev(self, datav, new_length):
-        with open(self.home, 'rb+') as f:
+        with self._open('rb+') as f:
             for (offset, data) in datav:
                 self._write_share_data(f, offset, data)
             if new_length is not None:
@@ -474,8 +489,9 @@ class EmptyShare(object):
                 break
         return test_good
 
-def create_mutable_sharefile(filename, my_nodeid, write_enabler, parent):
-    ms = MutableShareFile(filename, parent)
+def create_mutable_sharefile(filename, my_nodeid, write_enabler, parent,
+                             fd_cache=None):
+    ms = MutableShareFile(filename, parent, fd_cache=fd_cache)
     ms.create(my_nodeid, write_enabler)
     del ms
-    return MutableShareFile(filename, parent)
+    return MutableShareFile(filename, parent, fd_cache=fd_cache)
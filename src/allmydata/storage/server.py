@@ -6,15 +6,18 @@ from future.utils import bytes_to_native_str
 from typing import Dict, Tuple, Iterable
 
 import os, re
+from functools import partial
 
 from foolscap.api import Referenceable
 from foolscap.ipb import IRemoteReference
 from twisted.application import service
 from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
 
 from zope.interface import implementer
 from allmydata.interfaces import RIStorageServer, IStatsProducer
 from allmydata.util import fileutil, idlib, log, time_format
+from allmydata.util.histogram import WindowedHistogram
 import allmydata # for __full_version__
 
 from allmydata.storage.common import si_b2a, si_a2b, storage_index_to_dir
@@ -28,7 +31,15 @@ from allmydata.storage.immutable import (
     FoolscapBucketReader,
 )
 from allmydata.storage.crawler import BucketCountingCrawler
+from allmydata.storage.durability import (
+    DURABILITY_MODES, GroupCommitter, run_durably, bucket_directories,
+)
 from allmydata.storage.expirer import LeaseCheckingCrawler
+from allmydata.storage.fdcache import FileHandleCache
+from allmydata.storage.iopool import ShareIOPool, run_io, after_io
+from allmydata.storage.leasedb import LeaseDB
+from allmydata.storage.shareindex import ShareIndex, ShareIndexCrawler
+from allmydata.storage.space import SpaceAccountant
 
 # storage/
 # storage/shares/incoming
@@ -66,7 +77,36 @@ class StorageServer(service.MultiService):
                  expiration_override_lease_duration=None,
                  expiration_cutoff_date=None,
                  expiration_sharetypes=("mutable", "immutable"),
-                 clock=reactor):
+                 clock=reactor,
+                 io_threads=0,
+                 lease_index=False,
+                 share_index=False,
+                 open_file_cache=0,
+                 durability="none"):
+        """
+        :param int io_threads: If non-zero, do share-file I/O on a pool of
+            this many threads instead of in the reactor thread.  The methods
+            that touch share files then return ``Deferred``s.
+
+        :param bool lease_index: If ``True``, keep an index of the leases in
+            the share files in ``storage/leases.sqlite``, and let the lease
+            checker use it to find expired leases.
+
+        :param bool share_index: If ``True``, keep track of which shares
+            exist in memory, so that questions about storage indexes we have
+            no shares for can be answered without looking at the disk.
+
+        :param int open_file_cache: If non-zero, keep up to this many share
+            files open between operations on them.
+
+        :param str durability: One of ``DURABILITY_MODES``: whether to flush
+            finished shares to disk before reporting success, and if so
+            whether to do it for each share (``"close"``) or in batches
+            (``"group"``).  With ``"group"``, ``BucketWriter.close`` and
+            ``slot_testv_and_readv_and_writev`` return ``Deferred``s even
+            when ``io_threads`` is zero; ``"close"`` flushes in the calling
+            thread and returns plain values, just like ``"none"``.
+        """
         service.MultiService.__init__(self)
         assert isinstance(nodeid, bytes)
         assert len(nodeid) == 20
@@ -80,6 +120,7 @@ class StorageServer(service.MultiService):
                                                     "corruption-advisories")
         fileutil.make_dirs(self.corruption_advisory_dir)
         self.reserved_space = int(reserved_space)
+        self._space = SpaceAccountant(sharedir, self.reserved_space, clock)
         self.no_storage = discard_storage
         self.readonly_storage = readonly_storage
         self.stats_provider = stats_provider
@@ -91,23 +132,43 @@ class StorageServer(service.MultiService):
         log.msg("StorageServer created", facility="tahoe.storage")
 
         if reserved_space:
-            if self.get_available_space() is None:
+            if fileutil.get_available_space(
+                    sharedir, self.reserved_space) is None:
                 log.msg("warning: [storage]reserved_space= is set, but this platform does not support an API to get disk statistics (statvfs(2) or GetDiskFreeSpaceEx), so this reservation cannot be honored",
                         umin="0wZ27w", level=log.UNUSUAL)
 
-        self.latencies = {"allocate": [], # immutable
-                          "write": [],
-                          "close": [],
-                          "read": [],
-                          "get": [],
-                          "writev": [], # mutable
-                          "readv": [],
-                          "add-lease": [], # both
-                          "renew": [],
-                          "cancel": [],
-                          }
+        self.latencies = {
+            category: WindowedHistogram(clock.seconds)
+            for category in ["allocate", # immutable
+                             "write",
+                             "close",
+                             "read",
+                             "get",
+                             "writev", # mutable
+                             "readv",
+                             "add-lease", # both
+                             "renew",
+                             "cancel",
+                             "io-wait", # time queued for the I/O pool
+                             "commit", # time to flush a group commit
+                             ]
+        }
         self.add_bucket_counter()
 
+        self._fd_cache = None
+        if open_file_cache:
+            self._fd_cache = FileHandleCache(open_file_cache)
+
+        self.share_index = None
+        if share_index:
+            self.share_index = ShareIndex()
+            ShareIndexCrawler(self, self.share_index).setServiceParent(self)
+
+        self.lease_db = None
+        if lease_index:
+            self.lease_db = LeaseDB(os.path.join(self.storedir,
+                                                 "leases.sqlite"))
+
         statefile = os.path.join(self.storedir, "lease_checker.state")
         historyfile = os.path.join(self.storedir, "lease_checker.history")
         klass = self.LeaseCheckerClass
@@ -119,6 +180,27 @@ class StorageServer(service.MultiService):
         self.lease_checker.setServiceParent(self)
         self._clock = clock
 
+        self._io_pool = None
+        if io_threads:
+            self._io_pool = ShareIOPool(
+                io_threads,
+                on_wait=lambda seconds: self.add_latency("io-wait", seconds),
+            )
+            self._io_pool.setServiceParent(self)
+
+        if durability not in DURABILITY_MODES:
+            raise ValueError("durability '%s' must be 'none', 'close' or"
+                             " 'group'" % (durability,))
+        self._committer = None
+        if durability == "group":
+            self._committer = GroupCommitter(
+                on_commit=lambda seconds: self.add_latency("commit", seconds),
+            )
+            self._committer.setServiceParent(self)
+        self._sync = None
+        if durability != "none":
+            self._sync = partial(run_durably, self._io_pool, self._committer)
+
         # Map in-progress filesystem path -> BucketWriter:
         self._bucket_writers = {}  # type: Dict[str,BucketWriter]
 
@@ -129,7 +211,10 @@ class StorageServer(service.MultiService):
         # Cancel any in-progress uploads:
         for bw in list(self._bucket_writers.values()):
             bw.disconnected()
-        return service.MultiService.stopService(self)
+        d = service.MultiService.stopService(self)
+        if self._fd_cache is not None:
+            self._fd_cache.clear()
+        return d
 
     def __repr__(self):
         return "<StorageServer %s>" % (idlib.shortnodeid_b2a(self.my_nodeid),)
@@ -137,8 +222,38 @@ class StorageServer(service.MultiService):
     def have_shares(self):
         # quick test to decide if we need to commit to an implicit
         # permutation-seed or if we should use a new one
+        if self.share_index is not None and self.share_index.complete:
+            return len(self.share_index) > 0
         return bool(set(os.listdir(self.sharedir)) - set(["incoming"]))
 
+    def _may_have_shares(self, storage_index):
+        """
+        :return bool: ``False`` if we certainly have no shares for this
+            storage index, ``True`` if we might.
+        """
+        return self.share_index is None or self.share_index.may_have(storage_index)
+
+    def _share_added(self, sharefile):
+        if self.share_index is not None:
+            (bucketdir, shnum) = os.path.split(sharefile)
+            storage_index = si_a2b(os.path.basename(bucketdir).encode("ascii"))
+            self.share_index.add(storage_index, int(shnum))
+
+    def forget_share(self, sharefile):
+        """
+        Stop keeping track of a share that has been deleted.
+
+        :param str sharefile: The path the share file had.
+        """
+        if self._fd_cache is not None:
+            self._fd_cache.invalidate(sharefile)
+        if self.share_index is not None:
+            (bucketdir, shnum) = os.path.split(sharefile)
+            storage_index = si_a2b(os.path.basename(bucketdir).encode("ascii"))
+            self.share_index.remove(storage_index, int(shnum))
+        if self.lease_db is not None:
+            self.lease_db.remove_share(sharefile)
+
     def add_bucket_counter(self):
         statefile = os.path.join(self.storedir, "bucket_counter.state")
         self.bucket_counter = BucketCountingCrawler(self, statefile)
@@ -149,12 +264,9 @@ class StorageServer(service.MultiService):
             self.stats_provider.count("storage_server." + name, delta)
 
     def add_latency(self, category, latency):
-        a = self.latencies[category]
-        a.append(latency)
-        if len(a) > 1000:
-            self.latencies[category] = a[-1000:]
+        self.latencies[category].record(latency)
 
-    def get_latencies(self):
+    def get_latencies(self, window="5m"):
         """Return a dict, indexed by category, that contains a dict of
         latency numbers for each category. If there are sufficient samples
         for unambiguous interpretation, each dict will contain the
@@ -164,19 +276,22 @@ class StorageServer(service.MultiService):
         samples for a given percentile to be interpreted unambiguously
         that percentile will be reported as None. If no samples have been
         collected for the given category, then that category name will
-        not be present in the return value. """
+        not be present in the return value.
+
+        :param window: Only look at latencies recorded in this much recent
+            time: one of the keys of ``allmydata.util.histogram.WINDOWS``,
+            or ``None`` for all of them. """
         # note that Amazon's Dynamo paper says they use 99.9% percentile.
         output = {}
         for category in self.latencies:
-            if not self.latencies[category]:
+            histogram = self.latencies[category].snapshot(window)
+            if not histogram.count:
                 continue
             stats = {}
-            samples = self.latencies[category][:]
-            count = len(samples)
+            count = histogram.count
             stats["samplesize"] = count
-            samples.sort()
             if count > 1:
-                stats["mean"] = sum(samples) / count
+                stats["mean"] = histogram.sum / count
             else:
                 stats["mean"] = None
 
@@ -187,18 +302,45 @@ class StorageServer(service.MultiService):
 
             for percentile, percentilestring, minnumtoobserve in orderstatlist:
                 if count >= minnumtoobserve:
-                    stats[percentilestring] = samples[int(percentile*count)]
+                    stats[percentilestring] = histogram.quantile(percentile)
                 else:
                     stats[percentilestring] = None
 
             output[category] = stats
         return output
 
+    def get_histograms(self):
+        """
+        :return: A dict mapping names like
+            ``storage_server.latencies.read`` to a ``Histogram`` of all the
+            latencies (in seconds) recorded for each category.
+        """
+        return {
+            "storage_server.latencies.%s" % (category,): latencies.snapshot()
+            for (category, latencies) in self.latencies.items()
+        }
+
     def log(self, *args, **kwargs):
         if "facility" not in kwargs:
             kwargs["facility"] = "tahoe.storage"
+        if self._io_pool is not None and not isInIOThread():
+            # Share files log through us from I/O pool threads; log
+            # observers expect to be called in the reactor thread.
+            reactor.callFromThread(log.msg, *args, **kwargs)
+            return None
         return log.msg(*args, **kwargs)
 
+    def _run_io(self, key, f, *args, **kwargs):
+        """
+        Call ``f`` on the share I/O pool, if there is one.
+
+        :param key: Calls with equal keys run in order, one at a time.
+
+        :return: The result of ``f``, or a ``Deferred`` that fires with it if
+            there is an I/O pool.
+        """
+        return run_io(self._io_pool, key, f, *args, **kwargs)
+
     def _clean_incomplete(self):
         fileutil.rm_dir(self.incomingdir)
 
@@ -207,12 +349,18 @@ class StorageServer(service.MultiService):
         # contains numeric values.
         stats = { 'storage_server.allocated': self.allocated_size(), }
         stats['storage_server.reserved_space'] = self.reserved_space
+        if self._io_pool is not None:
+            stats.update(self._io_pool.get_stats())
+        if self._fd_cache is not None:
+            stats.update(self._fd_cache.get_stats())
+        if self._committer is not None:
+            stats.update(self._committer.get_stats())
         for category,ld in self.get_latencies().items():
             for name,v in ld.items():
                 stats['storage_server.latencies.%s.%s' % (category, name)] = v
 
         try:
-            disk = fileutil.get_disk_stats(self.sharedir, self.reserved_space)
+            disk = self._space.get_disk_stats()
             writeable = disk['avail'] > 0
 
             # spacetime predictors should use disk_avail / (d(disk_used)/dt)
@@ -244,13 +392,13 @@ class StorageServer(service.MultiService):
 
         if self.readonly_storage:
             return 0
-        return fileutil.get_available_space(self.sharedir, self.reserved_space)
+        return self._space.get_available_space()
 
     def allocated_size(self):
-        space = 0
-        for bw in self._bucket_writers.values():
-            space += bw.allocated_size()
-        return space
+        """
+        :return: The number of bytes promised to uploads in progress.
+        """
+        return self._space.allocated
 
     def get_version(self):
         remaining_space = self.get_available_space()
@@ -268,6 +416,7 @@ class StorageServer(service.MultiService):
                       b"delete-mutable-shares-with-zero-length-writev": True,
                       b"fills-holes-with-zero-bytes": True,
                       b"prevents-read-past-end-of-share-data": True,
+                      b"batched-mutable-readv": True,
                       },
                     b"application-version": allmydata.__full_version__.encode("utf-8"),
                     }
@@ -322,7 +471,7 @@ class StorageServer(service.MultiService):
         # leases for all of them: if they want us to hold shares for this
         # file, they'll want us to hold leases for this file.
         for (shnum, fn) in self.get_shares(storage_index):
-            alreadygot[shnum] = ShareFile(fn)
+            alreadygot[shnum] = ShareFile(fn, fd_cache=self._fd_cache)
         if renew_leases:
             self._add_or_renew_leases(alreadygot.values(), lease_info)
 
@@ -342,7 +491,10 @@ class StorageServer(service.MultiService):
                 # ok! we need to create the new share file.
                 bw = BucketWriter(self, incominghome, finalhome,
                                   max_space_per_bucket, lease_info,
-                                  clock=self._clock)
+                                  clock=self._clock,
+                                  io_pool=self._io_pool,
+                                  fd_cache=self._fd_cache,
+                                  sync=self._sync)
                 if self.no_storage:
                     # Really this should be done by having a separate class for
                     # this situation; see
@@ -350,6 +502,7 @@ class StorageServer(service.MultiService):
                     bw.throw_out_all_data = True
                 bucketwriters[shnum] = bw
                 self._bucket_writers[incominghome] = bw
+                self._space.allocate(max_space_per_bucket)
                 if limited:
                     remaining_space -= max_space_per_bucket
             else:
@@ -367,12 +520,13 @@ class StorageServer(service.MultiService):
             with open(filename, 'rb') as f:
                 header = f.read(32)
             if MutableShareFile.is_valid_header(header):
-                sf = MutableShareFile(filename, self)
+                sf = MutableShareFile(filename, self,
+                                      fd_cache=self._fd_cache)
                 # note: if the share has been migrated, the renew_lease()
                 # call will throw an exception, with information to help the
                 # client update the lease.
             elif ShareFile.is_valid_header(header):
-                sf = ShareFile(filename)
+                sf = ShareFile(filename, fd_cache=self._fd_cache)
             else:
                 continue # non-sharefile
             yield sf
@@ -384,29 +538,65 @@ class StorageServer(service.MultiService):
         lease_info = LeaseInfo(owner_num,
                                renew_secret, cancel_secret,
                                new_expire_time, self.my_nodeid)
-        self._add_or_renew_leases(
-            self._iter_share_files(storage_index),
-            lease_info,
+
+        def added(ignored):
+            self.add_latency("add-lease", self._clock.seconds() - start)
+            return None
+
+        return after_io(
+            self._run_io(
+                storage_index,
+                lambda: self._add_or_renew_leases(
+                    self._iter_share_files(storage_index),
+                    lease_info,
+                ),
+            ),
+            added,
         )
-        self.add_latency("add-lease", self._clock.seconds() - start)
-        return None
 
     def renew_lease(self, storage_index, renew_secret):
         start = self._clock.seconds()
         self.count("renew")
         new_expire_time = self._clock.seconds() + DEFAULT_RENEWAL_TIME
-        found_buckets = False
-        for sf in self._iter_share_files(storage_index):
-            found_buckets = True
-            sf.renew_lease(renew_secret, new_expire_time)
-        self.add_latency("renew", self._clock.seconds() - start)
-        if not found_buckets:
-            raise IndexError("no such lease to renew")
+
+        def renew():
+            found_buckets = False
+            for sf in self._iter_share_files(storage_index):
+                found_buckets = True
+                sf.renew_lease(renew_secret, new_expire_time)
+                self._index_lease(sf, LeaseInfo(
+                    renew_secret=renew_secret,
+                    expiration_time=new_expire_time,
+                ))
+            return found_buckets
+
+        def renewed(found_buckets):
+            self.add_latency("renew", self._clock.seconds() - start)
+            if not found_buckets:
+                raise IndexError("no such lease to renew")
+
+        return after_io(self._run_io(storage_index, renew), renewed)
+
+    def index_share_leases(self, sharefile):
+        """
+        Record the leases of a share that a ``BucketWriter`` has just put in
+        place, if there is a lease index.
+
+        This reads the share file, so ``BucketWriter`` calls it as part of
+        the I/O that closes the share, on the I/O pool if there is one.
+        """
+        if self.lease_db is not None:
+            sf = ShareFile(sharefile, fd_cache=self._fd_cache)
+            self.lease_db.set_leases(sharefile, sf.sharetype, sf.get_leases())
 
     def bucket_writer_closed(self, bw, consumed_size):
         if self.stats_provider:
             self.stats_provider.count('storage_server.bytes_added', consumed_size)
         del self._bucket_writers[bw.incominghome]
+        self._space.release(bw.allocated_size())
+        self._space.consumed(consumed_size)
+        if bw.placed:
+            self._share_added(bw.finalhome)
         for handler in self._call_on_bucket_writer_close:
             handler(bw)
 
@@ -422,6 +612,8 @@ class StorageServer(service.MultiService):
         shares for this storage_index. In each tuple, 'shnum' will always be
         the integer form of the last component of 'pathname'.
         """
+        if not self._may_have_shares(storage_index):
+            return
         storagedir = os.path.join(self.sharedir, storage_index_to_dir(storage_index))
         try:
             for f in os.listdir(storagedir):
@@ -440,12 +632,21 @@ class StorageServer(service.MultiService):
         self.count("get")
         si_s = si_b2a(storage_index)
         log.msg("storage: get_buckets %r" % si_s)
-        bucketreaders = {} # k: sharenum, v: BucketReader
-        for shnum, filename in self.get_shares(storage_index):
-            bucketreaders[shnum] = BucketReader(self, filename,
-                                                storage_index, shnum)
-        self.add_latency("get", self._clock.seconds() - start)
-        return bucketreaders
+
+        def open_buckets():
+            bucketreaders = {} # k: sharenum, v: BucketReader
+            for shnum, filename in self.get_shares(storage_index):
+                bucketreaders[shnum] = BucketReader(self, filename,
+                                                    storage_index, shnum,
+                                                    io_pool=self._io_pool,
+                                                    fd_cache=self._fd_cache)
+            return bucketreaders
+
+        def opened(bucketreaders):
+            self.add_latency("get", self._clock.seconds() - start)
+            return bucketreaders
+
+        return after_io(self._run_io(storage_index, open_buckets), opened)
 
     def get_leases(self, storage_index):
         """Provide an iterator that yields all of the leases attached to this
@@ -459,7 +660,7 @@ class StorageServer(service.MultiService):
         # from the first share
         try:
             shnum, filename = next(self.get_shares(storage_index))
-            sf = ShareFile(filename)
+            sf = ShareFile(filename, fd_cache=self._fd_cache)
             return sf.get_leases()
         except StopIteration:
             return iter([])
@@ -473,7 +674,7 @@ class StorageServer(service.MultiService):
         :return: An iterable of the leases attached to this slot.
         """
         for _, share_filename in self.get_shares(storage_index):
-            share = MutableShareFile(share_filename)
+            share = MutableShareFile(share_filename, fd_cache=self._fd_cache)
             return share.get_leases()
         return []
 
@@ -503,7 +704,7 @@ class StorageServer(service.MultiService):
                 except ValueError:
                     continue
                 filename = os.path.join(bucketdir, sharenum_s)
-                msf = MutableShareFile(filename, self)
+                msf = MutableShareFile(filename, self, fd_cache=self._fd_cache)
                 msf.check_write_enabler(write_enabler, si_s)
                 shares[sharenum] = msf
         return shares
@@ -580,6 +781,7 @@ class StorageServer(service.MultiService):
             if new_length == 0:
                 if sharenum in shares:
                     shares[sharenum].unlink()
+                    self.forget_share(shares[sharenum].home)
             else:
                 if sharenum not in shares:
                     # allocate a new share
@@ -587,6 +789,7 @@ class StorageServer(service.MultiService):
                                                       sharenum,
                                                       owner_num=0)
                     shares[sharenum] = share
+                    self._share_added(share.home)
                 shares[sharenum].writev(datav, new_length)
                 remaining_shares[sharenum] = shares[sharenum]
 
@@ -620,6 +823,16 @@ class StorageServer(service.MultiService):
         """
         for share in shares:
             share.add_or_renew_lease(self.get_available_space(), lease_info)
+            self._index_lease(share, lease_info)
+
+    def _index_lease(self, share, lease_info):
+        """
+        Tell the lease index, if there is one, that a lease was added to or
+        renewed on a share.
+        """
+        if self.lease_db is not None:
+            self.lease_db.add_or_renew_lease(share.home, share.sharetype,
+                                             lease_info)
 
     def slot_testv_and_readv_and_writev(  # type: ignore # warner/foolscap#78
             self,
@@ -645,17 +858,75 @@ class StorageServer(service.MultiService):
         self.count("writev")
         si_s = si_b2a(storage_index)
         log.msg("storage: slot_writev %r" % si_s)
+
+        def written(result):
+            self.add_latency("writev", self._clock.seconds() - start)
+            return result
+
+        def sync(result):
+            (result, changed) = result
+            if changed:
+                # Overwrites don't use more space, but this is the most
+                # these writes could have added.
+                self._space.consumed(sum(
+                    len(data)
+                    for (testv, datav, new_length)
+                    in test_and_write_vectors.values()
+                    for (offset, data) in datav
+                ))
+            if self._sync is None or not changed:
+                return result
+            (files, directories) = changed
+            return after_io(
+                self._sync(storage_index, files, None, directories),
+                lambda ignored: result,
+            )
+
+        return after_io(
+            after_io(
+                self._run_io(
+                    storage_index,
+                    self._slot_testv_and_readv_and_writev,
+                    storage_index,
+                    secrets,
+                    test_and_write_vectors,
+                    read_vector,
+                    renew_leases,
+                ),
+                sync,
+            ),
+            written,
+        )
+
+    def _slot_testv_and_readv_and_writev(
+            self,
+            storage_index,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+            renew_leases,
+    ):
+        """
+        Do the share-file work of ``slot_testv_and_readv_and_writev``.
+
+        :return: The result for the client, and ``None`` if no shares were
+            changed or else the share files that were written and the
+            directories that had shares added or removed.
+        """
+        si_s = si_b2a(storage_index)
         si_dir = storage_index_to_dir(storage_index)
         (write_enabler, renew_secret, cancel_secret) = secrets
         bucketdir = os.path.join(self.sharedir, si_dir)
 
         # If collection succeeds we know the write_enabler is good for all
         # existing shares.
-        shares = self._collect_mutable_shares_for_storage_index(
-            bucketdir,
-            write_enabler,
-            si_s,
-        )
+        shares = {}
+        if self._may_have_shares(storage_index):
+            shares = self._collect_mutable_shares_for_storage_index(
+                bucketdir,
+                write_enabler,
+                si_s,
+            )
 
         # Now evaluate test vectors.
         testv_is_good = self._evaluate_test_vectors(
@@ -669,8 +940,10 @@ class StorageServer(service.MultiService):
             shares,
         )
 
+        changed = None
         if testv_is_good:
             # now apply the write vectors
+            existing = set(shares)
             remaining_shares = self._evaluate_write_vectors(
                 bucketdir,
                 secrets,
@@ -680,10 +953,17 @@ class StorageServer(service.MultiService):
             if renew_leases:
                 lease_info = self._make_lease_info(renew_secret, cancel_secret)
                 self._add_or_renew_leases(remaining_shares.values(), lease_info)
-
-        # all done
-        self.add_latency("writev", self._clock.seconds() - start)
-        return (testv_is_good, read_data)
+            if test_and_write_vectors:
+                added_or_removed = (
+                    (existing ^ set(remaining_shares))
+                    & set(test_and_write_vectors)
+                )
+                changed = (
+                    [share.home for share in remaining_shares.values()],
+                    bucket_directories(bucketdir) if added_or_removed else [],
+                )
+
+        return ((testv_is_good, read_data), changed)
 
     def _allocate_slot_share(self, bucketdir, secrets, sharenum,
                              owner_num=0):
@@ -692,11 +972,18 @@ class StorageServer(service.MultiService):
         fileutil.make_dirs(bucketdir)
         filename = os.path.join(bucketdir, "%d" % sharenum)
         share = create_mutable_sharefile(filename, my_nodeid, write_enabler,
-                                         self)
+                                         self, fd_cache=self._fd_cache)
         return share
 
     def enumerate_mutable_shares(self, storage_index: bytes) -> set[int]:
         """Return all share numbers for the given mutable."""
+        return self._run_io(
+            storage_index, self._enumerate_mutable_shares, storage_index
+        )
+
+    def _enumerate_mutable_shares(self, storage_index: bytes) -> set[int]:
+        if not self._may_have_shares(storage_index):
+            return set()
         si_dir = storage_index_to_dir(storage_index)
         # shares exist if there is a file for them
         bucketdir = os.path.join(self.sharedir, si_dir)
@@ -719,23 +1006,35 @@ class StorageServer(service.MultiService):
         si_dir = storage_index_to_dir(storage_index)
         # shares exist if there is a file for them
         bucketdir = os.path.join(self.sharedir, si_dir)
-        if not os.path.isdir(bucketdir):
+
+        def read_shares():
+            if not self._may_have_shares(storage_index):
+                return None
+            if not os.path.isdir(bucketdir):
+                return None
+            datavs = {}
+            for sharenum_s in os.listdir(bucketdir):
+                try:
+                    sharenum = int(sharenum_s)
+                except ValueError:
+                    continue
+                if sharenum in shares or not shares:
+                    filename = os.path.join(bucketdir, sharenum_s)
+                    msf = MutableShareFile(filename, self,
+                                           fd_cache=self._fd_cache)
+                    datavs[sharenum] = msf.readv(readv)
+            return datavs
+
+        def read(datavs):
+            if datavs is None:
+                datavs = {}
+            else:
+                log.msg("returning shares %s" % (list(datavs.keys()),),
+                        facility="tahoe.storage", level=log.NOISY, parent=lp)
             self.add_latency("readv", self._clock.seconds() - start)
-            return {}
-        datavs = {}
-        for sharenum_s in os.listdir(bucketdir):
-            try:
-                sharenum = int(sharenum_s)
-            except ValueError:
-                continue
-            if sharenum in shares or not shares:
-                filename = os.path.join(bucketdir, sharenum_s)
-                msf = MutableShareFile(filename, self)
-                datavs[sharenum] = msf.readv(readv)
-        log.msg("returning shares %s" % (list(datavs.keys()),),
-                facility="tahoe.storage", level=log.NOISY, parent=lp)
-        self.add_latency("readv", self._clock.seconds() - start)
-        return datavs
+            return datavs
+
+        return after_io(self._run_io(storage_index, read_shares), read)
 
     def _share_exists(self, storage_index, shnum):
         """
@@ -852,10 +1151,13 @@ class FoolscapStorageServer(Referenceable):  # type: ignore # warner/foolscap#78
         return self._server.renew_lease(storage_index, renew_secret)
 
     def remote_get_buckets(self, storage_index):
-        return {
-            k: FoolscapBucketReader(bucket)
-            for (k, bucket) in self._server.get_buckets(storage_index).items()
-        }
+        return after_io(
+            self._server.get_buckets(storage_index),
+            lambda buckets: {
+                k: FoolscapBucketReader(bucket)
+                for (k, bucket) in buckets.items()
+            },
+        )
 
     def remote_slot_testv_and_readv_and_writev(self, storage_index,
                                                secrets,
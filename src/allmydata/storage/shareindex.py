@@ -0,0 +1,123 @@
+"""
+An in-memory index of which shares a storage server holds.
+
+Most of the storage indexes that clients ask a server about (every "do you
+have block" query during a download, for example) are ones it has no shares
+for. Without an index, each of those questions is a failed directory lookup
+on disk. ``ShareIndex`` remembers the share numbers present for every
+storage index, so once ``ShareIndexCrawler`` has looked at every bucket,
+those questions can be answered without touching the disk.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from allmydata.storage.common import si_a2b
+from allmydata.storage.crawler import ShareCrawler
+
+
+class ShareIndex(object):
+    """
+    I map storage indexes to the share numbers that a server holds for them.
+
+    Share numbers are kept as bits of an integer, which keeps each entry
+    small. I am updated from the storage server's I/O threads as well as
+    from the reactor thread.
+    """
+
+    def __init__(self):
+        self._buckets = {} # storage index -> bitmask of share numbers
+        self._lock = threading.Lock()
+        # Until the first crawl is finished, there may be shares I don't
+        # know about.
+        self.complete = False
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def may_have(self, storage_index: bytes) -> bool:
+        """
+        :return: ``False`` if the server definitely has no shares for
+            ``storage_index``.
+        """
+        return not self.complete or storage_index in self._buckets
+
+    def add(self, storage_index: bytes, shnum: int):
+        with self._lock:
+            self._buckets[storage_index] = (
+                self._buckets.get(storage_index, 0) | (1 << shnum))
+
+    def remove(self, storage_index: bytes, shnum: int):
+        with self._lock:
+            shares = self._buckets.get(storage_index, 0) & ~(1 << shnum)
+            if shares:
+                self._buckets[storage_index] = shares
+            else:
+                self._buckets.pop(storage_index, None)
+
+    def refresh(self, storage_index: bytes, bucketdir: str):
+        """
+        Replace what I know about ``storage_index`` with the shares that are
+        in ``bucketdir`` now.
+        """
+        shares = 0
+        with self._lock:
+            try:
+                names = os.listdir(bucketdir)
+            except EnvironmentError:
+                names = []
+            for name in names:
+                try:
+                    shares |= 1 << int(name)
+                except ValueError:
+                    continue # not a share
+            if shares:
+                self._buckets[storage_index] = shares
+            else:
+                self._buckets.pop(storage_index, None)
+
+
+class ShareIndexCrawler(ShareCrawler):
+    """
+    I fill in a ``ShareIndex`` by looking at every bucket on the server,
+    and mark it complete when I am done. After that I go around again once
+    a day, to pick up any shares that were added or removed behind the
+    storage server's back.
+
+    Since the index is only kept in memory, I always start from the
+    beginning when the node starts, and never save my state.
+    """
+
+    slow_start = 0
+    allowed_cpu_percentage = .50
+    minimum_cycle_time = 24*60*60
+
+    def __init__(self, server, share_index):
+        self.share_index = share_index
+        ShareCrawler.__init__(self, server,
+                              os.path.join(server.storedir,
+                                           "share_index.state"))
+
+    def load_state(self):
+        self.state = {"version": 1,
+                      "last-cycle-finished": None,
+                      "current-cycle": None,
+                      "current-cycle-start-time": time.time(),
+                      "last-complete-prefix": None,
+                      "last-complete-bucket": None,
+                      }
+        self.last_complete_prefix_index = -1
+
+    def save_state(self):
+        pass
+
+    def process_bucket(self, cycle, prefix, prefixdir, storage_index_b32):
+        storage_index = si_a2b(storage_index_b32.encode("ascii"))
+        self.share_index.refresh(storage_index,
+                                 os.path.join(prefixdir, storage_index_b32))
+
+    def finished_cycle(self, cycle):
+        self.share_index.complete = True
@@ -0,0 +1,126 @@
+"""
+Keep track of how much space a storage server has left.
+
+Asking the operating system how much space is free (``statvfs``) for every
+allocation and every lease adds up to thousands of system calls a second
+when a server is busy, and finding out how much space has been promised to
+uploads in progress used to mean adding up every open ``BucketWriter``.
+``SpaceAccountant`` keeps a running total of the space promised to uploads,
+and reuses the operating system's answer for a short while, taking away
+what the server has written since it was asked.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from allmydata.util import fileutil, log
+
+
+class SpaceAccountant(object):
+    """
+    I know how much space a storage server's shares may still use.
+
+    I only trust a cached answer from the operating system for
+    ``refresh_interval`` seconds, and only while it says there is more than
+    ``slack`` bytes to spare: other programs may be using the same disk,
+    and close to ``reserved_space`` it is worth asking every time.
+
+    I may be used from the storage server's I/O threads as well as the
+    reactor thread, so my state is only touched while holding a lock.
+
+    :ivar int allocated: Bytes promised to uploads that are in progress.
+    """
+
+    refresh_interval = 1.0
+    slack = 64 * 1024 * 1024
+
+    def __init__(self, sharedir: str, reserved_space: int, clock):
+        self._sharedir = sharedir
+        self._reserved_space = reserved_space
+        self._clock = clock
+        self.allocated = 0
+        self._checked = None # when we last asked, or None
+        self._stats = None # what we were told, if it worked
+        self._error = None # what went wrong, if it didn't
+        # Bytes written since we last asked:
+        self._consumed = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, size: int):
+        """
+        Promise ``size`` bytes to an upload.
+        """
+        with self._lock:
+            self.allocated += size
+
+    def release(self, size: int):
+        """
+        Take back a promise made with ``allocate``, because the upload
+        finished or was abandoned.
+        """
+        with self._lock:
+            self.allocated -= size
+
+    def consumed(self, size: int):
+        """
+        Note that ``size`` more bytes are on disk than when the operating
+        system was last asked.
+        """
+        with self._lock:
+            self._consumed += size
+
+    def _is_stale(self):
+        if self._checked is None:
+            return True
+        if self._clock.seconds() - self._checked >= self.refresh_interval:
+            return True
+        return (self._stats is not None and
+                self._stats["avail"] - self._consumed < self.slack)
+
+    def get_disk_stats(self) -> dict[str, int]:
+        """
+        Like ``fileutil.get_disk_stats`` for the share directory, but
+        possibly from a recent call, less what was written since.
+
+        :raise AttributeError: If the platform can't tell us.
+
+        :raise EnvironmentError: If asking failed.
+        """
+        with self._lock:
+            return self._get_disk_stats()
+
+    def _get_disk_stats(self):
+        if self._is_stale():
+            self._checked = self._clock.seconds()
+            self._consumed = 0
+            try:
+                self._stats = fileutil.get_disk_stats(self._sharedir,
+                                                      self._reserved_space)
+                self._error = None
+            except (AttributeError, EnvironmentError) as e:
+                self._stats = None
+                self._error = e
+        if self._error is not None:
+            raise self._error
+        stats = dict(self._stats)
+        for key in ["free_for_root", "free_for_nonroot", "avail"]:
+            if key in stats:
+                stats[key] = max(stats[key] - self._consumed, 0)
+        if "used" in stats:
+            stats["used"] += self._consumed
+        return stats
+
+    def get_available_space(self) -> Optional[int]:
+        """
+        Like ``fileutil.get_available_space`` for the share directory, but
+        possibly from a recent call, less what was written since.
+        """
+        try:
+            return self.get_disk_stats()["avail"]
+        except AttributeError:
+            return None
+        except EnvironmentError:
+            log.msg("OS call to get disk statistics failed")
+            return 0
@@ -32,7 +32,7 @@ Ported to Python 3.
 
 from six import ensure_text
 from typing import Union
-import re, time, hashlib
+import re, time, hashlib, heapq
 from os import urandom
 from configparser import NoSectionError
 
@@ -186,7 +186,12 @@ class StorageFarmBroker(service.MultiService):
         # storage servers that we've heard about. Each descriptor manages its
         # own Reconnector, and will give us a RemoteReference when we ask
         # them for it.
-        self.servers = BytesKeyDict()
+        self.servers = _ServerDict(self._servers_changed)
+        # The connected servers, as (is_unpreferred, permutation seed,
+        # server), and the preferred peers that was worked out with, or None
+        # if a server has come or gone or connected or disconnected since.
+        self._ring = None
+        self._ring_preferred_peers = None
         self._static_server_ids = set() # ignore announcements for these
         self.introducer_client = None
         self._threshold_listeners = [] # tuples of (threshold, Deferred)
@@ -304,9 +309,14 @@ class StorageFarmBroker(service.MultiService):
         ic.subscribe_to("storage", self._got_announcement)
 
     def _got_connection(self):
-        # this is called by NativeStorageServer when it is connected
+        # this is called by NativeStorageServer when it is connected, or
+        # loses its connection
+        self._servers_changed()
         self._check_connected_high_water_mark()
 
+    def _servers_changed(self):
+        self._ring = None
+
     def _check_connected_high_water_mark(self):
         current = len(self.get_connected_servers())
         if current > self._connected_high_water_mark:
@@ -418,17 +428,43 @@ class StorageFarmBroker(service.MultiService):
         for dsc in list(self.servers.values()):
             dsc.try_to_connect()
 
+    def _get_ring(self):
+        preferred_peers = self.preferred_peers
+        if self._ring is None or self._ring_preferred_peers is not preferred_peers:
+            self._ring = [
+                (s.get_longname() not in preferred_peers,
+                 s.get_permutation_seed(),
+                 s)
+                for s in self.servers.values()
+                if s.is_connected()
+            ]
+            self._ring_preferred_peers = preferred_peers
+        return self._ring
+
+    def _permuted_ring(self, peer_selection_index):
+        # (is_unpreferred, permuted hash, position in ring, server); the
+        # position keeps ties from comparing servers.
+        return [
+            (is_unpreferred, permute_server_hash(peer_selection_index, seed),
+             i, server)
+            for (i, (is_unpreferred, seed, server)) in enumerate(self._get_ring())
+        ]
+
     def get_servers_for_psi(self, peer_selection_index):
         # return a list of server objects (IServers)
         assert self.permute_peers == True
-        connected_servers = self.get_connected_servers()
-        preferred_servers = frozenset(s for s in connected_servers if s.get_longname() in self.preferred_peers)
-        def _permuted(server):
-            seed = server.get_permutation_seed()
-            is_unpreferred = server not in preferred_servers
-            return (is_unpreferred,
-                    permute_server_hash(peer_selection_index, seed))
-        return sorted(connected_servers, key=_permuted)
+        return [entry[-1] for entry in sorted(self._permuted_ring(peer_selection_index))]
+
+    def iter_servers_for_psi(self, peer_selection_index):
+        """
+        Yield the servers ``get_servers_for_psi`` would return, in the same
+        order, without sorting more of them than are asked for.
+        """
+        assert self.permute_peers == True
+        heap = self._permuted_ring(peer_selection_index)
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[-1]
 
     def get_all_serverids(self):
         return frozenset(self.servers.keys())
@@ -461,6 +497,32 @@ class StorageFarmBroker(service.MultiService):
                     return s
         return StubServer(serverid)
 
+class _ServerDict(BytesKeyDict):
+    """
+    A ``BytesKeyDict`` that calls ``changed()`` whenever it is modified, so
+    that ``StorageFarmBroker`` knows to work out its permuted rings again.
+    """
+
+    def __init__(self, changed):
+        BytesKeyDict.__init__(self)
+        self._changed = changed
+
+
+def _make_notifying_override(K, method_name):
+    method = getattr(BytesKeyDict, method_name)
+    def f(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+        return result
+    f.__name__ = method_name
+    setattr(K, method_name, f)
+
+for _method_name in ["__setitem__", "__delitem__", "setdefault", "pop",
+                     "popitem", "clear", "update"]:
+    _make_notifying_override(_ServerDict, _method_name)
+del _method_name
+
+
 @implementer(IDisplayableServer)
 class StubServer(object):
     def __init__(self, serverid):
@@ -806,7 +868,8 @@ class NativeStorageServer(service.MultiService):
     def on_status_changed(self, status_changed):
         """
         :param status_changed: a callable taking a single arg (the
-            NativeStorageServer) that is notified when we become connected
+            NativeStorageServer) that is notified when we become connected,
+            and when we lose our connection
         """
         return self._on_status_changed.subscribe(status_changed)
 
@@ -901,6 +964,7 @@ class NativeStorageServer(service.MultiService):
         # get_connected_servers() or get_servers_for_psi()) can continue to
         # use s.get_rref().callRemote() and not worry about it being None.
         self._is_connected = False
+        self._on_status_changed.notify(self)
 
     def stop_connecting(self):
         # used when this descriptor has been superceded by another
@@ -1095,6 +1159,10 @@ class _HTTPBucketReader(object):
        )
 
 
+# The most read vectors the HTTP server accepts in one batched mutable read.
+_MAX_BATCHED_READ_VECTORS = 30
+
+
 # WORK IN PROGRESS, for now it doesn't actually implement whole thing.
 @implementer(IStorageServer)  # type: ignore
 @attr.s
@@ -1103,6 +1171,9 @@ class _HTTPStorageServer(object):
     Talk to remote storage server over HTTP.
     """
     _http_client = attr.ib(type=StorageClient)
+    # Whether the server supports ``POST /v1/mutable/:storage_index/read``;
+    # ``None`` until we have asked for its version.
+    _batched_readv = attr.ib(default=None, init=False)
 
     @staticmethod
     def from_http_client(http_client):  # type: (StorageClient) -> _HTTPStorageServer
@@ -1194,9 +1265,34 @@ class _HTTPStorageServer(object):
             storage_index, shnum, str(reason, "utf-8", errors="backslashreplace")
         )
 
+    @defer.inlineCallbacks
+    def _supports_batched_readv(self):
+        """
+        :return: A ``Deferred`` firing with whether the server advertises the
+            batched mutable read endpoint in its version information.
+        """
+        if self._batched_readv is None:
+            version = yield self.get_version()
+            self._batched_readv = version[
+                b"http://allmydata.org/tahoe/protocols/storage/v1"
+            ].get(b"batched-mutable-readv", False)
+        return self._batched_readv
+
     @defer.inlineCallbacks
     def slot_readv(self, storage_index, shares, readv):
         mutable_client = StorageClientMutables(self._http_client)
+        if len(readv) <= _MAX_BATCHED_READ_VECTORS:
+            batched = yield self._supports_batched_readv()
+            if batched:
+                reads = yield mutable_client.read_share_chunks(
+                    storage_index,
+                    set(shares),
+                    [ReadVector(offset=offset, size=length)
+                     for (offset, length) in readv],
+                )
+                return reads
+
+        # Older servers need one request per share per read vector.
         pending_reads = {}
         reads = {}
         # If shares list is empty, that means list all shares, so we need
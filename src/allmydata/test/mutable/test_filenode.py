@@ -10,23 +10,29 @@ from future.utils import PY2
 if PY2:
     from future.builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, dict, list, object, range, str, max, min  # noqa: F401
 
+import struct
+
 from six.moves import cStringIO as StringIO
 from twisted.internet import defer, reactor
 from ..common import AsyncBrokenTestCase
 from testtools.matchers import (
     Equals,
     Contains,
+    GreaterThan,
     HasLength,
     Is,
     IsInstance,
+    Not,
 )
 from allmydata import uri, client
 from allmydata.util.consumer import MemoryConsumer
 from allmydata.interfaces import SDMF_VERSION, MDMF_VERSION, DownloadStopped
 from allmydata.mutable.filenode import MutableFileNode, BackoffAgent
-from allmydata.mutable.common import MODE_ANYTHING, MODE_WRITE, MODE_READ, UncoordinatedWriteError
+from allmydata.mutable.common import MODE_ANYTHING, MODE_WRITE, MODE_READ, UncoordinatedWriteError, \
+     NotEnoughServersError
 
-from allmydata.mutable.publish import MutableData
+from allmydata.mutable.publish import MutableData, Publish
+from allmydata.mutable.layout import MDMFSlotWriteProxy, MDMFCHECKSTRING
 from ..test_download import PausingConsumer, PausingAndStoppingConsumer, \
      StoppingConsumer, ImmediatelyStoppingConsumer
 from .. import common_util as testutil
@@ -400,6 +406,94 @@ class Filenode(AsyncBrokenTestCase, testutil.ShouldFailMixin):
         return d
 
 
+    @defer.inlineCallbacks
+    def test_mdmf_streaming_publish(self):
+        """
+        The blocks of a large MDMF file are sent to servers while it is
+        being published, instead of all at once at the end, and the result
+        can be read back and overwritten.
+        """
+        self.patch(Publish, "STREAMING_BUFFER_SIZE", 100 * 1024)
+        contents = b"streaming" * 200000 # about 1.7 MiB, 14 segments
+        n = yield self.nodemaker.create_mutable_file(MutableData(contents),
+                                                     version=MDMF_VERSION)
+        for peer in self._peers:
+            # Each share is about 600 KiB, so it goes out in a few pieces
+            # before the final write.
+            self.assertThat(peer.storage_server.queries, GreaterThan(3))
+        data = yield n.download_best_version()
+        self.assertThat(data, Equals(contents))
+
+        new_contents = b"overwrite" * 200000
+        yield n.overwrite(MutableData(new_contents))
+        data = yield n.download_best_version()
+        self.assertThat(data, Equals(new_contents))
+        smap = yield n.get_servermap(MODE_READ)
+        self.assertThat(smap.recoverable_versions(), HasLength(1))
+        self.assertThat(smap.unrecoverable_versions(), HasLength(0))
+
+
+    @defer.inlineCallbacks
+    def test_mdmf_streaming_publish_interrupted(self):
+        """
+        Blocks are only streamed to shares that did not exist before, and
+        without the new checkstring, so a publish that stops after some of
+        them were sent leaves the old version recoverable.
+        """
+        self.patch(Publish, "STREAMING_BUFFER_SIZE", 100 * 1024)
+        contents = b"streaming" * 200000
+        n = yield self.nodemaker.create_mutable_file(MutableData(contents),
+                                                     version=MDMF_VERSION)
+        # Lose three shares, so that the overwrite has new shares to stream
+        # as well as existing ones to replace.
+        for peer in self._peers[:3]:
+            self._storage._peers[peer.peerid].clear()
+        old_shares = dict(
+            (peerid, dict(shares))
+            for (peerid, shares) in self._storage._peers.items()
+        )
+
+        flushed = []
+        original_flush = MDMFSlotWriteProxy.flush
+        def _flush(writer):
+            d = original_flush(writer)
+            flushed.append((writer.server.get_serverid(), writer.shnum, d))
+            return d
+        self.patch(MDMFSlotWriteProxy, "flush", _flush)
+        original_flush_blocks = Publish._flush_blocks
+        def _flush_blocks_then_stop(publish, ignored=None):
+            d = original_flush_blocks(publish, ignored)
+            if flushed:
+                d.addCallback(lambda ign: defer.gatherResults(
+                    [fd for (serverid, shnum, fd) in flushed]))
+                def _stop(ign):
+                    raise ValueError("publish interrupted")
+                d.addCallback(_stop)
+            return d
+        self.patch(Publish, "_flush_blocks", _flush_blocks_then_stop)
+
+        yield self.shouldFail(NotEnoughServersError, "interrupted",
+                              "publish interrupted",
+                              n.overwrite, MutableData(b"overwrite" * 200000))
+        self.assertThat(flushed, Not(HasLength(0)))
+        for (serverid, shnum, d) in flushed:
+            # Only the lost shares were written early, and their header is
+            # still blank.
+            self.assertThat(old_shares.get(serverid, {}), Not(Contains(shnum)))
+            share = self._storage._peers[serverid][shnum]
+            header_size = struct.calcsize(MDMFCHECKSTRING)
+            self.assertThat(share[:header_size], Equals(b"\x00" * header_size))
+        for (peerid, shares) in old_shares.items():
+            for (shnum, data) in shares.items():
+                self.assertThat(self._storage._peers[peerid][shnum],
+                                Equals(data))
+
+        data = yield n.download_best_version()
+        self.assertThat(data, Equals(contents))
+        smap = yield n.get_servermap(MODE_READ)
+        self.assertThat(smap.recoverable_versions(), HasLength(1))
+
+
     def test_create_with_initial_contents(self):
         upload1 = MutableData(b"contents 1")
         d = self.nodemaker.create_mutable_file(upload1)
@@ -34,6 +34,20 @@ class Repair(AsyncTestCase, PublishMixin, ShouldFailMixin):
     def copy_shares(self, ignored=None):
         self.old_shares.append(self.get_shares(self._storage))
 
+    def test_repair_without_monitor(self):
+        """
+        ``repair`` does not need a monitor: the repairer makes its own to send
+        the servermap queries through.
+        """
+        d = self.publish_one()
+        d.addCallback(lambda res: self._fn.check(Monitor()))
+        d.addCallback(lambda check_results:
+                      self._fn.repair(check_results, monitor=None))
+        def _check_results(rres):
+            self.assertThat(rres.get_successful(), Equals(True))
+        d.addCallback(_check_results)
+        return d
+
     def test_repair_nop(self):
         self.old_shares = []
         d = self.publish_one()
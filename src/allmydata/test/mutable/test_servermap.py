@@ -14,12 +14,14 @@ if PY2:
 from ..common import AsyncTestCase
 from testtools.matchers import Equals, NotEquals, HasLength
 from twisted.internet import defer
+from twisted.internet.task import Clock
 from allmydata.monitor import Monitor
 from allmydata.mutable.common import \
      MODE_CHECK, MODE_ANYTHING, MODE_WRITE, MODE_READ
 from allmydata.mutable.publish import MutableData
-from allmydata.mutable.servermap import ServerMap, ServermapUpdater
-from .util import PublishMixin
+from allmydata.mutable.servermap import ServerMap, ServermapUpdater, \
+     ServermapCache
+from .util import PublishMixin, FakeStorage, make_nodemaker
 
 class Servermap(AsyncTestCase, PublishMixin):
     def setUp(self):
@@ -247,3 +249,137 @@ class Servermap(AsyncTestCase, PublishMixin):
         d.addCallback(lambda servermap:
             self.assertThat(servermap.recoverable_versions(), HasLength(1)))
         return d
+
+
+class ServermapCacheTests(AsyncTestCase):
+    def setUp(self):
+        super(ServermapCacheTests, self).setUp()
+        self.clock = Clock()
+        self.cache = ServermapCache(2, 60, self.clock)
+
+    def make_servermap(self):
+        sm = ServerMap()
+        sm.set_last_update(MODE_READ, 0)
+        return sm
+
+    def test_ttl(self):
+        sm = self.make_servermap()
+        self.cache.add(b"si1", sm, b"pubkey", self.cache.get_generation())
+        (cached, pubkey) = self.cache.get(b"si1")
+        # callers get their own copy
+        self.assertThat(cached, NotEquals(sm))
+        self.assertThat(cached.get_last_update(), Equals((MODE_READ, 0)))
+        self.assertThat(pubkey, Equals(b"pubkey"))
+        self.clock.advance(61)
+        self.assertThat(self.cache.get(b"si1"), Equals(None))
+
+    def test_size(self):
+        g = self.cache.get_generation()
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.cache.add(b"si2", self.make_servermap(), None, g)
+        # using si1 makes si2 the least recently used entry
+        self.cache.get(b"si1")
+        self.cache.add(b"si3", self.make_servermap(), None, g)
+        self.assertThat(self.cache.get(b"si2"), Equals(None))
+        self.assertThat(self.cache.get(b"si1"), NotEquals(None))
+        self.assertThat(self.cache.get(b"si3"), NotEquals(None))
+
+    def test_invalidate(self):
+        g = self.cache.get_generation()
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.cache.invalidate(b"si1")
+        self.assertThat(self.cache.get(b"si1"), Equals(None))
+        # an update that started before the invalidation is not cached
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.assertThat(self.cache.get(b"si1"), Equals(None))
+
+    def test_invalidate_other(self):
+        """
+        Invalidating one storage index does not stop updates of another that
+        were already running from being cached.
+        """
+        g = self.cache.get_generation()
+        self.cache.invalidate(b"si2")
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.assertThat(self.cache.get(b"si1"), NotEquals(None))
+
+    def test_forgotten_invalidation(self):
+        """
+        Once an invalidation has been forgotten to bound memory, updates that
+        started before it are still not cached.
+        """
+        g = self.cache.get_generation()
+        for si in [b"si1", b"si2", b"si3"]:
+            self.cache.invalidate(si)
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.assertThat(self.cache.get(b"si1"), Equals(None))
+        g = self.cache.get_generation()
+        self.cache.add(b"si1", self.make_servermap(), None, g)
+        self.assertThat(self.cache.get(b"si1"), NotEquals(None))
+
+
+class CachedReads(AsyncTestCase):
+    """
+    Tests for mutable file downloads that use a ``ServermapCache``.
+    """
+    CONTENTS = b"cached contents" * 100
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        super(CachedReads, self).setUp()
+        self._storage = FakeStorage()
+        self._nodemaker = make_nodemaker(self._storage)
+        self._nodemaker.servermap_cache = ServermapCache(10, 60, Clock())
+        n = yield self._nodemaker.create_mutable_file(MutableData(self.CONTENTS))
+        self._fn = self.count_updates(n)
+
+    def count_updates(self, node):
+        node.updates = 0
+        original = node._update_servermap
+        def _update_servermap(servermap, mode):
+            node.updates += 1
+            return original(servermap, mode)
+        node._update_servermap = _update_servermap
+        return node
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        """
+        Repeated downloads, from any node for the same file, only update the
+        servermap once.
+        """
+        for i in range(3):
+            data = yield self._fn.download_best_version()
+            self.assertThat(data, Equals(self.CONTENTS))
+        fn2 = self.count_updates(
+            self._nodemaker.create_from_cap(self._fn.get_readonly_uri()))
+        data = yield fn2.download_best_version()
+        self.assertThat(data, Equals(self.CONTENTS))
+        self.assertThat((self._fn.updates, fn2.updates), Equals((1, 0)))
+
+    @defer.inlineCallbacks
+    def test_own_publish_invalidates(self):
+        """
+        Publishing a new version forgets the cached servermap.
+        """
+        yield self._fn.download_best_version()
+        yield self._fn.overwrite(MutableData(b"new contents"))
+        updates = self._fn.updates
+        data = yield self._fn.download_best_version()
+        self.assertThat(data, Equals(b"new contents"))
+        self.assertThat(self._fn.updates, Equals(updates + 1))
+
+    @defer.inlineCallbacks
+    def test_stale(self):
+        """
+        If someone else publishes a new version, reading from the cached
+        servermap fails and the download falls back to a fresh servermap
+        update.
+        """
+        yield self._fn.download_best_version()
+        other = make_nodemaker(self._storage).create_from_cap(
+            self._fn.get_uri())
+        yield other.overwrite(MutableData(b"someone else's contents"))
+        data = yield self._fn.download_best_version()
+        self.assertThat(data, Equals(b"someone else's contents"))
+        self.assertThat(self._fn.updates, Equals(2))
@@ -230,6 +230,8 @@ class NoNetworkStorageBroker(object):  # type: ignore # missing many methods
             seed = server.get_permutation_seed()
             return permute_server_hash(peer_selection_index, seed)
         return sorted(self.get_connected_servers(), key=_permuted)
+    def iter_servers_for_psi(self, peer_selection_index):
+        return iter(self.get_servers_for_psi(peer_selection_index))
     def get_connected_servers(self):
         return self.client._servers
     def get_nickname_for_serverid(self, serverid):
@@ -796,7 +796,7 @@ class CounterHolder(object):
         self._num_active_block_fetches = 0
         self._max_active_block_fetches = 0
 
-from allmydata.immutable.checker import ValidatedReadBucketProxy
+from allmydata.immutable.checker import ValidatedReadBucketProxy, Checker
 class MockVRBP(ValidatedReadBucketProxy):
     def __init__(self, sharenum, bucket, share_hash_tree, num_blocks, block_size, share_size, counterholder):
         ValidatedReadBucketProxy.__init__(self, sharenum, bucket,
@@ -821,6 +821,22 @@ class TooParallel(GridTestMixin, unittest.TestCase):
     # crashing with MemoryErrors on >1GB files.
 
     def test_immutable(self):
+        # the verifier works on all 4 shares in parallel, but only fetches
+        # a window of blocks from each share at a time
+        return self._test_immutable(4 * Checker.VERIFY_WINDOW)
+
+    def test_immutable_byte_budget(self):
+        # 10 bytes is two of the 5-byte blocks, from all shares together
+        self.patch(Checker, "VERIFY_BYTE_BUDGET", 10)
+        return self._test_immutable(2)
+
+    def test_immutable_shared_byte_budget(self):
+        # checks using the same monitor share one budget, so verifying two
+        # files at once still only fetches two blocks at a time
+        self.patch(Checker, "VERIFY_BYTE_BUDGET", 10)
+        return self._test_immutable(2, files=2)
+
+    def _test_immutable(self, expected_max_active_block_fetches, files=1):
         import allmydata.immutable.checker
         origVRBP = allmydata.immutable.checker.ValidatedReadBucketProxy
 
@@ -844,18 +860,27 @@ class TooParallel(GridTestMixin, unittest.TestCase):
                                         "max_segment_size": 5,
                                       }
             self.uris = {}
-            DATA = b"data" * 100 # 400/5 = 80 blocks
-            return self.c0.upload(Data(DATA, convergence=b""))
+            # 400/5 = 80 blocks each
+            DATAS = [b"dat%d" % i * 100 for i in range(files)]
+            return defer.gatherResults(
+                [self.c0.upload(Data(DATA, convergence=b""))
+                 for DATA in DATAS])
         d.addCallback(_start)
-        def _do_check(ur):
-            n = self.c0.create_node_from_uri(ur.get_uri())
-            return n.check(Monitor(), verify=True)
+        monitor = Monitor()
+        def _do_check(urs):
+            nodes = [self.c0.create_node_from_uri(ur.get_uri())
+                     for ur in urs]
+            return defer.gatherResults([n.check(monitor, verify=True)
+                                        for n in nodes])
         d.addCallback(_do_check)
-        def _check(cr):
-            # the verifier works on all 4 shares in parallel, but only
-            # fetches one block from each share at a time, so we expect to
-            # see 4 parallel fetches
-            self.failUnlessEqual(counterholder._max_active_block_fetches, 4)
+        def _check(crs):
+            for cr in crs:
+                self.failUnless(cr.is_healthy())
+            self.failUnlessEqual(counterholder._max_active_block_fetches,
+                                 expected_max_active_block_fetches)
+            self.failUnlessEqual(monitor.get_progress(),
+                                 {"verify-blocks": files * 4 * 80,
+                                  "verify-bytes": files * 4 * 400})
         d.addCallback(_check)
         def _clean_up(res):
             allmydata.immutable.checker.ValidatedReadBucketProxy = origVRBP
@@ -62,7 +62,7 @@ from allmydata.nodemaker import (
     NodeMaker,
 )
 from allmydata.node import OldConfigError, UnescapedHashError, create_node_dir
-from allmydata import client
+from allmydata import client, uri
 from allmydata.storage_client import (
     StorageClientConfig,
     StorageFarmBroker,
@@ -339,6 +339,224 @@ class Basic(testutil.ReallyEqualMixin, unittest.TestCase):
         c = yield client.create_client(basedir)
         self.failUnlessEqual(c.getServiceNamed("storage").reserved_space, 1000)
 
+    @defer.inlineCallbacks
+    def test_io_threads(self):
+        """
+        io_threads option gives the storage server an I/O thread pool
+        """
+        basedir = "client.Basic.test_io_threads"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[storage]\n" + \
+                           "enabled = true\n" + \
+                           "io_threads = 4\n")
+        c = yield client.create_client(basedir)
+        stats = c.getServiceNamed("storage").get_stats()
+        self.failUnlessIn("storage_server.io.queue_depth", stats)
+
+    @defer.inlineCallbacks
+    def test_lease_index(self):
+        """
+        lease_index option gives the storage server a lease index database
+        """
+        basedir = "client.Basic.test_lease_index"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[storage]\n" + \
+                           "enabled = true\n" + \
+                           "lease_index = true\n")
+        c = yield client.create_client(basedir)
+        ss = c.getServiceNamed("storage")
+        self.addCleanup(ss.lease_db.close)
+        self.failUnless(os.path.exists(os.path.join(ss.storedir,
+                                                    "leases.sqlite")))
+
+    @defer.inlineCallbacks
+    def test_open_file_cache(self):
+        """
+        open_file_cache option gives the storage server a cache of open share
+        files of that size
+        """
+        basedir = "client.Basic.test_open_file_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[storage]\n" + \
+                           "enabled = true\n" + \
+                           "open_file_cache = 32\n")
+        c = yield client.create_client(basedir)
+        ss = c.getServiceNamed("storage")
+        self.failUnlessEqual(ss._fd_cache._size, 32)
+
+    @defer.inlineCallbacks
+    def test_durability(self):
+        """
+        durability = group gives the storage server a group committer
+        """
+        basedir = "client.Basic.test_durability"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[storage]\n" + \
+                           "enabled = true\n" + \
+                           "durability = group\n")
+        c = yield client.create_client(basedir)
+        ss = c.getServiceNamed("storage")
+        self.failUnless(ss._committer is not None)
+        self.failUnless(ss._sync is not None)
+
+    @defer.inlineCallbacks
+    def test_compute_threads(self):
+        """
+        compute.threads option gives the client a compute thread pool
+        """
+        basedir = "client.Basic.test_compute_threads"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "compute.threads = 2\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.getServiceNamed("compute").name, "compute")
+
+    @defer.inlineCallbacks
+    def test_keypool(self):
+        """
+        mutable.keypool_size option makes the client pre-generate RSA keys
+        """
+        basedir = "client.Basic.test_keypool"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "mutable.keypool_size = 3\n" + \
+                           "mutable.keypool_persist = true\n")
+        c = yield client.create_client(basedir)
+        keypool = c.getServiceNamed("keypool")
+        self.failUnlessIdentical(c.nodemaker.key_generator, keypool)
+        self.failUnlessEqual(keypool._size, 3)
+        self.failUnlessEqual(keypool._spare_keys_path,
+                             os.path.join(os.path.abspath(basedir), "private", "spare_rsa_keys"))
+
+    @defer.inlineCallbacks
+    def test_servermap_cache(self):
+        """
+        mutable.servermap_cache_ttl option gives the client a servermap cache
+        """
+        basedir = "client.Basic.test_servermap_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "mutable.servermap_cache_ttl = 30\n" + \
+                           "mutable.servermap_cache_size = 5\n")
+        c = yield client.create_client(basedir)
+        cache = c.nodemaker.servermap_cache
+        self.failUnlessEqual((cache._size, cache._ttl), (5, 30))
+
+    @defer.inlineCallbacks
+    def test_download_state_cache(self):
+        """
+        download.state_cache_size sizes the client's cache of immutable
+        download state, and 0 disables it
+        """
+        basedir = "client.Basic.test_download_state_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "download.state_cache_size = 7\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.download_cache._size, 7)
+
+        basedir = "client.Basic.test_download_state_cache_0"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "download.state_cache_size = 0\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.download_cache, None)
+
+    @defer.inlineCallbacks
+    def test_segment_cache(self):
+        """
+        download.segment_cache_size gives the client a segment cache, whose
+        statistics are reported
+        """
+        basedir = "client.Basic.test_segment_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "download.segment_cache_size = 2MiB\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.segment_cache._max_bytes,
+                             2*1024*1024)
+        stats = c.stats_provider.get_stats()["stats"]
+        self.failUnlessEqual(stats["downloader.segment_cache.hits"], 0)
+
+    @defer.inlineCallbacks
+    def test_download_readahead(self):
+        """
+        download.readahead_* options set how far immutable downloads read
+        ahead
+        """
+        basedir = "client.Basic.test_download_readahead"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "download.readahead_segments = 2\n" + \
+                           "download.readahead_max_bytes = 1MiB\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.download_readahead_segments, 2)
+        self.failUnlessEqual(c.nodemaker.download_readahead_max_bytes,
+                             1024*1024)
+        cap = uri.CHKFileURI(b"k"*16, b"e"*32, 3, 10, 1000)
+        n = c.create_node_from_uri(cap.to_string())
+        n._cnode._maybe_create_download_node()
+        self.failUnlessEqual(n._cnode._node.READAHEAD_SEGMENTS, 2)
+        self.failUnlessEqual(n._cnode._node.READAHEAD_MAX_BYTES, 1024*1024)
+
+    @defer.inlineCallbacks
+    def test_traverse(self):
+        """
+        traverse.* options control how the nodemaker's directories walk trees
+        """
+        basedir = "client.Basic.test_traverse"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "traverse.concurrency = 4\n" + \
+                           "traverse.memory_budget = 1MiB\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.traverse_concurrency, 4)
+        self.failUnlessEqual(c.nodemaker.traverse_memory_budget, 1024*1024)
+        self.failUnlessEqual(c.nodemaker.tempdir,
+                             os.path.abspath(os.path.join(basedir, "tmp")))
+
+    @defer.inlineCallbacks
+    def test_directory_write_window(self):
+        """
+        directory.write_window sets how long directory changes wait to be
+        published together, and their counts are reported as stats
+        """
+        basedir = "client.Basic.test_directory_write_window"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), \
+                           BASECONFIG + \
+                           "[client]\n" + \
+                           "directory.write_window = 0.5\n")
+        c = yield client.create_client(basedir)
+        self.failUnlessEqual(c.nodemaker.directory_write_window, 0.5)
+        stats = c.stats_provider.get_stats()["stats"]
+        self.failUnlessEqual(stats["dirnode.write.batches"], 0)
+        self.failUnlessEqual(stats["dirnode.write.changes"], 0)
+
     @defer.inlineCallbacks
     def test_reserved_2(self):
         """
@@ -558,6 +776,33 @@ class Basic(testutil.ReallyEqualMixin, unittest.TestCase):
         sb.servers.clear()
         self.failUnlessReallyEqual(self._permute(sb, b"one"), [])
 
+    def test_permute_lazily(self):
+        """
+        ``iter_servers_for_psi`` yields the servers in the same order as
+        ``get_servers_for_psi`` returns them, and both notice when servers
+        disconnect or are forgotten.
+        """
+        sb = StorageFarmBroker(True, None, EMPTY_CLIENT_CONFIG)
+        for k in [b"%d" % i for i in range(5)]:
+            ann = {"anonymous-storage-FURL": SOME_FURL,
+                   "permutation-seed-base32": base32.b2a(k) }
+            sb.test_add_rref(k, "rref", ann)
+
+        for key in [b"one", b"two"]:
+            self.assertEqual(
+                [s.get_longname() for s in sb.iter_servers_for_psi(key)],
+                self._permute(sb, key))
+        first = next(sb.iter_servers_for_psi(b"one"))
+        self.assertEqual(first.get_longname(), b"3")
+
+        sb.servers[b"3"]._lost()
+        self.assertEqual(self._permute(sb, b"one"), [b'1',b'0',b'4',b'2'])
+        del sb.servers[b"1"]
+        self.assertEqual(self._permute(sb, b"one"), [b'0',b'4',b'2'])
+        self.assertEqual(
+            [s.get_longname() for s in sb.iter_servers_for_psi(b"one")],
+            [b'0',b'4',b'2'])
+
     def test_permute_with_preferred(self):
         """
         Permutations need to be stable across Tahoe releases, which is why we
@@ -0,0 +1,195 @@
+"""
+Tests for allmydata.util.compute.
+"""
+
+import os
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.application import service
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+from allmydata.immutable import upload
+from allmydata.immutable.filenode import DecryptingConsumer
+from allmydata.interfaces import MDMF_VERSION
+from allmydata.mutable.publish import MutableData
+from allmydata.util.compute import ComputePool, defer_to_compute, have_compute_pool
+from allmydata.util.consumer import download_to_data
+from allmydata.test.no_network import GridTestMixin
+
+
+def _current_thread():
+    return threading.current_thread()
+
+
+class ComputePoolTests(unittest.TestCase):
+    """
+    Tests for ``ComputePool`` and ``defer_to_compute``.
+    """
+    def setUp(self):
+        self.parent = service.MultiService()
+        self.parent.startService()
+        self.addCleanup(self.parent.stopService)
+
+    def test_no_pool(self):
+        """
+        Without a running pool, ``defer_to_compute`` calls the function right
+        away in the calling thread.
+        """
+        self.assertFalse(have_compute_pool(None))
+        d = defer_to_compute(None, _current_thread)
+        self.assertIs(self.successResultOf(d), threading.current_thread())
+
+    def test_no_pool_failure(self):
+        """
+        Without a running pool, exceptions raised by the function come back as
+        an already-failed ``Deferred``.
+        """
+        d = defer_to_compute(None, int, "not a number")
+        self.failureResultOf(d, ValueError)
+
+    @defer.inlineCallbacks
+    def test_pool(self):
+        """
+        While a pool is running, ``defer_to_compute`` runs functions in one
+        of its threads, and stops doing so once the pool is stopped.
+        """
+        pool = ComputePool(2)
+        self.assertFalse(have_compute_pool(pool))
+        pool.setServiceParent(self.parent)
+        self.assertTrue(have_compute_pool(pool))
+        thread = yield defer_to_compute(pool, _current_thread)
+        self.assertIsNot(thread, threading.current_thread())
+        yield pool.disownServiceParent()
+        self.assertFalse(have_compute_pool(pool))
+        d = defer_to_compute(pool, _current_thread)
+        self.assertIs(self.successResultOf(d), threading.current_thread())
+
+    def test_pools_are_separate(self):
+        """
+        Starting one pool does not make ``defer_to_compute`` use it for work
+        given another, stopped, pool.
+        """
+        running = ComputePool(1)
+        running.setServiceParent(self.parent)
+        stopped = ComputePool(1)
+        self.assertFalse(have_compute_pool(stopped))
+        d = defer_to_compute(stopped, _current_thread)
+        self.assertIs(self.successResultOf(d), threading.current_thread())
+
+
+@implementer(IPushProducer)
+class FakeProducer(object):
+    def __init__(self):
+        self.paused = False
+        self.events = []
+    def pauseProducing(self):
+        self.paused = True
+        self.events.append("pause")
+    def resumeProducing(self):
+        self.paused = False
+        self.events.append("resume")
+    def stopProducing(self):
+        self.events.append("stop")
+
+
+class FakeConsumer(object):
+    def __init__(self):
+        self.producer = None
+        self.data = []
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+    def unregisterProducer(self):
+        self.producer = None
+    def write(self, data):
+        self.data.append(data)
+
+
+class DecryptingConsumerTests(unittest.TestCase):
+    """
+    Tests for ``DecryptingConsumer`` decrypting in compute threads.
+    """
+    def setUp(self):
+        self.parent = service.MultiService()
+        self.parent.startService()
+        self.addCleanup(self.parent.stopService)
+        self.pool = ComputePool(1)
+        self.pool.setServiceParent(self.parent)
+        self.consumer = FakeConsumer()
+        self.producer = FakeProducer()
+        self.decryptor = DecryptingConsumer(self.consumer, os.urandom(16), 0,
+                                            self.pool)
+        self.decryptor.MAX_PENDING_BYTES = 100
+        self.decryptor.registerProducer(self.producer, True)
+
+    @defer.inlineCallbacks
+    def test_pause_while_pending(self):
+        """
+        The producer is paused while more ciphertext than
+        ``MAX_PENDING_BYTES`` waits for the compute threads, and resumed once
+        it has been decrypted.
+        """
+        self.assertIs(self.consumer.producer, self.decryptor)
+        self.decryptor.write(b"a" * 60)
+        self.assertFalse(self.producer.paused)
+        self.decryptor.write(b"b" * 60)
+        self.assertTrue(self.producer.paused)
+        yield self.decryptor.when_written()
+        self.assertEqual(self.producer.events, ["pause", "resume"])
+        self.assertEqual(sum(len(d) for d in self.consumer.data), 120)
+
+    @defer.inlineCallbacks
+    def test_consumer_pause_wins(self):
+        """
+        A producer paused by the real consumer stays paused when the pending
+        ciphertext drains, until the consumer resumes it.
+        """
+        self.decryptor.write(b"a" * 120)
+        self.decryptor.pauseProducing()
+        yield self.decryptor.when_written()
+        self.assertTrue(self.producer.paused)
+        self.decryptor.resumeProducing()
+        self.assertFalse(self.producer.paused)
+        self.decryptor.stopProducing()
+        self.assertEqual(self.producer.events, ["pause", "resume", "stop"])
+
+
+class Roundtrip(GridTestMixin, unittest.TestCase):
+    """
+    Files can be uploaded and downloaded with the CPU-heavy parts running in
+    compute threads.
+    """
+    DATA = b"compute thread data " * 50000
+
+    def setUp(self):
+        GridTestMixin.setUp(self)
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        self.assertTrue(have_compute_pool(self.c0._compute_pool))
+
+    def set_up_grid(self):
+        def _compute_threads(clientdir):
+            with open(os.path.join(clientdir, "tahoe.cfg"), "a") as f:
+                f.write("[client]\ncompute.threads = 3\n")
+        GridTestMixin.set_up_grid(self, client_config_hooks={0: _compute_threads})
+
+    @defer.inlineCallbacks
+    def test_immutable(self):
+        u = upload.Data(self.DATA, None)
+        u.max_segment_size = 100000
+        ur = yield self.c0.upload(u)
+        n = self.c0.create_node_from_uri(ur.get_uri())
+        data = yield download_to_data(n)
+        self.assertEqual(data, self.DATA)
+        data = yield download_to_data(n, 150000, 300000)
+        self.assertEqual(data, self.DATA[150000:450000])
+
+    @defer.inlineCallbacks
+    def test_mutable(self):
+        n = yield self.c0.create_mutable_file(MutableData(self.DATA),
+                                              version=MDMF_VERSION)
+        data = yield n.download_best_version()
+        self.assertEqual(data, self.DATA)
@@ -473,6 +473,25 @@ class TestRsa(unittest.TestCase):
         with self.assertRaises(rsa.BadSignature):
             rsa.verify_signature(pub_key, sig1, data_to_sign + b"more")
 
+    def test_encrypted_keys(self):
+        """
+        a private key serialized with a password can only be loaded with that
+        password
+        """
+        priv_key, pub_key = rsa.create_signing_keypair(2048)
+        priv_key_str = rsa.der_string_from_signing_key(priv_key, b"password")
+        self.assertNotEqual(priv_key_str, rsa.der_string_from_signing_key(priv_key))
+
+        with self.assertRaises(TypeError):
+            rsa.create_signing_keypair_from_string(priv_key_str)
+        with self.assertRaises(ValueError):
+            rsa.create_signing_keypair_from_string(priv_key_str, b"wrong")
+
+        priv_key2, pub_key2 = rsa.create_signing_keypair_from_string(
+            priv_key_str, b"password")
+        sig = rsa.sign_data(priv_key2, b"test data")
+        rsa.verify_signature(pub_key, sig, b"test data")
+
     def test_sign_invalid_pubkey(self):
         '''
         signing data using an invalid key-object fails
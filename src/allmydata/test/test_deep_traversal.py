@@ -0,0 +1,193 @@
+"""
+Tests for allmydata.deep_traversal.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from allmydata import dirnode
+from allmydata.deep_traversal import Frontier
+from allmydata.immutable import upload
+from allmydata.test.no_network import GridTestMixin
+
+
+class DeepTraversal(GridTestMixin, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def _create_tree(self):
+        # root/{a,b,c}/{f1,f2,x/,y/}, and root/a/up -> root
+        c = self.g.clients[0]
+        root = yield c.create_dirnode()
+        for name in [u"a", u"b", u"c"]:
+            sub = yield root.create_subdirectory(name)
+            for filename in [u"f1", u"f2"]:
+                yield sub.add_file(filename, upload.Data(b"data", None))
+            yield sub.create_subdirectory(u"x")
+            yield sub.create_subdirectory(u"y")
+            if name == u"a":
+                yield sub.set_node(u"up", root)
+        defer.returnValue(root)
+
+    @defer.inlineCallbacks
+    def _manifest(self, root, concurrency, memory_budget):
+        nodemaker = self.g.clients[0].nodemaker
+        self.patch(nodemaker, "traverse_concurrency", concurrency)
+        self.patch(nodemaker, "traverse_memory_budget", memory_budget)
+        results = yield root.build_manifest().when_done()
+        defer.returnValue([path for (path, cap) in results["manifest"]])
+
+    @defer.inlineCallbacks
+    def test_manifest(self):
+        """
+        Every node is visited once whatever the concurrency, and in depth-first
+        order without any.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_manifest"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        expected = [()]
+        for name in [u"a", u"b", u"c"]:
+            expected += [(name,),
+                         (name, u"f1"), (name, u"f2"),
+                         (name, u"x"), (name, u"y")]
+        serial = yield self._manifest(root, 1, 1024 * 1024)
+        self.assertEqual(serial, expected)
+        spilled = yield self._manifest(root, 1, 1)
+        self.assertEqual(spilled, expected)
+        for budget in [1, 1024 * 1024]:
+            concurrent = yield self._manifest(root, 4, budget)
+            self.assertEqual(sorted(concurrent), sorted(expected))
+
+    @defer.inlineCallbacks
+    def test_concurrency(self):
+        """
+        Up to ``traverse_concurrency`` directories are read at once.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_concurrency"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        reading = [0]
+        most = [0]
+        original_list = dirnode.DirectoryNode.list
+        def list(node):
+            reading[0] += 1
+            most[0] = max(most[0], reading[0])
+            d = original_list(node)
+            def done(result):
+                reading[0] -= 1
+                return result
+            d.addBoth(done)
+            return d
+        self.patch(dirnode.DirectoryNode, "list", list)
+        yield self._manifest(root, 3, 1024 * 1024)
+        self.assertEqual(most[0], 3)
+
+    @defer.inlineCallbacks
+    def test_check_concurrency(self):
+        """
+        A deep-check checks up to ``deep_check_concurrency`` nodes at once, and
+        still checks every node.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_check_concurrency"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        nodemaker = self.g.clients[0].nodemaker
+        checking = [0]
+        most = [0]
+        original_check_node = dirnode.DeepChecker._check_node
+        def _check_node(checker, node, childpath):
+            checking[0] += 1
+            most[0] = max(most[0], checking[0])
+            d = original_check_node(checker, node, childpath)
+            def done(result):
+                checking[0] -= 1
+                return result
+            d.addBoth(done)
+            return d
+        self.patch(dirnode.DeepChecker, "_check_node", _check_node)
+        for concurrency in [1, 4]:
+            most[0] = 0
+            self.patch(nodemaker, "deep_check_concurrency", concurrency)
+            results = yield root.start_deep_check().when_done()
+            self.assertEqual(most[0], concurrency)
+            # root, a/b/c and their x/y subdirectories: the files are
+            # literal, so there is nothing to check for them
+            counters = results.get_counters()
+            self.assertEqual(counters["count-objects-checked"], 1 + 3 * 3)
+            self.assertEqual(counters["count-objects-healthy"], 1 + 3 * 3)
+
+    @defer.inlineCallbacks
+    def test_failure(self):
+        """
+        If the walker fails, so does the traversal.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_failure"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        class Failing(dirnode.ManifestWalker):
+            def add_node(self, node, path):
+                if path == [u"b", u"x"]:
+                    raise ValueError("no")
+                return dirnode.ManifestWalker.add_node(self, node, path)
+        monitor = root.deep_traverse(Failing(root))
+        with self.assertRaises(ValueError):
+            yield monitor.when_done()
+
+    @defer.inlineCallbacks
+    def test_nothing_after_failure(self):
+        """
+        Once a directory can't be listed, the walker is given nothing more, so
+        the failure follows that directory in streamed output.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_nothing_after_failure"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        original_list = dirnode.DirectoryNode.list
+        def list(node):
+            if node.get_uri() == broken:
+                return defer.fail(ValueError("unlistable"))
+            return original_list(node)
+        b = yield root.get(u"b")
+        broken = b.get_uri()
+        self.patch(dirnode.DirectoryNode, "list", list)
+        for concurrency in [1, 4]:
+            seen = []
+            class Recording(dirnode.ManifestWalker):
+                def add_node(self, node, path):
+                    seen.append(tuple(path))
+                    return dirnode.ManifestWalker.add_node(self, node, path)
+            self.patch(self.g.clients[0].nodemaker, "traverse_concurrency",
+                       concurrency)
+            monitor = root.deep_traverse(Recording(root))
+            with self.assertRaises(ValueError):
+                yield monitor.when_done()
+            self.assertEqual(seen[-1], (u"b",))
+
+    @defer.inlineCallbacks
+    def test_frontier(self):
+        """
+        ``Frontier`` is a stack, however much of it is on disk.
+        """
+        self.basedir = "deep_traversal/DeepTraversal/test_frontier"
+        self.set_up_grid(oneshare=True)
+        root = yield self._create_tree()
+        children = yield root.list()
+        nodes = [children[name][0] for name in [u"a", u"b", u"c"]]
+        nodes.append(self.g.clients[0].create_node_from_uri(
+            root.get_readonly_uri()))
+        frontier = Frontier(self.g.clients[0].nodemaker, 0)
+        for i in range(20):
+            frontier.push(nodes[i % 4], [u"%d" % i])
+        self.assertEqual(len(frontier), 20)
+        self.assertTrue(frontier.spilled > 10)
+        popped = []
+        while frontier:
+            popped.append(frontier.pop())
+        self.assertEqual([path for (node, path) in popped],
+                         [[u"%d" % i] for i in reversed(range(20))])
+        self.assertEqual(
+            [(node.get_write_uri(), node.get_readonly_uri())
+             for (node, path) in popped],
+            [(nodes[i % 4].get_write_uri(), nodes[i % 4].get_readonly_uri())
+             for i in reversed(range(20))])
+        frontier.close()
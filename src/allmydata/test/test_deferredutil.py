@@ -76,6 +76,41 @@ class DeferredUtilTests(unittest.TestCase, deferredutil.WaitForDelayedCallsMixin
         return d
 
 
+
+class ByteBudgetTests(unittest.TestCase):
+    """
+    Tests for ``deferredutil.ByteBudget``.
+    """
+
+    def test_in_order(self):
+        """
+        Requests are granted in the order they were made, each once enough
+        of the budget has been released.
+        """
+        budget = deferredutil.ByteBudget(10)
+        first = budget.acquire(4)
+        second = budget.acquire(8)
+        third = budget.acquire(1)
+        self.successResultOf(first)
+        self.assertNoResult(second)
+        self.assertNoResult(third)
+        budget.release(4)
+        self.successResultOf(second)
+        self.successResultOf(third)
+
+    def test_oversized(self):
+        """
+        A request for more than the whole budget is granted once nothing else
+        is outstanding.
+        """
+        budget = deferredutil.ByteBudget(10)
+        first = budget.acquire(1)
+        big = budget.acquire(20)
+        self.successResultOf(first)
+        self.assertNoResult(big)
+        budget.release(1)
+        self.successResultOf(big)
+
 class UntilTests(unittest.TestCase):
     """
     Tests for ``deferredutil.until``.
@@ -92,6 +92,46 @@ class DictUtil(unittest.TestCase):
         self.failUnlessEqual(d["one"], 1)
         self.failUnlessEqual(d.get_aux("one"), None)
 
+    def test_lazyauxdict(self):
+        loaded = []
+        def load(key, pending):
+            loaded.append(key)
+            if pending == "bad":
+                return None
+            return pending.upper()
+        d = dictutil.LazyAuxValueDict(load)
+        d.set_lazily("a", "one", "aux-a")
+        d.set_lazily("b", "two", "aux-b")
+        d.set_lazily("c", "bad", "aux-c")
+        d.set_lazily("e", "five", "aux-e")
+
+        self.failUnlessEqual(d["a"], "ONE")
+        self.failUnless("b" in d)
+        self.failIf("c" in d)
+        self.failUnlessEqual(loaded, ["a", "b", "c"])
+        self.failUnlessEqual(d.get_aux("a"), "aux-a")
+        self.failUnlessEqual(d.get_aux("c"), None)
+        self.failUnless(d.is_loaded("a"))
+        self.failIf(d.is_loaded("e"))
+        self.failUnlessEqual(sorted(d.all_keys()), ["a", "b", "e"])
+
+        d["d"] = "four"
+        d["b"] = "TWO!"
+        self.failUnlessEqual(d.get_aux("b"), None)
+        self.failUnlessEqual(loaded, ["a", "b", "c"])
+        self.failUnlessEqual(sorted(d.items()),
+                             [("a", "ONE"), ("b", "TWO!"), ("d", "four"),
+                              ("e", "FIVE")])
+        self.failUnlessEqual(loaded, ["a", "b", "c", "e"])
+        self.failUnlessEqual(len(d), 4)
+        self.failUnlessEqual(d, {"a": "ONE", "b": "TWO!", "d": "four",
+                                 "e": "FIVE"})
+
+        d = dictutil.LazyAuxValueDict(load)
+        d.set_lazily("x", "bad", "aux-x")
+        self.failUnlessEqual(len(d), 0)
+        self.failUnlessRaises(KeyError, d.__delitem__, "x")
+
 
 class TypedKeyDict(unittest.TestCase):
     """Tests for dictionaries that limit keys."""
@@ -19,7 +19,9 @@ import unicodedata
 from zope.interface import implementer
 from twisted.trial import unittest
 from twisted.internet import defer
+from twisted.internet.task import Clock
 from twisted.internet.interfaces import IConsumer
+from foolscap.api import fireEventually
 from allmydata import uri, dirnode
 from allmydata.client import _Client
 from allmydata.immutable import upload
@@ -1058,6 +1060,99 @@ class Dirnode(GridTestMixin, unittest.TestCase,
         d.addCallback(_check_kids)  # again with dirnode recreated from cap
         return d
 
+    @defer.inlineCallbacks
+    def test_lazy_unpacking(self):
+        """
+        Looking up or changing one child of a directory only decrypts that
+        child's writecap, and leaves the others packed as they were.
+        """
+        self.basedir = "dirnode/Dirnode/test_lazy_unpacking"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        n = yield c.create_dirnode()
+        kids = {}
+        for i in range(10):
+            kids[u"kid%d" % i] = (make_mutable_file_uri(), None, {"i": i})
+        yield n.set_children(kids)
+        decrypted = []
+        original_decrypt = dirnode.DirectoryNode._decrypt_rwcapdata
+        def _decrypt_rwcapdata(node, encwrcap):
+            decrypted.append(encwrcap)
+            return original_decrypt(node, encwrcap)
+        self.patch(dirnode.DirectoryNode, "_decrypt_rwcapdata",
+                   _decrypt_rwcapdata)
+
+        child = yield n.get(u"kid3")
+        self.assertEqual(child.get_uri(), kids[u"kid3"][0])
+        self.assertTrue((yield n.has_child(u"kid4")))
+        self.assertFalse((yield n.has_child(u"nope")))
+        metadata = yield n.get_metadata_for(u"kid5")
+        self.assertEqual(metadata["i"], 5)
+        self.assertEqual(len(decrypted), 3)
+
+        del decrypted[:]
+        yield n.delete(u"kid6")
+        self.assertEqual(len(decrypted), 1)
+
+        children = yield n.list()
+        self.assertEqual(sorted(children), sorted(set(kids) - {u"kid6"}))
+        self.assertEqual(len(decrypted), 10)
+        for name in children:
+            self.assertEqual(children[name][0].get_uri(), kids[name][0])
+            self.assertEqual(children[name][1]["i"], kids[name][2]["i"])
+
+    @defer.inlineCallbacks
+    def test_coalesced_writes(self):
+        """
+        Changes made to a directory within ``[client]directory.write_window``
+        of each other are published together, and each succeeds or fails on
+        its own.
+        """
+        self.basedir = "dirnode/Dirnode/test_coalesced_writes"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        self.patch(c.nodemaker, "directory_write_window", 1.0)
+        n = yield c.create_dirnode()
+        self.assertEqual(n._writes.window, 1.0)
+        clock = Clock()
+        self.patch(n._writes, "_reactor", clock)
+        def counts():
+            stats = c.stats_provider.get_stats()["stats"]
+            return (stats["dirnode.write.batches"],
+                    stats["dirnode.write.changes"])
+        before = counts()
+        cap1 = make_mutable_file_uri()
+        cap2 = make_mutable_file_uri()
+        results = []
+        for d in [n.set_uri(u"one", cap1, None),
+                  n.set_uri(u"two", cap2, None),
+                  n.set_uri(u"one", cap2, None, overwrite=False),
+                  n.delete(u"nope")]:
+            d.addBoth(results.append)
+        self.assertEqual(results, [])
+        clock.advance(1.0)
+        while len(results) < 4:
+            yield fireEventually()
+        self.assertEqual([child.get_uri() for child in results[:2]],
+                         [cap1, cap2])
+        results[2].trap(dirnode.ExistingChildError)
+        results[3].trap(dirnode.NoSuchChildError)
+        self.assertEqual(counts(), (before[0] + 1, before[1] + 4))
+
+        children = yield n.list()
+        self.assertEqual(sorted(children), [u"one", u"two"])
+        self.assertEqual(children[u"one"][0].get_uri(), cap1)
+        self.assertEqual(children[u"two"][0].get_uri(), cap2)
+
+        # A batch where every change fails publishes nothing.
+        d = n.delete(u"nope")
+        d.addBoth(results.append)
+        clock.advance(1.0)
+        while len(results) < 5:
+            yield fireEventually()
+        results[4].trap(dirnode.NoSuchChildError)
+        self.assertEqual(counts(), (before[0] + 2, before[1] + 5))
+
     def test_check(self):
         self.basedir = "dirnode/Dirnode/test_check"
         self.set_up_grid(oneshare=True)
@@ -35,6 +35,7 @@ from allmydata.interfaces import NotEnoughSharesError, NoSharesError, \
 from allmydata.immutable.downloader.common import BadSegmentNumberError, \
      BadCiphertextHashError, COMPLETE, OVERDUE, DEAD
 from allmydata.immutable.downloader.status import DownloadStatus
+from allmydata.immutable.downloader.node import SegmentCache
 from allmydata.immutable.downloader.fetcher import SegmentFetcher
 from allmydata.codec import CRSDecoder
 from foolscap.eventual import eventually, fireEventually, flushEventualQueue
@@ -459,6 +460,89 @@ class DownloadTest(_Base, unittest.TestCase):
         return d
 
 
+    def _upload_five_segments(self):
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 70 # 5 segs
+        d = self.c0.upload(u)
+        def _uploaded(ur):
+            n = self.c0.create_node_from_uri(ur.get_uri())
+            n._cnode._maybe_create_download_node()
+            dn = n._cnode._node
+            requested = []
+            orig_get_segment = dn.get_segment
+            def get_segment(segnum, logparent=None):
+                requested.append(segnum)
+                return orig_get_segment(segnum, logparent)
+            dn.get_segment = get_segment
+            return (n, dn, requested)
+        d.addCallback(_uploaded)
+        return d
+
+    def test_readahead(self):
+        # a sequential read asks for the following segments before the
+        # consumer has received the current one
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        d = self._upload_five_segments()
+        def _read(res):
+            (n, dn, requested) = res
+            con = RecordingConsumer(requested)
+            d2 = n.read(con)
+            def _done(ign):
+                self.failUnlessEqual(b"".join(con.chunks), plaintext)
+                self.failUnlessEqual(sorted(requested), [0, 1, 2, 3, 4])
+                # segment 2 was requested before segment 1 was delivered
+                self.failUnless(len(con.requested_at_write[1]) > 2,
+                                con.requested_at_write)
+                self.failUnlessEqual(dn._segment_requests, [])
+            d2.addCallback(_done)
+            return d2
+        d.addCallback(_read)
+        return d
+
+    def test_readahead_limited(self):
+        # the read-ahead window never goes past READAHEAD_SEGMENTS, nor past
+        # the end of the requested range
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        d = self._upload_five_segments()
+        def _read(res):
+            (n, dn, requested) = res
+            dn.READAHEAD_SEGMENTS = 1
+            con = RecordingConsumer(requested)
+            d2 = n.read(con, 0, 200)
+            def _done(ign):
+                self.failUnlessEqual(b"".join(con.chunks), plaintext[:200])
+                self.failUnlessEqual(requested, [0, 1, 2])
+                for (i, r) in enumerate(con.requested_at_write):
+                    self.failUnless(len(r) <= i + 2, con.requested_at_write)
+            d2.addCallback(_done)
+            return d2
+        d.addCallback(_read)
+        return d
+
+    def test_readahead_cancelled_on_stop(self):
+        # segments we read ahead are cancelled when the consumer stops
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        d = self._upload_five_segments()
+        def _read(res):
+            (n, dn, requested) = res
+            con = RecordingConsumer(requested, stop_after=2)
+            d2 = self.shouldFail(DownloadStopped, "test_readahead_cancelled",
+                                 "our Consumer called stopProducing()",
+                                 n.read, con)
+            def _stopped(ign):
+                self.failUnless(len(requested) > 2, requested)
+                self.failUnlessEqual(dn._segment_requests, [])
+            d2.addCallback(_stopped)
+            return d2
+        d.addCallback(_read)
+        return d
+
     def test_simultaneous_get_blocks(self):
         self.basedir = self.mktemp()
         self.set_up_grid()
@@ -887,6 +971,95 @@ class DownloadTest(_Base, unittest.TestCase):
         d.addCallback(_got_ciphertext)
         return d
 
+    def test_cached_download_state(self):
+        # a second node for the same file reuses the DownloadNode of the
+        # first, so it asks no servers where the shares are
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        self.load_shares()
+
+        n1 = self.c0.create_node_from_uri(immutable_uri)
+        d = download_to_data(n1)
+        def _downloaded_once(data):
+            self.failUnlessEqual(data, plaintext)
+            self.node = n1._cnode._node
+            self.dyhb_count = len(self.node._download_status.dyhb_requests)
+            n2 = self.n2 = self.c0.create_node_from_uri(immutable_uri)
+            self.failIf(n2 is n1)
+            return download_to_data(n2)
+        d.addCallback(_downloaded_once)
+        def _downloaded_again(data):
+            self.failUnlessEqual(data, plaintext)
+            self.failUnlessEqual(len(self.node._download_status.dyhb_requests),
+                                 self.dyhb_count)
+            # the second read shows up in a DownloadStatus of its own
+            n2_status = self.n2._cnode._download_status
+            self.failIf(n2_status is self.node._download_status)
+            self.failUnlessEqual(len(n2_status.read_events), 1)
+            self.failUnlessIn(n2_status,
+                              list(self.c0.get_history().list_all_download_statuses()))
+            # now lose every share the remembered node knows about, and
+            # every server its ShareFinder has yet to ask: it has to look
+            # for the shares again
+            for s in self.node._shares:
+                s._rref.broken = True
+            self.node._sharefinder._servers = None
+            n3 = self.c0.create_node_from_uri(immutable_uri)
+            return download_to_data(n3)
+        d.addCallback(_downloaded_again)
+        def _rediscovered(data):
+            self.failUnlessEqual(data, plaintext)
+            self.failUnless(len(self.node._download_status.dyhb_requests)
+                            > self.dyhb_count)
+        d.addCallback(_rediscovered)
+        return d
+
+    def test_segment_cache(self):
+        # with a SegmentCache, reading a range of a segment that was read
+        # before doesn't fetch its blocks again
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        cache = SegmentCache(200)
+        self.patch(self.c0.nodemaker, "segment_cache", cache)
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 60 # 6 segs, the last 4 of which fit in the cache
+        d = self.c0.upload(u)
+        def _uploaded(ur):
+            self.n = self.c0.create_node_from_uri(ur.get_uri())
+            return download_to_data(self.n)
+        d.addCallback(_uploaded)
+        def _read_range(offset, size):
+            c = MemoryConsumer()
+            d = self.n.read(c, offset, size)
+            d.addCallback(lambda c: b"".join(c.chunks))
+            return d
+        def _downloaded(data):
+            self.failUnlessEqual(data, plaintext)
+            self.status = self.n._cnode._node._download_status
+            self.block_requests = len(self.status.block_requests)
+            self.hits = cache.hits
+            self.failUnless(cache.get_stats()["downloader.segment_cache.bytes"]
+                            <= 200)
+            # the last segments are still cached
+            return _read_range(250, 70)
+        d.addCallback(_downloaded)
+        def _read_cached(data):
+            self.failUnlessEqual(data, plaintext[250:320])
+            self.failUnlessEqual(len(self.status.block_requests),
+                                 self.block_requests)
+            self.failUnlessEqual(cache.hits, self.hits + 2)
+            # the first one was evicted
+            return _read_range(10, 20)
+        d.addCallback(_read_cached)
+        def _read_evicted(data):
+            self.failUnlessEqual(data, plaintext[10:30])
+            self.failUnless(len(self.status.block_requests)
+                            > self.block_requests)
+        d.addCallback(_read_evicted)
+        return d
+
 class BrokenDecoder(CRSDecoder):
     def decode(self, shares, shareids):
         d = CRSDecoder.decode(self, shares, shareids)
@@ -947,6 +1120,23 @@ class StallingConsumer(MemoryConsumer):
             self.halfway_cb()
         return MemoryConsumer.write(self, data)
 
+class RecordingConsumer(MemoryConsumer):
+    """
+    Remember which segments had been requested at the time of each write,
+    and optionally stop the producer after a number of writes.
+    """
+    def __init__(self, requested, stop_after=None):
+        MemoryConsumer.__init__(self)
+        self.requested = requested
+        self.requested_at_write = []
+        self.stop_after = stop_after
+    def write(self, data):
+        self.requested_at_write.append(list(self.requested))
+        if len(self.requested_at_write) == self.stop_after:
+            self.producer.stopProducing()
+            return
+        return MemoryConsumer.write(self, data)
+
 class Corruption(_Base, unittest.TestCase):
 
     def _corrupt_flip(self, ign, imm_uri, which):
@@ -1015,6 +1205,9 @@ class Corruption(_Base, unittest.TestCase):
         self.basedir = "download/Corruption/each_byte"
         self.set_up_grid()
         self.c0 = self.g.clients[0]
+        # each download below must start from a new DownloadNode, so don't
+        # let the client hand back the one it remembers
+        self.c0.nodemaker.download_cache = None
 
         # to exercise the block-hash-tree code properly, we need to have
         # multiple segments. We don't tell the downloader about the different
@@ -1157,6 +1350,9 @@ class Corruption(_Base, unittest.TestCase):
         self.basedir = "download/Corruption/failure"
         self.set_up_grid()
         self.c0 = self.g.clients[0]
+        # each download below must start from a new DownloadNode, so don't
+        # let the client hand back the one it remembers
+        self.c0.nodemaker.download_cache = None
 
         # to exercise the block-hash-tree code properly, we need to have
         # multiple segments. We don't tell the downloader about the different
@@ -13,7 +13,7 @@ from past.builtins import chr as byteschr, long
 
 from zope.interface import implementer
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 from twisted.python.failure import Failure
 from foolscap.api import fireEventually
 from allmydata import uri
@@ -360,6 +360,108 @@ class Encode(unittest.TestCase):
         return self.do_encode(25, 101, 100, 5, 15, 8)
 
 
+class Pipeline(unittest.TestCase):
+    """
+    Tests for overlapping segment encoding with block delivery.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+
+    @defer.inlineCallbacks
+    def encode(self, pipeline_depth, shareholders):
+        done = []
+        d = self._encode(pipeline_depth, shareholders)
+        d.addBoth(lambda res: done.append(res) or res)
+        # Let the shareholders accept their blocks, a tenth of a second at a
+        # time, until everything has been sent. Between those, give the
+        # encoder a few turns to get as far ahead as it is allowed to.
+        while not done:
+            for i in range(10):
+                yield fireEventually()
+            self.clock.advance(0.1)
+        yield d
+
+    def _encode(self, pipeline_depth, shareholders):
+        e = encode.Encoder(pipeline_depth=pipeline_depth)
+        u = upload.Data(make_data(100), convergence=b"some convergence string")
+        u.set_default_encoding_parameters({'max_segment_size': 25,
+                                           'k': 2, 'happy': 2, 'n': 2})
+        eu = upload.EncryptAnUploadable(u)
+        d = e.set_encrypted_uploadable(eu)
+        def _ready(res):
+            e.set_shareholders(
+                dict(enumerate(shareholders)),
+                {shnum: {peer.get_peerid()}
+                 for (shnum, peer) in enumerate(shareholders)},
+            )
+            orig_encode_segment = e._encode_segment
+            def _encode_segment(segnum, is_tail):
+                d = orig_encode_segment(segnum, is_tail)
+                def _encoded(res):
+                    for peer in shareholders:
+                        peer.encoded += 1
+                    return res
+                d.addCallback(_encoded)
+                return d
+            e._encode_segment = _encode_segment
+            return e.start()
+        d.addCallback(_ready)
+        return d
+
+    @defer.inlineCallbacks
+    def test_depth_bounds_segments_in_flight(self):
+        """
+        With a pipeline depth greater than one, later segments are encoded
+        while earlier blocks are still being sent, but never more than that
+        many segments ahead.  Each shareholder still gets one block at a time,
+        and every block ends up with its shareholder.
+        """
+        peers = [SlowBucketWriterProxy(self.clock, peerid="a"),
+                 SlowBucketWriterProxy(self.clock, peerid="b")]
+        yield self.encode(3, peers)
+        for peer in peers:
+            self.assertTrue(1 < peer.max_lead <= 3, peer.max_lead)
+            self.assertEqual(sorted(peer.blocks), [0, 1, 2, 3])
+            self.assertTrue(peer.closed)
+
+    @defer.inlineCallbacks
+    def test_depth_one_is_serial(self):
+        """
+        With a pipeline depth of 1, a segment's blocks are all delivered
+        before the next segment is encoded.
+        """
+        peers = [SlowBucketWriterProxy(self.clock, peerid="a"),
+                 SlowBucketWriterProxy(self.clock, peerid="b")]
+        yield self.encode(1, peers)
+        for peer in peers:
+            self.assertEqual(peer.max_lead, 1)
+            self.assertEqual(sorted(peer.blocks), [0, 1, 2, 3])
+
+
+class SlowBucketWriterProxy(FakeBucketReaderWriterProxy):
+    """
+    A bucket writer that takes a while to accept each block and, like
+    ``WriteBucketProxy``, refuses a new block before it has accepted the
+    previous one.  It also records how many segments the encoder had
+    encoded beyond each block it is sent.
+    """
+    def __init__(self, clock, *args, **kwargs):
+        FakeBucketReaderWriterProxy.__init__(self, *args, **kwargs)
+        self.clock = clock
+        self.pending = False
+        self.encoded = 0
+        self.max_lead = 0
+
+    def put_block(self, segmentnum, data):
+        assert not self.pending, "put_block while another one is pending"
+        self.pending = True
+        self.max_lead = max(self.max_lead, self.encoded - segmentnum)
+        def _accept():
+            self.pending = False
+            return FakeBucketReaderWriterProxy.put_block(self, segmentnum, data)
+        return task.deferLater(self.clock, 0.1, _accept)
+
+
 class Roundtrip(GridTestMixin, unittest.TestCase):
 
     # a series of 3*3 tests to check out edge conditions. One axis is how the
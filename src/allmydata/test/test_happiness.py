@@ -28,32 +28,26 @@ from allmydata.test.common import ShouldFailMixin
 
 class HappinessUploadUtils(unittest.TestCase):
     """
-    test-cases for happiness_upload utility functions augmenting_path_for and
-    residual_network.
+    test-cases for happiness_upload's flow graph and matching helpers.
     """
 
-    def test_residual_0(self):
-        graph = happiness_upload._servermap_flow_graph(
-            ['peer0'],
-            ['share0'],
-            servermap={
-                'peer0': ['share0'],
-            }
-        )
-        flow = [[0 for _ in graph] for _ in graph]
-
-        residual, capacity = happiness_upload.residual_network(graph, flow)
-
-        # XXX no idea if these are right; hand-verify
-        self.assertEqual(residual, [[1], [2], [3], []])
-        self.assertEqual(capacity, [[0, 1, 0, 0], [-1, 0, 1, 0], [0, -1, 0, 1], [0, 0, -1, 0]])
-
     def test_trivial_maximum_graph(self):
         self.assertEqual(
             {},
             happiness_upload._compute_maximum_graph([], {})
         )
 
+    def test_maximum_matching(self):
+        """
+        ``maximum_matching`` finds a maximum matching even when the first
+        matches it could make have to be undone to get there.
+        """
+        # Source 0, peers 1-3, shares 4-6 and sink 7: peer1 can hold share4
+        # or share5, peer2 only share4, and peer3 share5 or share6.
+        graph = [[1, 2, 3], [4, 5], [4], [5, 6], [7], [7], [7], []]
+        matching = happiness_upload.maximum_matching(graph)
+        self.assertEqual(matching, {4: 2, 5: 1, 6: 3})
+
     def test_trivial_flow_graph(self):
         self.assertEqual(
             [],
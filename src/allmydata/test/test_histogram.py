@@ -0,0 +1,114 @@
+"""
+Tests for allmydata.util.histogram.
+"""
+
+import math
+import random
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+
+from allmydata.util.histogram import (
+    EXPORT_BOUNDS, NUM_BUCKETS, Histogram, WindowedHistogram, bucket_bounds,
+    bucket_index,
+)
+
+
+class BucketTests(unittest.TestCase):
+    def test_bounds(self):
+        """
+        Every value lands in the bucket whose bounds contain it.
+        """
+        for value in [0.0, 1e-9, 1e-6, 0.001, 0.0123, 1.0, 1.5, 2.0, 300.0,
+                      1e9]:
+            index = bucket_index(value)
+            (lower, upper) = bucket_bounds(index)
+            self.assertTrue(lower <= value < upper, (value, lower, upper))
+        self.assertEqual(bucket_index(0.0), 0)
+        self.assertEqual(bucket_index(1e9), NUM_BUCKETS - 1)
+
+    def test_contiguous(self):
+        """
+        Buckets leave no gaps between them.
+        """
+        for index in range(NUM_BUCKETS - 1):
+            self.assertEqual(bucket_bounds(index)[1],
+                             bucket_bounds(index + 1)[0])
+
+
+class HistogramTests(unittest.TestCase):
+    def test_quantiles(self):
+        """
+        Quantiles are within a few percent of the real ones.
+        """
+        r = random.Random(0)
+        values = sorted(r.lognormvariate(-7, 1.5) for i in range(5000))
+        h = Histogram()
+        for value in values:
+            h.record(value)
+        self.assertEqual(h.count, 5000)
+        self.assertAlmostEqual(h.sum, math.fsum(values))
+        for q in [0.01, 0.1, 0.5, 0.9, 0.99, 0.999]:
+            exact = values[int(q * len(values))]
+            self.assertTrue(abs(h.quantile(q) - exact) <= 0.035 * exact,
+                            (q, h.quantile(q), exact))
+
+    def test_empty(self):
+        self.assertIs(Histogram().quantile(0.5), None)
+
+    def test_merge(self):
+        """
+        Merging histograms gives the histogram of all their values.
+        """
+        a = Histogram()
+        b = Histogram()
+        both = Histogram()
+        for i in range(100):
+            (a if i % 3 else b).record(i / 100.0)
+            both.record(i / 100.0)
+        a.merge(b)
+        self.assertEqual(list(a.buckets()), list(both.buckets()))
+        self.assertEqual((a.count, a.min, a.max), (100, 0.0, 0.99))
+
+    def test_cumulative_counts(self):
+        h = Histogram()
+        for value in [0.0001, 0.001, 0.001, 0.5, 100.0, 1e9]:
+            h.record(value)
+        counts = dict(zip(EXPORT_BOUNDS, h.cumulative_counts(EXPORT_BOUNDS)))
+        self.assertEqual(counts[2 ** -13], 1)
+        self.assertEqual(counts[2 ** -9], 3)
+        self.assertEqual(counts[0.5], 3)
+        self.assertEqual(counts[1.0], 4)
+        self.assertEqual(counts[EXPORT_BOUNDS[-1]], 5)
+
+
+class WindowedHistogramTests(unittest.TestCase):
+    def test_windows(self):
+        """
+        Each window covers the values recorded in about that much time.
+        """
+        clock = Clock()
+        h = WindowedHistogram(clock.seconds)
+        for i in range(120):
+            h.record(1.0)
+            clock.advance(30)
+        # One hour is up to a minute more, five minutes up to ten seconds.
+        self.assertIn(h.snapshot("1h").count, (120, 121, 122))
+        self.assertIn(h.snapshot("5m").count, (10, 11))
+        self.assertIn(h.snapshot("1m").count, (2, 3))
+        self.assertEqual(h.snapshot().count, 120)
+        clock.advance(2 * 60 * 60)
+        self.assertEqual(h.snapshot("1h").count, 0)
+        self.assertEqual(h.snapshot().count, 120)
+
+    def test_bounded(self):
+        """
+        Old slices are thrown away.
+        """
+        clock = Clock()
+        h = WindowedHistogram(clock.seconds)
+        for i in range(10000):
+            h.record(0.1)
+            clock.advance(5)
+        self.assertTrue(len(h._fine) <= WindowedHistogram.FINE[1] + 1)
+        self.assertTrue(len(h._coarse) <= WindowedHistogram.COARSE[1] + 1)
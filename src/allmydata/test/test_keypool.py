@@ -0,0 +1,119 @@
+"""
+Tests for allmydata.keypool.
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+
+from allmydata.crypto import rsa
+from allmydata.keypool import KeyPool
+
+
+class KeyPoolTests(unittest.TestCase):
+    """
+    Tests for ``KeyPool``.
+    """
+    @defer.inlineCallbacks
+    def wait_until_full(self, pool):
+        while len(pool._keys) < pool._size or pool._refilling:
+            yield task.deferLater(reactor, 0.05, lambda: None)
+
+    def start(self, pool):
+        pool.startService()
+        self.addCleanup(lambda: pool.running and pool.stopService())
+        return pool
+
+    def check_keypair(self, keypair):
+        (verifier, signer) = keypair
+        sig = rsa.sign_data(signer, b"data")
+        rsa.verify_signature(verifier, sig, b"data")
+
+    def test_not_running(self):
+        """
+        A pool that isn't running still creates keys, synchronously.
+        """
+        pool = KeyPool(2)
+        self.check_keypair(self.successResultOf(pool.generate()))
+        self.assertEqual(pool._keys, [])
+
+    @defer.inlineCallbacks
+    def test_generate(self):
+        """
+        A running pool fills up in the background, hands out keys from the
+        pool, and replaces the ones it hands out.
+        """
+        pool = self.start(KeyPool(2))
+        yield self.wait_until_full(pool)
+        pooled = pool._keys[0]
+        keypair = self.successResultOf(pool.generate())
+        self.assertEqual(keypair, (pooled[1], pooled[0]))
+        self.check_keypair(keypair)
+        self.assertTrue(pool._refilling)
+        yield self.wait_until_full(pool)
+        self.assertEqual(len(pool._keys), 2)
+
+    @defer.inlineCallbacks
+    def test_generate_empty(self):
+        """
+        When the pool is empty, keys are still made in a thread.
+        """
+        pool = self.start(KeyPool(1))
+        keypairs = yield defer.gatherResults([pool.generate() for i in range(3)])
+        for keypair in keypairs:
+            self.check_keypair(keypair)
+        self.assertEqual(len(set(keypairs)), 3)
+
+    @defer.inlineCallbacks
+    def test_stop_while_generating(self):
+        """
+        Stopping the pool while a key is being generated doesn't wait for it
+        on the reactor thread; the returned ``Deferred`` fires once the pool's
+        threads have finished.
+        """
+        pool = self.start(KeyPool(1))
+        self.assertTrue(pool._refilling)
+        d = pool.stopService()
+        self.assertFalse(pool.running)
+        yield d
+        self.assertTrue(pool._pool.joined)
+        self.assertEqual(pool._keys, [])
+
+    @defer.inlineCallbacks
+    def test_persist(self):
+        """
+        Spare keys are saved encrypted when the pool stops, and used (once)
+        by the next pool with the same secret.
+        """
+        path = self.mktemp()
+        pool = self.start(KeyPool(2, path, b"secret"))
+        yield self.wait_until_full(pool)
+        saved = [rsa.der_string_from_signing_key(signer)
+                 for (signer, verifier) in pool._keys]
+        yield pool.stopService()
+        with open(path, "rb") as f:
+            data = f.read()
+        for der in saved:
+            self.assertNotIn(der, data)
+
+        pool = self.start(KeyPool(2, path, b"secret"))
+        self.assertFalse(os.path.exists(path))
+        (verifier, signer) = self.successResultOf(pool.generate())
+        self.assertEqual(rsa.der_string_from_signing_key(signer), saved[0])
+        yield self.wait_until_full(pool)
+
+    @defer.inlineCallbacks
+    def test_persist_wrong_secret(self):
+        """
+        Spare keys that can't be decrypted are thrown away.
+        """
+        path = self.mktemp()
+        pool = self.start(KeyPool(1, path, b"secret"))
+        yield self.wait_until_full(pool)
+        yield pool.stopService()
+
+        pool = self.start(KeyPool(1, path, b"other secret"))
+        self.assertEqual(pool._keys, [])
+        self.assertFalse(os.path.exists(path))
+        yield self.wait_until_full(pool)
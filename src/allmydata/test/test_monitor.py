@@ -12,6 +12,7 @@ if PY2:
     from builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, dict, list, object, range, str, max, min  # noqa: F401
 
 from twisted.trial import unittest
+from twisted.internet import defer
 
 from allmydata.monitor import Monitor, OperationCancelledError
 
@@ -50,3 +51,54 @@ class MonitorTests(unittest.TestCase):
 
         d.addBoth(self.assertEqual, 300)
         return d
+
+    def test_server_requests(self):
+        """
+        Once limited, the monitor holds back requests to a server that has too
+        many outstanding, but not requests to other servers.
+        """
+        class Server(object):
+            def __init__(self, serverid):
+                self.serverid = serverid
+            def get_serverid(self):
+                return self.serverid
+        (one, two) = (Server(b"one"), Server(b"two"))
+        sent = []
+        def send(server, n):
+            d = defer.Deferred()
+            sent.append((server.serverid, n, d))
+            return d
+
+        m = Monitor()
+        m.server_request(one, send, one, 0)
+        m.server_request(one, send, one, 1)
+        self.assertEqual(len(sent), 2)
+
+        m = Monitor()
+        m.limit_server_requests(2)
+        sent[:] = []
+        results = [m.server_request(server, send, server, n)
+                   for (server, n) in [(one, 0), (one, 1), (one, 2), (two, 3)]]
+        self.assertEqual([(s, n) for (s, n, d) in sent],
+                         [(b"one", 0), (b"one", 1), (b"two", 3)])
+        sent[0][2].callback("zero")
+        self.assertEqual(self.successResultOf(results[0]), "zero")
+        self.assertEqual([(s, n) for (s, n, d) in sent[3:]], [(b"one", 2)])
+
+    def test_byte_budget(self):
+        """
+        The monitor hands out the same byte budget to everyone who asks for
+        it by name, created with the size first asked for.
+        """
+        m = Monitor()
+        budget = m.get_byte_budget("verify", 10)
+        self.assertIs(m.get_byte_budget("verify", 20), budget)
+        self.assertIsNot(m.get_byte_budget("other", 10), budget)
+        self.assertIsNot(Monitor().get_byte_budget("verify", 10), budget)
+
+        first = budget.acquire(6)
+        second = m.get_byte_budget("verify", 20).acquire(6)
+        self.successResultOf(first)
+        self.assertNoResult(second)
+        budget.release(6)
+        self.successResultOf(second)
@@ -34,6 +34,7 @@ from testtools.matchers import (
 )
 from testtools.content import text_content
 
+from allmydata.util.histogram import Histogram
 from allmydata.web.status import Statistics
 from allmydata.test.common import SyncTestCase
 
@@ -140,6 +141,21 @@ class FakeStatsProvider(object):
         return stats
 
 
+class FakeHistogramStatsProvider(FakeStatsProvider):
+    """
+    A stats provider that also has latency histograms.
+    """
+
+    def get_histograms(self):
+        read = Histogram()
+        for latency in [0.0001, 0.0002, 0.001, 0.5]:
+            read.record(latency)
+        return {
+            "storage_server.latencies.read": read,
+            "storage_server.latencies.write": Histogram(),
+        }
+
+
 class HackItResource(Resource, object):
     """
     A bridge between ``RequestTraversalAgent`` and ``MultiFormatResource``
@@ -170,6 +186,41 @@ class OpenMetrics(SyncTestCase):
         d = rta.request(b"GET", b"http://localhost/?t=openmetrics")
         self.assertThat(d, succeeded(matches_stats(self)))
 
+    def test_histograms(self):
+        """
+        Histograms are exported as OpenMetrics histograms.
+        """
+        root = HackItResource()
+        root.putChild(b"", Statistics(FakeHistogramStatsProvider()))
+        rta = RequestTraversalAgent(root)
+        d = rta.request(b"GET", b"http://localhost/?t=openmetrics")
+        self.assertThat(d, succeeded(matches_stats(self)))
+
+        d = rta.request(b"GET", b"http://localhost/?t=openmetrics")
+        d.addCallback(readBodyText)
+        d.addCallback(
+            lambda body: {
+                family.name: family
+                for family in parser.text_string_to_metric_families(body)
+            })
+        self.assertThat(
+            d,
+            succeeded(
+                AfterPreprocessing(
+                    lambda families: (
+                        families["tahoe_histograms_storage_server_latencies_read"].type,
+                        {
+                            sample.labels.get("le"): sample.value
+                            for sample in families["tahoe_histograms_storage_server_latencies_read"].samples
+                            if sample.name.endswith("_bucket")
+                        }["+Inf"],
+                        families["tahoe_histograms_storage_server_latencies_write"].type,
+                    ),
+                    Equals(("histogram", 4, "histogram")),
+                ),
+            ),
+        )
+
 
 def matches_stats(testcase):
     """
@@ -0,0 +1,261 @@
+"""
+Tests for allmydata.sharded_dirnode.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from allmydata import uri
+from allmydata.interfaces import NoSuchChildError, ExistingChildError
+from allmydata.mutable.common import NotWriteableError
+from allmydata.monitor import Monitor
+from allmydata.sharded_dirnode import ShardedDirectoryNode, shard_path
+from allmydata.test.common import make_mutable_file_uri
+from allmydata.test.no_network import GridTestMixin
+
+
+class ShardedDirectory(GridTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        GridTestMixin.setUp(self)
+        # Split early, so that small tests have several levels of shards.
+        self.patch(ShardedDirectoryNode, "max_leaf_entries", 3)
+
+    def _names(self, count):
+        # Enough names that share the first digit of their shard path to
+        # split a leaf below the root, as well as the root's own leaves.
+        names = [u"kid%d" % i for i in range(count)]
+        first = shard_path(names[0])[0]
+        i = count
+        while len([n for n in names if shard_path(n)[0] == first]) < 5:
+            name = u"extra%d" % i
+            if shard_path(name)[0] == first:
+                names.append(name)
+            i += 1
+        return names
+
+    @defer.inlineCallbacks
+    def test_children(self):
+        """
+        A sharded directory behaves like a directory, whatever shards its
+        children end up in.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_children"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        n = yield c.nodemaker.create_new_sharded_directory()
+        self.assertIsInstance(n, ShardedDirectoryNode)
+        self.assertTrue(n.get_uri().startswith(b"URI:DIR2-HAMT:"))
+        self.assertEqual((yield n.list()), {})
+
+        names = self._names(10)
+        caps = dict((name, make_mutable_file_uri()) for name in names)
+        for name in names[:5]:
+            yield n.set_uri(name, caps[name], None, metadata={"n": name})
+        yield n.set_children(dict((name, (caps[name], None, {"n": name}))
+                                  for name in names[5:]))
+
+        children = yield n.list()
+        self.assertEqual(sorted(children), sorted(names))
+        for name in names:
+            self.assertEqual(children[name][0].get_uri(), caps[name])
+            self.assertEqual(children[name][1]["n"], name)
+        shards = yield n._list_shards()
+        self.assertTrue(len(shards) > 4, shards)
+
+        child = yield n.get(names[7])
+        self.assertEqual(child.get_uri(), caps[names[7]])
+        self.assertTrue((yield n.has_child(names[2])))
+        self.assertFalse((yield n.has_child(u"nope")))
+        with self.assertRaises(NoSuchChildError):
+            yield n.get(u"nope")
+        with self.assertRaises(ExistingChildError):
+            yield n.set_uri(names[3], caps[names[4]], None, overwrite=False)
+
+        yield n.set_metadata_for(names[1], {"n": u"changed"})
+        metadata = yield n.get_metadata_for(names[1])
+        self.assertEqual(metadata["n"], u"changed")
+
+        old = yield n.delete(names[0])
+        self.assertEqual(old.get_uri(), caps[names[0]])
+        with self.assertRaises(NoSuchChildError):
+            yield n.delete(names[0])
+        yield n.delete(u"nope", must_exist=False)
+
+        visited = []
+        yield n.iterate_children(
+            lambda name, child, metadata: visited.append(name))
+        self.assertEqual(sorted(visited), sorted(names[1:]))
+
+    @defer.inlineCallbacks
+    def test_caps(self):
+        """
+        Sharded directories can be made from their caps, and their
+        read-only caps only give read access to every shard.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_caps"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        names = self._names(6)
+        kids = dict((name, (c.create_node_from_uri(make_mutable_file_uri()),
+                            {})) for name in names)
+        n = yield c.nodemaker.create_new_sharded_directory(kids)
+
+        rw = c.create_node_from_uri(n.get_uri())
+        self.assertIsInstance(rw, ShardedDirectoryNode)
+        self.assertFalse(rw.is_readonly())
+        self.assertEqual(sorted((yield rw.list())), sorted(names))
+
+        ro = c.create_node_from_uri(n.get_readonly_uri())
+        self.assertIsInstance(ro, ShardedDirectoryNode)
+        self.assertTrue(ro.is_readonly())
+        self.assertIsInstance(uri.from_string(ro.get_uri()),
+                              uri.ReadonlyShardedDirectoryURI)
+        children = yield ro.list()
+        self.assertEqual(sorted(children), sorted(names))
+        for (child, metadata) in children.values():
+            self.assertTrue(child.is_readonly())
+        with self.assertRaises(NotWriteableError):
+            yield ro.set_uri(u"new", make_mutable_file_uri(), None)
+        with self.assertRaises(NotWriteableError):
+            yield ro.delete(names[0])
+
+        self.assertIsInstance(n.get_verify_cap(),
+                              uri.ShardedDirectoryURIVerifier)
+        results = yield n.check(Monitor())
+        self.assertTrue(results.is_healthy())
+
+    @defer.inlineCallbacks
+    def test_deep_traversal(self):
+        """
+        Deep traversals see the children of a sharded directory, but not
+        its shards.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_deep_traversal"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        root = yield c.create_dirnode()
+        n = yield c.nodemaker.create_new_sharded_directory()
+        yield root.set_node(u"big", n)
+        names = self._names(6)
+        for name in names:
+            yield n.set_uri(name, make_mutable_file_uri(), None)
+        results = yield root.build_manifest().when_done()
+        paths = [path for (path, cap) in results["manifest"]]
+        self.assertEqual(sorted(paths),
+                         sorted([(), (u"big",)] +
+                                [(u"big", name) for name in names]))
+
+    def _name_like(self, name, depth, prefix):
+        # A name that belongs in the same shard as ``name`` at ``depth``.
+        digit = shard_path(name)[depth]
+        i = 0
+        while shard_path(u"%s%d" % (prefix, i))[depth] != digit:
+            i += 1
+        return u"%s%d" % (prefix, i)
+
+    @defer.inlineCallbacks
+    def test_split_concurrent_writer(self):
+        """
+        A child added to a leaf shard through another sharded directory node
+        while we split that leaf is not lost.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_split_concurrent_writer"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        n = yield c.nodemaker.create_new_sharded_directory()
+        yield n.set_uri(u"kid0", make_mutable_file_uri(), None)
+        (interior, depth, leaf) = yield n._find_leaf(u"kid0")
+        digit = shard_path(u"kid0")[depth]
+        sneaky = self._name_like(u"kid0", depth, u"sneaky")
+
+        writer = n._writes
+        original_create_shard = writer._create_shard
+        created = []
+        @defer.inlineCallbacks
+        def _create_shard(children):
+            if not created:
+                # The leaf is retired by now, so this finishes the split
+                # and then adds the child to the new leaf.
+                other = c.create_node_from_uri(n.get_uri())
+                yield other.set_uri(sneaky, make_mutable_file_uri(), None)
+            created.append(children)
+            shard = yield original_create_shard(children)
+            return shard
+        self.patch(writer, "_create_shard", _create_shard)
+        yield writer._split(interior, digit, depth, leaf)
+
+        children = yield n.list()
+        self.assertEqual(sorted(children), sorted([u"kid0", sneaky]))
+        (interior, new_depth, new_leaf) = yield n._find_leaf(sneaky)
+        self.assertEqual(new_depth, depth + 1)
+
+    @defer.inlineCallbacks
+    def test_split_late_writer(self):
+        """
+        A writer that found a leaf shard before it was split, and changes it
+        afterwards, makes its change in the shard that replaced it.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_split_late_writer"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        n = yield c.nodemaker.create_new_sharded_directory()
+        yield n.set_uri(u"kid0", make_mutable_file_uri(), None)
+        late = self._name_like(u"kid0", 0, u"late")
+
+        other = c.create_node_from_uri(n.get_uri())
+        stale = yield other._find_leaf(late)
+        (interior, depth, leaf) = yield n._find_leaf(u"kid0")
+        yield n._writes._split(interior, shard_path(u"kid0")[depth], depth,
+                               leaf)
+
+        original_find_leaf = other._find_leaf
+        found = []
+        def _find_leaf(name):
+            if not found:
+                found.append(name)
+                return defer.succeed(stale)
+            return original_find_leaf(name)
+        self.patch(other, "_find_leaf", _find_leaf)
+        yield other.set_uri(late, make_mutable_file_uri(), None)
+        yield other.delete(u"kid0")
+
+        children = yield n.list()
+        self.assertEqual(sorted(children), [late])
+        (interior, new_depth, new_leaf) = yield n._find_leaf(late)
+        self.assertEqual(new_depth, depth + 1)
+        old_children = yield leaf.list()
+        self.assertEqual(sorted(old_children), [u"", u"kid0"])
+
+    @defer.inlineCallbacks
+    def test_split_interrupted(self):
+        """
+        A split that stops after retiring its leaf shard is finished by the
+        next change to that leaf, and the children stay readable meanwhile.
+        """
+        self.basedir = "sharded_dirnode/ShardedDirectory/test_split_interrupted"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        n = yield c.nodemaker.create_new_sharded_directory()
+        yield n.set_uri(u"kid0", make_mutable_file_uri(), None)
+        (interior, depth, leaf) = yield n._find_leaf(u"kid0")
+
+        writer = n._writes
+        def _create_shard(children):
+            return defer.fail(ValueError("interrupted"))
+        patch = self.patch(writer, "_create_shard", _create_shard)
+        with self.assertRaises(ValueError):
+            yield writer._split(interior, shard_path(u"kid0")[depth], depth,
+                                leaf)
+        patch.restore()
+
+        self.assertEqual(sorted((yield n.list())), [u"kid0"])
+        self.assertFalse((yield n.has_child(u"")))
+        with self.assertRaises(NoSuchChildError):
+            yield n.get(u"")
+
+        other = self._name_like(u"kid0", depth, u"other")
+        yield n.set_uri(other, make_mutable_file_uri(), None)
+        self.assertEqual(sorted((yield n.list())), sorted([u"kid0", other]))
+        (interior, new_depth, new_leaf) = yield n._find_leaf(u"kid0")
+        self.assertEqual(new_depth, depth + 1)
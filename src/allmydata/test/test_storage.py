@@ -22,6 +22,7 @@ import platform
 import stat
 import struct
 import shutil
+import threading
 from functools import partial
 from uuid import uuid4
 
@@ -38,7 +39,7 @@ from hypothesis import given, strategies, example
 
 import itertools
 from allmydata import interfaces
-from allmydata.util import fileutil, hashutil, base32
+from allmydata.util import fileutil, hashutil, base32, pollmixin
 from allmydata.storage.server import (
     StorageServer, DEFAULT_RENEWAL_TIME, FoolscapStorageServer,
 )
@@ -58,6 +59,10 @@ from allmydata.storage.common import storage_index_to_dir, \
      UnknownMutableContainerVersionError, UnknownImmutableContainerVersionError, \
      si_b2a, si_a2b
 from allmydata.storage.lease import LeaseInfo
+from allmydata.storage.shareindex import ShareIndex
+from allmydata.storage.fdcache import FileHandleCache, _FullIO
+from allmydata.storage import durability
+from allmydata.storage.space import SpaceAccountant
 from allmydata.immutable.layout import WriteBucketProxy, WriteBucketProxy_v2, \
      ReadBucketProxy
 from allmydata.mutable.layout import MDMFSlotWriteProxy, MDMFSlotReadProxy, \
@@ -146,6 +151,8 @@ class Bucket(unittest.TestCase):
 
     def bucket_writer_closed(self, bw, consumed):
         pass
+    def index_share_leases(self, sharefile):
+        pass
     def add_latency(self, category, latency):
         pass
     def count(self, name, delta=1):
@@ -451,6 +458,8 @@ class BucketProxy(unittest.TestCase):
 
     def bucket_writer_closed(self, bw, consumed):
         pass
+    def index_share_leases(self, sharefile):
+        pass
     def add_latency(self, category, latency):
         pass
     def count(self, name, delta=1):
@@ -3277,6 +3286,690 @@ class MDMFProxies(unittest.TestCase, ShouldFailMixin):
         return d
 
 
+class ThreadedIO(unittest.TestCase):
+    """
+    Tests for a ``StorageServer`` that does share-file I/O on a thread pool.
+    """
+
+    def setUp(self):
+        self.sparent = LoggingServiceParent()
+        self.sparent.startService()
+    def tearDown(self):
+        return self.sparent.stopService()
+
+    def create(self, name):
+        workdir = os.path.join("storage", "ThreadedIO", name)
+        ss = StorageServer(workdir, b"\x00" * 20, io_threads=2)
+        ss.setServiceParent(self.sparent)
+        return ss
+
+    @defer.inlineCallbacks
+    def test_immutable(self):
+        """
+        Immutable writes, closes, lookups and reads all return ``Deferred``s
+        and end up with the same data on disk as synchronous I/O would.
+        """
+        ss = self.create("test_immutable")
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            b"si1", renew_secret, cancel_secret, {0, 1}, 100,
+        )
+        self.assertEqual((already, set(writers)), (set(), {0, 1}))
+        for shnum, bw in writers.items():
+            d = bw.write(0, bchr(shnum) * 60)
+            self.assertIsInstance(d, defer.Deferred)
+            self.assertFalse((yield d))
+            self.assertTrue((yield bw.write(60, bchr(shnum) * 40)))
+            yield bw.close()
+            self.assertTrue(bw.closed)
+
+        readers = yield ss.get_buckets(b"si1")
+        self.assertEqual(set(readers), {0, 1})
+        for shnum, br in readers.items():
+            data = yield br.read(0, 100)
+            self.assertEqual(data, bchr(shnum) * 100)
+
+        stats = ss.get_stats()
+        self.assertEqual(stats["storage_server.io.queue_depth"], 0)
+        self.assertTrue(stats["storage_server.io.max_queue_depth"] >= 1)
+        self.assertIn("io-wait", ss.get_latencies())
+
+    def allocate(self, ss):
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            b"si1", renew_secret, cancel_secret, {0}, 100,
+        )
+        return writers[0]
+
+    @defer.inlineCallbacks
+    def test_close_fails(self):
+        """
+        If moving the share into place fails, ``close`` fails and the writer
+        gives up the share and its allocated space.
+        """
+        ss = self.create("test_close_fails")
+        bw = self.allocate(ss)
+        yield bw.write(0, b"a" * 100)
+        def fail():
+            raise OSError("no room")
+        bw._move_into_place = fail
+        with self.assertRaises(OSError):
+            yield bw.close()
+        self.assertTrue(bw.closed)
+        self.assertFalse(os.path.exists(bw.incominghome))
+        self.assertEqual(ss.allocated_size(), 0)
+        self.flushLoggedErrors(OSError)
+
+    @defer.inlineCallbacks
+    def test_abort_after_writes(self):
+        """
+        ``abort`` waits for writes still queued on the pool before removing
+        the share.
+        """
+        ss = self.create("test_abort_after_writes")
+        bw = self.allocate(ss)
+        writes = [bw.write(i * 10, b"b" * 10) for i in range(10)]
+        yield bw.abort()
+        yield defer.gatherResults(writes)
+        self.assertTrue(bw.closed)
+        self.assertFalse(os.path.exists(bw.incominghome))
+        self.assertEqual(ss.allocated_size(), 0)
+
+    @defer.inlineCallbacks
+    def test_mutable(self):
+        """
+        Mutable test-and-write and read operations return ``Deferred``s that
+        fire with the same results as synchronous I/O would.
+        """
+        ss = self.create("test_mutable")
+        secrets = (
+            hashutil.tagged_hash(b"we_blah", b"we1"),
+            hashutil.tagged_hash(b"renew_blah", b"le1"),
+            hashutil.tagged_hash(b"cancel_blah", b"le1"),
+        )
+        d = ss.slot_testv_and_readv_and_writev(
+            b"si1", secrets, {0: ([], [(0, b"abcdefghij")], None)}, [],
+        )
+        self.assertIsInstance(d, defer.Deferred)
+        self.assertEqual((yield d), (True, {}))
+        # A failing test vector leaves the data alone.
+        result = yield ss.slot_testv_and_readv_and_writev(
+            b"si1", secrets,
+            {0: ([(0, 3, b"eq", b"xyz")], [(0, b"0123")], None)},
+            [(0, 3)],
+        )
+        self.assertEqual(result, (False, {0: [b"abc"]}))
+        self.assertEqual(
+            (yield ss.slot_readv(b"si1", [], [(2, 4)])),
+            {0: [b"cdef"]},
+        )
+        self.assertEqual((yield ss.enumerate_mutable_shares(b"si1")), {0})
+        self.assertEqual((yield ss.slot_readv(b"si2", [], [(0, 4)])), {})
+
+    @defer.inlineCallbacks
+    def test_same_key_in_order(self):
+        """
+        Calls submitted to the pool with the same key run one at a time in
+        submission order, while calls with other keys don't wait for them.
+        """
+        ss = self.create("test_same_key_in_order")
+        pool = ss._io_pool
+        blocker = threading.Event()
+        order = []
+
+        def first():
+            blocker.wait(10)
+            order.append("first")
+
+        d1 = pool.run(b"key", first)
+        d2 = pool.run(b"key", order.append, "second")
+        yield pool.run(b"other", order.append, "other")
+        self.assertEqual(order, ["other"])
+        blocker.set()
+        yield defer.gatherResults([d1, d2])
+        self.assertEqual(order, ["other", "first", "second"])
+
+
+    @defer.inlineCallbacks
+    def test_close_indexes_leases_on_pool(self):
+        """
+        The leases of a closed share are read for the lease index on the
+        pool, as part of the close.
+        """
+        workdir = os.path.join("storage", "ThreadedIO", "test_close_leases")
+        ss = StorageServer(workdir, b"\x00" * 20, io_threads=2,
+                           lease_index=True)
+        ss.setServiceParent(self.sparent)
+        threads = []
+        original = ss.index_share_leases
+        def index_share_leases(sharefile):
+            threads.append(threading.current_thread())
+            return original(sharefile)
+        ss.index_share_leases = index_share_leases
+        bw = self.allocate(ss)
+        yield bw.write(0, b"c" * 100)
+        yield bw.close()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.assertEqual(len(ss.lease_db.get_leases(bw.finalhome)), 1)
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        """
+        Stopping the pool waits for calls that were already submitted
+        without blocking the reactor, and later calls run right away.
+        """
+        ss = self.create("test_stop")
+        pool = ss._io_pool
+        blocker = threading.Event()
+        running = pool.run(b"key", blocker.wait, 10)
+        queued = pool.run(b"key", lambda: "queued")
+        stopped = pool.disownServiceParent()
+        self.assertNoResult(stopped)
+        blocker.set()
+        self.assertEqual((yield queued), "queued")
+        self.assertTrue((yield running))
+        yield stopped
+        self.assertEqual((yield pool.run(b"key", lambda: "after")), "after")
+
+class ShareIndexTests(unittest.TestCase, pollmixin.PollMixin):
+    """
+    Tests for a ``StorageServer`` that keeps an in-memory share index.
+    """
+
+    def setUp(self):
+        self.sparent = LoggingServiceParent()
+        self.sparent.startService()
+    def tearDown(self):
+        return self.sparent.stopService()
+
+    def create(self, name):
+        workdir = os.path.join("storage", "ShareIndexTests", name)
+        return StorageServer(workdir, b"\x00" * 20, share_index=True)
+
+    def write_immutable(self, ss, storage_index, shnum):
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            storage_index, renew_secret, cancel_secret, {shnum}, 10,
+        )
+        writers[shnum].write(0, b"x" * 10)
+        writers[shnum].close()
+
+    def test_index(self):
+        """
+        ``ShareIndex`` keeps track of share numbers per storage index, and
+        only rules storage indexes out once it is complete.
+        """
+        index = ShareIndex()
+        index.add(b"si1", 0)
+        index.add(b"si1", 3)
+        self.assertTrue(index.may_have(b"si2"))
+        index.complete = True
+        self.assertTrue(index.may_have(b"si1"))
+        self.assertFalse(index.may_have(b"si2"))
+        index.remove(b"si1", 0)
+        self.assertTrue(index.may_have(b"si1"))
+        index.remove(b"si1", 3)
+        self.assertFalse(index.may_have(b"si1"))
+        self.assertEqual(len(index), 0)
+
+    @defer.inlineCallbacks
+    def test_startup_crawl(self):
+        """
+        Shares that were on disk before the server started are found by the
+        crawler; until it is done, lookups still go to disk.
+        """
+        ss = self.create("test_startup_crawl")
+        self.write_immutable(ss, b"si1" * 5 + b"x", 2)
+        ss = self.create("test_startup_crawl")
+        self.assertFalse(ss.share_index.complete)
+        self.assertEqual([shnum for (shnum, fn) in ss.get_shares(b"si1" * 5 + b"x")],
+                         [2])
+        self.assertTrue(ss.have_shares())
+        ss.setServiceParent(self.sparent)
+        yield self.poll(lambda: ss.share_index.complete)
+        self.assertEqual(len(ss.share_index), 1)
+        self.assertTrue(ss.have_shares())
+        self.assertEqual([shnum for (shnum, fn) in ss.get_shares(b"si1" * 5 + b"x")],
+                         [2])
+
+    @defer.inlineCallbacks
+    def test_negative_lookups(self):
+        """
+        Once the index is complete, looking for shares the server doesn't
+        have doesn't touch the disk, and new and deleted shares are noticed.
+        """
+        ss = self.create("test_negative_lookups")
+        ss.setServiceParent(self.sparent)
+        yield self.poll(lambda: ss.share_index.complete)
+        self.assertFalse(ss.have_shares())
+
+        self.write_immutable(ss, b"i" * 16, 0)
+        secrets = (
+            hashutil.tagged_hash(b"we_blah", b"we1"),
+            hashutil.tagged_hash(b"renew_blah", b"le1"),
+            hashutil.tagged_hash(b"cancel_blah", b"le1"),
+        )
+        ss.slot_testv_and_readv_and_writev(
+            b"m" * 16, secrets, {1: ([], [(0, b"abcdefghij")], None)}, [],
+        )
+
+        def no_disk(*a, **kw):
+            raise AssertionError("looked at the disk")
+        listdir, isdir = os.listdir, os.path.isdir
+        self.patch(os, "listdir", no_disk)
+        self.patch(os.path, "isdir", no_disk)
+        self.assertEqual(list(ss.get_shares(b"x" * 16)), [])
+        self.assertEqual(ss.get_buckets(b"x" * 16), {})
+        self.assertEqual(ss.enumerate_mutable_shares(b"x" * 16), set())
+        self.assertEqual(ss.slot_readv(b"x" * 16, [], [(0, 10)]), {})
+        self.assertFalse(ss._share_exists(b"x" * 16, 0))
+        self.assertTrue(ss.have_shares())
+        self.patch(os, "listdir", listdir)
+        self.patch(os.path, "isdir", isdir)
+
+        self.assertEqual(set(ss.get_buckets(b"i" * 16)), {0})
+        self.assertEqual(ss.slot_readv(b"m" * 16, [], [(0, 3)]),
+                         {1: [b"abc"]})
+        ss.slot_testv_and_readv_and_writev(
+            b"m" * 16, secrets, {1: ([], [], 0)}, [],
+        )
+        self.assertFalse(ss.share_index.may_have(b"m" * 16))
+        self.assertEqual(len(ss.share_index), 1)
+
+
+class FileHandleCacheTests(unittest.TestCase):
+    """
+    Tests for ``FileHandleCache`` and a ``StorageServer`` that uses one.
+    """
+
+    def make_file(self, data=b"abcdef"):
+        path = self.mktemp()
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_reuse(self):
+        """
+        A handle is reused for the same file, positioned at the start, and a
+        writable handle can serve reads but not the other way around.
+        """
+        cache = FileHandleCache(2)
+        path = self.make_file()
+        with cache.open(path, "rb") as f:
+            self.assertEqual(f.read(3), b"abc")
+        with cache.open(path, "rb") as f:
+            self.assertEqual(f.read(3), b"abc")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with cache.open(path, "rb+") as f:
+            f.seek(3)
+            f.write(b"XYZ")
+        with cache.open(path, "rb") as f:
+            self.assertEqual(f.read(), b"abcXYZ")
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        stats = cache.get_stats()
+        self.assertEqual(stats["storage_server.fd_cache.hit_rate"], 0.5)
+        self.assertEqual(stats["storage_server.fd_cache.open_files"], 1)
+
+    def test_eviction(self):
+        """
+        Once full, the least recently used handle is closed to make room.
+        """
+        cache = FileHandleCache(2)
+        paths = [self.make_file() for i in range(3)]
+        handles = []
+        for path in paths[:2] + paths[:1] + paths[2:]:
+            with cache.open(path, "rb") as f:
+                handles.append(f)
+        self.assertEqual(list(cache._handles), [paths[0], paths[2]])
+        self.assertTrue(handles[1].closed)
+        self.assertFalse(handles[0].closed)
+        cache.clear()
+        self.assertTrue(handles[3].closed)
+        self.assertEqual(len(cache._handles), 0)
+
+    def test_invalidate(self):
+        """
+        ``invalidate`` closes the cached handle, and a handle that was in use
+        when its file was invalidated isn't put back.
+        """
+        cache = FileHandleCache(2)
+        path = self.make_file()
+        with cache.open(path, "rb") as f:
+            pass
+        cache.invalidate(path)
+        self.assertTrue(f.closed)
+        with cache.open(path, "rb") as f:
+            os.rename(path, path + ".new")
+            cache.invalidate(path)
+        self.assertTrue(f.closed)
+        self.assertEqual(len(cache._handles), 0)
+        self.assertEqual(cache._in_use, {})
+
+    def test_error(self):
+        """
+        A handle that was in use when an exception was raised is closed.
+        """
+        cache = FileHandleCache(2)
+        path = self.make_file()
+        with self.assertRaises(ValueError):
+            with cache.open(path, "rb") as f:
+                raise ValueError()
+        self.assertTrue(f.closed)
+        self.assertEqual(len(cache._handles), 0)
+
+    def test_short_reads_and_writes(self):
+        """
+        Reads and writes through a cached handle are complete even if the
+        underlying file only reads or writes a little at a time.
+        """
+        class Trickle(BytesIO):
+            def read(self, size=-1):
+                return BytesIO.read(self, min(size, 2))
+            def write(self, data):
+                return BytesIO.write(self, bytes(data[:2]))
+        f = _FullIO(Trickle())
+        self.assertEqual(f.write(b"abcdefg"), 7)
+        f.seek(0)
+        self.assertEqual(f.read(5), b"abcde")
+        self.assertEqual(f.read(5), b"fg")
+        self.assertEqual(f.read(5), b"")
+
+    def test_server(self):
+        """
+        A ``StorageServer`` with ``open_file_cache`` reuses share file
+        handles for immutable and mutable shares, closes them when shares
+        move or go away, and reports how well the cache works.
+        """
+        workdir = os.path.join("storage", "FileHandleCacheTests", "server")
+        ss = StorageServer(workdir, b"\x00" * 20, open_file_cache=10)
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            b"i" * 16, renew_secret, cancel_secret, {0}, 30,
+        )
+        for i in range(3):
+            writers[0].write(i * 10, b"%d" % i * 10)
+        self.assertEqual(list(ss._fd_cache._handles),
+                         [writers[0].incominghome])
+        writers[0].close()
+        self.assertEqual(len(ss._fd_cache._handles), 0)
+        reader = ss.get_buckets(b"i" * 16)[0]
+        self.assertEqual(reader.read(0, 30), b"0" * 10 + b"1" * 10 + b"2" * 10)
+        self.assertEqual(reader.read(10, 5), b"1" * 5)
+
+        secrets = (
+            hashutil.tagged_hash(b"we_blah", b"we1"),
+            hashutil.tagged_hash(b"renew_blah", b"le1"),
+            hashutil.tagged_hash(b"cancel_blah", b"le1"),
+        )
+        write = ss.slot_testv_and_readv_and_writev
+        write(b"m" * 16, secrets, {1: ([], [(0, b"abcdefghij")], None)}, [])
+        write(b"m" * 16, secrets, {1: ([(0, 3, b"eq", b"abc")],
+                                       [(3, b"DEF")], None)}, [])
+        self.assertEqual(ss.slot_readv(b"m" * 16, [], [(0, 10)]),
+                         {1: [b"abcDEFghij"]})
+        write(b"m" * 16, secrets, {1: ([], [], 0)}, [])
+        self.assertEqual(ss.slot_readv(b"m" * 16, [], [(0, 10)]), {})
+        self.assertEqual(list(ss._fd_cache._handles), [reader._share_file.home])
+
+        stats = ss.get_stats()
+        self.assertGreater(stats["storage_server.fd_cache.hits"], 5)
+        self.assertEqual(stats["storage_server.fd_cache.hit_rate"],
+                         ss._fd_cache.hits / (ss._fd_cache.hits +
+                                              ss._fd_cache.misses))
+
+
+class DurabilityTests(unittest.TestCase):
+    """
+    Tests for a ``StorageServer`` that flushes shares to disk.
+    """
+
+    def setUp(self):
+        self.sparent = LoggingServiceParent()
+        self.sparent.startService()
+        self.synced = []
+        self.patch(durability, "fsync_path", self.synced.append)
+    def tearDown(self):
+        return self.sparent.stopService()
+
+    def create(self, name, mode):
+        workdir = os.path.join("storage", "DurabilityTests", name)
+        return StorageServer(workdir, b"\x00" * 20, durability=mode)
+
+    def allocate(self, ss, storage_index, shnum):
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            storage_index, renew_secret, cancel_secret, {shnum}, 10,
+        )
+        writers[shnum].write(0, b"x" * 10)
+        return writers[shnum]
+
+    def writev(self, ss, datav, new_length=None):
+        secrets = (
+            hashutil.tagged_hash(b"we_blah", b"we1"),
+            hashutil.tagged_hash(b"renew_blah", b"le1"),
+            hashutil.tagged_hash(b"cancel_blah", b"le1"),
+        )
+        return ss.slot_testv_and_readv_and_writev(
+            b"m" * 16, secrets, {0: ([], datav, new_length)}, [],
+        )
+
+    def test_invalid(self):
+        """
+        An unknown durability mode is rejected.
+        """
+        with self.assertRaises(ValueError):
+            self.create("test_invalid", "sometimes")
+
+    def test_none(self):
+        """
+        By default nothing is flushed.
+        """
+        ss = self.create("test_none", "none")
+        self.allocate(ss, b"i" * 16, 0).close()
+        self.writev(ss, [(0, b"abc")])
+        self.assertEqual(self.synced, [])
+
+    def test_close(self):
+        """
+        With ``close``, a finished immutable share is flushed before it is
+        moved into place and its directories after, and mutable shares are
+        flushed after every write, along with their directories when shares
+        are added or removed.
+        """
+        ss = self.create("test_close", "close")
+        bw = self.allocate(ss, b"i" * 16, 0)
+        moved = []
+        self.patch(durability, "fsync_path",
+                   lambda path: moved.append(os.path.exists(bw.finalhome)))
+        # Without I/O threads, flushing happens before these return.
+        self.assertIs(bw.close(), None)
+        self.assertEqual(moved, [False, True, True, True])
+        self.patch(durability, "fsync_path", self.synced.append)
+
+        self.assertEqual(self.writev(ss, [(0, b"abc")]), (True, {}))
+        [sharefile] = [fn for (shnum, fn) in ss.get_shares(b"m" * 16)]
+        bucketdir = os.path.dirname(sharefile)
+        self.assertEqual(self.synced,
+                         [sharefile] + durability.bucket_directories(bucketdir))
+        del self.synced[:]
+        self.writev(ss, [(3, b"def")])
+        self.assertEqual(self.synced, [sharefile])
+        del self.synced[:]
+        self.writev(ss, [], 0)
+        self.assertEqual(self.synced, durability.bucket_directories(bucketdir))
+
+    @defer.inlineCallbacks
+    def test_group(self):
+        """
+        With ``group``, shares finished around the same time are flushed in
+        one batch, and closes only finish once it has been flushed.
+        """
+        ss = self.create("test_group", "group")
+        ss.setServiceParent(self.sparent)
+        writers = [self.allocate(ss, b"i" * 16, 0),
+                   self.allocate(ss, b"j" * 16, 0)]
+        closes = [bw.close() for bw in writers]
+        for d in closes:
+            self.assertNoResult(d)
+        yield defer.gatherResults(closes)
+        for bw in writers:
+            self.assertTrue(bw.closed)
+            self.assertTrue(os.path.exists(bw.finalhome))
+        self.assertEqual((ss._committer.batches, ss._committer.commits),
+                         (1, 2))
+        # The shares directory is only flushed once.
+        self.assertEqual(self.synced.count(ss.sharedir), 1)
+        self.assertEqual(self.synced[:2],
+                         [writers[0].incominghome, writers[1].incominghome])
+
+        d = self.writev(ss, [(0, b"abc")])
+        self.assertIsInstance(d, defer.Deferred)
+        result = yield d
+        self.assertEqual(result, (True, {}))
+        self.assertEqual(ss._committer.batches, 2)
+        stats = ss.get_stats()
+        self.assertEqual(stats["storage_server.commit.commits"], 3)
+        self.assertEqual(
+            stats["storage_server.latencies.commit.samplesize"], 2)
+
+    @defer.inlineCallbacks
+    def test_group_failure(self):
+        """
+        If flushing a batch fails, so does every close in it.
+        """
+        def fail(path):
+            raise OSError("disk on fire")
+        self.patch(durability, "fsync_path", fail)
+        ss = self.create("test_group_failure", "group")
+        ss.setServiceParent(self.sparent)
+        bw = self.allocate(ss, b"i" * 16, 0)
+        with self.assertRaises(OSError):
+            yield bw.close()
+        self.assertFalse(os.path.exists(bw.finalhome))
+        self.assertEqual(ss._committer.batches, 1)
+
+
+class SpaceAccountantTests(unittest.TestCase):
+    """
+    Tests for ``SpaceAccountant`` and how ``StorageServer`` uses it.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.disk = FakeDisk(total=2 ** 40, used=0)
+        self.calls = []
+        def get_disk_stats(whichdir, reserved_space):
+            self.calls.append(whichdir)
+            return self.disk.get_disk_stats(whichdir, reserved_space)
+        self.patch(fileutil, "get_disk_stats", get_disk_stats)
+
+    def test_cached(self):
+        """
+        The operating system is asked again after ``refresh_interval``
+        seconds, and what was written in between is taken away from the
+        cached answer.
+        """
+        space = SpaceAccountant("shares", 1000, self.clock)
+        self.assertEqual(space.get_available_space(), 2 ** 40 - 1000)
+        space.consumed(300)
+        self.disk.use(300)
+        self.assertEqual(space.get_available_space(), 2 ** 40 - 1300)
+        self.assertEqual(space.get_disk_stats()["used"], 300)
+        self.assertEqual(len(self.calls), 1)
+        self.disk.use(500)
+        self.clock.advance(space.refresh_interval)
+        self.assertEqual(space.get_available_space(), 2 ** 40 - 1800)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_close_to_full(self):
+        """
+        When less than ``slack`` bytes are available, the operating system is
+        asked every time.
+        """
+        self.disk.total = SpaceAccountant.slack // 2
+        space = SpaceAccountant("shares", 0, self.clock)
+        space.get_available_space()
+        self.disk.use(100)
+        self.assertEqual(space.get_available_space(),
+                         SpaceAccountant.slack // 2 - 100)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_errors(self):
+        """
+        Failing to get disk statistics means no space is available.
+        """
+        def fail(whichdir, reserved_space):
+            raise OSError("no")
+        self.patch(fileutil, "get_disk_stats", fail)
+        space = SpaceAccountant("shares", 0, self.clock)
+        self.assertEqual(space.get_available_space(), 0)
+        with self.assertRaises(OSError):
+            space.get_disk_stats()
+
+    def test_threads(self):
+        """
+        A thread asking for disk statistics while another is still waiting
+        for the operating system's answer waits for that answer too.
+        """
+        asking = threading.Event()
+        answer = threading.Event()
+        def get_disk_stats(whichdir, reserved_space):
+            self.calls.append(whichdir)
+            asking.set()
+            answer.wait(10)
+            return self.disk.get_disk_stats(whichdir, reserved_space)
+        self.patch(fileutil, "get_disk_stats", get_disk_stats)
+        space = SpaceAccountant("shares", 0, self.clock)
+
+        results = []
+        def ask():
+            try:
+                results.append(space.get_disk_stats()["avail"])
+            except Exception as e:
+                results.append(e)
+        first = threading.Thread(target=ask)
+        first.start()
+        self.assertTrue(asking.wait(10))
+        second = threading.Thread(target=ask)
+        second.start()
+        # Give the second thread a chance to get in the first one's way.
+        second.join(0.1)
+        answer.set()
+        first.join(10)
+        second.join(10)
+        self.assertEqual(results, [2 ** 40, 2 ** 40])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_server(self):
+        """
+        ``StorageServer`` keeps count of the space promised to uploads as
+        they start and finish, and takes shares it accepts away from cached
+        disk statistics.
+        """
+        workdir = os.path.join("storage", "SpaceAccountantTests", "server")
+        ss = StorageServer(workdir, b"\x00" * 20, clock=self.clock)
+        available = ss.get_available_space()
+        renew_secret = hashutil.my_renewal_secret_hash(b"1")
+        cancel_secret = hashutil.my_cancel_secret_hash(b"1")
+        already, writers = ss.allocate_buckets(
+            b"i" * 16, renew_secret, cancel_secret, {0, 1, 2}, 100,
+        )
+        self.assertEqual(ss.allocated_size(), 300)
+        writers[0].write(0, b"x" * 100)
+        writers[0].close()
+        writers[1].abort()
+        self.assertEqual(ss.allocated_size(), 100)
+        self.assertEqual(ss.get_available_space(),
+                         available - os.path.getsize(writers[0].finalhome))
+        self.assertEqual(len(self.calls), 1)
+
+
 class Stats(unittest.TestCase):
 
     def setUp(self):
@@ -3295,6 +3988,11 @@ class Stats(unittest.TestCase):
         ss.setServiceParent(self.sparent)
         return ss
 
+    def assertClose(self, actual, expected, output):
+        # Percentiles come from histogram buckets, which are about 6% wide.
+        self.failUnless(abs(actual - expected) <= 0.035 * expected + 1e-9,
+                        (actual, expected, output))
+
     def test_latencies(self):
         ss = self.create("test_latencies")
         for i in range(10000):
@@ -3311,47 +4009,47 @@ class Stats(unittest.TestCase):
 
         self.failUnlessEqual(sorted(output.keys()),
                              sorted(["allocate", "renew", "cancel", "write", "get"]))
-        self.failUnlessEqual(len(ss.latencies["allocate"]), 1000)
-        self.failUnless(abs(output["allocate"]["mean"] - 9500) < 1, output)
-        self.failUnless(abs(output["allocate"]["01_0_percentile"] - 9010) < 1, output)
-        self.failUnless(abs(output["allocate"]["10_0_percentile"] - 9100) < 1, output)
-        self.failUnless(abs(output["allocate"]["50_0_percentile"] - 9500) < 1, output)
-        self.failUnless(abs(output["allocate"]["90_0_percentile"] - 9900) < 1, output)
-        self.failUnless(abs(output["allocate"]["95_0_percentile"] - 9950) < 1, output)
-        self.failUnless(abs(output["allocate"]["99_0_percentile"] - 9990) < 1, output)
-        self.failUnless(abs(output["allocate"]["99_9_percentile"] - 9999) < 1, output)
-
-        self.failUnlessEqual(len(ss.latencies["renew"]), 1000)
+        self.failUnlessEqual(output["allocate"]["samplesize"], 10000)
+        self.failUnless(abs(output["allocate"]["mean"] - 4999.5) < 1, output)
+        self.assertClose(output["allocate"]["01_0_percentile"], 100, output)
+        self.assertClose(output["allocate"]["10_0_percentile"], 1000, output)
+        self.assertClose(output["allocate"]["50_0_percentile"], 5000, output)
+        self.assertClose(output["allocate"]["90_0_percentile"], 9000, output)
+        self.assertClose(output["allocate"]["95_0_percentile"], 9500, output)
+        self.assertClose(output["allocate"]["99_0_percentile"], 9900, output)
+        self.assertClose(output["allocate"]["99_9_percentile"], 9990, output)
+
+        self.failUnlessEqual(output["renew"]["samplesize"], 1000)
         self.failUnless(abs(output["renew"]["mean"] - 500) < 1, output)
-        self.failUnless(abs(output["renew"]["01_0_percentile"] -  10) < 1, output)
-        self.failUnless(abs(output["renew"]["10_0_percentile"] - 100) < 1, output)
-        self.failUnless(abs(output["renew"]["50_0_percentile"] - 500) < 1, output)
-        self.failUnless(abs(output["renew"]["90_0_percentile"] - 900) < 1, output)
-        self.failUnless(abs(output["renew"]["95_0_percentile"] - 950) < 1, output)
-        self.failUnless(abs(output["renew"]["99_0_percentile"] - 990) < 1, output)
-        self.failUnless(abs(output["renew"]["99_9_percentile"] - 999) < 1, output)
-
-        self.failUnlessEqual(len(ss.latencies["write"]), 20)
+        self.assertClose(output["renew"]["01_0_percentile"], 10, output)
+        self.assertClose(output["renew"]["10_0_percentile"], 100, output)
+        self.assertClose(output["renew"]["50_0_percentile"], 500, output)
+        self.assertClose(output["renew"]["90_0_percentile"], 900, output)
+        self.assertClose(output["renew"]["95_0_percentile"], 950, output)
+        self.assertClose(output["renew"]["99_0_percentile"], 990, output)
+        self.assertClose(output["renew"]["99_9_percentile"], 999, output)
+
+        self.failUnlessEqual(output["write"]["samplesize"], 20)
         self.failUnless(abs(output["write"]["mean"] - 9) < 1, output)
         self.failUnless(output["write"]["01_0_percentile"] is None, output)
-        self.failUnless(abs(output["write"]["10_0_percentile"] -  2) < 1, output)
-        self.failUnless(abs(output["write"]["50_0_percentile"] - 10) < 1, output)
-        self.failUnless(abs(output["write"]["90_0_percentile"] - 18) < 1, output)
-        self.failUnless(abs(output["write"]["95_0_percentile"] - 19) < 1, output)
+        self.assertClose(output["write"]["10_0_percentile"], 2, output)
+        self.assertClose(output["write"]["50_0_percentile"], 10, output)
+        self.assertClose(output["write"]["90_0_percentile"], 18, output)
+        self.assertClose(output["write"]["95_0_percentile"], 19, output)
         self.failUnless(output["write"]["99_0_percentile"] is None, output)
         self.failUnless(output["write"]["99_9_percentile"] is None, output)
 
-        self.failUnlessEqual(len(ss.latencies["cancel"]), 10)
+        self.failUnlessEqual(output["cancel"]["samplesize"], 10)
         self.failUnless(abs(output["cancel"]["mean"] - 9) < 1, output)
         self.failUnless(output["cancel"]["01_0_percentile"] is None, output)
-        self.failUnless(abs(output["cancel"]["10_0_percentile"] -  2) < 1, output)
-        self.failUnless(abs(output["cancel"]["50_0_percentile"] - 10) < 1, output)
-        self.failUnless(abs(output["cancel"]["90_0_percentile"] - 18) < 1, output)
+        self.assertClose(output["cancel"]["10_0_percentile"], 2, output)
+        self.assertClose(output["cancel"]["50_0_percentile"], 10, output)
+        self.assertClose(output["cancel"]["90_0_percentile"], 18, output)
         self.failUnless(output["cancel"]["95_0_percentile"] is None, output)
         self.failUnless(output["cancel"]["99_0_percentile"] is None, output)
         self.failUnless(output["cancel"]["99_9_percentile"] is None, output)
 
-        self.failUnlessEqual(len(ss.latencies["get"]), 1)
+        self.failUnlessEqual(output["get"]["samplesize"], 1)
         self.failUnless(output["get"]["mean"] is None, output)
         self.failUnless(output["get"]["01_0_percentile"] is None, output)
         self.failUnless(output["get"]["10_0_percentile"] is None, output)
@@ -3361,6 +4059,26 @@ class Stats(unittest.TestCase):
         self.failUnless(output["get"]["99_0_percentile"] is None, output)
         self.failUnless(output["get"]["99_9_percentile"] is None, output)
 
+    def test_latency_windows(self):
+        """
+        Latencies are reported for a recent window of time, and in full by
+        ``get_histograms``.
+        """
+        clock = Clock()
+        ss = StorageServer(self.workdir("test_latency_windows"), b"\x00" * 20,
+                           clock=clock)
+        ss.add_latency("read", 1.0)
+        clock.advance(10 * 60)
+        ss.add_latency("read", 3.0)
+        ss.add_latency("read", 3.0)
+        self.failUnlessEqual(ss.get_latencies()["read"]["samplesize"], 2)
+        self.failUnlessEqual(ss.get_latencies("1h")["read"]["samplesize"], 3)
+        self.failUnlessEqual(ss.get_latencies(None)["read"]["mean"], 7.0 / 3)
+        clock.advance(2 * 60 * 60)
+        self.failIf("read" in ss.get_latencies("1h"))
+        histogram = ss.get_histograms()["storage_server.latencies.read"]
+        self.failUnlessEqual((histogram.count, histogram.sum), (3, 7.0))
+
 immutable_schemas = strategies.sampled_from(list(ALL_IMMUTABLE_SCHEMAS))
 
 class ShareFileTests(unittest.TestCase):
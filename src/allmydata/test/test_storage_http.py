@@ -37,6 +37,7 @@ from werkzeug import routing
 from werkzeug.exceptions import NotFound as WNotFound
 
 from .common import SyncTestCase
+from ..storage_client import _HTTPStorageServer
 from ..storage.http_common import get_content_type, CBOR_MIME_TYPE
 from ..storage.common import si_b2a
 from ..storage.lease import LeaseInfo
@@ -446,6 +447,21 @@ class StorageClientWithHeadersOverride(object):
         return self.storage_client.request(*args, headers=headers, **kwargs)
 
 
+class RecordingStorageClient(object):
+    """Wrap ``StorageClient`` and record the method and path of requests."""
+
+    def __init__(self, storage_client, requests):
+        self.storage_client = storage_client
+        self.requests = requests
+
+    def __getattr__(self, attr):
+        return getattr(self.storage_client, attr)
+
+    def request(self, method, url, *args, **kwargs):
+        self.requests.append((method, "/".join(url.path)))
+        return self.storage_client.request(method, url, *args, **kwargs)
+
+
 @contextmanager
 def assert_fails_with_http_code(test_case: SyncTestCase, code: int):
     """
@@ -1199,6 +1215,81 @@ class MutableHTTPAPIsTests(SyncTestCase):
             self.create_upload(b"0123456789" * 1024 * 1024)
         self.assertEqual(e.exception.code, http.REQUEST_ENTITY_TOO_LARGE)
 
+    def test_read_share_chunks(self):
+        """
+        ``read_share_chunks()`` reads each range from each of the given shares
+        in a single request; an empty set of shares means all of them.
+        """
+        storage_index, _, _ = self.create_upload()
+        read_vector = [ReadVector(1, 3), ReadVector(6, 10)]
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.mut_client.read_share_chunks(storage_index, {1, 5}, read_vector)
+            ),
+            {1: [b"bcd", b"-1"]},
+        )
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.mut_client.read_share_chunks(storage_index, set(), read_vector)
+            ),
+            {0: [b"bcd", b"-0"], 1: [b"bcd", b"-1"]},
+        )
+
+    def test_read_share_chunks_unknown_storage_index(self):
+        """
+        ``read_share_chunks()`` returns nothing for a storage index with no
+        shares.
+        """
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.mut_client.read_share_chunks(
+                    urandom(16), set(), [ReadVector(0, 8)]
+                )
+            ),
+            {},
+        )
+
+    def test_slot_readv_batched(self):
+        """
+        ``_HTTPStorageServer.slot_readv()`` uses a single batched read per call
+        when the server advertises support for it, and one read per share and
+        range otherwise, with the same results either way.
+        """
+        storage_index, _, _ = self.create_upload()
+        requests = []
+        client = RecordingStorageClient(self.http.client, requests)
+        readv = [(0, 2), (3, 5)]
+        expected = {0: [b"ab", b"def-0"], 1: [b"ab", b"def-1"]}
+
+        server = _HTTPStorageServer.from_http_client(client)
+        for i in range(2):
+            self.assertEqual(
+                self.http.result_of_with_flush(
+                    server.slot_readv(storage_index, [], readv)
+                ),
+                expected,
+            )
+        # The version is only fetched once:
+        self.assertEqual(
+            requests,
+            [
+                ("GET", "v1/version"),
+                ("POST", "v1/mutable/{}/read".format(_encode_si(storage_index))),
+                ("POST", "v1/mutable/{}/read".format(_encode_si(storage_index))),
+            ],
+        )
+
+        del requests[:]
+        server = _HTTPStorageServer.from_http_client(client)
+        server._batched_readv = False
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                server.slot_readv(storage_index, [], readv)
+            ),
+            expected,
+        )
+        self.assertEqual(len(requests), 5)
+
     def test_list_shares(self):
         """``list_shares()`` returns the shares for a given storage index."""
         storage_index, _, _ = self.create_upload()
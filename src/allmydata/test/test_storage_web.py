@@ -902,6 +902,167 @@ class LeaseCrawler(unittest.TestCase, pollmixin.PollMixin):
         d.addCallback(_check_html)
         return d
 
+    def test_lease_index(self):
+        """
+        A server with a lease index records every lease it adds or renews
+        there, and forgets the shares that are deleted.
+        """
+        basedir = "storage/LeaseCrawler/lease_index"
+        fileutil.make_dirs(basedir)
+        ss = StorageServer(basedir, b"\x00" * 20, lease_index=True)
+        self.addCleanup(ss.lease_db.close)
+        self.make_shares(ss)
+        [immutable_si_0, immutable_si_1, mutable_si_2, mutable_si_3] = self.sis
+
+        def get_expiration_times(si):
+            [sf] = ss._iter_share_files(si)
+            self.failUnlessEqual(
+                ss.lease_db.get_leases(sf.home),
+                sorted(li.get_expiration_time() for li in sf.get_leases()),
+            )
+            return ss.lease_db.get_leases(sf.home)
+
+        for si, num_leases in zip(self.sis, [1, 2, 1, 2]):
+            self.failUnlessEqual(len(get_expiration_times(si)), num_leases)
+
+        [sf0] = ss._iter_share_files(immutable_si_0)
+        sf0.renew_lease(self.renew_secrets[0], 1000, allow_backdate=True)
+        ss.lease_checker.update_lease_index(sf0)
+        self.failUnlessEqual(get_expiration_times(immutable_si_0), [1000])
+        ss.renew_lease(immutable_si_0, self.renew_secrets[0])
+        self.failIfEqual(get_expiration_times(immutable_si_0), [1000])
+
+        # deleting a mutable share removes it from the index
+        [sf2] = ss._iter_share_files(mutable_si_2)
+        ss.slot_testv_and_readv_and_writev(
+            mutable_si_2,
+            (hashutil.tagged_hash(b"write-enabler", mutable_si_2),
+             self.renew_secrets[3], self.cancel_secrets[3]),
+            {0: ([], [], 0)}, [])
+        self.failUnlessEqual(ss.lease_db.get_leases(sf2.home), [])
+
+    def test_expire_from_index(self):
+        """
+        The lease checker can expire leases that the lease index points it
+        at, without crawling.
+        """
+        basedir = "storage/LeaseCrawler/expire_from_index"
+        fileutil.make_dirs(basedir)
+        ss = StorageServer(basedir, b"\x00" * 20,
+                           expiration_enabled=True,
+                           expiration_mode="age",
+                           expiration_override_lease_duration=2000,
+                           lease_index=True)
+        self.addCleanup(ss.lease_db.close)
+        lc = ss.lease_checker
+        self.make_shares(ss)
+        [immutable_si_0, immutable_si_1, mutable_si_2, mutable_si_3] = self.sis
+        self.failUnlessEqual(lc.expire_from_index(), [])
+
+        # Make the first lease on every share look 31 days + 1000s old; the
+        # extra leases on si_1 and si_3 are still fresh.
+        now = time.time()
+        sharefiles = {}
+        for si, renew_secret in zip(self.sis, [self.renew_secrets[i]
+                                               for i in (0, 1, 3, 4)]):
+            [sf] = ss._iter_share_files(si)
+            self.backdate_lease(sf, renew_secret, now - 1000)
+            lc.update_lease_index(sf)
+            sharefiles[si] = sf.home
+
+        self.failUnlessEqual(len(lc.expire_from_index()), 4)
+        self.failIf(os.path.exists(sharefiles[immutable_si_0]))
+        self.failIf(os.path.exists(sharefiles[mutable_si_2]))
+        self.failUnlessEqual(ss.lease_db.get_leases(sharefiles[immutable_si_0]),
+                             [])
+        for si in (immutable_si_1, mutable_si_3):
+            [sf] = ss._iter_share_files(si)
+            self.failUnlessEqual(len(list(sf.get_leases())), 1)
+            self.failUnlessEqual(len(ss.lease_db.get_leases(sf.home)), 1)
+        self.failUnlessEqual(lc.expire_from_index(), [])
+
+    def make_expired_index_shares(self, basedir):
+        fileutil.make_dirs(basedir)
+        ss = StorageServer(basedir, b"\x00" * 20,
+                           expiration_enabled=True,
+                           expiration_mode="age",
+                           expiration_override_lease_duration=2000,
+                           lease_index=True)
+        self.addCleanup(ss.lease_db.close)
+        self.make_shares(ss)
+        now = time.time()
+        for si, renew_secret in zip(self.sis, [self.renew_secrets[i]
+                                               for i in (0, 1, 3, 4)]):
+            [sf] = ss._iter_share_files(si)
+            self.backdate_lease(sf, renew_secret, now - 1000)
+            ss.lease_checker.update_lease_index(sf)
+        return ss
+
+    @defer.inlineCallbacks
+    def test_expire_from_index_in_batches(self):
+        """
+        The lease checker expires leases from the lease index a bounded
+        batch at a time, going back to the reactor in between.
+        """
+        ss = self.make_expired_index_shares(
+            "storage/LeaseCrawler/expire_from_index_in_batches")
+        lc = ss.lease_checker
+        lc.index_expiration_batch = 3
+        lc.running = True
+        batches = []
+        original = lc.expire_from_index
+        def expire_from_index(after, limit):
+            examined = original(after, limit)
+            batches.append(len(examined))
+            return examined
+        lc.expire_from_index = expire_from_index
+        yield lc.expire_all_from_index()
+        self.failUnlessEqual(batches, [3, 1])
+        self.failUnlessEqual(original(), [])
+
+    @defer.inlineCallbacks
+    def test_expire_from_index_error(self):
+        """
+        Unexpected errors while expiring from the lease index are logged
+        instead of stopping the periodic expiration.
+        """
+        ss = self.make_expired_index_shares(
+            "storage/LeaseCrawler/expire_from_index_error")
+        lc = ss.lease_checker
+        lc.running = True
+        def broken(*args, **kwargs):
+            raise ValueError("broken lease index")
+        ss.lease_db.get_expiration_candidates = broken
+        yield lc.expire_all_from_index()
+        self.failUnlessEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+    def test_lease_index_rebuild(self):
+        """
+        The lease checker fills in a lease index that is missing leases.
+        """
+        basedir = "storage/LeaseCrawler/lease_index_rebuild"
+        fileutil.make_dirs(basedir)
+        ss = StorageServer(basedir, b"\x00" * 20)
+        self.make_shares(ss)
+
+        ss = StorageServer(basedir, b"\x00" * 20, lease_index=True)
+        self.addCleanup(ss.lease_db.close)
+        lc = ss.lease_checker
+        lc.slow_start = 0
+        for si in self.sis:
+            [sf] = ss._iter_share_files(si)
+            self.failUnlessEqual(ss.lease_db.get_leases(sf.home), [])
+        ss.setServiceParent(self.s)
+
+        d = self.poll(lambda: lc.get_state()["last-cycle-finished"] is not None)
+        def _check(ignored):
+            for si, num_leases in zip(self.sis, [1, 2, 1, 2]):
+                [sf] = ss._iter_share_files(si)
+                self.failUnlessEqual(len(ss.lease_db.get_leases(sf.home)),
+                                     num_leases)
+        d.addCallback(_check)
+        return d
+
     def test_bad_mode(self):
         basedir = "storage/LeaseCrawler/bad_mode"
         fileutil.make_dirs(basedir)
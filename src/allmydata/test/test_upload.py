@@ -923,6 +923,56 @@ class FileHandleTests(unittest.TestCase):
             b"oBcuR/wKdCgCV2GKKXqiNg==",
         )
 
+    def test_get_encryption_key_spooled(self):
+        """
+        ``FileHandle.get_encryption_key`` uses the key ``ConvergentSpool``
+        hashed while the data was written, instead of reading the data
+        again, and gets the same key either way.
+        """
+        secret = b"\x42" * 16
+        params = {"k": 3, "happy": 5, "n": 10, "max_segment_size": 100}
+        data = b"spooled data " * 1000
+        f = upload.ConvergentSpool(BytesIO(), len(data), params, secret)
+        for i in range(0, len(data), 4000):
+            f.write(data[i:i+4000])
+        f.seek(0)
+        reads = []
+        original_read = f.read
+        self.patch(f, "read", lambda *a: reads.append(a) or original_read(*a))
+        handle = upload.FileHandle(f, secret)
+        handle.set_default_encoding_parameters(params)
+        key = self.successResultOf(handle.get_encryption_key())
+        self.assertEqual(reads, [])
+
+        rehashed = upload.FileHandle(BytesIO(data), secret)
+        rehashed.set_default_encoding_parameters(params)
+        self.assertEqual(key, self.successResultOf(rehashed.get_encryption_key()))
+        self.assertEqual(self.successResultOf(handle.read(len(data))), [data])
+
+    def test_get_encryption_key_spooled_mismatch(self):
+        """
+        If ``ConvergentSpool`` was given fewer bytes than it expected, or
+        different encoding parameters, ``FileHandle.get_encryption_key``
+        hashes the data itself.
+        """
+        secret = b"\x42" * 16
+        params = {"k": 3, "happy": 5, "n": 10, "max_segment_size": 100}
+        data = b"spooled data " * 1000
+        expected = upload.FileHandle(BytesIO(data), secret)
+        expected.set_default_encoding_parameters(params)
+        expected = self.successResultOf(expected.get_encryption_key())
+
+        short = upload.ConvergentSpool(BytesIO(), len(data) + 1, params, secret)
+        other = upload.ConvergentSpool(BytesIO(), len(data),
+                                       dict(params, k=2), secret)
+        for f in (short, other):
+            f.write(data)
+            f.seek(0)
+            handle = upload.FileHandle(f, secret)
+            handle.set_default_encoding_parameters(params)
+            self.assertEqual(
+                self.successResultOf(handle.get_encryption_key()), expected)
+
 
 class EncodingParameters(GridTestMixin, unittest.TestCase, SetDEPMixin,
     ShouldFailMixin):
@@ -2160,6 +2210,34 @@ class EncryptAnUploadableTests(unittest.TestCase):
             [1] * len(plaintext),
         )
 
+    def test_segment_sizes(self):
+        """
+        ``EncryptAnUploadable`` logs how many bytes went into each segment's
+        plaintext hash, including a short last segment.
+        """
+        plaintext = b"x" * 10
+        uploadable = upload.FileHandle(BytesIO(plaintext), None)
+        uploadable.set_default_encoding_parameters({
+            "k": 1,
+            "happy": 1,
+            "n": 1,
+            "max_segment_size": 4,
+        })
+        encrypter = upload.EncryptAnUploadable(uploadable)
+        messages = []
+        self.patch(encrypter, "log",
+                   lambda *args, **kwargs: messages.append(args[0] if args
+                                                           else None))
+        self.successResultOf(encrypter.read_encrypted(len(plaintext), True))
+        self.successResultOf(encrypter.get_plaintext_hashtree_leaves(0, 3, 3))
+        self.assertEqual(encrypter._plaintext_segment_sizes, [4, 4, 2])
+        self.assertEqual(
+            [m for m in messages if m and m.startswith("closed hash")],
+            ["closed hash [0]: 4B", "closed hash [1]: 4B"],
+        )
+        self.assertIn("closing plaintext leaf hasher, hashed 2 bytes",
+                      messages)
+
 
 # TODO:
 #  upload with exactly 75 servers (shares_of_happiness)
@@ -721,3 +721,35 @@ class Dirnode(testutil.ReallyEqualMixin, unittest.TestCase):
         self.failUnlessIsInstance(v4, uri.MDMFDirectoryURIVerifier)
         self.failIf(v4.is_mutable())
         self.failUnlessEqual(v4.to_string(), v3.to_string())
+
+    def test_sharded(self):
+        writekey = b"\x01" * 16
+        fingerprint = b"\x02" * 32
+        uri1 = uri.WriteableMDMFFileURI(writekey, fingerprint)
+        d1 = uri.ShardedDirectoryURI(uri1)
+        self.failIf(d1.is_readonly())
+        self.failUnless(d1.is_mutable())
+        self.failUnless(IDirnodeURI.providedBy(d1))
+        d1_uri = d1.to_string()
+        self.failUnless(d1_uri.startswith(b"URI:DIR2-HAMT:"))
+
+        d2 = uri.from_string(d1_uri)
+        self.failUnlessIsInstance(d2, uri.ShardedDirectoryURI)
+        self.failUnlessEqual(d2.get_filenode_cap().to_string(),
+                             uri1.to_string())
+        self.failUnlessIsInstance(uri.from_string(d1_uri, deep_immutable=True),
+                                  uri.UnknownURI)
+
+        ro = uri.from_string(d2.get_readonly().to_string())
+        self.failUnlessIsInstance(ro, uri.ReadonlyShardedDirectoryURI)
+        self.failUnless(ro.is_readonly())
+        self.failUnless(ro.is_mutable())
+        self.failUnlessIsInstance(
+            uri.from_string(b"ro." + d1_uri), uri.UnknownURI)
+
+        v1 = d1.get_verify_cap()
+        self.failUnlessIsInstance(v1, uri.ShardedDirectoryURIVerifier)
+        self.failIf(v1.is_mutable())
+        self.failUnlessEqual(ro.get_verify_cap().to_string(), v1.to_string())
+        v2 = uri.from_string(v1.to_string())
+        self.failUnlessIsInstance(v2, uri.ShardedDirectoryURIVerifier)
@@ -18,6 +18,7 @@ from six.moves import StringIO
 from bs4 import BeautifulSoup
 
 from twisted.web import resource
+from twisted.internet.defer import inlineCallbacks
 from allmydata import uri, dirnode
 from allmydata.util import base32
 from allmydata.util.encodingutil import to_bytes
@@ -1298,6 +1299,20 @@ class Grid(GridTestMixin, WebErrorMixin, ShouldFailMixin, testutil.ReallyEqualMi
 
         return d
 
+    @inlineCallbacks
+    def test_put_spooled(self):
+        """
+        A large ``PUT /uri`` body, hashed while it is spooled, is uploaded
+        with the same convergent key as the same data uploaded directly.
+        """
+        self.basedir = "web/Grid/put_spooled"
+        self.set_up_grid(oneshare=True)
+        c0 = self.g.clients[0]
+        DATA = b"spooled " * (200 * 1024)
+        cap = yield self.PUT("uri", data=DATA)
+        results = yield c0.upload(upload.Data(DATA, convergence=c0.convergence))
+        self.assertEqual(cap, results.get_uri())
+
     def test_blacklist(self):
         # download from a blacklisted URI, get an error
         self.basedir = "web/Grid/blacklist"
@@ -280,6 +280,7 @@ class FakeClient(_Client):  # type: ignore  # tahoe-lafs/ticket/3573
         self._secret_holder = SecretHolder(b"lease secret", b"convergence secret")
         self.helper = None
         self.convergence = b"some random string"
+        self.encoding_params = FakeNodeMaker.encoding_params.copy()
         self.storage_broker = StorageFarmBroker(
             permute_peers=True,
             tub_maker=None,
@@ -45,6 +45,12 @@ from twisted.python.runtime import (
 from twisted.python.filepath import (
     FilePath,
 )
+from twisted.internet.address import (
+    IPv4Address,
+)
+from twisted.internet.testing import (
+    StringTransport,
+)
 from twisted.web.test.requesthelper import (
     DummyChannel,
 )
@@ -56,6 +62,12 @@ from ..common import (
     SyncTestCase,
 )
 
+from ...immutable.upload import (
+    ConvergentSpool,
+)
+from ...util.hashutil import (
+    convergence_hasher,
+)
 from ...webish import (
     TahoeLAFSRequest,
     TahoeLAFSSite,
@@ -341,6 +353,122 @@ class TahoeLAFSSiteTests(SyncTestCase):
         """
         self._large_request_test(request_body_size)
 
+    def _create_upload_request(self, tempdir, method=b"PUT", uri=b"/uri"):
+        """
+        Like ``_create_request``, for a request with the given method and URI
+        whose site has convergence parameters.
+        """
+        request = self._create_request(tempdir)
+        request.channel._command = method
+        request.channel._path = uri
+        params = {"k": 3, "happy": 7, "n": 10, "max_segment_size": 120000}
+        request.channel.site.convergence_parameters = lambda: (params, b"secret")
+        return request
+
+    def test_convergent_large_request(self):
+        """
+        When ``TahoeLAFSSite`` has convergence parameters, the body of an
+        immutable upload of 1 MiB or more with a known length is hashed as it
+        is spooled.
+        """
+        tempdir = FilePath(self.mktemp())
+        tempdir.makedirs()
+        request = self._create_upload_request(tempdir)
+        body = b"x" * (1024 * 1024)
+        request.gotLength(len(body))
+        self.assertThat(request.content, IsInstance(ConvergentSpool))
+        request.handleContentChunk(body)
+        request.content.seek(0)
+        hasher = convergence_hasher(3, 10, 120000, b"secret")
+        hasher.update(body)
+        self.assertThat(
+            request.content.get_convergent_key(3, 10, 120000, b"secret"),
+            Equals(hasher.digest()),
+        )
+
+        request = self._create_upload_request(tempdir)
+        request.gotLength(None)
+        self.assertThat(request.content, Not(IsInstance(ConvergentSpool)))
+
+    def test_convergent_real_channel(self):
+        """
+        The method and URI that decide whether a body is hashed as it is
+        spooled come from the ``HTTPChannel`` that parses the request, before
+        any of its body arrives.
+        """
+        tempdir = FilePath(self.mktemp())
+        tempdir.makedirs()
+        params = {"k": 3, "happy": 7, "n": 10, "max_segment_size": 120000}
+        site = TahoeLAFSSite(
+            tempdir.path, Resource(), logPath=self.mktemp(),
+            convergence_parameters=lambda: (params, b"secret"),
+        )
+        site.startFactory()
+        contents = []
+        def getContentFile(length, method=None, uri=None):
+            contents.append(TahoeLAFSSite.getContentFile(
+                site, length, method, uri))
+            return contents[-1]
+        site.getContentFile = getContentFile
+        for (request_line, convergent) in [
+                (b"PUT /uri HTTP/1.1", True),
+                (b"PUT /uri?t=mkdir HTTP/1.1", False),
+        ]:
+            del contents[:]
+            channel = site.buildProtocol(IPv4Address("TCP", "127.0.0.1", 0))
+            channel.makeConnection(StringTransport())
+            channel.dataReceived(
+                request_line + b"\r\n"
+                b"Host: example.com\r\n"
+                b"Content-Length: 1048576\r\n"
+                b"\r\n"
+            )
+            [content] = contents
+            self.assertThat(
+                isinstance(content, ConvergentSpool),
+                Equals(convergent),
+                request_line,
+            )
+            channel.connectionLost(None)
+
+    def test_convergent_only_immutable_uploads(self):
+        """
+        Only the bodies of immutable uploads are hashed as they are spooled.
+        """
+        tempdir = FilePath(self.mktemp())
+        tempdir.makedirs()
+        for (method, uri, convergent) in [
+                (b"PUT", b"/uri/URI:DIR2:a:b/file", True),
+                (b"PUT", b"/uri?format=chk", True),
+                (b"PUT", b"/uri?format=MDMF", False),
+                (b"PUT", b"/uri?mutable=true", False),
+                (b"PUT", b"/uri?t=mkdir", False),
+                (b"PUT", b"/uri/URI:DIR2:a:b?t=uri", False),
+                (b"PUT", b"/storage-plugins/x", False),
+                (b"POST", b"/uri?t=upload", False),
+        ]:
+            request = self._create_upload_request(tempdir, method, uri)
+            request.gotLength(1024 * 1024)
+            self.assertThat(
+                isinstance(request.content, ConvergentSpool),
+                Equals(convergent),
+                "%r %r" % (method, uri),
+            )
+
+    def test_convergence_parameters_fail(self):
+        """
+        If the convergence parameters can't be found, the body of an
+        immutable upload is spooled without being hashed.
+        """
+        tempdir = FilePath(self.mktemp())
+        tempdir.makedirs()
+        request = self._create_upload_request(tempdir)
+        def broken():
+            raise AttributeError("no encoding parameters")
+        request.channel.site.convergence_parameters = broken
+        request.gotLength(1024 * 1024)
+        self.assertThat(request.content, Not(IsInstance(ConvergentSpool)))
+
 
 def param(name, value):
     return u"; {}={}".format(name, value)
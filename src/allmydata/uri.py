@@ -702,6 +702,88 @@ class MDMFDirectoryURIVerifier(_DirectoryBaseURI):
         return self
 
 
+@implementer(IURI, IDirectoryURI)
+class ShardedDirectoryURI(_DirectoryBaseURI):
+    """
+    A directory whose children are spread over a tree of MDMF directories
+    (see allmydata.sharded_dirnode). The inner MDMF file is the root of
+    that tree.
+    """
+
+    BASE_STRING=b'URI:DIR2-HAMT:'
+    BASE_STRING_RE=re.compile(b'^'+BASE_STRING)
+    INNER_URI_CLASS=WriteableMDMFFileURI
+
+    def __init__(self, filenode_uri=None):
+        if filenode_uri:
+            assert not filenode_uri.is_readonly()
+        _DirectoryBaseURI.__init__(self, filenode_uri)
+
+    def is_readonly(self):
+        return False
+
+    def get_readonly(self):
+        return ReadonlyShardedDirectoryURI(self._filenode_uri.get_readonly())
+
+    def get_verify_cap(self):
+        return ShardedDirectoryURIVerifier(self._filenode_uri.get_verify_cap())
+
+
+@implementer(IURI, IReadonlyDirectoryURI)
+class ReadonlyShardedDirectoryURI(_DirectoryBaseURI):
+
+    BASE_STRING=b'URI:DIR2-HAMT-RO:'
+    BASE_STRING_RE=re.compile(b'^'+BASE_STRING)
+    INNER_URI_CLASS=ReadonlyMDMFFileURI
+
+    def __init__(self, filenode_uri=None):
+        if filenode_uri:
+            assert filenode_uri.is_readonly()
+        _DirectoryBaseURI.__init__(self, filenode_uri)
+
+    def is_readonly(self):
+        return True
+
+    def get_readonly(self):
+        return self
+
+    def get_verify_cap(self):
+        return ShardedDirectoryURIVerifier(self._filenode_uri.get_verify_cap())
+
+
+def wrap_sharded_dirnode_cap(filecap):
+    if isinstance(filecap, WriteableMDMFFileURI):
+        return ShardedDirectoryURI(filecap)
+    if isinstance(filecap, ReadonlyMDMFFileURI):
+        return ReadonlyShardedDirectoryURI(filecap)
+    raise AssertionError("cannot interpret as a sharded directory cap: %s" % filecap.__class__)
+
+
+@implementer(IURI, IVerifierURI)
+class ShardedDirectoryURIVerifier(_DirectoryBaseURI):
+
+    BASE_STRING=b'URI:DIR2-HAMT-Verifier:'
+    BASE_STRING_RE=re.compile(b'^'+BASE_STRING)
+    INNER_URI_CLASS=MDMFVerifierURI
+
+    def __init__(self, filenode_uri=None):
+        if filenode_uri:
+            _assert(IVerifierURI.providedBy(filenode_uri))
+        self._filenode_uri = filenode_uri
+
+    def get_filenode_cap(self):
+        return self._filenode_uri
+
+    def is_mutable(self):
+        return False
+
+    def is_readonly(self):
+        return True
+
+    def get_readonly(self):
+        return self
+
+
 @implementer(IURI, IVerifierURI)
 class DirectoryURIVerifier(_DirectoryBaseURI):
 
@@ -830,6 +912,16 @@ def from_string(u, deep_immutable=False, name=u"<unknown name>"):
             kind = "URI:DIR2-MDMF-RO readcap to a mutable directory"
         elif s.startswith(b'URI:DIR2-MDMF-Verifier:'):
             return MDMFDirectoryURIVerifier.init_from_string(s)
+        elif s.startswith(b'URI:DIR2-HAMT:'):
+            if can_be_writeable:
+                return ShardedDirectoryURI.init_from_string(s)
+            kind = "URI:DIR2-HAMT directory writecap"
+        elif s.startswith(b'URI:DIR2-HAMT-RO:'):
+            if can_be_mutable:
+                return ReadonlyShardedDirectoryURI.init_from_string(s)
+            kind = "URI:DIR2-HAMT-RO readcap to a mutable directory"
+        elif s.startswith(b'URI:DIR2-HAMT-Verifier:'):
+            return ShardedDirectoryURIVerifier.init_from_string(s)
         elif s.startswith(b'x-tahoe-future-test-writeable:') and not can_be_writeable:
             # For testing how future writeable caps would behave in read-only contexts.
             kind = "x-tahoe-future-test-writeable: testing cap"
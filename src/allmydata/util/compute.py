@@ -0,0 +1,73 @@
+"""
+A shared thread pool for CPU-bound work: erasure coding, encryption and
+hashing.
+
+zfec, ``cryptography`` and ``hashlib`` all release the GIL while they work on
+large buffers, so running that work on a handful of threads lets concurrent
+uploads and downloads use more than one core, and keeps the reactor free to
+serve other requests in the meantime.
+
+Each client that has ``[client]compute.threads`` set starts its own
+``ComputePool`` and hands it to the code that does this work for it. Given
+``None``, or a pool that is not running, ``defer_to_compute`` simply calls the
+function right away.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+from twisted.application import service
+from twisted.internet import defer, reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+def have_compute_pool(pool: Optional[ComputePool]) -> bool:
+    """
+    :return: Whether ``defer_to_compute`` will run things in threads of
+        ``pool``.
+    """
+    return pool is not None and pool.running
+
+
+def defer_to_compute(pool: Optional[ComputePool], f: Callable,
+                     *args, **kwargs) -> defer.Deferred:
+    """
+    Call ``f(*args, **kwargs)`` on ``pool`` if it is running, otherwise
+    synchronously.
+
+    ``f`` must not touch reactor-thread-only state (logging included) unless
+    the caller serializes calls itself.
+
+    :return: A ``Deferred`` that fires with the result of ``f``.  When there
+        is no running pool it has already fired by the time it is returned.
+    """
+    if not have_compute_pool(pool):
+        return defer.maybeDeferred(f, *args, **kwargs)
+    return deferToThreadPool(pool._reactor, pool._pool, f, *args, **kwargs)
+
+
+class ComputePool(service.Service):
+    """
+    A thread pool for ``defer_to_compute``, used while I am running.
+    """
+    name = "compute"
+
+    def __init__(self, threads: int, reactor=reactor):
+        """
+        :param threads: The maximum number of threads to run work on.
+        """
+        assert threads > 0, threads
+        self._reactor = reactor
+        self._pool = ThreadPool(minthreads=0, maxthreads=threads,
+                                name="tahoe-compute")
+
+    def startService(self):
+        self._pool.start()
+        service.Service.startService(self)
+
+    def stopService(self):
+        d = service.Service.stopService(self)
+        self._pool.stop()
+        return d
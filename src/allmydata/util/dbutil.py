@@ -26,16 +26,19 @@ class DBError(Exception):
 
 def get_db(dbfile, stderr=sys.stderr,
            create_version=(None, None), updaters={}, just_create=False, dbname="db",
+           check_same_thread=True,
            ):
     """Open or create the given db file. The parent directory must exist.
     create_version=(SCHEMA, VERNUM), and SCHEMA must have a 'version' table.
     Updaters is a {newver: commands} mapping, where e.g. updaters[2] is used
-    to get from ver=1 to ver=2. Returns a (sqlite3,db) tuple, or raises
+    to get from ver=1 to ver=2. Pass check_same_thread=False if the
+    connection will be used from more than one thread (the caller must then
+    serialize access to it). Returns a (sqlite3,db) tuple, or raises
     DBError.
     """
     must_create = not os.path.exists(dbfile)
     try:
-        db = sqlite3.connect(dbfile)
+        db = sqlite3.connect(dbfile, check_same_thread=check_same_thread)
     except (EnvironmentError, sqlite3.OperationalError) as e:
         raise DBError("Unable to create/open %s file %s: %s" % (dbname, dbfile, e))
 
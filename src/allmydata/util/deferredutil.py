@@ -5,6 +5,7 @@ Ported to Python 3.
 """
 
 import time
+from collections import deque
 from functools import wraps
 
 from typing import (
@@ -116,6 +117,67 @@ def eventual_chain(source, target):
     source.addCallbacks(eventually_callback(target), eventually_errback(target))
 
 
+class KeyedLimiter(object):
+    """
+    I run calls so that no more than ``limit`` of the ones made with the same
+    key are running at once. The rest wait their turn, in the order they
+    were made.
+    """
+
+    def __init__(self, limit: int):
+        assert limit > 0, limit
+        self._limit = limit
+        self._semaphores = {}
+
+    def run(self, key, f: Callable[..., Any], *args, **kwargs) -> defer.Deferred:
+        """
+        Call ``f(*args, **kwargs)`` once fewer than ``limit`` calls with
+        ``key`` are running.
+
+        :return: A ``Deferred`` that fires with the result of the call.
+        """
+        if key not in self._semaphores:
+            self._semaphores[key] = defer.DeferredSemaphore(self._limit)
+        return self._semaphores[key].run(f, *args, **kwargs)
+
+
+class ByteBudget(object):
+    """
+    I hand out a budget of bytes, in the order they are asked for. A request
+    bigger than the whole budget is let through once nothing else is
+    outstanding.
+    """
+
+    def __init__(self, max_bytes: int):
+        assert max_bytes > 0, max_bytes
+        self._max_bytes = max_bytes
+        self._used = 0
+        self._waiting = deque() # (size, Deferred)
+
+    def acquire(self, size: int) -> defer.Deferred:
+        """
+        Return a ``Deferred`` that fires once ``size`` bytes of the budget
+        are the caller's. Give them back with ``release``.
+        """
+        d = defer.Deferred()
+        self._waiting.append((size, d))
+        self._grant()
+        return d
+
+    def release(self, size: int) -> None:
+        self._used -= size
+        self._grant()
+
+    def _grant(self):
+        while self._waiting:
+            (size, d) = self._waiting[0]
+            if self._used and self._used + size > self._max_bytes:
+                return
+            self._waiting.popleft()
+            self._used += size
+            d.callback(None)
+
+
 class HookMixin(object):
     """
     I am a helper mixin that maintains a collection of named hooks, primarily
@@ -79,6 +79,100 @@ class AuxValueDict(dict):
         self.auxilliary[key] = auxilliary
 
 
+class LazyAuxValueDict(AuxValueDict):
+    """I am an AuxValueDict whose main values can be made when they are
+    first needed rather than up front.
+
+    Set a key with set_lazily(key, pending, auxilliary), and the first time
+    the key is looked up I will call load(key, pending) to make its value.
+    If load() returns None the key is dropped, as if it had never been set.
+    Looking up one key only loads that key; anything that needs every key
+    (iterating, len(), comparing, ...) loads them all first.
+
+    This lets a directory node look up one child of a big directory without
+    decrypting and parsing all the others."""
+
+    def __init__(self, load):
+        super(LazyAuxValueDict, self).__init__()
+        self._load_value = load
+        self._pending = {}
+
+    def set_lazily(self, key, pending, auxilliary):
+        dict.pop(self, key, None)
+        self._pending[key] = pending
+        self.auxilliary[key] = auxilliary
+
+    def is_loaded(self, key):
+        return key not in self._pending
+
+    def all_keys(self):
+        """Return every key without loading any values, including keys that
+        loading might yet drop."""
+        return list(dict.keys(self)) + list(self._pending)
+
+    def _load(self, key):
+        if key not in self._pending:
+            return
+        value = self._load_value(key, self._pending.pop(key))
+        if value is None:
+            self.auxilliary.pop(key, None)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def _load_all(self):
+        for key in list(self._pending):
+            self._load(key)
+
+    def __getitem__(self, key):
+        self._load(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._load(key)
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self._load(key)
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        super(LazyAuxValueDict, self).__setitem__(key, value)
+
+    def set_with_aux(self, key, value, auxilliary):
+        self._pending.pop(key, None)
+        super(LazyAuxValueDict, self).set_with_aux(key, value, auxilliary)
+
+    def __delitem__(self, key):
+        self._load(key)
+        super(LazyAuxValueDict, self).__delitem__(key)
+
+    def pop(self, key, *default):
+        self._load(key)
+        self.auxilliary.pop(key, None)
+        return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+
+def _make_loading_override(K, method_name):
+    method = getattr(dict, method_name)
+    def f(self, *args, **kwargs):
+        self._load_all()
+        return method(self, *args, **kwargs)
+    f.__name__ = ensure_str(method_name)
+    setattr(K, method_name, f)
+
+for _method_name in ["__iter__", "__len__", "__eq__", "__ne__", "__repr__",
+                     "keys", "values", "items", "copy", "popitem", "clear",
+                     "update"]:
+    _make_loading_override(LazyAuxValueDict, _method_name)
+del _method_name
+
+
 class _TypedKeyDict(dict):
     """Dictionary that enforces key type.
 
@@ -15,8 +15,7 @@ if PY2:
     from builtins import filter, map, zip, ascii, chr, hex, input, next, oct, open, pow, round, super, bytes, list, object, range, str, max, min  # noqa: F401
 
 from copy import deepcopy
-from allmydata.immutable.happiness_upload import residual_network
-from allmydata.immutable.happiness_upload import augmenting_path_for
+from allmydata.immutable.happiness_upload import maximum_matching
 
 
 def failure_message(peer_count, k, happy, effective_happy):
@@ -144,48 +143,14 @@ def servers_of_happiness(sharemap):
     servermap = shares_by_server(sharemap)
     graph = _flow_network_for(servermap)
 
-    # XXX this core stuff is identical to
-    # happiness_upload._compute_maximum_graph and we should find a way
-    # to share the code.
-
-    # This is an implementation of the Ford-Fulkerson method for finding
-    # a maximum flow in a flow network applied to a bipartite graph.
-    # Specifically, it is the Edmonds-Karp algorithm, since it uses a
-    # BFS to find the shortest augmenting path at each iteration, if one
-    # exists.
-    #
-    # The implementation here is an adapation of an algorithm described in
-    # "Introduction to Algorithms", Cormen et al, 2nd ed., pp 658-662.
-    dim = len(graph)
-    flow_function = [[0 for sh in range(dim)] for s in range(dim)]
-    residual_graph, residual_function = residual_network(graph, flow_function)
-    while augmenting_path_for(residual_graph):
-        path = augmenting_path_for(residual_graph)
-        # Delta is the largest amount that we can increase flow across
-        # all of the edges in path. Because of the way that the residual
-        # function is constructed, f[u][v] for a particular edge (u, v)
-        # is the amount of unused capacity on that edge. Taking the
-        # minimum of a list of those values for each edge in the
-        # augmenting path gives us our delta.
-        delta = min(residual_function[u][v] for (u, v) in path)
-        for (u, v) in path:
-            flow_function[u][v] += delta
-            flow_function[v][u] -= delta
-        residual_graph, residual_function = residual_network(graph,
-                                                             flow_function)
-    num_servers = len(servermap)
-    # The value of a flow is the total flow out of the source vertex
-    # (vertex 0, in our graph). We could just as well sum across all of
-    # f[0], but we know that vertex 0 only has edges to the servers in
-    # our graph, so we can stop after summing flow across those. The
-    # value of a flow computed in this way is the size of a maximum
-    # matching on the bipartite graph described above.
-    return sum([flow_function[0][v] for v in range(1, num_servers+1)])
+    # The size of a maximum matching on the bipartite graph described
+    # above.
+    return len(maximum_matching(graph))
 
 def _flow_network_for(servermap):
     """
     I take my argument, a dict of peerid -> set(shareid) mappings, and
-    turn it into a flow network suitable for use with Edmonds-Karp. I
+    turn it into a flow network suitable for use with maximum_matching. I
     then return the adjacency list representation of that network.
 
     Specifically, I build G = (V, E), where:
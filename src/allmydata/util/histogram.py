@@ -0,0 +1,210 @@
+"""
+Fixed-size latency histograms.
+
+Keeping every latency sample (or the last thousand of them) and sorting
+them to find percentiles costs memory and time in proportion to the number
+of samples. ``Histogram`` counts samples in log-linear buckets instead:
+each power of two is split into ``SUB_BUCKETS`` equal parts, so recording a
+sample is a single increment and a percentile read from the histogram is
+within about 3% of the real one, whatever the number of samples.
+Histograms can be merged, and ``WindowedHistogram`` keeps them for recent
+slices of time so that percentiles can be found for the last minute, five
+minutes or hour.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import Callable, Iterator, Optional
+import math
+import time
+
+# Buckets cover 2**(MIN_EXPONENT - 1) to 2**MAX_EXPONENT, about a
+# microsecond to four and a half hours when recording seconds. Smaller
+# values are counted in the first bucket and larger ones in the last.
+MIN_EXPONENT = -19
+MAX_EXPONENT = 14
+SUB_BUCKETS = 16
+NUM_BUCKETS = (MAX_EXPONENT - MIN_EXPONENT + 1) * SUB_BUCKETS
+
+# Bucket boundaries to export histograms with: the powers of two, which are
+# boundaries of the first bucket of each power of two.
+EXPORT_BOUNDS = [math.ldexp(1, exponent)
+                 for exponent in range(MIN_EXPONENT, MAX_EXPONENT)]
+
+# Names of the windows that WindowedHistogram can report on, in seconds.
+WINDOWS = {"1m": 60, "5m": 5 * 60, "1h": 60 * 60}
+
+
+def bucket_index(value: float) -> int:
+    """
+    :return: The index of the bucket that ``value`` is counted in.
+    """
+    (mantissa, exponent) = math.frexp(value)
+    if value <= 0 or exponent < MIN_EXPONENT:
+        return 0
+    if exponent > MAX_EXPONENT:
+        return NUM_BUCKETS - 1
+    return ((exponent - MIN_EXPONENT) * SUB_BUCKETS
+            + int((mantissa - 0.5) * 2 * SUB_BUCKETS))
+
+
+def bucket_bounds(index: int) -> tuple[float, float]:
+    """
+    :return: The smallest value counted in bucket ``index``, and the
+        smallest value that is too large for it.
+    """
+    (exponent, sub) = divmod(index, SUB_BUCKETS)
+    exponent += MIN_EXPONENT
+    lower = math.ldexp(0.5 + sub / (2 * SUB_BUCKETS), exponent)
+    upper = math.ldexp(0.5 + (sub + 1) / (2 * SUB_BUCKETS), exponent)
+    if index == 0:
+        lower = 0.0
+    if index == NUM_BUCKETS - 1:
+        upper = math.inf
+    return (lower, upper)
+
+
+class Histogram(object):
+    """
+    I count non-negative values in log-linear buckets.
+
+    Only buckets that have been used take up memory, so an empty histogram,
+    like one for a slice of time with little activity, is cheap.
+
+    :ivar int count: The number of values recorded.
+    :ivar float sum: The sum of the values recorded.
+    """
+
+    def __init__(self):
+        self._counts = {} # bucket index -> count
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value: float):
+        index = bucket_index(value)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: Histogram):
+        """
+        Add everything recorded in ``other`` to me.
+        """
+        for (index, count) in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def buckets(self) -> Iterator[tuple[float, int]]:
+        """
+        :return: The upper bound and count of each bucket that has been
+            used, smallest first.
+        """
+        for index in sorted(self._counts):
+            yield (bucket_bounds(index)[1], self._counts[index])
+
+    def cumulative_counts(self, bounds: list[float]) -> list[int]:
+        """
+        :param bounds: Bucket boundaries, like the items of
+            ``EXPORT_BOUNDS``, smallest first.
+
+        :return: The number of values smaller than each bound.
+        """
+        result = []
+        buckets = list(self.buckets())
+        seen = 0
+        i = 0
+        for bound in bounds:
+            while i < len(buckets) and buckets[i][0] <= bound:
+                seen += buckets[i][1]
+                i += 1
+            result.append(seen)
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        :return: An estimate of the value that a fraction ``q`` of the
+            recorded values are smaller than, or ``None`` if nothing has been
+            recorded.
+        """
+        if not self.count:
+            return None
+        rank = int(q * self.count) + 1
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                break
+        (lower, upper) = bucket_bounds(index)
+        middle = lower + (upper - lower) / 2
+        return max(self.min, min(self.max, middle))
+
+
+class WindowedHistogram(object):
+    """
+    I keep a ``Histogram`` of everything recorded in me, and others for
+    slices of the last hour, so I can report on recent values as well.
+
+    The last five minutes are kept in ten second slices and the last hour
+    in one minute slices, so the windows I report on may include up to one
+    slice more than they are named for.
+    """
+
+    # (slice length in seconds, number of slices to keep) for each ring
+    FINE = (10, 30)
+    COARSE = (60, 60)
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self.total = Histogram()
+        self._fine = deque() # (slice start time, Histogram)
+        self._coarse = deque()
+
+    def record(self, value: float):
+        now = self._clock()
+        self.total.record(value)
+        self._current(self._fine, self.FINE, now).record(value)
+        self._current(self._coarse, self.COARSE, now).record(value)
+
+    def _current(self, ring, shape, now):
+        (length, keep) = shape
+        start = now - now % length
+        if not ring or ring[-1][0] != start:
+            ring.append((start, Histogram()))
+        self._expire(ring, shape, now)
+        return ring[-1][1]
+
+    def _expire(self, ring, shape, now):
+        # A window ending now can overlap keep + 1 slices.
+        (length, keep) = shape
+        while ring and ring[0][0] + length * (keep + 1) <= now:
+            ring.popleft()
+
+    def snapshot(self, window: Optional[str] = None) -> Histogram:
+        """
+        :param window: One of the keys of ``WINDOWS``, or ``None`` for
+            everything ever recorded.
+
+        :return: A new ``Histogram`` of the values recorded in ``window``.
+        """
+        result = Histogram()
+        if window is None:
+            result.merge(self.total)
+            return result
+        seconds = WINDOWS[window]
+        now = self._clock()
+        (ring, shape) = (self._fine, self.FINE)
+        if seconds > self.FINE[0] * self.FINE[1]:
+            (ring, shape) = (self._coarse, self.COARSE)
+        self._expire(ring, shape, now)
+        for (start, histogram) in ring:
+            if start + shape[0] > now - seconds:
+                result.merge(histogram)
+        return result
@@ -50,6 +50,7 @@ from allmydata.interfaces import IDirectoryNode, IFileNode, IFilesystemNode, \
 from allmydata.blacklist import ProhibitedNode
 from allmydata.monitor import Monitor, OperationCancelledError
 from allmydata import dirnode
+from allmydata.deep_traversal import ConcurrentChecks
 from allmydata.web.common import (
     text_plain,
     WebError,
@@ -563,7 +564,10 @@ class DirectoryNodeHandler(ReplaceMeMixin, Resource, object):
         verify = boolean_of_arg(get_arg(req, "verify", "false"))
         repair = boolean_of_arg(get_arg(req, "repair", "false"))
         add_lease = boolean_of_arg(get_arg(req, "add-lease", "false"))
-        walker = DeepCheckStreamer(req, self.node, verify, repair, add_lease)
+        nodemaker = self.client.nodemaker
+        walker = DeepCheckStreamer(req, self.node, verify, repair, add_lease,
+                                   nodemaker.deep_check_concurrency,
+                                   nodemaker.deep_check_requests_per_server)
         monitor = self.node.deep_traverse(walker)
         walker.setMonitor(monitor)
         # register to hear stopProducing. The walker ignores pauseProducing.
@@ -1396,12 +1400,20 @@ class ManifestStreamer(dirnode.DeepStats):
 @implementer(IPushProducer)
 class DeepCheckStreamer(dirnode.DeepStats):
 
-    def __init__(self, req, origin, verify, repair, add_lease):
+    def __init__(self, req, origin, verify, repair, add_lease,
+                 concurrency=1, requests_per_server=None):
         dirnode.DeepStats.__init__(self, origin)
         self.req = req
         self.verify = verify
         self.repair = repair
         self.add_lease = add_lease
+        self.checks = ConcurrentChecks(concurrency)
+        self.requests_per_server = requests_per_server
+
+    def set_monitor(self, monitor):
+        dirnode.DeepStats.set_monitor(self, monitor)
+        if self.requests_per_server:
+            monitor.limit_server_requests(self.requests_per_server)
 
     def setMonitor(self, monitor):
         self.monitor = monitor
@@ -1439,6 +1451,9 @@ class DeepCheckStreamer(dirnode.DeepStats):
             si = base32.b2a(si)
         data["storage-index"] = si or ""
 
+        return self.checks.add(self.check_node, node, data)
+
+    def check_node(self, node, data):
         if self.repair:
             d = node.check_and_repair(self.monitor, self.verify, self.add_lease)
             d.addCallback(self.add_check_and_repair, data)
@@ -1462,6 +1477,11 @@ class DeepCheckStreamer(dirnode.DeepStats):
         self.req.write(j.encode("utf-8")+b"\n")
 
     def finish(self):
+        d = self.checks.when_done()
+        d.addCallback(self.write_stats)
+        return d
+
+    def write_stats(self, ignored):
         stats = dirnode.DeepStats.get_results(self)
         d = {"type": "stats",
              "stats": stats,
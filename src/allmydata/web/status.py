@@ -26,6 +26,7 @@ from twisted.web.template import (
     tags,
 )
 from allmydata.util import base32, idlib, jsonbytes as json
+from allmydata.util.histogram import EXPORT_BOUNDS
 from allmydata.web.common import (
     abbreviate_time,
     abbreviate_rate,
@@ -1576,6 +1577,16 @@ class Statistics(MultiFormatResource):
 
         for (k, v) in sorted(stats['counters'].items()):
             ret.append(u"tahoe_counters_%s %s" % (mangle_name(k), mangle_value(v)))
+        histograms = getattr(self._provider, "get_histograms", dict)()
+        for (k, h) in sorted(histograms.items()):
+            name = u"tahoe_histograms_%s" % (mangle_name(k),)
+            ret.append(u"# TYPE %s histogram" % (name,))
+            counts = h.cumulative_counts(EXPORT_BOUNDS)
+            for (bound, count) in zip(EXPORT_BOUNDS, counts):
+                ret.append(u'%s_bucket{le="%r"} %d' % (name, bound, count))
+            ret.append(u'%s_bucket{le="+Inf"} %d' % (name, h.count))
+            ret.append(u"%s_count %d" % (name, h.count))
+            ret.append(u"%s_sum %r" % (name, h.sum))
         for (k, v) in sorted(stats['stats'].items()):
             ret.append(u"tahoe_stats_%s %s" % (mangle_name(k), mangle_value(v)))
 
@@ -1627,6 +1638,21 @@ class StatisticsElement(Element):
         return tag("%s files / %s bytes (%s)" %
                    (files, bytes, abbreviate_size(bytes)))
 
+    @renderer
+    def segment_cache(self, req, tag):
+        stats = self._stats["stats"]
+        if "downloader.segment_cache.hits" not in stats:
+            return tag("disabled")
+        hits = stats["downloader.segment_cache.hits"]
+        misses = stats["downloader.segment_cache.misses"]
+        ratio = ""
+        if hits + misses:
+            ratio = " (%d%% hits)" % (100 * hits // (hits + misses))
+        return tag("%s hits / %s misses%s, holding %s of %s" %
+                   (hits, misses, ratio,
+                    abbreviate_size(stats["downloader.segment_cache.bytes"]),
+                    abbreviate_size(stats["downloader.segment_cache.max_bytes"])))
+
     @renderer
     def publishes(self, req, tag):
         files = self._stats["counters"].get("mutable.files_published", 0)
@@ -31,11 +31,13 @@ from twisted.web.server import (
     Site,
 )
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from twisted.internet.address import (
     IPv4Address,
     IPv6Address,
 )
 from allmydata.util import log, fileutil
+from allmydata.immutable.upload import ConvergentSpool
 
 from allmydata.web import introweb, root
 from allmydata.web.operations import OphandleTable
@@ -92,6 +94,31 @@ class TahoeLAFSRequest(Request, object):
     """
     fields = None
 
+    def gotLength(self, length):
+        """
+        Called by channel when all headers have been received, to choose
+        where the body goes.
+
+        Override the base implementation so that ``TahoeLAFSSite`` can tell
+        which request the body is for. Twisted only sets ``method`` and
+        ``uri`` once the body has arrived, but the channel already knows
+        them.
+        """
+        if not isinstance(self.channel.site, TahoeLAFSSite):
+            Request.gotLength(self, length)
+            return
+        # This can't wait for requestReceived: by then the whole body has
+        # been written to self.content. Twisted has no public way to get the
+        # request line before that, so this reads the private attributes
+        # HTTPChannel keeps it in (test_webish pins this for a real
+        # channel). Should they go away, getContentFile gets None for both
+        # and the body is spooled without being hashed, as before.
+        self.content = self.channel.site.getContentFile(
+            length,
+            getattr(self.channel, "_command", None),
+            getattr(self.channel, "_path", None),
+        )
+
     def requestReceived(self, command, path, version):
         """
         Called by channel when all data has been received.
@@ -218,18 +245,66 @@ class TahoeLAFSSite(Site, object):
 
     * A log formatter that writes some access logs but omits capability
       strings to help keep them secret.
+
+    * Optionally, hashing large request bodies of immutable uploads
+      (``PUT /uri`` and ``PUT /uri/$DIRCAP/[SUBDIRS../]FILENAME``) for
+      convergent encryption as they are written to that directory, so that
+      uploading one needn't read it all back just to find its key.
+
+    :ivar convergence_parameters: None, or a callable that returns the
+        encoding parameters (a dict like ``Client.get_encoding_parameters``
+        returns) and the convergence secret to hash request bodies with.
     """
     requestFactory = TahoeLAFSRequest
 
-    def __init__(self, tempdir, *args, **kwargs):
+    def __init__(self, tempdir, *args, convergence_parameters=None, **kwargs):
         Site.__init__(self, *args, logFormatter=_logFormatter, **kwargs)
         self._tempdir = tempdir
+        self.convergence_parameters = convergence_parameters
 
-    def getContentFile(self, length):
+    def getContentFile(self, length, method=None, uri=None):
         if length is None or length >= 1024 * 1024:
-            return tempfile.TemporaryFile(dir=self._tempdir)
+            f = tempfile.TemporaryFile(dir=self._tempdir)
+            if length is not None and _is_immutable_upload(method, uri):
+                f = self._convergent_spool(f, length)
+            return f
         return BytesIO()
 
+    def _convergent_spool(self, f, length):
+        # This runs while the headers are being parsed, where an exception
+        # would drop the connection, so any problem just means the body is
+        # spooled without being hashed.
+        if self.convergence_parameters is None:
+            return f
+        try:
+            (encoding_parameters, convergence) = self.convergence_parameters()
+            return ConvergentSpool(f, length, encoding_parameters, convergence)
+        except Exception:
+            log.msg("unable to hash a request body while spooling it",
+                    failure=Failure(), level=log.UNUSUAL,
+                    facility="tahoe.webish")
+            return f
+
+
+def _is_immutable_upload(method, uri):
+    """
+    :return: Whether a request with this method and URI uploads an
+        immutable file from its body.
+    """
+    if method != b"PUT" or uri is None:
+        return False
+    x = uri.split(b"?", 1)
+    if not (x[0] == b"/uri" or x[0].startswith(b"/uri/")):
+        return False
+    args = parse_qs(x[1], 1) if len(x) == 2 else {}
+    if args.get(b"t", [b""])[0].strip():
+        return False
+    if args.get(b"format", [b"CHK"])[0].upper() != b"CHK":
+        return False
+    if args.get(b"mutable", [b"false"])[0].lower() in (b"true", b"t", b"1", b"on"):
+        return False
+    return True
+
 
 class WebishServer(service.MultiService):
     name = "webish"
@@ -245,6 +320,8 @@ class WebishServer(service.MultiService):
 
         self.root = root.Root(client, clock, now_fn)
         self.buildServer(webport, tempdir, nodeurl_path, staticdir)
+        self.site.convergence_parameters = lambda: (
+            client.get_encoding_parameters(), client.convergence)
 
         # If set, clock is a twisted.internet.task.Clock that the tests
         # use to test ophandle expiration.